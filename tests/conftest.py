@@ -0,0 +1,47 @@
+import os
+import socket
+
+import pytest
+
+from wakematecompanion.benchmarks import fakes
+from wakematecompanion.core.connections import Connection
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fake_backends():
+    """Never move the real pointer, press keys or power off the machine running the tests"""
+    fakes.install()
+
+
+@pytest.fixture
+def make_server():
+    """Build WakeMateServer instances that are never started and are stopped afterwards"""
+    from wakematecompanion.core.server import WakeMateServer
+    servers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("pairing_key", os.urandom(32))
+        server = WakeMateServer("127.0.0.1", 0, **kwargs)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def make_conn():
+    """Build Connections over socket pairs; returns (client socket, Connection)"""
+    sockets = []
+
+    def make(host="192.0.2.10", conn_id=1):
+        client, server = socket.socketpair()
+        client.settimeout(5)
+        server.settimeout(5)
+        sockets.extend((client, server))
+        return client, Connection(conn_id, server, (host, 50000 + conn_id))
+
+    yield make
+    for sock in sockets:
+        sock.close()
@@ -0,0 +1,189 @@
+import base64
+import json
+import os
+import stat
+import time
+
+import pytest
+
+from wakematecompanion.core import auth
+from wakematecompanion.core.auth import (AUTH_PROTECTED, AUTH_REQUIRED, MAX_PENDING_PER_PEER, AuthError,
+                                         Authenticator, ClientSession, ReplayWindow, load_or_create_pairing_key)
+
+KEY = os.urandom(32)
+
+
+def _pair(authenticator, peer="192.0.2.1"):
+    client = ClientSession(KEY)
+    hello = json.loads(client.hello())
+    session, data = authenticator.handshake(hello["params"]["client_nonce"], peer)
+    client.finish({"status": "success", "data": data})
+    return client, session
+
+
+def _open(authenticator, envelope_bytes, cached=None):
+    return authenticator.open_envelope(json.loads(envelope_bytes), cached)
+
+
+def test_handshake_and_envelope():
+    authenticator = Authenticator(AUTH_PROTECTED, KEY)
+    client, session = _pair(authenticator)
+    opened, command = _open(authenticator, client.wrap({"command": "shutdown"}), session)
+    assert opened is session
+    assert command == {"command": "shutdown"}
+
+
+def test_client_rejects_server_without_the_key():
+    other = Authenticator(AUTH_PROTECTED, os.urandom(32))
+    client = ClientSession(KEY)
+    hello = json.loads(client.hello())
+    _, data = other.handshake(hello["params"]["client_nonce"])
+    with pytest.raises(AuthError):
+        client.finish({"data": data})
+
+
+def test_bad_mac_is_rejected():
+    authenticator = Authenticator(AUTH_PROTECTED, KEY)
+    client, session = _pair(authenticator)
+    envelope = json.loads(client.wrap({"command": "ping"}))
+    envelope["payload"] = json.dumps({"command": "shutdown"})
+    with pytest.raises(AuthError, match="Bad MAC"):
+        authenticator.open_envelope(envelope, session)
+    envelope["mac"] = "not base64!"
+    with pytest.raises(AuthError):
+        authenticator.open_envelope(envelope, session)
+
+
+def test_client_with_wrong_key_cannot_sign():
+    authenticator = Authenticator(AUTH_PROTECTED, KEY)
+    client, session = _pair(authenticator)
+    client.session_key = os.urandom(32)
+    with pytest.raises(AuthError):
+        _open(authenticator, client.wrap({"command": "ping"}), session)
+
+
+def test_replayed_envelope_is_rejected():
+    authenticator = Authenticator(AUTH_PROTECTED, KEY)
+    client, session = _pair(authenticator)
+    envelope = client.wrap({"command": "shutdown"})
+    _open(authenticator, envelope, session)
+    with pytest.raises(AuthError, match="Replayed"):
+        _open(authenticator, envelope, session)
+
+
+def test_replay_window():
+    window = ReplayWindow(size=8)
+    assert not window.accept(0)
+    assert window.accept(5)
+    assert window.accept(3)
+    assert not window.accept(3)
+    assert window.accept(12)
+    # 12 - 8 = 4: anything at or below is too old
+    assert not window.accept(4)
+    assert window.accept(6)
+    assert not window.accept(6)
+    assert window.accept(100)
+    assert not window.accept(12)
+
+
+def test_unknown_session_is_rejected():
+    authenticator = Authenticator(AUTH_PROTECTED, KEY)
+    client, _ = _pair(authenticator)
+    client.session_id = "nope"
+    with pytest.raises(AuthError, match="Unknown"):
+        _open(authenticator, client.wrap({"command": "ping"}))
+
+
+def test_session_is_reusable_from_another_connection_once_established():
+    authenticator = Authenticator(AUTH_PROTECTED, KEY)
+    client, session = _pair(authenticator)
+    _open(authenticator, client.wrap({"command": "ping"}), session)
+    assert authenticator.get_session(client.session_id) is session
+    opened, _ = _open(authenticator, client.wrap({"command": "ping"}))
+    assert opened is session
+
+
+def test_handshake_flood_does_not_evict_paired_sessions():
+    authenticator = Authenticator(AUTH_PROTECTED, KEY, max_sessions=4)
+    paired = []
+    for i in range(4):
+        client, session = _pair(authenticator, f"192.0.2.{i}")
+        _open(authenticator, client.wrap({"command": "ping"}), session)
+        paired.append(client)
+    for _ in range(5000):
+        _pair(authenticator, "198.51.100.66")
+    for client in paired:
+        assert authenticator.get_session(client.session_id) is not None
+    assert len(authenticator._pending) <= MAX_PENDING_PER_PEER
+
+
+def test_pending_handshakes_are_capped_per_peer():
+    authenticator = Authenticator(AUTH_PROTECTED, KEY)
+    mine = [_pair(authenticator, "192.0.2.1")[0] for _ in range(MAX_PENDING_PER_PEER + 1)]
+    other, _ = _pair(authenticator, "192.0.2.2")
+    # The oldest handshake of the flooding peer is gone, the newest and the other peer's remain
+    with pytest.raises(AuthError):
+        _open(authenticator, mine[0].wrap({"command": "ping"}))
+    _open(authenticator, mine[-1].wrap({"command": "ping"}))
+    _open(authenticator, other.wrap({"command": "ping"}))
+
+
+def test_pending_handshakes_expire(monkeypatch):
+    authenticator = Authenticator(AUTH_PROTECTED, KEY)
+    client, _ = _pair(authenticator)
+    monkeypatch.setattr(auth, "PENDING_TTL", -1)
+    with pytest.raises(AuthError):
+        _open(authenticator, client.wrap({"command": "ping"}))
+
+
+def test_exported_sessions_survive_import():
+    first = Authenticator(AUTH_PROTECTED, KEY)
+    client, session = _pair(first)
+    _open(first, client.wrap({"command": "ping"}), session)
+    second = Authenticator(AUTH_PROTECTED, KEY)
+    second.import_sessions(first.export_sessions())
+    envelope = client.wrap({"command": "ping"})
+    _open(second, envelope)
+    with pytest.raises(AuthError):
+        _open(second, envelope)
+
+
+def test_requires_auth_by_mode():
+    protected = Authenticator(AUTH_PROTECTED, KEY)
+    required = Authenticator(AUTH_REQUIRED, KEY)
+    off = Authenticator()
+    assert protected.requires_auth("shutdown") and not protected.requires_auth("get_status")
+    assert required.requires_auth("get_status") and not required.requires_auth("auth_hello")
+    assert not off.requires_auth("shutdown") and off.requires_auth("file_upload")
+    protected.protect("my_plugin")
+    assert protected.requires_auth("my_plugin")
+
+
+def test_pairing_key_file_is_private(tmp_path):
+    path = str(tmp_path / "cfg" / "pairing.key")
+    key = load_or_create_pairing_key(path)
+    assert len(key) == 32
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert load_or_create_pairing_key(path) == key
+
+
+def test_server_handshake_over_dispatch(make_server, make_conn):
+    server = make_server(auth_mode=AUTH_REQUIRED, pairing_key=base64.b64encode(KEY).decode("ascii"))
+    _, conn = make_conn()
+    assert server._process_command(b'{"command": "get_status"}', conn)["code"] == "auth_required"
+    client = ClientSession(KEY)
+    client.finish(server._process_command(client.hello(), conn))
+    reply = server._process_command(client.wrap({"command": "get_status"}), conn)
+    assert reply["status"] == "success"
+
+
+def test_qr_image_is_private_and_removed(monkeypatch, tmp_path):
+    pytest.importorskip("qrcode")
+    from wakematecompanion.core import qr_generator
+    monkeypatch.setattr(qr_generator.platform, "system", lambda: "Other")
+    monkeypatch.setattr(qr_generator, "QR_LIFETIME", 0.05)
+    monkeypatch.setattr(qr_generator.tempfile, "tempdir", str(tmp_path))
+    path = qr_generator.generate_qr_code("192.0.2.1", 7777, pairing_key="secret")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    time.sleep(0.3)
+    assert not os.path.exists(path)
@@ -0,0 +1,95 @@
+import json
+import os
+import stat
+
+import pytest
+
+from wakematecompanion.core import capture
+from wakematecompanion.core.capture import CLOSE, IN, OPEN, OUT, CaptureWriter, read_capture, redact
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "session.wmcap")
+    writer = CaptureWriter(path)
+    writer.record(OPEN, 1, b"192.0.2.1:5")
+    writer.record(IN, 1, b'{"command":"get_status"}')
+    writer.record(OUT, 1, b'{"status":"success"}\n')
+    writer.record(CLOSE, 1)
+    writer.close()
+    _, records = read_capture(path)
+    assert [(kind, conn_id, payload) for kind, conn_id, _, payload in records] == [
+        (OPEN, 1, b"192.0.2.1:5"),
+        (IN, 1, b'{"command":"get_status"}'),
+        (OUT, 1, b'{"status":"success"}\n'),
+        (CLOSE, 1, b""),
+    ]
+    times = [t for _, _, t, _ in records]
+    assert times == sorted(times)
+
+
+def test_file_is_private_even_if_it_existed(tmp_path):
+    path = tmp_path / "session.wmcap"
+    path.write_bytes(b"old")
+    os.chmod(path, 0o644)
+    CaptureWriter(str(path)).close()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_typed_text_is_masked():
+    frame = json.dumps({"command": "keyboard_input", "params": {"text": "hunter2"}}).encode()
+    assert json.loads(redact(frame))["params"]["text"] == "*******"
+    other = b'{"command": "mouse_move", "params": {"dx": 1}}'
+    assert redact(other) is other
+    assert redact(b"keyboard_input garbage") == b"{}"
+
+
+def test_signed_envelopes_are_masked_inside():
+    inner = json.dumps({"command": "keyboard_input", "params": {"text": "secret"}})
+    frame = json.dumps({"mac": "x", "payload": inner}).encode()
+    recorded = json.loads(redact(frame))
+    assert json.loads(recorded["payload"])["params"]["text"] == "******"
+
+
+def test_redaction_can_be_turned_off(tmp_path):
+    path = str(tmp_path / "session.wmcap")
+    writer = CaptureWriter(path, redact_input=False)
+    frame = b'{"command": "keyboard_input", "params": {"text": "hi"}}'
+    writer.record(IN, 1, frame)
+    writer.close()
+    assert read_capture(path)[1][0][3] == frame
+
+
+def test_size_limit_stops_recording(tmp_path):
+    path = str(tmp_path / "session.wmcap")
+    writer = CaptureWriter(path, max_bytes=capture.HEADER.size + capture.RECORD.size + 10)
+    writer.record(IN, 1, b"x" * 10)
+    writer.record(IN, 1, b"y")
+    writer.close()
+    assert writer.full
+    assert len(read_capture(path)[1]) == 1
+
+
+def test_truncated_capture_ends_at_last_complete_record(tmp_path):
+    path = tmp_path / "session.wmcap"
+    writer = CaptureWriter(str(path))
+    writer.record(IN, 1, b"first")
+    writer.record(IN, 1, b"second")
+    writer.close()
+    path.write_bytes(path.read_bytes()[:-3])
+    assert [payload for _, _, _, payload in read_capture(str(path))[1]] == [b"first"]
+    path.write_bytes(b"not a capture")
+    with pytest.raises(ValueError):
+        read_capture(str(path))
+
+
+def test_server_records_traffic(make_server, make_conn, tmp_path):
+    path = str(tmp_path / "session.wmcap")
+    server = make_server()
+    # start() opens the capture; an unstarted server takes the writer directly
+    server.capture = CaptureWriter(path)
+    _, conn = make_conn()
+    server._process_command(b'{"command": "keyboard_input", "params": {"text": "pw"}}', conn)
+    server.capture.close()
+    records = read_capture(path)[1]
+    assert [kind for kind, _, _, _ in records] == [IN, OUT]
+    assert b"pw" not in records[0][3]
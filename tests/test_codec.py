@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from wakematecompanion.core import codec
+from wakematecompanion.core.codec import DECODE_ERRORS, JSONCodec, get_codec, preencoded
+
+
+def codecs():
+    yield JSONCodec()
+    if codec.ORJSON_AVAILABLE:
+        yield get_codec("orjson")
+
+
+@pytest.mark.parametrize("instance", list(codecs()), ids=lambda c: c.name)
+def test_round_trip_and_framing(instance):
+    obj = {"status": "success", "data": {"text": "héllo", "n": [1, 2.5, None, True]}}
+    frame = instance.frame(obj)
+    assert frame.endswith(b"\n") and frame.count(b"\n") == 1
+    assert instance.loads(frame) == obj
+    assert instance.loads(frame.decode("utf-8")) == obj
+    assert json.loads(instance.dumps(obj)) == obj
+
+
+@pytest.mark.parametrize("instance", list(codecs()), ids=lambda c: c.name)
+def test_malformed_input_raises_decode_errors(instance):
+    for data in (b"{", b"\xff\xfe", b'{"a": }'):
+        with pytest.raises(DECODE_ERRORS):
+            instance.loads(data)
+
+
+def test_get_codec():
+    assert get_codec("json").name == "json"
+    assert get_codec().name == ("orjson" if codec.ORJSON_AVAILABLE else "json")
+    with pytest.raises(ValueError):
+        get_codec("msgpack")
+
+
+def test_preencoded_response_is_constant():
+    response = preencoded({"status": "success", "message": "Mouse moved"})
+    assert response.frame == b'{"status":"success","message":"Mouse moved"}\n'
+    assert response == {"status": "success", "message": "Mouse moved"}
+    with pytest.raises(TypeError):
+        response["status"] = "error"
+    with pytest.raises(TypeError):
+        response.update(status="error")
+    copy = dict(response)
+    copy["status"] = "error"
+    assert response["status"] == "success"
+
+
+def test_server_sends_preencoded_frame(make_server, make_conn):
+    server = make_server(codec="json")
+    client, conn = make_conn()
+    server._process_command(b'{"command": "mouse_move", "params": {"dx": 1}}', conn)
+    assert client.recv(1000) == b'{"status":"success","message":"Mouse moved"}\n'
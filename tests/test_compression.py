@@ -0,0 +1,121 @@
+import json
+import socket
+import struct
+import time
+import zlib
+
+import pytest
+
+from wakematecompanion.core import compression
+from wakematecompanion.core.compression import (HEADER, MAX_DECOMPRESSED_BYTES, MAX_FRAME_BYTES, Compression,
+                                                CompressionError, frame_length, negotiate)
+
+ALGORITHMS = ["zlib", "zstd", "lz4"]
+
+
+@pytest.fixture(params=ALGORITHMS)
+def algorithm(request):
+    if request.param not in compression.available():
+        pytest.skip(f"{request.param} is not installed")
+    return request.param
+
+
+def _frame(i):
+    return json.dumps({"type": "status", "seq": i, "clients": [{"id": n, "label": "phone"} for n in range(40)]}
+                      ).encode("utf-8") + b"\n"
+
+
+def test_round_trip_keeps_context(algorithm):
+    sender, receiver = Compression(algorithm), Compression(algorithm)
+    for i in range(20):
+        frame = _frame(i)
+        packed = sender.pack(frame)
+        assert packed[:1] == b"\x00"
+        assert frame_length(packed) == len(packed)
+        assert receiver.unpack(packed) == frame
+    assert sender.ratio() < 0.5
+
+
+def test_short_frames_are_not_compressed(algorithm):
+    sender = Compression(algorithm, threshold=1024)
+    frame = b'{"status": "success"}\n'
+    assert sender.pack(frame) is frame
+    assert sender.ratio() is None
+
+
+def test_corrupt_frame_is_rejected(algorithm):
+    receiver = Compression(algorithm)
+    garbage = bytes(range(256)) * 4
+    with pytest.raises(CompressionError):
+        receiver.unpack(HEADER.pack(0, HEADER.size + len(garbage)) + garbage)
+
+
+def test_expansion_beyond_limit_is_rejected(algorithm):
+    sender, receiver = Compression(algorithm), Compression(algorithm)
+    bomb = sender.pack(b" " * (MAX_DECOMPRESSED_BYTES + 1))
+    assert len(bomb) < MAX_FRAME_BYTES
+    with pytest.raises(CompressionError):
+        receiver.unpack(bomb)
+
+
+def test_frame_at_limit_is_accepted(algorithm):
+    sender, receiver = Compression(algorithm), Compression(algorithm)
+    frame = b" " * (MAX_DECOMPRESSED_BYTES - 1) + b"\n"
+    assert receiver.unpack(sender.pack(frame)) == frame
+
+
+def test_zlib_bomb_from_another_compressor():
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(bytes(64 * 1024 * 1024)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    with pytest.raises(CompressionError):
+        Compression("zlib").unpack(HEADER.pack(0, HEADER.size + len(data)) + data)
+
+
+def test_frame_length():
+    assert frame_length(b"\x00\x00") is None
+    assert frame_length(HEADER.pack(0, 100)) == 100
+    with pytest.raises(CompressionError):
+        frame_length(HEADER.pack(0, MAX_FRAME_BYTES + 1))
+    assert frame_length(HEADER.pack(0, HEADER.size)) == HEADER.size
+
+
+@pytest.mark.parametrize("length", [0, 1, HEADER.size - 1])
+def test_length_shorter_than_header_is_rejected(length):
+    with pytest.raises(CompressionError, match="shorter than its header"):
+        frame_length(HEADER.pack(0, length) + b"xyz")
+
+
+def test_server_reader_does_not_loop_on_zero_length(make_server, make_conn):
+    server = make_server()
+    _, conn = make_conn()
+    conn.compression = Compression("zlib")
+    started = time.monotonic()
+    with pytest.raises(CompressionError):
+        server._read_compressed(conn, struct.pack(">BI", 0, 0) + b"xyz")
+    assert time.monotonic() - started < 1
+
+
+def test_server_closes_connection_on_malformed_frame(make_server):
+    server = make_server(plugins=False)
+    assert server.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not server.addresses and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with socket.create_connection(("127.0.0.1", server.bound_port), timeout=5) as sock:
+            sock.sendall(b'{"command": "compression", "params": {"algorithms": ["zlib"]}}\n')
+            assert json.loads(sock.recv(65536))["algorithm"] == "zlib"
+            sock.sendall(struct.pack(">BI", 0, 0) + b"xyz")
+            assert sock.recv(65536) == b""
+    finally:
+        server.stop()
+
+
+def test_negotiate():
+    assert negotiate(["lz4", "zlib"], ["zstd", "zlib"]) == "zlib"
+    assert negotiate(["brotli"], ["zlib"]) is None
+
+
+def test_unknown_algorithm():
+    with pytest.raises(ValueError):
+        Compression("brotli")
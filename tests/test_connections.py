@@ -0,0 +1,115 @@
+import json
+import socket
+import threading
+import time
+
+from wakematecompanion.core.connections import Connection, ConnectionTable, enable_keepalive
+
+
+def test_table_add_remove_and_limit():
+    table = ConnectionTable(max_connections=2)
+    first = table.add(None, ("192.0.2.1", 1000))
+    second = table.add(None, ("192.0.2.2", 1000))
+    assert table.add(None, ("192.0.2.3", 1000)) is None
+    assert first.id != second.id
+    assert table.get(first.id) is first
+    assert table.remove(first.id) is first
+    assert table.remove(first.id) is None
+    assert len(table) == 1
+    assert table.add(None, ("192.0.2.3", 1000)) is not None
+
+
+def test_table_is_safe_under_concurrent_adds():
+    table = ConnectionTable()
+
+    def add():
+        for i in range(500):
+            table.remove(table.add(None, ("192.0.2.1", i)).id)
+            table.add(None, ("192.0.2.1", i))
+
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(table) == 2000
+    assert len({conn.id for conn in table.all()}) == 2000
+
+
+def test_close_all(make_conn):
+    table = ConnectionTable()
+    _, conn = make_conn()
+    table.add(conn.sock, conn.addr)
+    closed = table.close_all()
+    assert len(closed) == 1 and closed[0].closed
+    assert len(table) == 0
+
+
+def test_touch_and_idle(make_conn):
+    _, conn = make_conn()
+    conn.last_activity -= 30
+    conn.ping_sent_at = time.monotonic()
+    assert conn.idle_seconds() >= 30
+    conn.touch(10)
+    assert conn.idle_seconds() < 1
+    assert conn.ping_sent_at is None
+    assert conn.bytes_in == 10
+
+
+def test_send_and_snapshot(make_conn):
+    client, conn = make_conn()
+    conn.send(b'{"status": "success"}\n')
+    assert client.recv(100) == b'{"status": "success"}\n'
+    snapshot = conn.to_dict()
+    assert snapshot["address"] == "192.0.2.10:50001"
+    assert snapshot["bytes_out"] == 22
+    assert snapshot["authenticated"] is False
+    json.dumps(snapshot)
+
+
+def test_wait_readable(make_conn):
+    client, conn = make_conn()
+    assert not conn.wait_readable(0.05)
+    client.sendall(b"x")
+    assert conn.wait_readable(1)
+
+
+def test_close_is_idempotent(make_conn):
+    client, conn = make_conn()
+    conn.close()
+    conn.close()
+    assert conn.closed
+    assert client.recv(10) == b""
+
+
+def test_keepalive_on_tcp_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        enable_keepalive(sock, idle=30, interval=5, count=2)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+    finally:
+        sock.close()
+
+
+def test_idle_connections_are_pinged_then_expired(make_server, make_conn):
+    server = make_server(idle_timeout=60, ping_interval=10)
+    client, conn = make_conn()
+    assert server._check_idle(conn)
+    conn.last_activity -= 15
+    assert server._check_idle(conn)
+    assert json.loads(client.recv(1000))["type"] == "ping"
+    conn.last_activity -= 60
+    assert not server._check_idle(conn)
+
+
+def test_connection_limit_refuses_clients(make_server):
+    server = make_server(max_connections=1)
+    assert server.connections.add(None, ("192.0.2.1", 1)) is not None
+    assert server.connections.add(None, ("192.0.2.1", 2)) is None
+
+
+def test_new_connection_has_no_state():
+    conn = Connection(7, None, ("unix", 0))
+    assert conn.label == "unix:0"
+    assert conn.held_buttons == set()
+    assert not conn.write_blocked()
@@ -0,0 +1,97 @@
+import sys
+import threading
+import time
+
+from wakematecompanion.core import diagnostics
+from wakematecompanion.core.diagnostics import MemoryTracker, SamplingProfiler
+
+
+def _busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_samples_other_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_worker, args=(stop,), name="busy-7")
+    worker.start()
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    time.sleep(0.2)
+    profiler.stop()
+    stop.set()
+    worker.join()
+    assert not profiler.running
+    assert profiler.samples > 0
+    lines = profiler.collapsed()
+    busy = [line for line in lines if line.startswith("busy-N;") and "_busy_worker" in line]
+    assert busy
+    assert not any("profiler" == line.split(";")[0] for line in lines)
+    tree = profiler.flamegraph()
+    assert tree["name"] == "all" and tree["value"] == sum(int(line.rsplit(" ", 1)[1]) for line in lines)
+    assert profiler.summary()["samples"] == profiler.samples
+
+
+def test_profiler_stops_after_its_duration():
+    profiler = SamplingProfiler(interval=0.001, duration=0.05)
+    profiler.start()
+    time.sleep(0.3)
+    assert not profiler.running
+    assert profiler.stopped_at is not None
+
+
+def test_distinct_stacks_are_capped(monkeypatch):
+    monkeypatch.setattr(diagnostics, "MAX_STACKS", 1)
+    profiler = SamplingProfiler()
+    profiler._record("main", _frame_a())
+    profiler._record("main", _frame_b())
+    assert diagnostics.TRUNCATED in profiler.stacks
+    assert len(profiler.stacks) == 2
+
+
+def _frame_a():
+    return sys._getframe()
+
+
+def _frame_b():
+    return sys._getframe()
+
+
+def test_memory_snapshots_and_diff():
+    tracker = MemoryTracker()
+    try:
+        first, old = tracker.snapshot()
+        kept = [bytearray(1000) for _ in range(100)]
+        second, new = tracker.snapshot()
+        assert tracker.usage()["current"] > 0
+        assert tracker.get(first) is old
+        changed = diagnostics.diff_stats(new, old, limit=50)
+        assert any("test_diagnostics.py" in entry["site"] and entry["size_diff"] >= 100000 for entry in changed)
+        assert diagnostics.top_stats(new, limit=3)
+        for _ in range(diagnostics.MAX_SNAPSHOTS):
+            tracker.snapshot()
+        assert first not in tracker.snapshots
+        del kept
+    finally:
+        tracker.stop()
+    assert not tracker.tracing
+    assert tracker.usage() == {"current": 0, "peak": 0}
+
+
+def test_process_stats():
+    stats = diagnostics.process_stats()
+    assert stats["threads"] >= 1
+    assert "MainThread" in stats["threads_by_name"]
+    assert stats["fds"] is None or stats["fds"] > 0
+
+
+def test_server_profile_commands(make_server, make_conn):
+    server = make_server()
+    _, conn = make_conn(host="127.0.0.1")
+    reply = server._process_command(b'{"command": "profile_start", "params": {"interval_ms": 1}}', conn)
+    assert reply["data"]["running"]
+    assert server._process_command(b'{"command": "profile_start"}', conn)["status"] == "error"
+    time.sleep(0.05)
+    reply = server._process_command(b'{"command": "profile_stop"}', conn)
+    assert reply["status"] == "success"
+    assert not server.profiler.running
@@ -0,0 +1,163 @@
+import asyncio
+import base64
+import json
+import os
+import socket
+import struct
+import time
+
+import pytest
+
+from wakematecompanion.core import gateway
+from wakematecompanion.core.gateway import (CLOSE_PROTOCOL_ERROR, CLOSE_TOO_BIG, OP_CLOSE, OP_CONTINUATION, OP_PING,
+                                            OP_TEXT, FrameError, Gateway, read_frame)
+
+
+def client_frame(opcode, payload=b"", fin=True, masked=True):
+    """Encode a client frame, masked unless told otherwise"""
+    n = len(payload)
+    b0 = (0x80 if fin else 0) | opcode
+    mask_bit = 0x80 if masked else 0
+    if n < 126:
+        header = struct.pack("!BB", b0, mask_bit | n)
+    elif n < 65536:
+        header = struct.pack("!BBH", b0, mask_bit | 126, n)
+    else:
+        header = struct.pack("!BBQ", b0, mask_bit | 127, n)
+    if not masked:
+        return header + payload
+    mask = os.urandom(4)
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def parse(data, limit=1 << 20):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_frame(reader, limit)
+    return asyncio.run(run())
+
+
+def test_masked_frames_are_unmasked():
+    assert parse(client_frame(OP_TEXT, b"hello")) == (True, OP_TEXT, b"hello")
+    payload = os.urandom(70000)
+    assert parse(client_frame(OP_TEXT, payload)) == (True, OP_TEXT, payload)
+    assert parse(client_frame(OP_TEXT, b"")) == (True, OP_TEXT, b"")
+
+
+def test_fragments_are_parsed_one_by_one():
+    data = client_frame(OP_TEXT, b"hel", fin=False) + client_frame(OP_CONTINUATION, b"lo")
+    assert parse(data) == (False, OP_TEXT, b"hel")
+
+
+def test_unmasked_frames_are_refused():
+    with pytest.raises(FrameError) as e:
+        parse(client_frame(OP_TEXT, b"hello", masked=False))
+    assert e.value.close_code == CLOSE_PROTOCOL_ERROR
+
+
+def test_bad_control_frames_are_refused():
+    with pytest.raises(FrameError):
+        parse(client_frame(OP_PING, b"x" * 126))
+    with pytest.raises(FrameError):
+        parse(client_frame(OP_PING, b"x", fin=False))
+
+
+def test_oversized_frames_are_refused_before_reading_the_payload():
+    header = struct.pack("!BBQ", 0x80 | OP_TEXT, 0x80 | 127, 1 << 40)
+    with pytest.raises(FrameError) as e:
+        parse(header, limit=1024)
+    assert e.value.close_code == CLOSE_TOO_BIG
+
+
+def test_truncated_frame():
+    with pytest.raises(asyncio.IncompleteReadError):
+        parse(client_frame(OP_TEXT, b"hello")[:-2])
+
+
+@pytest.fixture
+def gateway_port(make_server):
+    server = make_server(idle_timeout=0.5)
+    gw = Gateway(server, "127.0.0.1", 0)
+    gw.start()
+    yield gw.listening_socket().getsockname()[1]
+    gw.stop()
+
+
+def _http(port, method, path, body=b""):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(f"{method} {path} HTTP/1.1\r\nHost: x\r\nConnection: close\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    head, _, payload = data.partition(b"\r\n\r\n")
+    return int(head.split(b" ")[1]), payload
+
+
+def test_http_statuses(gateway_port):
+    assert _http(gateway_port, "POST", "/command", b'{"command": "get_status"}')[0] == 200
+    assert _http(gateway_port, "POST", "/command", b"{")[0] == 400
+    assert _http(gateway_port, "POST", "/commands/mouse_move", b'{"dx": "far"}')[0] == 400
+    assert _http(gateway_port, "POST", "/commands/no_such_command")[0] == 404
+    status, payload = _http(gateway_port, "POST", "/commands/profile_stop")
+    # Refused by the handler, without an error code
+    assert status == 400 and json.loads(payload)["status"] == "error"
+
+
+def _upgrade(port):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    sock.sendall((f"GET /ws HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("ascii"))
+    head = b""
+    while not head.endswith(b"\r\n\r\n"):
+        head += sock.recv(1)
+    assert head.startswith(b"HTTP/1.1 101")
+    assert gateway.accept_key(key).encode("ascii") in head
+    return sock
+
+
+def _read_server_frame(sock):
+    b0, n = sock.recv(2, socket.MSG_WAITALL)
+    if n == 126:
+        n = struct.unpack("!H", sock.recv(2, socket.MSG_WAITALL))[0]
+    return b0 & 0x0F, sock.recv(n, socket.MSG_WAITALL) if n else b""
+
+
+def test_websocket_fragmented_command(gateway_port):
+    sock = _upgrade(gateway_port)
+    try:
+        sock.sendall(client_frame(OP_TEXT, b'{"command": "ge', fin=False)
+                     + client_frame(OP_PING, b"p")
+                     + client_frame(OP_CONTINUATION, b't_status"}'))
+        assert _read_server_frame(sock) == (gateway.OP_PONG, b"p")
+        opcode, payload = _read_server_frame(sock)
+        assert opcode == OP_TEXT and json.loads(payload)["status"] == "success"
+    finally:
+        sock.close()
+
+
+def test_websocket_unmasked_frame_closes(gateway_port):
+    sock = _upgrade(gateway_port)
+    try:
+        sock.sendall(client_frame(OP_TEXT, b"{}", masked=False))
+        assert _read_server_frame(sock) == (OP_CLOSE, struct.pack("!H", CLOSE_PROTOCOL_ERROR))
+    finally:
+        sock.close()
+
+
+def test_trickled_frame_header_times_out(gateway_port):
+    sock = _upgrade(gateway_port)
+    try:
+        # Half a frame header, then nothing: the connection must not hang
+        sock.sendall(client_frame(OP_TEXT, b"x" * 200)[:3])
+        started = time.monotonic()
+        assert sock.recv(100) == b""
+        assert time.monotonic() - started < 3
+    finally:
+        sock.close()
@@ -0,0 +1,80 @@
+import json
+import os
+import socket
+import stat
+import time
+
+import pytest
+
+from wakematecompanion.core import handoff
+
+pytestmark = pytest.mark.skipif(not handoff.handoff_supported(), reason="needs Unix domain sockets")
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    """Keep the pairing key the handoff key derives from out of the real home"""
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    return tmp_path / "home"
+
+
+def test_control_socket_is_private_and_umask_untouched(tmp_path):
+    path = str(tmp_path / "control" / "handoff.sock")
+    before = os.umask(0o022)
+    try:
+        listener = handoff.HandoffListener(path, lambda channel: None)
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(before)
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+    finally:
+        listener.close()
+
+
+def test_take_over_without_a_server(tmp_path):
+    assert handoff.take_over(str(tmp_path / "missing.sock")) is None
+
+
+def _request(sock, command):
+    sock.sendall(json.dumps({"command": command}).encode("utf-8") + b"\n")
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = sock.recv(65536)
+        assert chunk
+        data += chunk
+    return json.loads(data)
+
+
+def test_server_hands_listeners_and_clients_over(tmp_path):
+    from wakematecompanion.core.server import WakeMateServer
+
+    path = str(tmp_path / "handoff.sock")
+    old = WakeMateServer("127.0.0.1", 0, plugins=False, handoff_path=path)
+    new = None
+    assert old.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not old.addresses and time.monotonic() < deadline:
+            time.sleep(0.01)
+        port = old.bound_port
+        client = socket.create_connection(("127.0.0.1", port), timeout=5)
+        assert _request(client, "get_status")["status"] == "success"
+
+        new = WakeMateServer("127.0.0.1", port, plugins=False, handoff_path=path)
+        assert new.start()
+        deadline = time.monotonic() + 5
+        while old.running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not old.running
+
+        # The same client connection and the same port keep working
+        assert _request(client, "get_status")["status"] == "success"
+        with socket.create_connection(("127.0.0.1", port), timeout=5) as second:
+            assert _request(second, "get_status")["status"] == "success"
+        client.close()
+    finally:
+        if new is not None:
+            new.stop()
+        old.stop()
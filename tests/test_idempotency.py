@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+from wakematecompanion.core.idempotency import IdempotencyBusy, IdempotencyCache
+
+
+def test_first_request_claims_and_duplicate_replays():
+    cache = IdempotencyCache()
+    result, ticket = cache.begin("k")
+    assert result is None and ticket is not None
+    cache.complete("k", ticket, {"status": "success"})
+    assert cache.begin("k") == ({"status": "success"}, None)
+
+
+def test_duplicate_waits_for_running_original():
+    cache = IdempotencyCache(wait_timeout=5)
+    _, ticket = cache.begin("k")
+    replies = []
+    thread = threading.Thread(target=lambda: replies.append(cache.begin("k")))
+    thread.start()
+    time.sleep(0.05)
+    assert not replies
+    cache.complete("k", ticket, "done")
+    thread.join(5)
+    assert replies == [("done", None)]
+
+
+def test_duplicate_gives_up_after_wait_timeout():
+    cache = IdempotencyCache(wait_timeout=0.05)
+    cache.begin("k")
+    assert cache.begin("k") == (None, None)
+
+
+def test_abandoned_key_runs_again():
+    cache = IdempotencyCache()
+    _, ticket = cache.begin("k")
+    cache.abandon("k", ticket)
+    result, again = cache.begin("k")
+    assert result is None and again is not None and again is not ticket
+
+
+def test_entries_expire():
+    cache = IdempotencyCache(ttl=0.05)
+    _, ticket = cache.begin("k")
+    cache.complete("k", ticket, "done")
+    time.sleep(0.1)
+    result, ticket = cache.begin("k")
+    assert result is None and ticket is not None
+
+
+def test_size_bound_evicts_oldest_finished_entry():
+    cache = IdempotencyCache(max_entries=2)
+    cache.begin("running")
+    _, first = cache.begin("first")
+    cache.complete("first", first, "one")
+    _, ticket = cache.begin("new")
+    assert ticket is not None
+    # The finished entry went, the running claim stayed
+    assert list(cache._running) == ["running", "new"]
+    assert not cache._finished
+
+
+def test_running_claims_are_never_evicted():
+    cache = IdempotencyCache(max_entries=2)
+    cache.begin("a")
+    cache.begin("b")
+    with pytest.raises(IdempotencyBusy):
+        cache.begin("c")
+    assert len(cache) == 2
+
+
+def test_running_claims_never_expire():
+    cache = IdempotencyCache(ttl=0.01, wait_timeout=0.01)
+    _, ticket = cache.begin("k")
+    time.sleep(0.05)
+    # Still running: a retry must not get to run the command again
+    assert cache.begin("k") == (None, None)
+    cache.complete("k", ticket, "done")
+    assert cache.begin("k") == ("done", None)
+
+
+def test_finished_entries_make_room_for_new_keys():
+    cache = IdempotencyCache(max_entries=1)
+    _, ticket = cache.begin("k")
+    cache.complete("k", ticket, "done")
+    # The finished entry makes room for a new key
+    _, other = cache.begin("other")
+    assert other is not None
+    assert "k" not in cache._finished and len(cache) == 1
@@ -0,0 +1,113 @@
+import contextlib
+
+from wakematecompanion.core.input_aggregation import DRAG_STEP_PX, InputAggregator
+from wakematecompanion.core.metrics import ServerMetrics
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.calls = []
+
+    def move_mouse(self, dx, dy):
+        self.calls.append(("move", dx, dy))
+
+    def scroll_mouse(self, amount):
+        self.calls.append(("scroll", amount))
+
+    def hscroll_mouse(self, amount):
+        self.calls.append(("hscroll", amount))
+
+    def mouse_button(self, button, down):
+        self.calls.append(("button", button, down))
+
+    def click_mouse(self, button, clicks, interval):
+        self.calls.append(("click", button, clicks))
+
+
+def _deferred():
+    """An aggregator whose flushes wait until the test runs them"""
+    backend = RecordingBackend()
+    pending = []
+    return backend, InputAggregator(backend, pending.append, ServerMetrics()), pending
+
+
+def test_consecutive_moves_become_one_call():
+    backend, aggregator, pending = _deferred()
+    for _ in range(10):
+        aggregator.move(1, -2)
+    assert len(pending) == 1
+    pending.pop()()
+    assert backend.calls == [("move", 10, -20)]
+    assert aggregator.metrics.snapshot()["counters"]["input_events_coalesced_total[move]"] == 9
+
+
+def test_clicks_keep_their_place():
+    backend, aggregator, pending = _deferred()
+    aggregator.move(1, 0)
+    aggregator.click("left", 2)
+    aggregator.move(2, 0)
+    aggregator.move(3, 0)
+    pending.pop()()
+    assert backend.calls == [("move", 1, 0), ("click", "left", 2), ("move", 5, 0)]
+
+
+def test_fractional_scroll_carries_over():
+    backend, aggregator, pending = _deferred()
+    aggregator.scroll(0.6)
+    pending.pop()()
+    assert backend.calls == []
+    aggregator.scroll(0.6, -1.5)
+    pending.pop()()
+    assert backend.calls == [("scroll", 1), ("hscroll", -1)]
+
+
+def test_fractional_backend_gets_fractions():
+    backend, aggregator, pending = _deferred()
+    backend.fractional_scroll = True
+    aggregator.scroll(0.25)
+    aggregator.scroll(0.5)
+    pending.pop()()
+    assert backend.calls == [("scroll", 0.75)]
+
+
+def test_drag_is_pressed_moved_in_steps_and_released():
+    backend, aggregator, pending = _deferred()
+    aggregator.drag(DRAG_STEP_PX * 3 + 1, -10)
+    pending.pop()()
+    moves = [call for call in backend.calls if call[0] == "move"]
+    assert backend.calls[0] == ("button", "left", True)
+    assert backend.calls[-1] == ("button", "left", False)
+    assert len(moves) == 4
+    assert sum(m[1] for m in moves) == DRAG_STEP_PX * 3 + 1
+    assert sum(m[2] for m in moves) == -10
+    assert all(abs(m[1]) <= DRAG_STEP_PX for m in moves)
+
+
+def test_batch_backend_gets_one_batch_per_flush():
+    backend, aggregator, pending = _deferred()
+    batches = []
+
+    @contextlib.contextmanager
+    def batch():
+        batches.append(len(backend.calls))
+        yield
+
+    backend.batch = batch
+    aggregator.move(1, 1)
+    aggregator.click()
+    pending.pop()()
+    assert batches == [0]
+    assert len(backend.calls) == 2
+
+
+def test_inline_submit_and_backend_errors():
+    class Failing(RecordingBackend):
+        def move_mouse(self, dx, dy):
+            raise OSError("gone")
+
+    backend = Failing()
+    aggregator = InputAggregator(backend, lambda fn: fn())
+    aggregator.move(1, 1)
+    aggregator.click()
+    # A failing call does not stop the rest of the flush
+    assert backend.calls == [("click", "left", 1)]
@@ -0,0 +1,78 @@
+import os
+import socket
+import stat
+
+import pytest
+
+from wakematecompanion.core import listeners
+
+unix_only = pytest.mark.skipif(not listeners.UNIX_AVAILABLE or os.name != "posix", reason="needs Unix sockets")
+
+
+def test_parse_listener():
+    assert listeners.parse_listener("0.0.0.0:7777") == (socket.AF_INET, ("0.0.0.0", 7777))
+    assert listeners.parse_listener("[::]:7777") == (socket.AF_INET6, ("::", 7777))
+    assert listeners.parse_listener(("192.0.2.1", "80")) == (socket.AF_INET, ("192.0.2.1", 80))
+    with pytest.raises(ValueError):
+        listeners.parse_listener("localhost")
+
+
+def test_default_listeners_bind_only_the_given_host():
+    specs = listeners.default_listeners("192.0.2.1", 7777, unix_path="/tmp/x.sock")
+    assert specs[0] == ("192.0.2.1", 7777)
+    assert all(spec[0] not in ("::", "0.0.0.0") for spec in specs if isinstance(spec, tuple))
+
+
+def test_covers_ephemeral_ports():
+    bound = ("127.0.0.1", 40000)
+    assert listeners.covers(socket.AF_INET, ("127.0.0.1", 0), socket.AF_INET, bound)
+    assert not listeners.same_address(socket.AF_INET, ("127.0.0.1", 0), socket.AF_INET, bound)
+    assert not listeners.covers(socket.AF_INET, ("127.0.0.2", 0), socket.AF_INET, bound)
+
+
+def test_tcp_listener_accepts():
+    sock, bound = listeners.open_listener(socket.AF_INET, ("127.0.0.1", 0))
+    try:
+        with socket.create_connection(bound, timeout=5):
+            pass
+        assert listeners.format_address(socket.AF_INET, bound) == f"127.0.0.1:{bound[1]}"
+    finally:
+        listeners.close_listener(sock, socket.AF_INET, bound)
+
+
+def test_peer_address_unmaps_ipv4():
+    assert listeners.peer_address(socket.AF_INET6, ("::ffff:192.0.2.1", 5, 0, 0), None) == ("192.0.2.1", 5)
+    assert listeners.peer_address(socket.AF_INET6, ("2001:db8::1", 5, 0, 0), None) == ("2001:db8::1", 5)
+
+
+@unix_only
+def test_unix_socket_is_private_and_umask_untouched(tmp_path):
+    path = str(tmp_path / "sub" / "wakemate.sock")
+    before = os.umask(0o022)
+    try:
+        sock, _ = listeners.open_listener(socket.AF_UNIX, path)
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(before)
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+        # A second server refuses to take over a live socket
+        with pytest.raises(OSError, match="Another server"):
+            listeners.open_listener(socket.AF_UNIX, path)
+    finally:
+        listeners.close_listener(sock, socket.AF_UNIX, path)
+    assert not os.path.exists(path)
+
+
+@unix_only
+def test_stale_unix_socket_is_replaced(tmp_path):
+    path = str(tmp_path / "wakemate.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    sock, _ = listeners.open_listener(socket.AF_UNIX, path)
+    listeners.close_listener(sock, socket.AF_UNIX, path)
+    (tmp_path / "regular").write_text("")
+    with pytest.raises(OSError, match="not a socket"):
+        listeners.open_listener(socket.AF_UNIX, str(tmp_path / "regular"))
@@ -0,0 +1,108 @@
+import json
+import threading
+
+import pytest
+
+from wakematecompanion.core.metrics import Histogram, MergedMetrics, ServerMetrics
+from wakematecompanion.core.server import INPUT_COMMANDS
+
+
+def test_histogram_buckets_and_quantiles():
+    hist = Histogram((1, 10, 100))
+    for value in (0.5, 5, 5, 50, 500):
+        hist.observe(value)
+    assert hist.counts == [1, 2, 1, 1]
+    assert hist.quantile(0.5) == 10
+    assert hist.quantile(1.0) == float("inf")
+    assert Histogram().quantile(0.5) is None
+    assert hist.to_dict()["buckets"]["+Inf"] == 1
+
+
+def test_counters_merge_across_threads():
+    metrics = ServerMetrics()
+
+    def work():
+        for _ in range(1000):
+            metrics.increment("hits", ("a",))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.snapshot()["counters"]["hits[a]"] == 8000
+
+
+def test_record_command_snapshot():
+    metrics = ServerMetrics()
+    metrics.record_command("mouse_move", {"parse": 0.2, "execute": 3.0})
+    metrics.record_command("mouse_move", {"parse": 0.2, "execute": 3.0}, error=True)
+    entry = metrics.snapshot()["commands"]["mouse_move"]
+    assert entry["count"] == 2
+    assert entry["errors"] == 1
+    assert entry["latency_ms"]["execute"]["count"] == 2
+
+
+def test_gauges_are_read_on_demand_and_failures_skipped():
+    metrics = ServerMetrics()
+    value = [1]
+    metrics.register_gauge("depth", lambda: value[0])
+    metrics.register_gauge("broken", lambda: 1 / 0)
+    value[0] = 7
+    assert metrics.snapshot()["gauges"] == {"depth": 7}
+    metrics.unregister_gauge("depth")
+    assert metrics.snapshot()["gauges"] == {}
+
+
+def test_prometheus_histogram_is_cumulative():
+    metrics = ServerMetrics((1, 10))
+    metrics.record_command("ping", {"execute": 0.5})
+    metrics.record_command("ping", {"execute": 5})
+    text = metrics.render_prometheus()
+    assert '# TYPE wakemate_command_latency_ms histogram' in text
+    assert 'le="10"} 2' in text
+    assert 'le="+Inf"} 2' in text
+
+
+def test_merged_metrics_add_worker_exports():
+    worker = ServerMetrics()
+    worker.record_command("ping", {"execute": 1})
+    worker.register_gauge("connections", lambda: 2)
+    merged = MergedMetrics()
+    merged.record_command("ping", {"execute": 1})
+    merged.update(0, worker.export())
+    merged.update(1, worker.export())
+    snapshot = merged.snapshot()
+    assert snapshot["commands"]["ping"]["count"] == 3
+    assert snapshot["gauges"]["connections"] == 4
+
+
+def test_dispatch_records_commands_and_errors(make_server, make_conn):
+    server = make_server()
+    _, conn = make_conn()
+    server._process_command(b'{"command": "ping"}', conn)
+    server._process_command(b'{"command": "no_such_command"}', conn)
+    server._process_command(b'{"command": "mouse_move", "params": {"dx": "far"}}', conn)
+    reply = server._process_command(b'{"command": "get_metrics"}', conn)
+    commands = reply["data"]["commands"]
+    assert commands["ping"]["count"] == 1
+    assert commands["unknown"]["errors"] == 1
+    assert commands["mouse_move"]["errors"] == 1
+
+
+@pytest.mark.parametrize("command", INPUT_COMMANDS)
+def test_input_commands_need_a_session_in_protected_mode(make_server, make_conn, command):
+    server = make_server(auth_mode="protected")
+    _, conn = make_conn()
+    params = {"text": "x", "key": "enter", "action": "down"}
+    reply = server._process_command(json.dumps({"command": command, "params": params}).encode(), conn)
+    assert reply["code"] == "auth_required"
+    listed = server._process_command(b'{"command": "list_commands"}', conn)
+    assert listed["data"]["commands"][command]["protected"]
+
+
+def test_input_commands_without_auth(make_server, make_conn):
+    server = make_server()
+    _, conn = make_conn()
+    reply = server._process_command(b'{"command": "mouse_move", "params": {"dx": 1}}', conn)
+    assert reply["status"] == "success"
@@ -0,0 +1,107 @@
+import errno
+import socket
+import time
+
+from wakematecompanion.core import netmon
+from wakematecompanion.core.netmon import (ADDRESS_ADDED, ADDRESS_REMOVED, LINK_DOWN, LINK_UP, OVERFLOW,
+                                           FakeSource, NetworkMonitor, parse_netlink)
+
+# RTM_NEWADDR dump of a machine with 127.0.0.1 on lo and 192.0.2.2 on eth0
+NEWADDR_DUMP = bytes.fromhex(
+    "4c0000001400020001000000ef450000020880fe01000000080001007f000001080002007f00000107000300"
+    "6c6f0000080008008000000014000600ffffffffffffffff0f0000000f000000580000001400020001000000"
+    "ef450000021880000400000008000100c000020208000200c000020208000400c00002ff0900030065746830"
+    "000000000800080080000000140006ffffffffffffffffff0f0000000f000000"
+)
+
+
+def _message(msg_type, body, attrs=b""):
+    payload = body + attrs
+    return netmon._NLMSGHDR.pack(netmon._NLMSGHDR.size + len(payload), msg_type, 0, 0, 0) + payload
+
+
+def _attr(attr_type, data):
+    length = netmon._RTATTR.size + len(data)
+    return netmon._RTATTR.pack(length, attr_type) + data + bytes(-length % 4)
+
+
+def test_recorded_address_dump():
+    events = parse_netlink(NEWADDR_DUMP)
+    assert [(e.kind, e.address, e.ifindex) for e in events] == [
+        (ADDRESS_ADDED, "127.0.0.1", 1),
+        (ADDRESS_ADDED, "192.0.2.2", 4),
+    ]
+
+
+def test_address_removed_ipv6():
+    body = netmon._IFADDRMSG.pack(socket.AF_INET6, 64, 0, 0, 3)
+    raw = socket.inet_pton(socket.AF_INET6, "fe80::1")
+    events = parse_netlink(_message(netmon._RTM_DELADDR, body, _attr(netmon._IFA_ADDRESS, raw)))
+    assert [(e.kind, e.address, e.ifindex) for e in events] == [(ADDRESS_REMOVED, "fe80::1", 3)]
+
+
+def test_local_address_wins_over_peer_address():
+    body = netmon._IFADDRMSG.pack(socket.AF_INET, 32, 0, 0, 7)
+    attrs = (_attr(netmon._IFA_ADDRESS, socket.inet_aton("10.0.0.2"))
+             + _attr(netmon._IFA_LOCAL, socket.inet_aton("10.0.0.1")))
+    assert parse_netlink(_message(netmon._RTM_NEWADDR, body, attrs))[0].address == "10.0.0.1"
+
+
+def test_link_messages():
+    running = netmon._IFINFOMSG.pack(0, 1, 2, netmon._IFF_RUNNING, 0)
+    stopped = netmon._IFINFOMSG.pack(0, 1, 2, 0, 0)
+    data = (_message(netmon._RTM_NEWLINK, running) + _message(netmon._RTM_NEWLINK, stopped)
+            + _message(netmon._RTM_DELLINK, running))
+    assert [(e.kind, e.ifindex) for e in parse_netlink(data)] == [(LINK_UP, 2), (LINK_DOWN, 2), (LINK_DOWN, 2)]
+
+
+def test_truncated_and_unknown_messages_are_ignored():
+    assert parse_netlink(NEWADDR_DUMP[:10]) == []
+    # A header claiming a length shorter than itself stops parsing
+    assert parse_netlink(netmon._NLMSGHDR.pack(4, netmon._RTM_NEWADDR, 0, 0, 0)) == []
+    # NLMSG_DONE carries no event
+    assert parse_netlink(_message(3, bytes(4))) == []
+    # The first message is cut short; its event is dropped, not misparsed
+    assert len(parse_netlink(NEWADDR_DUMP[:40])) == 0
+
+
+class _FailingSource(FakeSource):
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+    def read(self):
+        super().read()
+        raise OSError(self.error, "read failed")
+
+
+def _run_monitor(source, push):
+    seen = []
+    monitor = NetworkMonitor(lambda events, detected_at: seen.append(events), source, settle=0.01)
+    monitor.start()
+    try:
+        push()
+        deadline = time.monotonic() + 5
+        while not seen and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        monitor.stop()
+    return monitor, seen
+
+
+def test_monitor_merges_a_burst():
+    source = FakeSource()
+
+    def push():
+        source.push(ADDRESS_REMOVED, "10.0.0.1", 2)
+        source.push(ADDRESS_ADDED, "10.0.0.2", 2)
+
+    _, seen = _run_monitor(source, push)
+    assert [e.kind for e in seen[0]] == [ADDRESS_REMOVED, ADDRESS_ADDED]
+
+
+def test_monitor_turns_read_failure_into_overflow_and_stops():
+    source = _FailingSource(errno.EIO)
+    monitor, seen = _run_monitor(source, lambda: source.push(LINK_UP))
+    assert [e.kind for e in seen[0]] == [OVERFLOW]
+    assert monitor._failed
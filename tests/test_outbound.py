@@ -0,0 +1,170 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from wakematecompanion.core.connections import Connection
+from wakematecompanion.core.outbound import DISCONNECT, OutboundWriter
+from wakematecompanion.core.subscriptions import SubscriptionHub
+
+FRAME = b"x" * 16383 + b"\n"
+
+
+def _wait(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def pair():
+    client, server = socket.socketpair()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    conn = Connection(1, server, ("127.0.0.1", 50001))
+    yield client, conn
+    client.close()
+    conn.close()
+
+
+def _writer(conn, **kwargs):
+    writer = OutboundWriter(**kwargs)
+    writer.start()
+    writer.attach(conn)
+    return writer
+
+
+def _fill(conn, limit):
+    """Send frames to a peer that is not reading until more than limit bytes are queued"""
+    while conn.pending_bytes <= limit:
+        conn.send(FRAME)
+
+
+def _drain(client, stop):
+    client.settimeout(0.1)
+    while not stop.is_set():
+        try:
+            if not client.recv(65536):
+                return
+        except socket.timeout:
+            pass
+        except OSError:
+            return
+
+
+def test_watermarks_block_and_release(pair):
+    client, conn = pair
+    writer = _writer(conn, high_watermark=64 * 1024, low_watermark=16 * 1024)
+    try:
+        _fill(conn, 64 * 1024)
+        assert conn.write_blocked()
+        stop = threading.Event()
+        reader = threading.Thread(target=_drain, args=(client, stop))
+        reader.start()
+        assert writer.wait_unblocked(conn)
+        assert not conn.write_blocked()
+        assert _wait(lambda: conn.pending_bytes == 0)
+        stop.set()
+        reader.join(5)
+        assert not conn.closed
+    finally:
+        writer.stop()
+
+
+def test_frames_arrive_in_order(pair):
+    client, conn = pair
+    writer = _writer(conn, high_watermark=1 << 30, low_watermark=0)
+    try:
+        frames = [json.dumps({"n": i, "pad": "y" * 3000}).encode() + b"\n" for i in range(200)]
+        for frame in frames:
+            conn.send(frame)
+        received = b""
+        client.settimeout(5)
+        while len(received) < sum(map(len, frames)):
+            received += client.recv(65536)
+        assert [json.loads(line)["n"] for line in received.splitlines()] == list(range(200))
+    finally:
+        writer.stop()
+
+
+def test_stalled_connection_is_disconnected(pair):
+    _, conn = pair
+    writer = _writer(conn, high_watermark=32 * 1024, low_watermark=0, stall_timeout=0.2)
+    try:
+        _fill(conn, 32 * 1024)
+        assert _wait(lambda: conn.closed)
+        with pytest.raises(ConnectionError):
+            conn.send(FRAME)
+    finally:
+        writer.stop()
+
+
+def test_wait_unblocked_gives_up_after_stall_timeout(pair):
+    _, conn = pair
+    writer = _writer(conn, high_watermark=32 * 1024, low_watermark=0, stall_timeout=0.2)
+    try:
+        _fill(conn, 32 * 1024)
+        assert not writer.wait_unblocked(conn)
+        assert conn.closed
+    finally:
+        writer.stop()
+
+
+def test_disconnect_policy_closes_at_high_watermark(pair):
+    _, conn = pair
+    writer = _writer(conn, high_watermark=32 * 1024, low_watermark=0, overflow=DISCONNECT)
+    try:
+        with pytest.raises(ConnectionError):
+            _fill(conn, 32 * 1024)
+        assert conn.closed
+    finally:
+        writer.stop()
+
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        OutboundWriter(overflow="drop")
+    with pytest.raises(ValueError):
+        OutboundWriter(high_watermark=10, low_watermark=20)
+
+
+class _BlockableConn:
+    def __init__(self):
+        self.id = 1
+        self.label = "phone"
+        self.blocked = False
+        self.frames = []
+
+    def write_blocked(self):
+        return self.blocked
+
+    def send(self, payload):
+        self.frames.append(json.loads(payload))
+
+
+def test_conflate_policy_sends_one_snapshot_after_unblock():
+    hub = SubscriptionHub()
+    hub.start()
+    try:
+        conn = _BlockableConn()
+        hub.subscribe(conn, ["status"])
+        hub.publish("status", {"level": 0})
+        assert _wait(lambda: conn.frames)
+        conn.frames.clear()
+        conn.blocked = True
+        for level in range(1, 20):
+            hub.publish("status", {"level": level})
+        time.sleep(0.2)
+        assert conn.frames == []
+        conn.blocked = False
+        assert _wait(lambda: conn.frames)
+        time.sleep(0.2)
+        assert len(conn.frames) == 1
+        assert conn.frames[0]["snapshot"] == {"level": 19}
+    finally:
+        hub.stop()
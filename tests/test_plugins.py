@@ -0,0 +1,79 @@
+import os
+import sys
+import textwrap
+
+import pytest
+
+from wakematecompanion.core import plugins
+from wakematecompanion.core.auth import AUTH_PROTECTED
+
+PLUGIN = textwrap.dedent('''
+    import os
+    LOADED = os.environ.setdefault("WAKEMATE_TEST_PLUGIN_LOADED", "1")
+
+    COMMANDS = {
+        "echo_name": {
+            "handler": "echo",
+            "description": "Echo a name",
+            "params": {"name": {"type": "str", "required": True}},
+            "protected": False,
+        },
+        "launch_app": {"handler": "echo"},
+        "get_status": {"handler": "echo", "protected": False},
+    }
+
+    def echo(params, conn):
+        return {"status": "success", "data": {"name": params.get("name")}}
+''')
+
+
+@pytest.fixture
+def plugin_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv("WAKEMATE_TEST_PLUGIN_LOADED", raising=False)
+    (tmp_path / "sample.py").write_text(PLUGIN)
+    (tmp_path / "_private.py").write_text(PLUGIN)
+    (tmp_path / "broken.py").write_text("COMMANDS = make_commands()\n")
+    yield str(tmp_path)
+    sys.modules.pop(plugins.DIRECTORY_PREFIX + "sample", None)
+
+
+def test_manifest_is_read_without_importing(plugin_dir, monkeypatch):
+    commands = {c.name: c for c in plugins.discover([plugin_dir], entry_point_group=None)}
+    assert sorted(commands) == ["echo_name", "get_status", "launch_app"]
+    assert commands["echo_name"].params["name"]["required"]
+    assert not commands["echo_name"].protected
+    # Plugin commands are protected unless they say otherwise
+    assert commands["launch_app"].protected
+    assert plugins.DIRECTORY_PREFIX + "sample" not in sys.modules
+    assert "WAKEMATE_TEST_PLUGIN_LOADED" not in os.environ
+
+
+def test_module_loads_on_first_call(plugin_dir):
+    command = next(c for c in plugins.discover([plugin_dir], entry_point_group=None) if c.name == "echo_name")
+    assert command.handler({"name": "x"}, None) == {"status": "success", "data": {"name": "x"}}
+    assert plugins.DIRECTORY_PREFIX + "sample" in sys.modules
+
+
+def test_missing_handler_fails_on_resolve():
+    with pytest.raises(AttributeError):
+        plugins.LazyFunction("json", "no_such_function").resolve()
+
+
+def test_read_manifest_requires_a_literal(tmp_path):
+    path = tmp_path / "plugin.py"
+    path.write_text("COMMANDS = dict(a=1)\n")
+    with pytest.raises(ValueError):
+        plugins.read_manifest(str(path))
+
+
+def test_server_registers_plugins(plugin_dir, make_server, make_conn):
+    server = make_server(auth_mode=AUTH_PROTECTED, plugin_dirs=[plugin_dir])
+    # A plugin cannot replace a built-in command
+    assert not isinstance(server.commands["get_status"], plugins.LazyFunction)
+    _, conn = make_conn()
+    reply = server._process_command(b'{"command": "echo_name", "params": {"name": "pc"}}', conn)
+    assert reply["data"] == {"name": "pc"}
+    reply = server._process_command(b'{"command": "echo_name"}', conn)
+    assert reply["status"] == "error"
+    reply = server._process_command(b'{"command": "launch_app"}', conn)
+    assert reply["code"] == "auth_required"
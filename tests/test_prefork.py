@@ -0,0 +1,94 @@
+import json
+import socket
+import time
+
+import pytest
+
+from wakematecompanion.benchmarks import fakes
+from wakematecompanion.core import prefork
+from wakematecompanion.core.idempotency import IdempotencyCache
+from wakematecompanion.core.metrics import MergedMetrics
+from wakematecompanion.core.rate_limit import RateLimiter
+
+pytestmark = pytest.mark.skipif(not prefork.prefork_supported(), reason="pre-fork mode is Linux-only")
+
+
+@pytest.fixture
+def coordinator():
+    metrics = MergedMetrics()
+    coordinator = prefork._Coordinator(metrics, RateLimiter(None, metrics), IdempotencyCache(wait_timeout=0))
+    clients = []
+
+    def connect(index=0):
+        client = prefork.SharedStateClient(coordinator.address, coordinator.authkey, index, idempotency_wait=0.1)
+        clients.append(client)
+        return client
+
+    yield coordinator, connect
+    for client in clients:
+        client._conn.close()
+    coordinator.close()
+
+
+def test_idempotency_is_shared_across_workers(coordinator):
+    _, connect = coordinator
+    first, second = connect(0), connect(1)
+    cached, ticket = first.idempotency.begin("k")
+    assert cached is None and ticket is not None
+    # The other worker waits for the original, then gives up
+    assert second.idempotency.begin("k") == (None, None)
+    first.idempotency.complete("k", ticket, {"status": "success"})
+    assert second.idempotency.begin("k") == ({"status": "success"}, None)
+
+
+def test_claims_of_a_dead_worker_are_released(coordinator):
+    _, connect = coordinator
+    first, second = connect(0), connect(1)
+    first.idempotency.begin("k")
+    first._conn.close()
+    cached, ticket = None, None
+    for _ in range(50):
+        cached, ticket = second.idempotency.begin("k")
+        if ticket is not None:
+            break
+    assert ticket is not None
+
+
+def test_power_limits_are_shared(coordinator):
+    _, connect = coordinator
+    waits = [connect(i).wrap_rate_limiter(RateLimiter()).check("192.0.2.1", "shutdown") for i in range(2)]
+    # Two workers, one budget
+    assert waits[0] == 0
+    assert waits[1] > 0
+
+
+def _request(port, command):
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+        sock.sendall(json.dumps({"command": command}).encode() + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+
+def test_workers_share_one_port():
+    server = prefork.PreforkServer("127.0.0.1", 0, workers=2, worker_init=fakes.install,
+                                   plugins=False, metrics_port=None)
+    assert server.start()
+    try:
+        for _ in range(4):
+            assert _request(server.port, "get_status")["status"] == "success"
+        assert server.metrics.snapshot()["gauges"]["workers_alive"] == 2
+        # Workers push their metrics to the supervisor every second
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            commands = server.metrics.snapshot()["commands"]
+            if commands.get("get_status", {}).get("count") == 4:
+                break
+            time.sleep(0.1)
+        assert commands["get_status"]["count"] == 4
+    finally:
+        server.stop()
@@ -0,0 +1,136 @@
+import threading
+
+import pytest
+
+from wakematecompanion.core.rate_limit import DEFAULT_CLASS, RateLimiter, TokenBucket, command_class
+from wakematecompanion.core.scheduler import (PRIORITY_CONTROL, PRIORITY_INPUT, PriorityScheduler,
+                                              SchedulerBusy)
+
+
+def test_token_bucket_burst_then_refill():
+    bucket = TokenBucket(rate=10.0, burst=3, now=0.0)
+    assert [bucket.take(0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(0.0) == pytest.approx(0.1)
+    assert bucket.take(0.1) == 0.0
+    assert not bucket.is_full(0.1)
+    assert bucket.is_full(1.0)
+
+
+def test_token_bucket_never_exceeds_burst():
+    bucket = TokenBucket(rate=100.0, burst=2, now=0.0)
+    bucket.take(1000.0)
+    bucket.take(1000.0)
+    assert bucket.take(1000.0) > 0
+
+
+def test_zero_rate_bucket_waits_forever():
+    bucket = TokenBucket(rate=0.0, burst=1, now=0.0)
+    assert bucket.take(0.0) == 0.0
+    assert bucket.take(5.0) == float("inf")
+
+
+def test_rate_limiter_is_per_client_and_class():
+    limiter = RateLimiter({"power": (0.001, 1)})
+    assert limiter.check("10.0.0.1", "shutdown") == 0.0
+    assert limiter.check("10.0.0.1", "restart") > 0
+    assert limiter.check("10.0.0.2", "shutdown") == 0.0
+    assert limiter.check("10.0.0.1", "mouse_move") == 0.0
+
+
+def test_rate_limiter_class_can_be_disabled():
+    limiter = RateLimiter({"power": None})
+    assert all(limiter.check("10.0.0.1", "shutdown") == 0.0 for _ in range(10))
+    assert limiter.snapshot()["limits"]["power"] is None
+
+
+def test_command_class():
+    assert command_class("keyboard_special") == "input"
+    assert command_class("no_such_command") == DEFAULT_CLASS
+
+
+def test_jobs_run_in_priority_order():
+    scheduler = PriorityScheduler(workers=1)
+    scheduler.start()
+    try:
+        gate = threading.Event()
+        order = []
+        scheduler.submit(PRIORITY_INPUT, gate.wait)
+        for i in range(3):
+            scheduler.submit(PRIORITY_INPUT, order.append, f"input{i}")
+        scheduler.submit(PRIORITY_CONTROL, order.append, "control")
+        gate.set()
+        assert scheduler.drain(5)
+        assert order == ["control", "input0", "input1", "input2"]
+    finally:
+        scheduler.stop()
+
+
+def test_run_returns_result_and_raises_errors():
+    scheduler = PriorityScheduler()
+    scheduler.start()
+    try:
+        result, queue_ms = scheduler.run(PRIORITY_CONTROL, lambda a, b: a + b, 2, 3)
+        assert result == 5
+        assert queue_ms >= 0
+        with pytest.raises(ZeroDivisionError):
+            scheduler.run(PRIORITY_CONTROL, lambda: 1 / 0)
+    finally:
+        scheduler.stop()
+
+
+def test_queue_bound_raises_busy():
+    scheduler = PriorityScheduler(workers=1, max_queued=2)
+    scheduler.start()
+    gate = threading.Event()
+    try:
+        scheduler.submit(PRIORITY_INPUT, gate.wait)
+        # Let the worker pick up the blocking job
+        assert not scheduler.drain(0.1)
+        scheduler.submit(PRIORITY_INPUT, lambda: None)
+        scheduler.submit(PRIORITY_INPUT, lambda: None)
+        with pytest.raises(SchedulerBusy):
+            scheduler.submit(PRIORITY_INPUT, lambda: None)
+        # Each priority has its own bound
+        scheduler.submit(PRIORITY_CONTROL, lambda: None)
+    finally:
+        gate.set()
+        scheduler.stop()
+
+
+def test_stop_fails_queued_waiters():
+    scheduler = PriorityScheduler(workers=1)
+    scheduler.start()
+    gate = threading.Event()
+    errors = []
+
+    def waiter():
+        try:
+            scheduler.run(PRIORITY_INPUT, lambda: None)
+        except RuntimeError as e:
+            errors.append(e)
+
+    scheduler.submit(PRIORITY_INPUT, gate.wait)
+    assert not scheduler.drain(0.1)
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while not scheduler.snapshot()["input"]:
+        thread.join(0.01)
+    stopper = threading.Thread(target=scheduler.stop)
+    stopper.start()
+    thread.join(5)
+    gate.set()
+    stopper.join(5)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    assert scheduler.snapshot() == {"control": 0, "input": 0}
+
+
+def test_runs_inline_after_stop():
+    scheduler = PriorityScheduler()
+    scheduler.start()
+    scheduler.stop()
+    assert not scheduler.running
+    assert scheduler.run(PRIORITY_CONTROL, lambda: "inline") == ("inline", 0.0)
+    ran = []
+    scheduler.submit(PRIORITY_INPUT, ran.append, 1)
+    assert ran == [1]
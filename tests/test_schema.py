@@ -0,0 +1,117 @@
+import pytest
+
+from wakematecompanion.core.schema import COMMAND_PARAMS, ValidationError, compile_params, describe_params
+
+
+def validator(command):
+    return compile_params(COMMAND_PARAMS[command])
+
+
+def test_defaults_are_filled_in():
+    assert validator("mouse_move")({}) == {"dx": 0, "dy": 0}
+    assert validator("mouse_click")(None) == {"button": "left", "clicks": 1}
+
+
+def test_unknown_params_are_dropped():
+    assert validator("mouse_move")({"dx": 5, "extra": True}) == {"dx": 5, "dy": 0}
+
+
+def test_params_must_be_an_object():
+    with pytest.raises(ValidationError):
+        validator("mouse_move")([1, 2])
+
+
+def test_int_accepts_whole_floats_only():
+    check = validator("mouse_move")
+    assert check({"dx": 3.0})["dx"] == 3
+    assert type(check({"dx": 3.0})["dx"]) is int
+    for bad in (3.5, "3", True):
+        with pytest.raises(ValidationError):
+            check({"dx": bad})
+
+
+def test_range_is_enforced():
+    check = validator("mouse_move")
+    assert check({"dx": 10000})["dx"] == 10000
+    with pytest.raises(ValidationError, match="at most"):
+        check({"dx": 10001})
+    with pytest.raises(ValidationError, match="at least"):
+        check({"dy": -10001})
+
+
+def test_number_is_converted_to_float():
+    assert validator("mouse_scroll")({"amount": 2}) == {"amount": 2.0, "horizontal": 0}
+    with pytest.raises(ValidationError):
+        validator("mouse_scroll")({"amount": "2"})
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf")])
+def test_non_finite_numbers_are_rejected(value):
+    with pytest.raises(ValidationError, match="must be a number"):
+        validator("mouse_scroll")({"amount": value})
+    with pytest.raises(ValidationError, match="must be an integer"):
+        validator("mouse_move")({"dx": value})
+
+
+def test_bool_rejects_integers():
+    check = compile_params({"flag": {"type": "bool"}})
+    assert check({"flag": False}) == {"flag": False}
+    with pytest.raises(ValidationError):
+        check({"flag": 1})
+
+
+def test_choices():
+    check = validator("mouse_button")
+    assert check({"button": "right", "action": "down"}) == {"button": "right", "action": "down"}
+    with pytest.raises(ValidationError, match="one of"):
+        check({"button": "side", "action": "down"})
+
+
+def test_long_choice_lists_are_not_spelled_out():
+    with pytest.raises(ValidationError, match="list_commands"):
+        validator("key_press")({"key": "not-a-key"})
+
+
+def test_required_params():
+    with pytest.raises(ValidationError, match="Missing 'action'"):
+        validator("mouse_button")({})
+    with pytest.raises(ValidationError, match="Missing 'action'"):
+        validator("mouse_button")({"action": None})
+
+
+def test_string_length_and_pattern():
+    check = validator("wake")
+    assert check({"mac": "aa:bb:cc:dd:ee:ff"})["broadcast"] == "255.255.255.255"
+    with pytest.raises(ValidationError, match="expected format"):
+        check({"mac": "aa:bb:cc:dd:ee"})
+    with pytest.raises(ValidationError, match="longer than"):
+        validator("keyboard_input")({"text": "x" * 4097})
+
+
+def test_broadcast_must_be_an_ipv4_address():
+    check = validator("wake")
+    assert check({"mac": "aa:bb:cc:dd:ee:ff", "broadcast": "192.168.1.255"})["broadcast"] == "192.168.1.255"
+    for bad in ("999.999.999.999", "256.1.1.1", "1.2.3", "::1"):
+        with pytest.raises(ValidationError, match="valid ipv4"):
+            check({"mac": "aa:bb:cc:dd:ee:ff", "broadcast": bad})
+
+
+def test_list_items_are_checked():
+    check = validator("subscribe")
+    assert check({"topics": "status"}) == {"topics": ["status"]}
+    with pytest.raises(ValidationError):
+        check({"topics": ["status", "nope"]})
+    with pytest.raises(ValidationError, match="more than"):
+        check({"topics": ["status"] * 100})
+
+
+def test_unknown_type_is_a_programming_error():
+    with pytest.raises(ValueError):
+        compile_params({"x": {"type": "complex"}})
+
+
+def test_every_command_schema_compiles_and_describes():
+    for command, fields in COMMAND_PARAMS.items():
+        compile_params(fields)
+        described = describe_params(fields)
+        assert set(described) == set(fields or {})
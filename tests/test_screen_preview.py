@@ -0,0 +1,98 @@
+import pytest
+
+pytest.importorskip("PIL")
+
+from wakematecompanion.core import screen_preview
+from wakematecompanion.core.screen_preview import SyntheticSource, TileTracker, preview_size, tile_runs
+
+
+@pytest.fixture(params=["numpy", "hashes"])
+def tracker_mode(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(screen_preview, "NUMPY_AVAILABLE", request.param == "numpy")
+    return request.param
+
+
+def test_first_frame_is_all_tiles(tracker_mode):
+    tracker = TileTracker(64)
+    tiles = tracker.changed(SyntheticSource(200, 100).grab())
+    assert (tracker.cols, tracker.rows) == (4, 2)
+    assert len(tiles) == 8
+
+
+def test_still_screen_has_no_changes(tracker_mode):
+    source = SyntheticSource(200, 100, step=0, box=20)
+    tracker = TileTracker(64)
+    tracker.mark_sent(tracker.changed(source.grab()), 70)
+    assert tracker.changed(source.grab()) == []
+
+
+def test_moving_box_changes_only_its_tiles(tracker_mode):
+    source = SyntheticSource(640, 320, step=64, box=40)
+    tracker = TileTracker(64)
+    tracker.mark_sent(tracker.changed(source.grab()), 70)
+    changed = tracker.changed(source.grab())
+    # The box leaves tile column 0 and lands in column 1, on the middle rows
+    assert changed
+    assert {col for col, _ in changed} <= {0, 1}
+    assert {row for _, row in changed} <= {1, 2}
+    tracker.mark_sent(changed, 70)
+    assert tracker.changed(source._background.copy()) != []
+
+
+def test_unsent_tiles_stay_changed(tracker_mode):
+    source = SyntheticSource(256, 128, step=0)
+    tracker = TileTracker(64)
+    first = tracker.changed(source.grab())
+    tracker.mark_sent(first[:2], 70)
+    assert sorted(tracker.changed(source.grab())) == sorted(first[2:])
+
+
+def test_new_size_resets(tracker_mode):
+    tracker = TileTracker(64)
+    tracker.mark_sent(tracker.changed(SyntheticSource(128, 128, step=0).grab()), 70)
+    assert len(tracker.changed(SyntheticSource(256, 128, step=0).grab())) == 8
+
+
+def test_below_returns_low_quality_rows():
+    tracker = TileTracker(64)
+    tracker.mark_sent(tracker.changed(SyntheticSource(256, 192, step=0).grab()), 70)
+    tracker.mark_sent([(1, 0), (2, 2)], 25)
+    assert tracker.below(70, 1) == [(1, 0)]
+    assert tracker.below(70, 2) == [(1, 0), (2, 2)]
+    assert tracker.below(25, 2) == []
+
+
+def test_tile_runs_merges_rows():
+    boxes = tile_runs([(2, 0), (0, 0), (1, 0), (3, 1)], 64, (250, 100), 4, 2)
+    assert boxes == [(0, 0, 192, 64), (192, 64, 250, 100)]
+
+
+def test_tile_runs_splits_gaps():
+    assert tile_runs([(0, 0), (2, 0)], 10, (40, 10), 4, 1) == [(0, 0, 10, 10), (20, 0, 30, 10)]
+
+
+def test_tile_runs_whole_frame():
+    tiles = [(c, r) for r in range(2) for c in range(3)]
+    assert tile_runs(tiles, 64, (150, 100), 3, 2) == [(0, 0, 150, 100)]
+
+
+def test_tile_runs_cover_changed_tiles(tracker_mode):
+    source = SyntheticSource(640, 360, step=50, box=90)
+    tracker = TileTracker(64)
+    tracker.mark_sent(tracker.changed(source.grab()), 70)
+    image = source.grab()
+    changed = tracker.changed(image)
+    boxes = tile_runs(changed, 64, image.size, tracker.cols, tracker.rows)
+    covered = set()
+    for left, top, right, bottom in boxes:
+        assert right <= image.size[0] and bottom <= image.size[1]
+        covered |= {(c, top // 64) for c in range(left // 64, -(-right // 64))}
+    assert covered == set(changed)
+
+
+def test_preview_size():
+    assert preview_size(1920, 1080, 960, 540) == (960, 540)
+    assert preview_size(800, 600, 960, 540) == (720, 540)
+    assert preview_size(320, 200, 960, 540) == (320, 200)
@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+
+import pytest
+
+from wakematecompanion.core.subscriptions import SubscriptionHub
+
+
+class _Subscriber:
+    def __init__(self, conn_id=1):
+        self.id = conn_id
+        self.label = f"phone{conn_id}"
+        self.blocked = False
+        self.events = []
+
+    def write_blocked(self):
+        return self.blocked
+
+    def send(self, payload):
+        self.events.extend(json.loads(line) for line in payload.splitlines())
+
+
+def _wait(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def hub():
+    hub = SubscriptionHub(poll_interval=None)
+    hub.start()
+    yield hub
+    hub.stop()
+
+
+def test_publish_pushes_deltas(hub):
+    sub = _Subscriber()
+    hub.subscribe(sub, ["status"])
+    assert hub.publish("status", {"a": 1, "b": 2})
+    assert _wait(lambda: len(sub.events) == 1)
+    assert hub.publish("status", {"a": 1})
+    assert _wait(lambda: len(sub.events) == 2)
+    assert not hub.publish("status", {"a": 1})
+    first, second = sub.events
+    assert first["delta"] == {"a": 1, "b": 2}
+    assert second["delta"] == {"b": None}
+    assert second["seq"] == first["seq"] + 1
+
+
+def test_new_subscriber_gets_a_snapshot(hub):
+    hub.publish("status", {"a": 1})
+    sub = _Subscriber()
+    assert hub.subscribe(sub, ["status", "bogus"]) == ["status"]
+    assert _wait(lambda: sub.events)
+    assert sub.events[0]["snapshot"] == {"a": 1}
+
+
+def test_unsubscribe_stops_pushes(hub):
+    sub = _Subscriber()
+    hub.subscribe(sub, ["status", "wake"])
+    hub.unsubscribe(sub.id, ["status"])
+    assert hub.topics(sub.id) == ["wake"]
+    hub.publish("status", {"a": 1})
+    hub.publish("wake", {"sent": 1})
+    assert _wait(lambda: sub.events)
+    time.sleep(0.05)
+    assert [event["topic"] for event in sub.events] == ["wake"]
+    hub.unsubscribe(sub.id)
+    assert hub.topics(sub.id) == []
+
+
+def test_sources_are_read_on_subscribe_and_refresh(hub):
+    volume = {"level": 10}
+    hub.register_source("volume", lambda: dict(volume))
+    sub = _Subscriber()
+    hub.subscribe(sub, ["volume"])
+    assert _wait(lambda: sub.events)
+    volume["level"] = 20
+    hub.request_refresh("volume")
+    assert _wait(lambda: len(sub.events) == 2)
+    assert sub.events[1]["delta"] == {"level": 20}
+
+
+def test_slow_source_does_not_hold_back_other_topics(hub):
+    release = threading.Event()
+    hub.register_source("now_playing", lambda: release.wait(5) and {"title": "x"})
+    sub = _Subscriber()
+    hub.subscribe(sub, ["now_playing", "status"])
+    hub.publish("status", {"a": 1})
+    try:
+        assert _wait(lambda: sub.events, timeout=1)
+        assert sub.events[0]["topic"] == "status"
+    finally:
+        release.set()
+
+
+def test_subscribed_sources_are_polled():
+    hub = SubscriptionHub(poll_interval=0.05)
+    reads = []
+    hub.register_source("volume", lambda: reads.append(1) or {"level": len(reads)})
+    hub.register_source("now_playing", lambda: reads.append(2) or {"title": "x"})
+    hub.start()
+    try:
+        time.sleep(0.2)
+        # Nobody is subscribed: nothing is read
+        assert reads == []
+        sub = _Subscriber()
+        hub.subscribe(sub, ["volume"])
+        assert _wait(lambda: len(sub.events) >= 3)
+        assert 2 not in reads
+        assert [event["seq"] for event in sub.events[:3]] == [1, 2, 3]
+    finally:
+        hub.stop()
+
+
+def test_blocked_subscriber_is_dropped_after_max_lag():
+    hub = SubscriptionHub(max_lag=0.1, poll_interval=None)
+    hub.start()
+    try:
+        sub = _Subscriber()
+        sub.blocked = True
+        hub.subscribe(sub, ["status"])
+        hub.publish("status", {"a": 1})
+        assert _wait(lambda: not hub.topics(sub.id))
+        assert not hub.has_subscribers("status")
+    finally:
+        hub.stop()
@@ -0,0 +1,85 @@
+import re
+import socket
+import ssl
+import threading
+
+import pytest
+
+from wakematecompanion.core import tls
+
+
+@pytest.fixture(scope="module")
+def config(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("tls")
+    try:
+        return tls.TLSConfig(str(directory / "cert.pem"), str(directory / "key.pem"))
+    except RuntimeError as e:
+        pytest.skip(str(e))
+
+
+def _serve(config, listener, count):
+    for _ in range(count):
+        sock, _ = listener.accept()
+        conn = config.wrap(sock)
+        try:
+            conn.do_handshake()
+            data = conn.recv(100)
+            conn.sendall(data)
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            conn.close()
+
+
+def _connect(port, context=None, session=None):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    conn = (context or tls.client_context()).wrap_socket(sock, session=session)
+    conn.sendall(b"hello")
+    assert conn.recv(100) == b"hello"
+    return conn
+
+
+@pytest.fixture
+def server(config):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(4)
+    thread = threading.Thread(target=_serve, args=(config, listener, 2))
+    thread.daemon = True
+    thread.start()
+    yield listener.getsockname()[1]
+    listener.close()
+
+
+def test_certificate_is_created_once(config):
+    assert re.fullmatch(r"([0-9A-F]{2}:){31}[0-9A-F]{2}", config.fingerprint)
+    again = tls.TLSConfig(config.cert_path, config.key_path)
+    assert again.fingerprint == config.fingerprint
+
+
+def test_pinned_fingerprint(config, server):
+    conn = _connect(server)
+    try:
+        tls.verify_fingerprint(conn, config.fingerprint.lower())
+        with pytest.raises(ssl.SSLError):
+            tls.verify_fingerprint(conn, "00:" * 31 + "00")
+    finally:
+        conn.close()
+
+
+def test_session_is_resumed(config, server):
+    context = tls.client_context()
+    first = _connect(server, context)
+    session = first.session
+    first.close()
+    second = _connect(server, context, session)
+    try:
+        assert second.session_reused
+    finally:
+        second.close()
+    assert config.session_stats()["hits"] >= 1
+
+
+def test_format_fingerprint():
+    assert tls.format_fingerprint(b"") == (
+        "E3:B0:C4:42:98:FC:1C:14:9A:FB:F4:C8:99:6F:B9:24:27:AE:41:E4:64:9B:93:4C:A4:95:99:1B:78:52:B8:55")
@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+
+from wakematecompanion.core import tracing
+from wakematecompanion.core.tracing import Tracer
+
+
+def test_ring_buffer_keeps_newest_spans():
+    tracer = Tracer(capacity=4)
+    for i in range(10):
+        now = time.perf_counter()
+        tracer.add(f"span{i}", "request", now, now + 0.001)
+    names = [event["name"] for event in tracer.events() if event["ph"] == "X"]
+    assert names == ["span6", "span7", "span8", "span9"]
+
+
+def test_chrome_events():
+    tracer = Tracer()
+    start = time.perf_counter()
+    tracer.add("decode", "request", start, start + 0.002, {"bytes": 10})
+    tracer.instant("overflow", "network", start)
+    doc = json.loads(json.dumps(tracer.to_chrome()))
+    span, instant, meta = doc["traceEvents"]
+    assert span["ph"] == "X" and abs(span["dur"] - 2000) < 1 and span["args"] == {"bytes": 10}
+    assert instant["ph"] == "i" and "dur" not in instant
+    assert meta["ph"] == "M" and meta["args"]["name"] == threading.current_thread().name
+
+
+def test_sample_rate():
+    assert Tracer(sample_rate=1.0).should_sample()
+    tracer = Tracer(sample_rate=0.0001)
+    assert sum(tracer.should_sample() for _ in range(1000)) < 50
+
+
+def test_backend_calls_record_spans_only_inside_traced_requests():
+    tracer = Tracer()
+    backend = tracing.traced(lambda x: x * 2, "fake.call")
+    tracing.install(tracer)
+    try:
+        assert backend(2) == 4
+        assert tracer.events() == []
+        handler = tracer.wrap(lambda: backend(3), "handle:test")
+        assert handler() == 6
+        assert not tracing.sampled()
+    finally:
+        tracing.install(None)
+    names = [event["name"] for event in tracer.events() if event["ph"] == "X"]
+    assert names == ["fake.call", "handle:test"]
+
+
+def test_dump(tmp_path):
+    tracer = Tracer()
+    now = time.perf_counter()
+    tracer.add("a", "request", now, now)
+    path = tmp_path / "traces" / "trace.json"
+    assert tracer.dump(str(path)) == 2
+    assert json.loads(path.read_text())["otherData"]["sample_rate"] == 1.0
+
+
+def test_server_trace_commands(make_server, make_conn):
+    server = make_server()
+    _, conn = make_conn(host="127.0.0.1")
+    try:
+        reply = server._process_command(b'{"command": "trace_start", "params": {"buffer_size": 1024}}', conn)
+        assert reply["buffer_size"] == 1024
+        server._process_command(b'{"command": "get_status"}', conn)
+        assert server._process_command(b'{"command": "trace_stop"}', conn)["was_tracing"]
+        trace = server._process_command(b'{"command": "trace_dump", "params": {"inline": true}}', conn)["trace"]
+    finally:
+        server._disable_tracing()
+    names = {event["name"] for event in trace["traceEvents"]}
+    assert {"decode", "validate", "handle:get_status", "encode", "send"} <= names
+    assert tracing.active() is None
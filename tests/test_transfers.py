@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from wakematecompanion.core.connections import Connection
+from wakematecompanion.core.transfers import (COMPLETE, FAILED, PAUSED, PART_SUFFIX, TransferError,
+                                              TransferManager, check_name)
+
+DATA = os.urandom(300 * 1024 + 17)
+
+
+def _pair(conn_id=1):
+    client, server = socket.socketpair()
+    server.settimeout(5)
+    client.settimeout(5)
+    return client, Connection(conn_id, server, ("127.0.0.1", 50000 + conn_id))
+
+
+def _run(manager, transfer, conn):
+    thread = threading.Thread(target=manager.run, args=(transfer, conn, lambda: True))
+    thread.start()
+    return thread
+
+
+def _read_line(sock, expected_bytes=0):
+    buf = b""
+    while len(buf) < expected_bytes or b"\n" not in buf[expected_bytes:]:
+        data = sock.recv(65536)
+        if not data:
+            break
+        buf += data
+    body, line = buf[:expected_bytes], buf[expected_bytes:]
+    return body, json.loads(line)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return TransferManager(str(tmp_path), chunk_size=4096)
+
+
+@pytest.mark.parametrize("name", ["../etc/passwd", "a/b", "a\\b", "/abs", ".hidden", "", "x.part", "nul\0"])
+def test_check_name_rejects_paths(name):
+    with pytest.raises(TransferError):
+        check_name(name)
+
+
+def test_check_name_accepts_plain_names():
+    check_name("IMG_0001.jpg")
+    check_name("report v2.pdf")
+
+
+def test_traversal_never_reaches_the_filesystem(manager, tmp_path):
+    with pytest.raises(TransferError):
+        manager.start_upload("../escape.bin", 10)
+    with pytest.raises(TransferError):
+        manager.start_download("../" + tmp_path.name + "/x")
+    assert not (tmp_path.parent / "escape.bin").exists()
+
+
+def test_upload_with_hash(manager, tmp_path):
+    digest = hashlib.sha256(DATA).hexdigest()
+    transfer = manager.start_upload("a.bin", len(DATA), sha256=digest.upper())
+    client, conn = _pair()
+    manager.attach(transfer.id, conn)
+    thread = _run(manager, transfer, conn)
+    client.sendall(DATA)
+    _, line = _read_line(client)
+    thread.join(5)
+    assert line["type"] == "transfer_complete"
+    assert line["sha256"] == digest
+    assert transfer.status == COMPLETE
+    assert (tmp_path / "a.bin").read_bytes() == DATA
+    assert not (tmp_path / ("a.bin" + PART_SUFFIX)).exists()
+
+
+def test_upload_hash_mismatch_discards_file(manager, tmp_path):
+    transfer = manager.start_upload("a.bin", len(DATA), sha256="0" * 64)
+    client, conn = _pair()
+    manager.attach(transfer.id, conn)
+    thread = _run(manager, transfer, conn)
+    client.sendall(DATA)
+    _, line = _read_line(client)
+    thread.join(5)
+    assert line["type"] == "transfer_failed"
+    assert line["code"] == "hash_mismatch"
+    assert transfer.status == FAILED
+    assert not (tmp_path / "a.bin").exists()
+    assert not (tmp_path / ("a.bin" + PART_SUFFIX)).exists()
+
+
+def test_upload_resumes_after_disconnect(manager, tmp_path):
+    digest = hashlib.sha256(DATA).hexdigest()
+    transfer = manager.start_upload("a.bin", len(DATA), sha256=digest)
+    client, conn = _pair(1)
+    manager.attach(transfer.id, conn)
+    thread = _run(manager, transfer, conn)
+    cut = 100 * 1024 + 3
+    client.sendall(DATA[:cut])
+    client.close()
+    thread.join(5)
+    assert transfer.status == PAUSED
+    assert transfer.offset == cut
+
+    client, conn = _pair(2)
+    assert manager.attach(transfer.id, conn).offset == cut
+    thread = _run(manager, transfer, conn)
+    client.sendall(DATA[cut:])
+    _, line = _read_line(client)
+    thread.join(5)
+    assert line["sha256"] == digest
+    assert (tmp_path / "a.bin").read_bytes() == DATA
+
+
+def test_upload_resumes_part_file_after_restart(manager, tmp_path):
+    digest = hashlib.sha256(DATA).hexdigest()
+    cut = 5000
+    (tmp_path / ("a.bin" + PART_SUFFIX)).write_bytes(DATA[:cut])
+    restarted = TransferManager(str(tmp_path), chunk_size=4096)
+    transfer = restarted.start_upload("a.bin", len(DATA), sha256=digest)
+    assert transfer.offset == cut
+    client, conn = _pair()
+    restarted.attach(transfer.id, conn)
+    thread = _run(restarted, transfer, conn)
+    client.sendall(DATA[cut:])
+    _, line = _read_line(client)
+    thread.join(5)
+    assert line["type"] == "transfer_complete"
+    assert (tmp_path / "a.bin").read_bytes() == DATA
+
+
+def test_upload_refuses_existing_file(manager, tmp_path):
+    (tmp_path / "a.bin").write_bytes(b"x")
+    with pytest.raises(TransferError) as info:
+        manager.start_upload("a.bin", 10)
+    assert info.value.code == "exists"
+    assert manager.start_upload("a.bin", 10, overwrite=True).offset == 0
+
+
+def test_download_from_offset_hashes_whole_file(manager, tmp_path):
+    (tmp_path / "d.bin").write_bytes(DATA)
+    transfer = manager.start_download("d.bin")
+    client, conn = _pair()
+    offset = 12345
+    manager.attach(transfer.id, conn, offset=offset)
+    thread = _run(manager, transfer, conn)
+    body, line = _read_line(client, len(DATA) - offset)
+    thread.join(5)
+    assert body == DATA[offset:]
+    assert line["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_download_of_changed_file_fails(manager, tmp_path):
+    path = tmp_path / "d.bin"
+    path.write_bytes(DATA)
+    transfer = manager.start_download("d.bin")
+    path.write_bytes(DATA[:10])
+    _, conn = _pair()
+    with pytest.raises(TransferError) as info:
+        manager.attach(transfer.id, conn)
+    assert info.value.code == "invalid_state"
+
+
+def test_download_offset_out_of_range(manager, tmp_path):
+    (tmp_path / "d.bin").write_bytes(b"abc")
+    transfer = manager.start_download("d.bin")
+    _, conn = _pair()
+    with pytest.raises(TransferError):
+        manager.attach(transfer.id, conn, offset=4)
+
+
+def test_missing_download(manager):
+    with pytest.raises(TransferError) as info:
+        manager.start_download("nope.bin")
+    assert info.value.code == "not_found"
+
+
+def test_max_active_transfers(tmp_path):
+    manager = TransferManager(str(tmp_path), max_active=1)
+    first = manager.start_upload("a.bin", 10)
+    second = manager.start_upload("b.bin", 10)
+    manager.attach(first.id, _pair(1)[1])
+    with pytest.raises(TransferError) as info:
+        manager.attach(second.id, _pair(2)[1])
+    assert info.value.code == "busy"
+
+
+def test_cancel_removes_partial_upload(manager, tmp_path):
+    transfer = manager.start_upload("a.bin", 10)
+    assert (tmp_path / ("a.bin" + PART_SUFFIX)).exists()
+    manager.cancel(transfer.id)
+    assert not (tmp_path / ("a.bin" + PART_SUFFIX)).exists()
+    with pytest.raises(TransferError):
+        manager.attach(transfer.id, _pair()[1])
+
+
+def test_list_files_hides_partial_and_hidden(manager, tmp_path):
+    (tmp_path / "a.bin").write_bytes(b"1")
+    (tmp_path / "b.bin.part").write_bytes(b"1")
+    (tmp_path / ".secret").write_bytes(b"1")
+    assert [f["name"] for f in manager.list_files()] == ["a.bin"]
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from wakematecompanion.core import uinput
+from wakematecompanion.core.uinput import (BUTTONS, EV_KEY, EV_REL, EV_SYN, KEY_LEFTSHIFT, REL_WHEEL, REL_WHEEL_HI_RES,
+                                           REL_X, REL_Y, SYN_REPORT, UInputBackend, read_events)
+
+SYN = (EV_SYN, SYN_REPORT, 0)
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    path = tmp_path / "events"
+    path.write_bytes(b"")
+    backend = UInputBackend(str(path))
+    yield backend, lambda: read_events(path.read_bytes())
+    backend.close()
+
+
+def test_move_is_one_frame(recorder):
+    backend, events = recorder
+    backend.move_mouse(3, -4)
+    backend.move_mouse(0, 0)
+    assert events() == [(EV_REL, REL_X, 3), (EV_REL, REL_Y, -4), SYN]
+
+
+def test_click_and_shifted_text(recorder):
+    backend, events = recorder
+    backend.click_mouse("right", clicks=2)
+    backend.type_text("A")
+    right = BUTTONS["right"]
+    code = uinput.CHARS["a"][0]
+    assert events() == [
+        (EV_KEY, right, 1), SYN, (EV_KEY, right, 0), SYN,
+        (EV_KEY, right, 1), SYN, (EV_KEY, right, 0), SYN,
+        (EV_KEY, KEY_LEFTSHIFT, 1), (EV_KEY, code, 1), SYN,
+        (EV_KEY, code, 0), (EV_KEY, KEY_LEFTSHIFT, 0), SYN,
+    ]
+
+
+def test_unknown_keys_are_refused(recorder):
+    backend, events = recorder
+    with pytest.raises(ValueError):
+        backend.press_key("hyper")
+    with pytest.raises(ValueError):
+        backend.type_text("ü")
+    assert events() == []
+
+
+def test_fractional_scroll_sends_detents_when_whole(recorder):
+    backend, events = recorder
+    backend.scroll_mouse(0.5)
+    backend.scroll_mouse(0.5)
+    assert events() == [
+        (EV_REL, REL_WHEEL_HI_RES, 60), SYN,
+        (EV_REL, REL_WHEEL_HI_RES, 60), (EV_REL, REL_WHEEL, 1), SYN,
+    ]
+
+
+def test_batch_is_a_single_write(recorder, monkeypatch):
+    backend, events = recorder
+    backend.open()
+    writes = []
+    real_write = os.write
+
+    def counting_write(fd, data):
+        writes.append(len(data))
+        return real_write(fd, data)
+
+    monkeypatch.setattr(uinput.os, "write", counting_write)
+    with backend.batch():
+        backend.move_mouse(1, 1)
+        backend.type_text("hello")
+        backend.mouse_button("left", True)
+    assert len(writes) == 1
+    assert len(events()) * uinput.EVENT_SIZE == writes[0]
+
+
+def test_read_events_ignores_partial_tail():
+    data = b"".join(uinput.struct.pack(uinput.EVENT_FORMAT, 0, 0, *event) for event in [(EV_REL, REL_X, 1), SYN])
+    assert read_events(data + b"\0" * 3) == [(EV_REL, REL_X, 1), SYN]
+
+
+def test_settle_waits_for_the_event_node(tmp_path, monkeypatch):
+    (tmp_path / "input42" / "event7").mkdir(parents=True)
+    monkeypatch.setattr(uinput, "SYSFS_INPUT", str(tmp_path))
+    monkeypatch.setattr(uinput, "SETTLE_DELAY", 0)
+    monkeypatch.setattr(uinput.fcntl, "ioctl", lambda fd, request, arg: b"input42\0".ljust(64, b"\0"))
+    real_exists = os.path.exists
+    seen = []
+
+    def exists(path):
+        if path.startswith("/dev/input/"):
+            seen.append(path)
+            return True
+        return real_exists(path)
+
+    monkeypatch.setattr(uinput.os.path, "exists", exists)
+    UInputBackend()._settle(0)
+    assert seen == ["/dev/input/event7"]
+
+
+def test_settle_gives_up(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(uinput, "SYSFS_INPUT", str(tmp_path))
+    monkeypatch.setattr(uinput, "SETTLE_DELAY", 0)
+    monkeypatch.setattr(uinput, "SETTLE_TIMEOUT", 0.05)
+    monkeypatch.setattr(uinput.fcntl, "ioctl", lambda fd, request, arg: b"input1\0".ljust(64, b"\0"))
+    UInputBackend()._settle(0)
+    assert "no event node" in caplog.text
+
+    def no_sysname(fd, request, arg):
+        raise OSError("not supported")
+
+    # Old kernels cannot name the device; the backend just waits
+    monkeypatch.setattr(uinput.fcntl, "ioctl", no_sysname)
+    UInputBackend()._settle(0)
@@ -10,6 +10,8 @@ import platform
 from .core.utils import logging_config
 from .core.utils import network_utils
 from .core.server import WakeMateServer
+from .core.listeners import default_listeners
+from .core.handoff import default_handoff_path, handoff_supported
 from .core.system_tray import WakeMateTray
 
 def main():
@@ -22,11 +24,15 @@ def main():
         system = platform.system()
         logger.info(f"Running on {system} {platform.version()}")
         
-        # Get local IP
+        # Get local IP (shown in the tray and QR code)
         server_ip = network_utils.get_local_ip()
         
-        # Create server
-        server = WakeMateServer(server_ip)
+        # Create server, listening on the LAN address and a local Unix socket.
+        # Power and wake commands need the pairing key from the QR code.
+        # Launching a new version takes over from one already running.
+        server = WakeMateServer(server_ip, listeners=default_listeners(server_ip), auth_mode="protected",
+                                handoff_path=default_handoff_path() if handoff_supported() else None,
+                                network_monitor=True)
         
         # Start server automatically
         server.start()
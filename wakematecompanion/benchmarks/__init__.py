@@ -0,0 +1,5 @@
+"""
+Load generation and latency benchmarks for WakeMATECompanion
+
+Run with ``python -m wakematecompanion.benchmarks --help``.
+"""
@@ -0,0 +1,220 @@
+"""
+Command line interface for the WakeMATECompanion benchmarks
+
+Examples:
+    python -m wakematecompanion.benchmarks run --clients 32 --duration 20 -o base.json
+    python -m wakematecompanion.benchmarks run --server-kwargs '{"metrics_port": 0}' -o new.json
+    python -m wakematecompanion.benchmarks run --auth -o auth.json
+    python -m wakematecompanion.benchmarks run --tls --workload churn -o tls.json
+    python -m wakematecompanion.benchmarks run --pace 0 --workers 4 -o prefork.json
+    python -m wakematecompanion.benchmarks tls --connections 500
+    python -m wakematecompanion.benchmarks compression --requests 1000
+    python -m wakematecompanion.benchmarks transfer --size-mb 128 --concurrency 1 4
+    python -m wakematecompanion.benchmarks replay session.wmcap --speed 0 --copies 20 -o replay.json
+    python -m wakematecompanion.benchmarks compare base.json new.json
+"""
+
+import argparse
+import json
+import logging
+import sys
+
+from . import compression_overhead
+from . import loadgen
+from . import replay
+from . import tls_overhead
+from . import transfer_throughput
+
+
+def _parse_target(value):
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _print_summary(report, out):
+    totals = report["totals"]
+    lat = totals["latency_ms"]
+    label = f" [{report['label']}]" if report.get("label") else ""
+    out.write(f"WakeMATE benchmark{label}: {report['config']['clients']} clients, "
+              f"{report['config']['workload']} workload, {totals['elapsed_s']}s\n")
+    out.write(f"  requests {totals['requests']}  errors {totals['errors']}  "
+              f"connections {totals['connections']}  throughput {totals['throughput_rps']} req/s\n")
+    out.write(f"  latency ms  p50 {lat['p50']}  p90 {lat['p90']}  p99 {lat['p99']}  max {lat['max']}\n")
+    for name, entry in report["scenarios"].items():
+        s = entry["latency_ms"]
+        out.write(f"    {name:<12} clients {entry['clients']:<4} requests {entry['requests']:<8} "
+                  f"errors {entry['errors']:<4} p50 {s['p50']}  p99 {s['p99']}\n")
+    server = report.get("server")
+    if server:
+        out.write(f"  server cpu {server['cpu_percent']}%  "
+                  f"{server['cpu_us_per_request']} us/request  max rss {server['max_rss_kb']} KB\n")
+
+
+def _run(args):
+    server_kwargs = json.loads(args.server_kwargs) if args.server_kwargs else {}
+    report = loadgen.run_benchmark(
+        clients=args.clients,
+        duration=args.duration,
+        workload=args.workload,
+        seed=args.seed,
+        pace=args.pace,
+        target=_parse_target(args.target) if args.target else None,
+        server_kwargs=server_kwargs,
+        label=args.label,
+        log_level=getattr(logging, args.server_log_level.upper()),
+        auth=args.auth,
+        tls=args.tls,
+        workers=args.workers,
+    )
+    _print_summary(report, sys.stderr)
+    _write(report, args.output)
+    return 0
+
+
+def _replay(args):
+    server_kwargs = json.loads(args.server_kwargs) if args.server_kwargs else {}
+    report = replay.run_replay(
+        args.capture,
+        speed=args.speed,
+        copies=args.copies,
+        target=_parse_target(args.target) if args.target else None,
+        server_kwargs=server_kwargs,
+        label=args.label,
+        log_level=getattr(logging, args.server_log_level.upper()),
+    )
+    _print_summary(report, sys.stderr)
+    sys.stderr.write(f"  mismatched responses {report['totals']['mismatches']}\n")
+    _write(report, args.output)
+    return 0
+
+
+def _write(report, output):
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+
+
+def _tls(args):
+    report = tls_overhead.run_tls_overhead(args.connections, args.commands)
+    for group in ("connect_ms", "command_ms"):
+        for name, stats in report[group].items():
+            sys.stderr.write(f"{group:<11} {name:<12} p50 {stats['p50']}  p99 {stats['p99']}\n")
+    sys.stderr.write(f"overhead ms {report['overhead_ms']}\n")
+    _write(report, args.output)
+    return 0
+
+
+def _compression(args):
+    report = compression_overhead.run_compression_overhead(args.requests, args.threshold)
+    for name, stats in report["results"].items():
+        sys.stderr.write(f"{name:<8} wire ratio {stats['wire_ratio']:<7} p50 {stats['latency_ms']['p50']} ms  "
+                         f"server {stats['server_cpu_us_per_request']} us/req  "
+                         f"client {stats['client_cpu_us_per_request']} us/req\n")
+    _write(report, args.output)
+    return 0
+
+
+def _transfer(args):
+    report = transfer_throughput.run_transfer_throughput(args.size_mb, tuple(args.concurrency))
+    for level, stats in report["results"].items():
+        sys.stderr.write(f"{level:>3} x up/down  {stats['throughput_mb_s']} MB/s  "
+                         f"server {stats['server_cpu_ms_per_mb']} ms cpu/MB  "
+                         f"ping p99 idle {stats['ping_idle_ms']['p99']} ms, "
+                         f"busy {stats['ping_during_transfers_ms']['p99']} ms\n")
+    _write(report, args.output)
+    return 0
+
+
+def _compare(args):
+    with open(args.baseline, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    with open(args.candidate, encoding="utf-8") as fh:
+        candidate = json.load(fh)
+    rows, regressed = loadgen.compare(baseline, candidate, args.threshold)
+    for metric, old, new, change, bad in rows:
+        flag = "  REGRESSION" if bad else ""
+        print(f"{metric:<28} {old:>12} -> {new:<12} {change:+.2f}%{flag}")
+    return 1 if regressed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m wakematecompanion.benchmarks",
+                                     description="WakeMATECompanion server benchmarks")
+    sub = parser.add_subparsers(dest="action")
+
+    run = sub.add_parser("run", help="Generate load and report latency/throughput")
+    run.add_argument("--clients", type=int, default=16, help="Concurrent virtual clients")
+    run.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    run.add_argument("--workload", default="mixed",
+                     choices=["mixed"] + sorted(loadgen.SCENARIOS), help="Traffic mix")
+    run.add_argument("--seed", type=int, default=1, help="Random seed")
+    run.add_argument("--pace", type=float, default=1.0,
+                     help="Think-time multiplier; 0 sends as fast as possible")
+    run.add_argument("--target", help="host:port of a running server (skips spawning one)")
+    run.add_argument("--server-kwargs", help="JSON object of extra WakeMateServer arguments")
+    run.add_argument("--server-log-level", default="warning", help="Log level inside the server")
+    run.add_argument("--auth", action="store_true",
+                     help="Authenticate every command (server auth_mode 'required')")
+    run.add_argument("--tls", action="store_true", help="Connect over TLS with session resumption")
+    run.add_argument("--workers", type=int,
+                     help="Run the server in pre-fork mode with this many processes (Linux)")
+    run.add_argument("--label", help="Name for this run, e.g. the server mode under test")
+    run.add_argument("-o", "--output", help="Write JSON results here instead of stdout")
+
+    tls_parser = sub.add_parser("tls", help="Measure TLS handshake and per-command overhead")
+    tls_parser.add_argument("--connections", type=int, default=200, help="Fresh connections per scenario")
+    tls_parser.add_argument("--commands", type=int, default=2000, help="Round trips per scenario")
+    tls_parser.add_argument("-o", "--output", help="Write JSON results here instead of stdout")
+
+    comp_parser = sub.add_parser("compression", help="Measure the CPU and bytes of frame compression")
+    comp_parser.add_argument("--requests", type=int, default=600, help="Round trips per configuration")
+    comp_parser.add_argument("--threshold", type=int, default=1024,
+                             help="Compress frames of at least this many bytes")
+    comp_parser.add_argument("-o", "--output", help="Write JSON results here instead of stdout")
+
+    transfer_parser = sub.add_parser("transfer", help="Measure file transfer throughput")
+    transfer_parser.add_argument("--size-mb", type=int, default=64, help="Size of each file in MiB")
+    transfer_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4],
+                                 help="Parallel uploads and downloads per round")
+    transfer_parser.add_argument("-o", "--output", help="Write JSON results here instead of stdout")
+
+    replay_parser = sub.add_parser("replay", help="Replay a traffic capture against a server")
+    replay_parser.add_argument("capture", help="Capture file written with WakeMateServer(capture=...)")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="Replay speed multiplier; 0 sends as fast as possible")
+    replay_parser.add_argument("--copies", type=int, default=1,
+                               help="Parallel replays of every captured session")
+    replay_parser.add_argument("--target", help="host:port of a running server (skips spawning one)")
+    replay_parser.add_argument("--server-kwargs", help="JSON object of extra WakeMateServer arguments")
+    replay_parser.add_argument("--server-log-level", default="warning", help="Log level inside the server")
+    replay_parser.add_argument("--label", help="Name for this run")
+    replay_parser.add_argument("-o", "--output", help="Write JSON results here instead of stdout")
+
+    cmp_parser = sub.add_parser("compare", help="Compare two result files")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("candidate")
+    cmp_parser.add_argument("--threshold", type=float, default=10.0,
+                            help="Percent change treated as a regression")
+
+    args = parser.parse_args(argv)
+    if args.action == "run":
+        return _run(args)
+    if args.action == "tls":
+        return _tls(args)
+    if args.action == "compression":
+        return _compression(args)
+    if args.action == "transfer":
+        return _transfer(args)
+    if args.action == "replay":
+        return _replay(args)
+    if args.action == "compare":
+        return _compare(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
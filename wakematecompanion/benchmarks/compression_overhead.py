@@ -0,0 +1,153 @@
+"""
+Compression trade-off micro-benchmark
+
+Measures, on loopback, what negotiated frame compression costs in CPU and
+saves in bytes. One client per configuration sends a fixed, seeded mix of
+large requests and responses (command listings, metrics dumps and long typed
+text) with no compression and with every installed algorithm at a low,
+default and high level.
+"""
+
+import json
+import random
+import time
+
+from ..core import compression
+from .loadgen import ServerProcess, _connect, percentiles
+
+# Level triples (fast, default, small) per algorithm
+LEVELS = {
+    "zlib": (1, 6, 9),
+    "zstd": (1, 3, 9),
+    "lz4": (0, 4, 9),
+}
+
+_WORDS = ("the quick brown fox jumps over lazy dog meeting notes agenda project deadline "
+          "review update please send call tomorrow morning thanks regards").split()
+
+
+def _requests(count, seed):
+    """Return the seeded request mix as encoded frames"""
+    rng = random.Random(seed)
+    frames = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            message = {"command": "list_commands", "params": {}}
+        elif kind == 1:
+            message = {"command": "get_metrics", "params": {}}
+        else:
+            text = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(150, 600)))
+            message = {"command": "keyboard_input", "params": {"text": text[:4096]}}
+        frames.append(json.dumps(message).encode("utf-8") + b"\n")
+    return frames
+
+
+class _FrameReader:
+    """Splits a socket's byte stream into plain and compressed frames"""
+
+    def __init__(self, sock, state=None):
+        self.sock = sock
+        self.state = state
+        self.buf = b""
+        self.wire_bytes = 0
+        self.raw_bytes = 0
+
+    def read(self):
+        while True:
+            if self.buf[:1] == compression.MARKER:
+                length = compression.frame_length(self.buf)
+                if length is not None and len(self.buf) >= length:
+                    frame, self.buf = self.buf[:length], self.buf[length:]
+                    self.wire_bytes += len(frame)
+                    data = self.state.unpack(frame)
+                    self.raw_bytes += len(data)
+                    return data
+            elif b"\n" in self.buf:
+                line, self.buf = self.buf.split(b"\n", 1)
+                self.wire_bytes += len(line) + 1
+                self.raw_bytes += len(line) + 1
+                return line
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            self.buf += data
+
+
+def _run_client(host, port, frames, algorithm, level, threshold):
+    sock = _connect(host, port, 10.0)
+    state = None
+    reader = _FrameReader(sock)
+    try:
+        if algorithm is not None:
+            sock.sendall(json.dumps({"command": "compression",
+                                     "params": {"algorithms": [algorithm], "threshold": threshold}}
+                                    ).encode("utf-8"))
+            reply = json.loads(reader.read())
+            if reply.get("status") != "success":
+                raise RuntimeError(f"Compression was refused: {reply}")
+            state = reader.state = compression.Compression(algorithm, threshold, level)
+
+        # Warm up the stream, then time the same mix again
+        for frame in frames[:30]:
+            sock.sendall(state.pack(frame) if state else frame)
+            reader.read()
+        reader.wire_bytes = reader.raw_bytes = 0
+        sent_wire = sent_raw = 0
+        samples = []
+        cpu_start = time.process_time()
+        for frame in frames:
+            start = time.perf_counter()
+            packed = state.pack(frame) if state else frame
+            sock.sendall(packed)
+            reader.read()
+            samples.append((time.perf_counter() - start) * 1000)
+            sent_wire += len(packed)
+            sent_raw += len(frame)
+        client_cpu = time.process_time() - cpu_start
+    finally:
+        sock.close()
+    return {
+        "latency_ms": percentiles(samples),
+        "sent_bytes": sent_wire,
+        "sent_raw_bytes": sent_raw,
+        "received_bytes": reader.wire_bytes,
+        "received_raw_bytes": reader.raw_bytes,
+        "client_cpu_us_per_request": round(client_cpu / len(frames) * 1e6, 2),
+    }
+
+
+def run_compression_overhead(requests=600, threshold=compression.DEFAULT_THRESHOLD, seed=1,
+                             host="127.0.0.1"):
+    """Compare uncompressed and compressed traffic for every installed algorithm
+
+    Args:
+        requests (int, optional): Round trips per configuration
+        threshold (int, optional): Compression threshold requested by the client
+        seed (int, optional): Seed for the typed text
+        host (str, optional): Loopback address to use
+
+    Returns:
+        dict: Machine-readable results keyed by configuration, e.g. "zlib-6"
+    """
+    frames = _requests(requests, seed)
+    configs = [("none", None, None)]
+    for algorithm in compression.available():
+        for level in LEVELS[algorithm]:
+            configs.append((f"{algorithm}-{level}", algorithm, level))
+
+    results = {}
+    for name, algorithm, level in configs:
+        server_kwargs = {"rate_limiting": False, "compression_level": level}
+        with ServerProcess(host, None, server_kwargs) as server:
+            result = _run_client(server.host, server.port, frames, algorithm, level, threshold)
+        usage = server.usage or {}
+        cpu = usage.get("cpu_user_s", 0.0) + usage.get("cpu_system_s", 0.0)
+        # Server CPU covers the warm-up and negotiation too; close enough at this count
+        result["server_cpu_us_per_request"] = round(cpu / requests * 1e6, 2)
+        wire = result["sent_bytes"] + result["received_bytes"]
+        raw = result["sent_raw_bytes"] + result["received_raw_bytes"]
+        result["wire_ratio"] = round(wire / raw, 4) if raw else None
+        results[name] = result
+    return {"config": {"requests": requests, "threshold": threshold, "seed": seed},
+            "results": results}
@@ -0,0 +1,78 @@
+"""
+No-op backend stand-ins used when benchmarking the server headless
+"""
+
+import os
+import sys
+import types
+import logging
+
+logger = logging.getLogger("WakeMATECompanion")
+
+
+def _make_fake_pyautogui():
+    """Build a module object that mimics the parts of pyautogui the server uses"""
+    fake = types.ModuleType("pyautogui")
+    fake.PAUSE = 0
+    fake.FAILSAFE = False
+    state = {"x": 0, "y": 0}
+
+    def position():
+        return state["x"], state["y"]
+
+    def moveTo(x, y, *args, **kwargs):
+        state["x"], state["y"] = x, y
+
+    def moveRel(dx, dy, *args, **kwargs):
+        state["x"] += dx
+        state["y"] += dy
+
+    def noop(*args, **kwargs):
+        return None
+
+    fake.position = position
+    fake.moveTo = moveTo
+    fake.moveRel = moveRel
+    for name in ("click", "scroll", "hscroll", "write", "press", "keyDown", "keyUp",
+                 "mouseDown", "mouseUp", "hotkey", "doubleClick"):
+        setattr(fake, name, noop)
+    return fake
+
+
+def install():
+    """Replace every side-effecting backend with a no-op
+
+    Installs a fake ``pyautogui`` module and stubs out the system power and
+    Wake-on-LAN functions, so benchmarks never move the real cursor, press
+    keys or power off the machine running them.
+    """
+    sys.modules["pyautogui"] = _make_fake_pyautogui()
+
+    from ..core import system_controls
+    from ..core.utils import wol
+
+    def noop(*args, **kwargs):
+        return None
+
+    for name in ("shutdown", "restart", "sleep", "logoff"):
+        setattr(system_controls, name, noop)
+    wol.send_magic_packet = noop
+
+    logger.info("Benchmark fake backends installed")
+
+
+def fake_uinput_device(path):
+    """Create an empty regular file for the uinput backend to record into
+
+    The uinput backend only records to a file that already exists; a missing
+    path would be opened as a device and fail.
+
+    Args:
+        path (str): File to create, truncated if it exists
+
+    Returns:
+        str: The path
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.close(fd)
+    return path
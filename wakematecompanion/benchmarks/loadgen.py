@@ -0,0 +1,560 @@
+"""
+Load generator for the WakeMATECompanion command server
+
+Opens N concurrent virtual phones against a ``WakeMateServer`` and replays a
+reproducible mix of realistic traffic. The server runs in a child process with
+fake backends, so its CPU and memory usage can be measured separately from the
+clients generating the load.
+"""
+
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import tempfile
+import threading
+import time
+
+from ..core import tls as tls_support
+from ..core.auth import ClientSession
+
+logger = logging.getLogger("WakeMATECompanion")
+
+RESULTS_FORMAT_VERSION = 1
+
+# Default share of clients running each scenario in the "mixed" workload
+DEFAULT_MIX = {
+    "trackpad": 0.5,
+    "volume_hold": 0.2,
+    "status_poll": 0.2,
+    "churn": 0.1,
+}
+
+
+def _trackpad(rng):
+    """Bursts of small mouse moves, like a finger dragging across the trackpad"""
+    while True:
+        for _ in range(rng.randint(10, 40)):
+            yield {"command": "mouse_move",
+                   "params": {"dx": rng.randint(-8, 8), "dy": rng.randint(-8, 8)}}, 0.008
+        yield {"command": "mouse_click", "params": {"button": "left"}}, 0.25
+
+
+def _volume_hold(rng):
+    """Holding a volume key: a run of repeats, then a pause"""
+    while True:
+        cmd = rng.choice(("volume_up", "volume_down"))
+        for _ in range(rng.randint(5, 15)):
+            yield {"command": cmd, "params": {}}, 0.05
+        yield {"command": "get_status", "params": {}}, 0.5
+
+
+def _status_poll(rng):
+    """A phone polling for status on a fixed interval"""
+    while True:
+        yield {"command": "get_status", "params": {}}, 0.5
+
+
+def _churn(rng):
+    """One command per connection, as the current phone app does"""
+    while True:
+        cmd = rng.choice(("get_status", "media_play_pause", "volume_up", "mouse_move"))
+        params = {"dx": 1, "dy": 1} if cmd == "mouse_move" else {}
+        yield {"command": cmd, "params": params}, 0.1
+
+
+# name -> (step generator, opens a new connection per request)
+SCENARIOS = {
+    "trackpad": (_trackpad, False),
+    "volume_hold": (_volume_hold, False),
+    "status_poll": (_status_poll, False),
+    "churn": (_churn, True),
+}
+
+
+class ClientStats:
+    """Results collected by one virtual client"""
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.latencies_ms = []
+        self.errors = 0
+        self.connections = 0
+        self.tls = None
+
+
+class TLSClient:
+    """Client-side TLS state for one virtual phone
+
+    Keeps the last session so reconnects resume instead of running a full
+    handshake, as a phone waking from sleep would.
+    """
+
+    def __init__(self, fingerprint, resume=True):
+        self.fingerprint = fingerprint
+        self.resume = resume
+        self.context = tls_support.client_context()
+        self.session = None
+        self.handshakes = 0
+        self.resumed = 0
+
+    def wrap(self, sock):
+        ssl_sock = self.context.wrap_socket(sock, session=self.session if self.resume else None)
+        tls_support.verify_fingerprint(ssl_sock, self.fingerprint)
+        self.handshakes += 1
+        if ssl_sock.session_reused:
+            self.resumed += 1
+        return ssl_sock
+
+    def remember(self, ssl_sock):
+        # TLS 1.3 tickets arrive after the handshake, so capture once data has flowed
+        if self.resume and ssl_sock.session is not self.session:
+            self.session = ssl_sock.session
+
+
+def _connect(host, port, timeout, tls_client=None):
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if tls_client is not None:
+        sock = tls_client.wrap(sock)
+    return sock
+
+
+def _exchange(sock, payload):
+    """Send one request and wait for its response"""
+    sock.sendall(payload)
+    data = sock.recv(65536)
+    if not data:
+        raise ConnectionError("Server closed the connection")
+    return data
+
+
+def run_client(host, port, scenario, seed, deadline, pace=1.0, timeout=5.0, pairing_key=None,
+               tls_fingerprint=None):
+    """Run one virtual client until the deadline
+
+    Args:
+        host (str): Server address
+        port (int): Server port
+        scenario (str): Name of a scenario in SCENARIOS
+        seed (int): Seed for this client's random stream
+        deadline (float): time.monotonic() value at which to stop
+        pace (float, optional): Multiplier for think time between requests;
+            0 sends as fast as possible. Defaults to 1.0.
+        timeout (float, optional): Socket timeout in seconds. Defaults to 5.0.
+        pairing_key (bytes, optional): Authenticate with this key. The first
+            connection performs the handshake; later ones resume the session.
+        tls_fingerprint (str, optional): Connect over TLS, pinning this
+            certificate fingerprint and resuming TLS sessions on reconnect.
+
+    Returns:
+        ClientStats: The collected latencies and error counts
+    """
+    rng = random.Random(seed)
+    steps, per_request_connection = SCENARIOS[scenario]
+    stats = ClientStats(scenario)
+    session = ClientSession(pairing_key) if pairing_key else None
+    tls_client = TLSClient(tls_fingerprint) if tls_fingerprint else None
+    stats.tls = tls_client
+    sock = None
+
+    try:
+        for command, pause in steps(rng):
+            if time.monotonic() >= deadline:
+                break
+            start = time.perf_counter()
+            try:
+                if sock is None:
+                    sock = _connect(host, port, timeout, tls_client)
+                    stats.connections += 1
+                    if session is not None and session.session_id is None:
+                        session.finish(json.loads(_exchange(sock, session.hello())))
+                if session is not None:
+                    payload = session.wrap(command)
+                else:
+                    payload = json.dumps(command).encode("utf-8")
+                response = _exchange(sock, payload)
+                if tls_client is not None:
+                    tls_client.remember(sock)
+                elapsed = (time.perf_counter() - start) * 1000
+                stats.latencies_ms.append(elapsed)
+                if b'"status": "error"' in response or b'"status":"error"' in response:
+                    stats.errors += 1
+            except (OSError, ConnectionError, ValueError, KeyError):
+                stats.errors += 1
+                if sock is not None:
+                    sock.close()
+                    sock = None
+            if per_request_connection and sock is not None:
+                sock.close()
+                sock = None
+            if pace:
+                time.sleep(pause * pace)
+    finally:
+        if sock is not None:
+            sock.close()
+
+    return stats
+
+
+def percentiles(values):
+    """Summarize a list of latencies in milliseconds"""
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(values)
+    n = len(ordered)
+
+    def pick(q):
+        return round(ordered[min(n - 1, int(q * n))], 4)
+
+    return {
+        "count": n,
+        "mean": round(sum(ordered) / n, 4),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def _resource_usage(children=False):
+    """Return (user_s, system_s, max_rss_kb) for the current process
+
+    With children=True, CPU time of exited child processes is included and
+    max_rss is the largest of the process and any one child.
+    """
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        user, system, max_rss = usage.ru_utime, usage.ru_stime, usage.ru_maxrss
+        if children:
+            child = resource.getrusage(resource.RUSAGE_CHILDREN)
+            user, system, max_rss = user + child.ru_utime, system + child.ru_stime, max(max_rss, child.ru_maxrss)
+        # ru_maxrss is bytes on macOS and kilobytes elsewhere
+        if platform.system() == "Darwin":
+            max_rss //= 1024
+        return user, system, max_rss
+    except ImportError:
+        return time.process_time(), 0.0, None
+
+
+def _serve(conn, host, port, server_kwargs, log_level, workers=None):
+    """Child process entry point: run a server with fake backends"""
+    logging.basicConfig(level=log_level, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    from . import fakes
+    fakes.install()
+    device = server_kwargs.get("uinput_device")
+    if device and not os.path.exists(device):
+        # Never create a real device node; record to a file instead
+        fakes.fake_uinput_device(device)
+    if workers:
+        # Pre-fork workers report their CPU time once they have exited
+        from ..core.prefork import PreforkServer
+        server = PreforkServer(host, port, workers=workers, worker_init=fakes.install,
+                               log_level=log_level, **server_kwargs)
+    else:
+        from ..core.server import WakeMateServer
+        server = WakeMateServer(host, port, **server_kwargs)
+    server.start()
+
+    # Wait until the listener accepts connections
+    ready_by = time.monotonic() + 10
+    while time.monotonic() < ready_by:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            break
+        except OSError:
+            time.sleep(0.02)
+
+    usage_before = _resource_usage(children=bool(workers))
+    conn.send("ready")
+    conn.recv()  # Block until told to stop
+
+    if workers:
+        server.stop()
+        usage_after = _resource_usage(children=True)
+        metrics = server.metrics.snapshot()
+    else:
+        usage_after = _resource_usage()
+        metrics = server.metrics.snapshot()
+        server.stop()
+    conn.send({
+        "cpu_user_s": round(usage_after[0] - usage_before[0], 4),
+        "cpu_system_s": round(usage_after[1] - usage_before[1], 4),
+        "max_rss_kb": usage_after[2],
+        "server_metrics": metrics,
+    })
+    conn.close()
+
+
+class ServerProcess:
+    """Runs a benchmark server in a separate process"""
+
+    def __init__(self, host="127.0.0.1", port=None, server_kwargs=None, log_level=logging.WARNING,
+                 workers=None):
+        self.host = host
+        self.port = port or _free_port(host)
+        self.server_kwargs = server_kwargs or {}
+        self.log_level = log_level
+        self.workers = workers
+        self.process = None
+        self.conn = None
+        self.usage = None
+
+    def __enter__(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_serve,
+            args=(child_conn, self.host, self.port, self.server_kwargs, self.log_level, self.workers),
+        )
+        # Daemonic processes may not start the pre-fork workers
+        self.process.daemon = not self.workers
+        self.process.start()
+        if not self.conn.poll(30) or self.conn.recv() != "ready":
+            raise RuntimeError("Benchmark server failed to start")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.send("stop")
+            if self.conn.poll(30):
+                self.usage = self.conn.recv()
+        finally:
+            self.process.join(10)
+            if self.process.is_alive():
+                self.process.terminate()
+        return False
+
+
+def _free_port(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def assign_scenarios(clients, workload, seed):
+    """Deterministically pick a scenario for each client
+
+    Args:
+        clients (int): Number of clients
+        workload (str): A scenario name, or "mixed" to use DEFAULT_MIX
+        seed (int): Random seed
+
+    Returns:
+        list: One scenario name per client
+    """
+    if workload != "mixed":
+        if workload not in SCENARIOS:
+            raise ValueError(f"Unknown workload: {workload}")
+        return [workload] * clients
+
+    # Largest-remainder apportionment keeps the mix stable for small N
+    names = sorted(DEFAULT_MIX)
+    quotas = {name: DEFAULT_MIX[name] * clients for name in names}
+    counts = {name: int(quotas[name]) for name in names}
+    leftover = clients - sum(counts.values())
+    for name in sorted(names, key=lambda n: quotas[n] - counts[n], reverse=True)[:leftover]:
+        counts[name] += 1
+    assigned = [name for name in names for _ in range(counts[name])]
+    random.Random(seed).shuffle(assigned)
+    return assigned
+
+
+def run_benchmark(clients=16, duration=10.0, workload="mixed", seed=1, pace=1.0,
+                  host="127.0.0.1", port=None, target=None, server_kwargs=None,
+                  label=None, log_level=logging.WARNING, auth=False, tls=False, workers=None):
+    """Run a complete benchmark and return machine-readable results
+
+    Args:
+        clients (int, optional): Number of concurrent virtual clients
+        duration (float, optional): Seconds to generate load for
+        workload (str, optional): Scenario name or "mixed"
+        seed (int, optional): Seed for scenario assignment and traffic
+        pace (float, optional): Think-time multiplier (0 = no pauses)
+        host (str, optional): Address for the spawned server
+        port (int, optional): Port for the spawned server (random if None)
+        target (tuple, optional): (host, port) of an already running server to
+            benchmark instead of spawning one
+        server_kwargs (dict, optional): Extra WakeMateServer keyword arguments
+        label (str, optional): Free-form name for this run, e.g. the server mode
+        log_level (int, optional): Log level inside the server process
+        auth (bool, optional): Run the server with auth_mode "required" and
+            send every command in an authenticated envelope
+        tls (bool, optional): Run the server with TLS on a throwaway certificate
+        workers (int, optional): Run the server in pre-fork mode with this
+            many worker processes (Linux only)
+
+    Returns:
+        dict: Benchmark results
+    """
+    scenarios = assign_scenarios(clients, workload, seed)
+    # Every virtual client shares the loopback address, so per-client rate
+    # limits would throttle the whole fleet as one phone
+    server_kwargs = dict({"rate_limiting": False}, **(server_kwargs or {}))
+    results = [None] * clients
+    pairing_key = None
+    tls_fingerprint = None
+    if tls:
+        cert_dir = tempfile.mkdtemp(prefix="wakemate-bench-")
+        cert, key = tls_support.ensure_certificate(os.path.join(cert_dir, "cert.pem"),
+                                                   os.path.join(cert_dir, "key.pem"))
+        tls_fingerprint = tls_support.certificate_fingerprint(cert)
+        server_kwargs = dict(server_kwargs or {}, tls=True, tls_cert=cert, tls_key=key)
+    if auth:
+        pairing_key = os.urandom(32)
+        server_kwargs = dict(server_kwargs or {}, auth_mode="required",
+                             pairing_key=base64.b64encode(pairing_key).decode("ascii"))
+
+    def generate(bench_host, bench_port):
+        deadline = time.monotonic() + duration
+        threads = []
+        for i, scenario in enumerate(scenarios):
+            def worker(i=i, scenario=scenario):
+                results[i] = run_client(bench_host, bench_port, scenario, seed * 100003 + i,
+                                        deadline, pace, pairing_key=pairing_key,
+                                        tls_fingerprint=tls_fingerprint)
+            t = threading.Thread(target=worker, name=f"bench-client-{i}")
+            t.daemon = True
+            threads.append(t)
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - started
+
+    client_usage_before = _resource_usage()
+    server_usage = None
+    if target:
+        elapsed = generate(*target)
+    else:
+        with ServerProcess(host, port, server_kwargs, log_level, workers) as server:
+            elapsed = generate(server.host, server.port)
+        server_usage = server.usage
+    client_usage_after = _resource_usage()
+
+    all_latencies = []
+    by_scenario = {}
+    errors = 0
+    connections = 0
+    tls_handshakes = 0
+    tls_resumed = 0
+    for stats in results:
+        all_latencies.extend(stats.latencies_ms)
+        errors += stats.errors
+        connections += stats.connections
+        if stats.tls is not None:
+            tls_handshakes += stats.tls.handshakes
+            tls_resumed += stats.tls.resumed
+        entry = by_scenario.setdefault(stats.scenario, {"clients": 0, "latencies": [], "errors": 0})
+        entry["clients"] += 1
+        entry["latencies"].extend(stats.latencies_ms)
+        entry["errors"] += stats.errors
+
+    report = {
+        "format_version": RESULTS_FORMAT_VERSION,
+        "label": label,
+        "config": {
+            "clients": clients,
+            "duration_s": duration,
+            "workload": workload,
+            "seed": seed,
+            "pace": pace,
+            "auth": auth,
+            "tls": tls,
+            "workers": workers,
+            "server_kwargs": {k: v for k, v in (server_kwargs or {}).items()
+                              if k not in ("pairing_key", "tls_cert", "tls_key")},
+            "target": f"{target[0]}:{target[1]}" if target else None,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpu_count": multiprocessing.cpu_count(),
+        },
+        "totals": {
+            "requests": len(all_latencies),
+            "errors": errors,
+            "connections": connections,
+            "tls_handshakes": tls_handshakes,
+            "tls_resumed": tls_resumed,
+            "elapsed_s": round(elapsed, 4),
+            "throughput_rps": round(len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": percentiles(all_latencies),
+        },
+        "scenarios": {
+            name: {
+                "clients": entry["clients"],
+                "requests": len(entry["latencies"]),
+                "errors": entry["errors"],
+                "latency_ms": percentiles(entry["latencies"]),
+            }
+            for name, entry in sorted(by_scenario.items())
+        },
+        "clients_process": {
+            "cpu_user_s": round(client_usage_after[0] - client_usage_before[0], 4),
+            "cpu_system_s": round(client_usage_after[1] - client_usage_before[1], 4),
+        },
+    }
+
+    if server_usage:
+        cpu = server_usage["cpu_user_s"] + server_usage["cpu_system_s"]
+        report["server"] = {
+            "cpu_user_s": server_usage["cpu_user_s"],
+            "cpu_system_s": server_usage["cpu_system_s"],
+            "cpu_percent": round(100 * cpu / elapsed, 2) if elapsed else None,
+            "cpu_us_per_request": round(1e6 * cpu / len(all_latencies), 2) if all_latencies else None,
+            "max_rss_kb": server_usage["max_rss_kb"],
+            "metrics": server_usage["server_metrics"],
+        }
+
+    return report
+
+
+# Metrics compared between runs: (path, higher is better)
+COMPARED_METRICS = (
+    (("totals", "throughput_rps"), True),
+    (("totals", "latency_ms", "p50"), False),
+    (("totals", "latency_ms", "p99"), False),
+    (("server", "cpu_us_per_request"), False),
+    (("server", "max_rss_kb"), False),
+)
+
+
+def compare(baseline, candidate, threshold_pct=10.0):
+    """Compare two result documents
+
+    Args:
+        baseline (dict): Results of the reference run
+        candidate (dict): Results of the run under test
+        threshold_pct (float, optional): Relative change that counts as a regression
+
+    Returns:
+        tuple: (rows, regressed) where rows is a list of
+            (metric, baseline, candidate, change_pct, regressed) tuples
+    """
+    def lookup(doc, path):
+        for key in path:
+            if not isinstance(doc, dict) or key not in doc:
+                return None
+            doc = doc[key]
+        return doc
+
+    rows = []
+    any_regressed = False
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = lookup(baseline, path), lookup(candidate, path)
+        if old is None or new is None:
+            continue
+        change = 100.0 * (new - old) / old if old else 0.0
+        regressed = (-change if higher_is_better else change) > threshold_pct
+        any_regressed = any_regressed or regressed
+        rows.append((".".join(path), old, new, round(change, 2), regressed))
+    return rows, any_regressed
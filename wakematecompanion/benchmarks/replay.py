@@ -0,0 +1,264 @@
+"""
+Deterministic replay of captured traffic
+
+Each connection in a capture file (see ``wakematecompanion/core/capture.py``)
+becomes a virtual client. It connects at its recorded offset, sends its
+inbound frames again, and waits for a response wherever the original session
+got one. ``speed`` 1 keeps the recorded gaps, 2 halves them, and 0 sends
+everything back to back. ``copies`` replays every session several times in
+parallel, so one phone's session can stand in for many.
+
+Replayed responses are compared with the recorded ones by status and error
+code; differences are reported as mismatches. The results have the same shape
+as ``loadgen.run_benchmark``, so ``compare`` works on them.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import threading
+import time
+
+from ..core import capture
+from . import loadgen
+
+logger = logging.getLogger("WakeMATECompanion")
+
+
+class Session:
+    """One captured connection"""
+
+    __slots__ = ("conn_id", "peer", "opened_at", "steps")
+
+    def __init__(self, conn_id, opened_at):
+        self.conn_id = conn_id
+        self.peer = None
+        self.opened_at = opened_at
+        # [t, inbound frame, recorded response or None]
+        self.steps = []
+
+
+class ReplayStats:
+    """Results collected by one replayed session"""
+
+    def __init__(self):
+        self.latencies_ms = []
+        self.sent = 0
+        self.errors = 0
+        self.mismatches = 0
+
+
+def load_sessions(path):
+    """Group a capture's records into sessions in the order they opened
+
+    Args:
+        path (str): The capture file
+
+    Returns:
+        list: Session objects
+    """
+    _, records = capture.read_capture(path)
+    sessions = {}
+    ordered = []
+    for kind, conn_id, t, payload in records:
+        session = sessions.get(conn_id)
+        if session is None:
+            session = sessions[conn_id] = Session(conn_id, t)
+            ordered.append(session)
+        if kind == capture.OPEN:
+            session.peer = payload.decode("utf-8", "replace")
+        elif kind == capture.IN:
+            session.steps.append([t, payload, None])
+        elif kind == capture.OUT and session.steps and session.steps[-1][2] is None:
+            session.steps[-1][2] = payload
+    return ordered
+
+
+def _outcome(frame):
+    try:
+        response = json.loads(frame)
+    except ValueError:
+        return ("invalid", None)
+    return (response.get("status"), response.get("code"))
+
+
+def _read_response(reader):
+    """Read the next response line, skipping pushed events and pings"""
+    while True:
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        if b'"type":' in line:
+            kind = json.loads(line).get("type")
+            if kind in ("event", "ping"):
+                continue
+        return line
+
+
+def replay_session(session, host, port, origin, speed=1.0, timeout=5.0):
+    """Replay one session
+
+    Args:
+        session (Session): The captured session
+        host (str): Server address
+        port (int): Server port
+        origin (float): time.monotonic() value that capture time 0 maps to
+        speed (float, optional): Replay speed; 0 ignores recorded timing.
+            Defaults to 1.0.
+        timeout (float, optional): Socket timeout in seconds. Defaults to 5.0.
+
+    Returns:
+        ReplayStats: The collected latencies, errors and mismatches
+    """
+    stats = ReplayStats()
+
+    def wait_until(t):
+        if speed:
+            delay = origin + t / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    wait_until(session.opened_at)
+    try:
+        sock = loadgen._connect(host, port, timeout)
+    except OSError:
+        stats.errors += 1
+        return stats
+    reader = sock.makefile("rb")
+    try:
+        for t, payload, recorded in session.steps:
+            wait_until(t)
+            start = time.perf_counter()
+            try:
+                sock.sendall(payload)
+                stats.sent += 1
+                if recorded is None:
+                    continue
+                response = _read_response(reader)
+            except (OSError, ValueError):
+                stats.errors += 1
+                break
+            stats.latencies_ms.append((time.perf_counter() - start) * 1000)
+            outcome = _outcome(response)
+            if outcome[0] == "error":
+                stats.errors += 1
+            if outcome != _outcome(recorded):
+                stats.mismatches += 1
+    finally:
+        reader.close()
+        sock.close()
+    return stats
+
+
+def run_replay(path, speed=1.0, copies=1, host="127.0.0.1", port=None, target=None,
+               server_kwargs=None, label=None, log_level=logging.WARNING):
+    """Replay a capture and return machine-readable results
+
+    Args:
+        path (str): The capture file
+        speed (float, optional): Replay speed; 0 sends as fast as possible
+        copies (int, optional): Parallel replays of every session
+        host (str, optional): Address for the spawned server
+        port (int, optional): Port for the spawned server (random if None)
+        target (tuple, optional): (host, port) of an already running server to
+            replay against instead of spawning one
+        server_kwargs (dict, optional): Extra WakeMateServer keyword arguments
+        label (str, optional): Free-form name for this run
+        log_level (int, optional): Log level inside the server process
+
+    Returns:
+        dict: Replay results
+    """
+    sessions = load_sessions(path)
+    # As in run_benchmark, every virtual client shares the loopback address
+    server_kwargs = dict({"rate_limiting": False}, **(server_kwargs or {}))
+    jobs = [session for session in sessions for _ in range(copies)]
+    results = [None] * len(jobs)
+
+    def generate(replay_host, replay_port):
+        origin = time.monotonic() + 0.05
+        threads = []
+        for i, session in enumerate(jobs):
+            def worker(i=i, session=session):
+                results[i] = replay_session(session, replay_host, replay_port, origin, speed)
+            t = threading.Thread(target=worker, name=f"replay-client-{i}")
+            t.daemon = True
+            threads.append(t)
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - started
+
+    client_usage_before = loadgen._resource_usage()
+    server_usage = None
+    if target:
+        elapsed = generate(*target)
+    else:
+        with loadgen.ServerProcess(host, port, server_kwargs, log_level) as server:
+            elapsed = generate(server.host, server.port)
+        server_usage = server.usage
+    client_usage_after = loadgen._resource_usage()
+
+    latencies = [ms for stats in results for ms in stats.latencies_ms]
+    errors = sum(stats.errors for stats in results)
+    mismatches = sum(stats.mismatches for stats in results)
+    sent = sum(stats.sent for stats in results)
+    summary = {
+        "clients": len(jobs),
+        "requests": len(latencies),
+        "errors": errors,
+        "latency_ms": loadgen.percentiles(latencies),
+    }
+
+    report = {
+        "format_version": loadgen.RESULTS_FORMAT_VERSION,
+        "label": label,
+        "config": {
+            "clients": len(jobs),
+            "workload": f"replay:{os.path.basename(path)}",
+            "capture": path,
+            "sessions": len(sessions),
+            "copies": copies,
+            "speed": speed,
+            "server_kwargs": server_kwargs,
+            "target": f"{target[0]}:{target[1]}" if target else None,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpu_count": multiprocessing.cpu_count(),
+        },
+        "totals": {
+            "requests": len(latencies),
+            "frames_sent": sent,
+            "errors": errors,
+            "mismatches": mismatches,
+            "connections": len(jobs),
+            "elapsed_s": round(elapsed, 4),
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": loadgen.percentiles(latencies),
+        },
+        "scenarios": {"replay": summary},
+        "clients_process": {
+            "cpu_user_s": round(client_usage_after[0] - client_usage_before[0], 4),
+            "cpu_system_s": round(client_usage_after[1] - client_usage_before[1], 4),
+        },
+    }
+
+    if server_usage:
+        cpu = server_usage["cpu_user_s"] + server_usage["cpu_system_s"]
+        report["server"] = {
+            "cpu_user_s": server_usage["cpu_user_s"],
+            "cpu_system_s": server_usage["cpu_system_s"],
+            "cpu_percent": round(100 * cpu / elapsed, 2) if elapsed else None,
+            "cpu_us_per_request": round(1e6 * cpu / len(latencies), 2) if latencies else None,
+            "max_rss_kb": server_usage["max_rss_kb"],
+            "metrics": server_usage["server_metrics"],
+        }
+
+    return report
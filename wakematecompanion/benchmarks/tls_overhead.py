@@ -0,0 +1,102 @@
+"""
+TLS overhead micro-benchmark
+
+Measures, on loopback, the cost of connection setup (plain TCP, full TLS
+handshake, resumed TLS handshake) and of a single command round trip over an
+established plain or TLS connection.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+from ..core import tls as tls_support
+from .loadgen import ServerProcess, TLSClient, _connect, _exchange, percentiles
+
+STATUS_COMMAND = json.dumps({"command": "get_status", "params": {}}).encode("utf-8")
+
+
+def _time_connects(host, port, count, tls_client=None):
+    """Time connect + first command for a series of fresh connections"""
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        sock = _connect(host, port, 5.0, tls_client)
+        _exchange(sock, STATUS_COMMAND)
+        samples.append((time.perf_counter() - start) * 1000)
+        if tls_client is not None:
+            tls_client.remember(sock)
+        sock.close()
+    return samples
+
+
+def _time_commands(host, port, count, tls_client=None):
+    """Time command round trips over one established connection"""
+    sock = _connect(host, port, 5.0, tls_client)
+    try:
+        _exchange(sock, STATUS_COMMAND)  # Warm up
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            _exchange(sock, STATUS_COMMAND)
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+    finally:
+        sock.close()
+
+
+def run_tls_overhead(connections=200, commands=2000, host="127.0.0.1"):
+    """Compare plaintext and TLS connection setup and per-command latency
+
+    Args:
+        connections (int, optional): Fresh connections per setup scenario
+        commands (int, optional): Round trips per command scenario
+        host (str, optional): Loopback address to use
+
+    Returns:
+        dict: Machine-readable results
+    """
+    cert_dir = tempfile.mkdtemp(prefix="wakemate-tls-bench-")
+    cert, key = tls_support.ensure_certificate(os.path.join(cert_dir, "cert.pem"),
+                                               os.path.join(cert_dir, "key.pem"))
+    fingerprint = tls_support.certificate_fingerprint(cert)
+    server_kwargs = {"max_connections": None, "rate_limiting": False}
+
+    with ServerProcess(host, None, server_kwargs) as plain:
+        plain_connect = _time_connects(plain.host, plain.port, connections)
+        plain_command = _time_commands(plain.host, plain.port, commands)
+
+    tls_kwargs = dict(server_kwargs, tls=True, tls_cert=cert, tls_key=key)
+    with ServerProcess(host, None, tls_kwargs) as secure:
+        full = TLSClient(fingerprint, resume=False)
+        full_connect = _time_connects(secure.host, secure.port, connections, full)
+        resumed = TLSClient(fingerprint, resume=True)
+        _time_connects(secure.host, secure.port, 1, resumed)  # Obtain a ticket
+        resumed_connect = _time_connects(secure.host, secure.port, connections, resumed)
+        tls_command = _time_commands(secure.host, secure.port, commands, TLSClient(fingerprint))
+
+    results = {
+        "connect_ms": {
+            "plain": percentiles(plain_connect),
+            "tls_full": percentiles(full_connect),
+            "tls_resumed": percentiles(resumed_connect),
+        },
+        "command_ms": {
+            "plain": percentiles(plain_command),
+            "tls": percentiles(tls_command),
+        },
+        "tls_resumed_ratio": round(resumed.resumed / max(resumed.handshakes, 1), 3),
+    }
+    results["overhead_ms"] = {
+        "full_handshake_p50": _diff(results["connect_ms"]["tls_full"], results["connect_ms"]["plain"]),
+        "resumed_handshake_p50": _diff(results["connect_ms"]["tls_resumed"], results["connect_ms"]["plain"]),
+        "per_command_p50": _diff(results["command_ms"]["tls"], results["command_ms"]["plain"]),
+    }
+    return results
+
+
+def _diff(a, b):
+    if a["p50"] is None or b["p50"] is None:
+        return None
+    return round(a["p50"] - b["p50"], 4)
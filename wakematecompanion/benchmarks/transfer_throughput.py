@@ -0,0 +1,188 @@
+"""
+File transfer throughput micro-benchmark
+
+Measures, on loopback, how fast files move over data connections and how
+much that slows the command connection. For each concurrency level, the
+same number of uploads and downloads run at once while a separate client
+times ping round trips on its command connection.
+"""
+
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from ..core.auth import ClientSession
+from .loadgen import ServerProcess, _connect, percentiles
+
+PING = json.dumps({"command": "ping", "params": {}}).encode("utf-8")
+
+
+class _LineClient:
+    """A connection that reads newline-terminated replies"""
+
+    def __init__(self, host, port, pairing_key=None):
+        self.sock = _connect(host, port, 30.0)
+        self.buf = b""
+        self.session = None
+        if pairing_key:
+            self.session = ClientSession(pairing_key)
+            self.sock.sendall(self.session.hello())
+            self.session.finish(self.line())
+
+    def line(self):
+        while b"\n" not in self.buf:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            self.buf += data
+        line, self.buf = self.buf.split(b"\n", 1)
+        return json.loads(line)
+
+    def command(self, cmd, **params):
+        command = {"command": cmd, "params": params}
+        if self.session is not None:
+            self.sock.sendall(self.session.wrap(command))
+        else:
+            self.sock.sendall(json.dumps(command).encode("utf-8"))
+        reply = self.line()
+        if reply.get("status") == "error":
+            raise RuntimeError(f"{cmd} failed: {reply}")
+        return reply
+
+    def close(self):
+        self.sock.close()
+
+
+def _upload(host, port, key, name, data):
+    control = _LineClient(host, port, key)
+    try:
+        transfer = control.command("file_upload", name=name, size=len(data))
+    finally:
+        control.close()
+    conn = _LineClient(host, port)
+    try:
+        conn.command("transfer_attach", transfer_id=transfer["transfer_id"])
+        conn.sock.sendall(data)
+        return conn.line()
+    finally:
+        conn.close()
+
+
+def _download(host, port, key, name, size):
+    control = _LineClient(host, port, key)
+    try:
+        transfer = control.command("file_download", name=name)
+    finally:
+        control.close()
+    conn = _LineClient(host, port)
+    try:
+        conn.command("transfer_attach", transfer_id=transfer["transfer_id"])
+        buf = bytearray(1024 * 1024)
+        view = memoryview(buf)
+        left = size - len(conn.buf)
+        conn.buf = b""
+        while left:
+            n = conn.sock.recv_into(view, min(len(buf), left))
+            if not n:
+                raise ConnectionError("Server closed the connection")
+            left -= n
+        return conn.line()
+    finally:
+        conn.close()
+
+
+def _ping_until(host, port, done, samples):
+    client = _LineClient(host, port)
+    try:
+        while not done.is_set():
+            start = time.perf_counter()
+            client.sock.sendall(PING)
+            client.line()
+            samples.append((time.perf_counter() - start) * 1000)
+            done.wait(0.002)
+    finally:
+        client.close()
+
+
+def run_transfer_throughput(size_mb=64, concurrency=(1, 4), host="127.0.0.1"):
+    """Measure upload and download throughput and command latency under load
+
+    Args:
+        size_mb (int, optional): Size of each file in MiB
+        concurrency (tuple, optional): Parallel uploads (and as many
+            downloads) per round
+        host (str, optional): Loopback address to use
+
+    Returns:
+        dict: Machine-readable results keyed by concurrency level
+    """
+    size = size_mb * 1024 * 1024
+    data = os.urandom(size)
+    # File commands need a paired session
+    key = os.urandom(32)
+    directory = tempfile.mkdtemp(prefix="wakemate-transfer-bench-")
+    results = {}
+    try:
+        for level in concurrency:
+            for i in range(level):
+                with open(os.path.join(directory, f"down{i}.bin"), "wb") as fh:
+                    fh.write(data)
+            server_kwargs = {"rate_limiting": False, "transfer_dir": directory,
+                             "max_transfers": 2 * level, "max_connections": None,
+                             "auth_mode": "protected", "pairing_key": base64.b64encode(key).decode("ascii")}
+            with ServerProcess(host, None, server_kwargs) as server:
+                idle, busy = [], []
+                done = threading.Event()
+                pinger = threading.Thread(target=_ping_until, args=(server.host, server.port, done, idle))
+                pinger.start()
+                time.sleep(1.0)
+                done.set()
+                pinger.join()
+
+                timings = {"upload": [], "download": []}
+
+                def timed(kind, fn, *args):
+                    start = time.perf_counter()
+                    reply = fn(*args)
+                    if reply.get("type") != "transfer_complete":
+                        raise RuntimeError(f"Transfer failed: {reply}")
+                    timings[kind].append(time.perf_counter() - start)
+
+                workers = [threading.Thread(target=timed, args=("upload", _upload, server.host,
+                                                                server.port, key, f"up{i}.bin", data))
+                           for i in range(level)]
+                workers += [threading.Thread(target=timed, args=("download", _download, server.host,
+                                                                 server.port, key, f"down{i}.bin", size))
+                            for i in range(level)]
+                done = threading.Event()
+                pinger = threading.Thread(target=_ping_until, args=(server.host, server.port, done, busy))
+                start = time.perf_counter()
+                pinger.start()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+                done.set()
+                pinger.join()
+            usage = server.usage or {}
+            cpu = usage.get("cpu_user_s", 0.0) + usage.get("cpu_system_s", 0.0)
+            moved = 2 * level * size
+            results[str(level)] = {
+                "elapsed_s": round(elapsed, 3),
+                "throughput_mb_s": round(moved / elapsed / 1e6, 1),
+                "upload_mb_s_each": round(size / (sum(timings["upload"]) / level) / 1e6, 1),
+                "download_mb_s_each": round(size / (sum(timings["download"]) / level) / 1e6, 1),
+                "server_cpu_ms_per_mb": round(cpu * 1000 / (moved / 1e6), 3),
+                "ping_idle_ms": percentiles(idle),
+                "ping_during_transfers_ms": percentiles(busy),
+            }
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {"config": {"size_mb": size_mb, "concurrency": list(concurrency)}, "results": results}
@@ -0,0 +1,433 @@
+"""
+Pairing-based authentication for WakeMATECompanion
+
+The phone learns a 32-byte pairing key from the QR code. Once per connection
+it sends ``auth_hello`` with a random nonce; the server answers with its own
+nonce, a session ID and a proof that it knows the key. Both sides derive a
+session key from the pairing key and the two nonces, and every command after
+that is wrapped in an envelope carrying a sequence number and an HMAC-SHA256
+over the raw command text:
+
+    {"sid": "<session id>", "seq": 7, "mac": "<base64>", "payload": "{\\"command\\": ...}"}
+
+Sequence numbers are checked against a sliding replay window. Sessions are kept
+in a bounded cache, so a phone that reconnects can keep using its session ID
+and skip the handshake.
+
+``auth_hello`` needs no key, so a new session waits in a separate, smaller
+table of pending handshakes until its first command verifies. Each peer
+address may only have a few pending handshakes; a client flooding
+``auth_hello`` only churns its own entries there and cannot evict the
+sessions of paired phones.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Authentication modes
+AUTH_OFF = "off"
+AUTH_PROTECTED = "protected"
+AUTH_REQUIRED = "required"
+AUTH_MODES = (AUTH_OFF, AUTH_PROTECTED, AUTH_REQUIRED)
+
+# Commands that need a session in "protected" mode
+PROTECTED_COMMANDS = frozenset(("shutdown", "restart", "sleep", "logoff", "wake"))
+
+# Commands that need a session in every mode; with auth off they are refused.
+# transfer_attach stays public: its transfer ID comes from a session.
+SESSION_COMMANDS = frozenset(("preview_start", "file_upload", "file_download", "file_list",
+                              "transfer_status", "transfer_cancel"))
+
+# Commands that never need a session
+PUBLIC_COMMANDS = frozenset(("auth_hello", "ping", "pong", "transfer_attach"))
+
+KEY_SIZE = 32
+NONCE_SIZE = 16
+REPLAY_WINDOW = 64
+
+# Handshakes not yet confirmed by a verified command, per peer and in total
+MAX_PENDING_PER_PEER = 4
+MAX_PENDING = 256
+PENDING_TTL = 60.0
+
+
+class AuthError(Exception):
+    """Raised when a command fails authentication"""
+
+
+def default_config_dir():
+    """Directory for per-user WakeMATECompanion state"""
+    return os.path.join(str(Path.home()), ".wakematecompanion")
+
+
+def load_or_create_pairing_key(path=None):
+    """Load the pairing key, generating and saving a new one if needed
+
+    Args:
+        path (str, optional): Key file location. Defaults to
+            ~/.wakematecompanion/pairing.key
+
+    Returns:
+        bytes: The pairing key
+    """
+    path = path or os.path.join(default_config_dir(), "pairing.key")
+    try:
+        with open(path, "rb") as fh:
+            key = base64.b64decode(fh.read().strip())
+        if len(key) == KEY_SIZE:
+            return key
+        logger.warning(f"Ignoring malformed pairing key at {path}")
+    except FileNotFoundError:
+        pass
+
+    key = os.urandom(KEY_SIZE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(base64.b64encode(key))
+    logger.info(f"Generated new pairing key at {path}")
+    return key
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _derive(key, label, *parts):
+    return hmac.new(key, label + b"".join(parts), hashlib.sha256).digest()
+
+
+def command_mac(session_key, seq, payload):
+    """Compute the MAC for one command envelope
+
+    Args:
+        session_key (bytes): The session key
+        seq (int): The envelope sequence number
+        payload (bytes): The raw command JSON
+
+    Returns:
+        bytes: HMAC-SHA256 digest
+    """
+    return hmac.new(session_key, str(seq).encode("ascii") + b"." + payload, hashlib.sha256).digest()
+
+
+class ReplayWindow:
+    """Sliding window of accepted sequence numbers"""
+
+    __slots__ = ("size", "highest", "bitmap")
+
+    def __init__(self, size=REPLAY_WINDOW):
+        self.size = size
+        self.highest = 0
+        self.bitmap = 0
+
+    def accept(self, seq):
+        """Record a sequence number
+
+        Returns:
+            bool: False if it is a replay or too old
+        """
+        if seq <= 0:
+            return False
+        if seq > self.highest:
+            shift = seq - self.highest
+            self.bitmap = ((self.bitmap << shift) | 1) & ((1 << self.size) - 1)
+            self.highest = seq
+            return True
+        offset = self.highest - seq
+        if offset >= self.size or self.bitmap & (1 << offset):
+            return False
+        self.bitmap |= 1 << offset
+        return True
+
+
+class Session:
+    """An authenticated session and its replay state"""
+
+    __slots__ = ("id", "key", "window", "lock", "created_at", "last_used", "peer", "established")
+
+    def __init__(self, session_id, key, peer=None, established=True):
+        self.id = session_id
+        self.key = key
+        self.window = ReplayWindow()
+        self.lock = threading.Lock()
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # Pending handshakes: the address that asked for it
+        self.peer = peer
+        self.established = established
+
+
+class Authenticator:
+    """Server side of the pairing handshake and per-command verification"""
+
+    def __init__(self, mode=AUTH_OFF, pairing_key=None, session_ttl=12 * 3600, max_sessions=1024):
+        """Initialize the authenticator
+
+        Args:
+            mode (str, optional): "off", "protected" (power and wake commands,
+                and any registered as protected, need a session) or "required"
+                (everything does). Defaults to "off".
+            pairing_key (bytes or str, optional): The pairing key, raw or base64.
+                Loaded from (or created in) the config directory if omitted.
+            session_ttl (float, optional): Seconds an unused session stays cached
+            max_sessions (int, optional): Maximum cached sessions
+        """
+        if mode not in AUTH_MODES:
+            raise ValueError(f"Unknown auth mode: {mode}")
+        self.mode = mode
+        self.protected_commands = PROTECTED_COMMANDS
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+        if isinstance(pairing_key, str):
+            pairing_key = base64.b64decode(pairing_key)
+        if pairing_key is None and mode != AUTH_OFF:
+            pairing_key = load_or_create_pairing_key()
+        self.pairing_key = pairing_key
+
+    @property
+    def enabled(self):
+        return self.mode != AUTH_OFF
+
+    def pairing_key_b64(self):
+        """Return the pairing key for the QR payload, or None when auth is off"""
+        return _b64(self.pairing_key) if self.pairing_key else None
+
+    def requires_auth(self, cmd_type):
+        """Check whether a command must arrive in an authenticated envelope"""
+        if cmd_type in SESSION_COMMANDS:
+            return True
+        if self.mode == AUTH_OFF or cmd_type in PUBLIC_COMMANDS:
+            return False
+        return self.mode == AUTH_REQUIRED or cmd_type in self.protected_commands
+
+    def protect(self, cmd_type):
+        """Require a session for a command in "protected" mode"""
+        self.protected_commands = self.protected_commands | {cmd_type}
+
+    def handshake(self, client_nonce_b64, peer=None):
+        """Start a new session
+
+        The session stays pending until its first command verifies.
+
+        Args:
+            client_nonce_b64 (str): The client's random nonce, base64 encoded
+            peer (str, optional): Address of the client, for the per-peer
+                limit on pending handshakes
+
+        Returns:
+            tuple: (Session, response data dict)
+        """
+        if not self.pairing_key:
+            raise AuthError("Authentication is not enabled")
+        try:
+            client_nonce = base64.b64decode(client_nonce_b64)
+        except (TypeError, ValueError):
+            raise AuthError("Malformed client nonce")
+        if len(client_nonce) < NONCE_SIZE:
+            raise AuthError("Client nonce too short")
+
+        server_nonce = os.urandom(NONCE_SIZE)
+        session_key = _derive(self.pairing_key, b"wakemate-session", client_nonce, server_nonce)
+        proof = _derive(self.pairing_key, b"wakemate-server", client_nonce, server_nonce)
+        session = Session(_b64(os.urandom(12)), session_key, peer, established=False)
+
+        with self._lock:
+            self._expire_pending()
+            mine = [s.id for s in self._pending.values() if s.peer == peer]
+            for session_id in mine[:max(0, len(mine) - MAX_PENDING_PER_PEER + 1)]:
+                del self._pending[session_id]
+            self._pending[session.id] = session
+            while len(self._pending) > MAX_PENDING:
+                self._pending.popitem(last=False)
+
+        return session, {
+            "session_id": session.id,
+            "server_nonce": _b64(server_nonce),
+            "proof": _b64(proof),
+        }
+
+    def export_sessions(self):
+        """Return the cached sessions in a picklable form, oldest first
+
+        Used to hand sessions to a replacement server (see handoff.py).
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "id": session.id,
+                "key": session.key,
+                "highest": session.window.highest,
+                "bitmap": session.window.bitmap,
+                "idle": now - session.last_used,
+            } for session in self._sessions.values()]
+
+    def import_sessions(self, exported):
+        """Add sessions returned by another server's export_sessions()"""
+        now = time.monotonic()
+        with self._lock:
+            for data in exported:
+                session = Session(data["id"], data["key"])
+                session.window.highest = data["highest"]
+                session.window.bitmap = data["bitmap"]
+                session.last_used = now - data["idle"]
+                self._sessions[session.id] = session
+            self._evict()
+
+    def get_session(self, session_id):
+        """Return a cached session, or None if it is unknown or expired"""
+        return self._lookup(session_id)
+
+    def _evict(self):
+        # Caller holds self._lock
+        now = time.monotonic()
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) > self.max_sessions or now - oldest.last_used > self.session_ttl:
+                self._sessions.popitem(last=False)
+            else:
+                break
+
+    def _expire_pending(self):
+        # Caller holds self._lock
+        now = time.monotonic()
+        while self._pending:
+            oldest = next(iter(self._pending.values()))
+            if now - oldest.created_at <= PENDING_TTL:
+                break
+            self._pending.popitem(last=False)
+
+    def _establish(self, session):
+        """Move a pending session into the cache once a command has verified"""
+        with self._lock:
+            if session.established:
+                return
+            session.established = True
+            self._pending.pop(session.id, None)
+            self._sessions[session.id] = session
+            self._evict()
+
+    def _lookup(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._pending.get(session_id)
+                if session is not None and time.monotonic() - session.created_at > PENDING_TTL:
+                    del self._pending[session_id]
+                    return None
+                return session
+            if time.monotonic() - session.last_used > self.session_ttl:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def open_envelope(self, envelope, cached=None):
+        """Verify an envelope and return the command inside it
+
+        Args:
+            envelope (dict): The parsed envelope
+            cached (Session, optional): The session already bound to this
+                connection, checked before the shared cache
+
+        Returns:
+            tuple: (Session, command dict)
+        """
+        session_id = envelope.get("sid")
+        session = cached if cached is not None and cached.id == session_id else self._lookup(session_id)
+        if session is None:
+            raise AuthError("Unknown or expired session")
+
+        payload = envelope.get("payload")
+        seq = envelope.get("seq")
+        if not isinstance(payload, str) or not isinstance(seq, int):
+            raise AuthError("Malformed envelope")
+        payload_bytes = payload.encode("utf-8")
+
+        try:
+            mac = base64.b64decode(envelope.get("mac", ""))
+        except (TypeError, ValueError):
+            raise AuthError("Malformed MAC")
+        if not hmac.compare_digest(mac, command_mac(session.key, seq, payload_bytes)):
+            raise AuthError("Bad MAC")
+
+        with session.lock:
+            if not session.window.accept(seq):
+                raise AuthError("Replayed or stale sequence number")
+            session.last_used = time.monotonic()
+        if not session.established:
+            self._establish(session)
+
+        return session, json.loads(payload)
+
+
+class ClientSession:
+    """Client side of the protocol, used by the benchmarks and scripts"""
+
+    def __init__(self, pairing_key):
+        """Initialize the client
+
+        Args:
+            pairing_key (bytes or str): The pairing key, raw or base64
+        """
+        if isinstance(pairing_key, str):
+            pairing_key = base64.b64decode(pairing_key)
+        self.pairing_key = pairing_key
+        self.client_nonce = None
+        self.session_id = None
+        self.session_key = None
+        self.seq = 0
+
+    def hello(self):
+        """Build the auth_hello command
+
+        Returns:
+            bytes: The encoded command
+        """
+        self.client_nonce = os.urandom(NONCE_SIZE)
+        return json.dumps({"command": "auth_hello",
+                           "params": {"client_nonce": _b64(self.client_nonce)}}).encode("utf-8")
+
+    def finish(self, response):
+        """Complete the handshake from the server's auth_hello response
+
+        Args:
+            response (dict): The parsed response
+        """
+        data = response.get("data") or {}
+        server_nonce = base64.b64decode(data["server_nonce"])
+        expected = _derive(self.pairing_key, b"wakemate-server", self.client_nonce, server_nonce)
+        if not hmac.compare_digest(expected, base64.b64decode(data["proof"])):
+            raise AuthError("Server failed to prove knowledge of the pairing key")
+        self.session_key = _derive(self.pairing_key, b"wakemate-session", self.client_nonce, server_nonce)
+        self.session_id = data["session_id"]
+        self.seq = 0
+
+    def wrap(self, command):
+        """Wrap a command in an authenticated envelope
+
+        Args:
+            command (dict): The command to send
+
+        Returns:
+            bytes: The encoded envelope
+        """
+        self.seq += 1
+        payload = json.dumps(command)
+        mac = command_mac(self.session_key, self.seq, payload.encode("utf-8"))
+        return json.dumps({"sid": self.session_id, "seq": self.seq,
+                           "mac": _b64(mac), "payload": payload}).encode("utf-8")
@@ -0,0 +1,188 @@
+"""
+Traffic capture for WakeMATECompanion
+
+With ``WakeMateServer(capture="session.wmcap")`` every connection open and
+close, every inbound frame and every response sent back is appended to a
+compact binary file. Timestamps come from the monotonic clock, relative to the
+start of the capture. ``python -m wakematecompanion.benchmarks replay`` sends
+a capture back at a server, so a real session becomes a repeatable load test.
+
+File layout (little-endian):
+
+    header   b"WMCAP" version:u8 started_at:f64 (Unix time)
+    record   kind:u8 conn_id:u32 t:f64 length:u32 payload[length]
+
+Record kinds are OPEN (payload is the peer address), IN (bytes received),
+OUT (a response frame) and CLOSE (empty payload). Subscription pushes are not
+recorded. Authenticated envelopes are recorded as sent, but they cannot be
+replayed because every one carries a single-use nonce.
+
+The file is readable by its owner only. Typed text is masked by default: the
+text of every keyboard_input command is replaced by as many asterisks, so a
+replay types the same amount without the capture holding passwords.
+"""
+
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger("WakeMATECompanion")
+
+MAGIC = b"WMCAP"
+VERSION = 1
+HEADER = struct.Struct("<5sBd")
+RECORD = struct.Struct("<BIdI")
+
+OPEN = 1
+IN = 2
+OUT = 3
+CLOSE = 4
+
+KIND_NAMES = {OPEN: "open", IN: "in", OUT: "out", CLOSE: "close"}
+
+# Parameters masked in recorded commands when redacting input
+REDACTED_PARAMS = {"keyboard_input": ("text",)}
+
+
+def _redact_command(command):
+    if not isinstance(command, dict):
+        return False
+    params = command.get("params")
+    names = REDACTED_PARAMS.get(command.get("command"))
+    if not names or not isinstance(params, dict):
+        return False
+    for name in names:
+        value = params.get(name)
+        if isinstance(value, str):
+            params[name] = "*" * len(value)
+    return True
+
+
+def redact(payload):
+    """Mask typed text in an inbound frame
+
+    Signed envelopes are redacted inside; their MAC no longer matches, but
+    they could not be replayed anyway.
+
+    Args:
+        payload (bytes): The received frame
+
+    Returns:
+        bytes: The frame to record; unchanged if it holds no typed text
+    """
+    if b"keyboard_input" not in payload:
+        return payload
+    try:
+        command = json.loads(payload)
+        if isinstance(command, dict) and "mac" in command and isinstance(command.get("payload"), str):
+            inner = json.loads(command["payload"])
+            if not _redact_command(inner):
+                return payload
+            command["payload"] = json.dumps(inner)
+        elif not _redact_command(command):
+            return payload
+    except ValueError:
+        # Not JSON; keep nothing of it
+        return b"{}"
+    return json.dumps(command).encode("utf-8")
+
+
+class CaptureWriter:
+    """Appends capture records to a file; safe to call from any thread"""
+
+    def __init__(self, path, max_bytes=None, redact_input=True):
+        """Create the capture file, readable by its owner only
+
+        Args:
+            path (str): File to write; replaced if it exists
+            max_bytes (int, optional): Stop recording once the file reaches
+                this size. Defaults to None (unlimited).
+            redact_input (bool, optional): Mask the text of keyboard_input
+                commands. Defaults to True.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.redact_input = redact_input
+        self._lock = threading.Lock()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        if hasattr(os, "fchmod"):
+            # O_CREAT's mode does not apply to a file that already existed
+            os.fchmod(fd, 0o600)
+        self._file = os.fdopen(fd, "wb", buffering=65536)
+        self._start = time.monotonic()
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self.bytes_written = HEADER.size
+        self.records = 0
+        self.full = False
+        logger.info(f"Capturing traffic to {path}")
+
+    def record(self, kind, conn_id, payload=b""):
+        """Append one record
+
+        Args:
+            kind (int): OPEN, IN, OUT or CLOSE
+            conn_id (int): The connection ID
+            payload (bytes, optional): Record data
+        """
+        t = time.monotonic() - self._start
+        if kind == IN and self.redact_input:
+            payload = redact(payload)
+        size = RECORD.size + len(payload)
+        with self._lock:
+            if self._file is None or self.full:
+                return
+            if self.max_bytes is not None and self.bytes_written + size > self.max_bytes:
+                self.full = True
+                logger.warning(f"Capture file {self.path} reached its size limit; recording stopped")
+                return
+            self._file.write(RECORD.pack(kind, conn_id, t, len(payload)))
+            self._file.write(payload)
+            self.bytes_written += size
+            self.records += 1
+            if kind == CLOSE:
+                self._file.flush()
+
+    def close(self):
+        """Flush and close the file"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        logger.info(f"Capture closed: {self.records} records, {self.bytes_written} bytes")
+
+
+def read_capture(path):
+    """Read a capture file
+
+    Args:
+        path (str): The capture file
+
+    Returns:
+        tuple: (started_at Unix time, list of (kind, conn_id, t, payload))
+
+    Raises:
+        ValueError: If the file is not a capture
+    """
+    with open(path, "rb") as fh:
+        data = fh.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a capture file")
+    magic, version, started_at = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} capture file")
+
+    records = []
+    offset = HEADER.size
+    # A capture cut short by a crash ends at the last complete record
+    while offset + RECORD.size <= len(data):
+        kind, conn_id, t, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            break
+        records.append((kind, conn_id, t, data[offset:offset + length]))
+        offset += length
+    return started_at, records
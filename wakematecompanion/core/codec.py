@@ -0,0 +1,103 @@
+"""
+JSON codecs for WakeMATECompanion
+
+Commands are decoded straight from the received bytes and responses are
+encoded straight to bytes. orjson is used when it is installed; the standard
+library json module is the fallback. Responses that never change are built
+once with preencoded() and carry their wire bytes, so sending them costs no
+serialization at all.
+"""
+
+import json
+import logging
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Optional imports - will be handled gracefully if not available
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Raised by every codec for malformed input (orjson's error subclasses JSONDecodeError)
+DECODE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+
+class JSONCodec:
+    """Standard library codec"""
+
+    name = "json"
+
+    def loads(self, data):
+        """Decode a JSON document from bytes or str"""
+        return json.loads(data)
+
+    def dumps(self, obj):
+        """Encode an object to UTF-8 JSON bytes"""
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def frame(self, obj):
+        """Encode an object as one newline-terminated wire frame"""
+        return self.dumps(obj) + b"\n"
+
+
+class OrjsonCodec(JSONCodec):
+    """orjson codec; encodes non-finite floats as null"""
+
+    name = "orjson"
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def frame(self, obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+
+
+def get_codec(name=None):
+    """Return a codec by name, or the fastest available one
+
+    Args:
+        name (str, optional): "orjson" or "json". Defaults to orjson when
+            installed.
+
+    Returns:
+        JSONCodec: The codec
+    """
+    if name is None:
+        name = "orjson" if ORJSON_AVAILABLE else "json"
+    if name == "orjson":
+        if not ORJSON_AVAILABLE:
+            raise ValueError("The orjson codec needs the orjson package")
+        return OrjsonCodec()
+    if name == "json":
+        return JSONCodec()
+    raise ValueError(f"Unknown codec: {name}")
+
+
+class PreencodedResponse(dict):
+    """A constant response that carries its encoded wire frame"""
+
+    __slots__ = ("frame",)
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Pre-encoded responses are read-only; copy with dict() first")
+
+    __setitem__ = __delitem__ = update = pop = popitem = clear = setdefault = _readonly
+
+
+def preencoded(response):
+    """Build a constant response whose frame is encoded once
+
+    Args:
+        response (dict): The response
+
+    Returns:
+        PreencodedResponse: A read-only dict with a .frame attribute
+    """
+    constant = PreencodedResponse(response)
+    constant.frame = JSONCodec().frame(response)
+    return constant
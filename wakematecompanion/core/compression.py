@@ -0,0 +1,274 @@
+"""
+Negotiated frame compression for WakeMATECompanion
+
+Frames are newline-terminated JSON text, which is fine for taps but wasteful
+for long typed text, status dumps and device lists. A client that sends the
+``compression`` command may exchange compressed frames from then on, in both
+directions:
+
+    0x00 | total length (4 bytes, big endian) | compressed frame
+
+JSON never starts with a zero byte, so compressed and plain frames mix
+freely on one connection and a reader only has to look at the first byte.
+Only frames at least ``threshold`` bytes long are compressed; short ones go
+out as plain text, which costs nothing.
+
+Each direction of a connection has one compression stream that lives as long
+as the connection. Every frame is compressed with the same context and ends
+with a flush, so keys and values repeated from earlier frames cost a few bytes
+each. This is the same trade-off as WebSocket permessage-deflate with context
+takeover: better ratios at the price of keeping per-connection state.
+
+Algorithms, in the server's preference order:
+
+- "zstd": needs the zstandard package
+- "lz4": needs the lz4 package; the fastest, the weakest ratio
+- "zlib": raw deflate, always available
+"""
+
+import logging
+import struct
+import zlib
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Optional imports - will be handled gracefully if not available
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    import lz4.block
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+MARKER = b"\x00"
+HEADER = struct.Struct(">BI")
+
+DEFAULT_THRESHOLD = 1024
+
+# Largest compressed frame accepted, and largest frame it may expand to
+MAX_FRAME_BYTES = 1024 * 1024
+MAX_DECOMPRESSED_BYTES = 4 * 1024 * 1024
+
+# History LZ4 can refer back to
+LZ4_WINDOW = 64 * 1024
+
+# Most zstd output per input byte (a 4-byte RLE block expands to 128 KiB),
+# and the smallest piece of a frame fed to the decompressor at once
+ZSTD_MAX_EXPANSION = 32 * 1024
+ZSTD_MIN_PIECE = 64
+
+
+class CompressionError(ValueError):
+    """Raised for a malformed, oversized or unexpected compressed frame"""
+
+
+class _ZlibStream:
+    """Raw deflate with a sync flush after every frame"""
+
+    name = "zlib"
+    default_level = 6
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def decompress(self, data):
+        try:
+            out = self._decompressor.decompress(data, MAX_DECOMPRESSED_BYTES)
+        except zlib.error as e:
+            raise CompressionError(f"Corrupt zlib frame: {str(e)}")
+        if self._decompressor.unconsumed_tail:
+            raise CompressionError("Compressed frame expands beyond the size limit")
+        return out
+
+
+class _ZstdStream:
+    """zstandard stream with a block flush after every frame"""
+
+    name = "zstd"
+    default_level = 3
+
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def decompress(self, data):
+        # The decompressor has no output cap, so feed it pieces small enough
+        # that none can expand far past the limit
+        view = memoryview(data)
+        out = []
+        produced = 0
+        pos = 0
+        try:
+            while pos < len(view):
+                piece = max(ZSTD_MIN_PIECE, (MAX_DECOMPRESSED_BYTES - produced) // ZSTD_MAX_EXPANSION)
+                chunk = self._decompressor.decompress(view[pos:pos + piece])
+                pos += piece
+                produced += len(chunk)
+                if produced > MAX_DECOMPRESSED_BYTES:
+                    raise CompressionError("Compressed frame expands beyond the size limit")
+                out.append(chunk)
+        except zstandard.ZstdError as e:
+            raise CompressionError(f"Corrupt zstd frame: {str(e)}")
+        return out[0] if len(out) == 1 else b"".join(out)
+
+
+class _Lz4Stream:
+    """LZ4 blocks, each using the previous 64 KiB of its direction as dictionary"""
+
+    name = "lz4"
+    default_level = 0
+
+    def __init__(self, level):
+        # Level 0 is LZ4's fast mode; higher levels use LZ4 HC
+        self._mode = "high_compression" if level > 0 else "default"
+        self._level = level
+        self._sent = b""
+        self._received = b""
+
+    def compress(self, data):
+        out = lz4.block.compress(data, mode=self._mode, compression=self._level, dict=self._sent)
+        self._sent = (self._sent + data)[-LZ4_WINDOW:]
+        return out
+
+    def decompress(self, data):
+        # Blocks start with their decompressed size
+        if len(data) < 4 or int.from_bytes(data[:4], "little") > MAX_DECOMPRESSED_BYTES:
+            raise CompressionError("Compressed frame expands beyond the size limit")
+        try:
+            out = lz4.block.decompress(data, dict=self._received)
+        except lz4.block.LZ4BlockError as e:
+            raise CompressionError(f"Corrupt lz4 frame: {str(e)}")
+        self._received = (self._received + out)[-LZ4_WINDOW:]
+        return out
+
+
+def available():
+    """Return the usable algorithm names, in server preference order"""
+    names = []
+    if ZSTD_AVAILABLE:
+        names.append("zstd")
+    if LZ4_AVAILABLE:
+        names.append("lz4")
+    names.append("zlib")
+    return names
+
+
+_STREAMS = {"zlib": _ZlibStream, "zstd": _ZstdStream, "lz4": _Lz4Stream}
+
+
+def negotiate(offered, allowed):
+    """Pick the algorithm for a connection
+
+    Args:
+        offered (list): Algorithms the client supports, its favourite first
+        allowed (list): Algorithms this server may use
+
+    Returns:
+        str: The client's first choice that the server allows, or None
+    """
+    for name in offered:
+        if name in allowed:
+            return name
+    return None
+
+
+def frame_length(buf):
+    """Return the total length of the compressed frame at the start of a buffer
+
+    Returns:
+        int: Header plus payload length, or None if the header is incomplete
+
+    Raises:
+        CompressionError: If the length is shorter than the header itself or
+            larger than MAX_FRAME_BYTES
+    """
+    if len(buf) < HEADER.size:
+        return None
+    length = HEADER.unpack_from(buf)[1]
+    if length < HEADER.size:
+        # The length counts the header; anything shorter would never advance
+        raise CompressionError(f"Compressed frame length {length} is shorter than its header")
+    if length > MAX_FRAME_BYTES:
+        raise CompressionError(f"Compressed frame of {length} bytes is too large")
+    return length
+
+
+class Compression:
+    """The compression streams and statistics of one connection"""
+
+    def __init__(self, algorithm, threshold=DEFAULT_THRESHOLD, level=None, metrics=None):
+        """Set up both directions of a connection
+
+        Args:
+            algorithm (str): "zlib", "zstd" or "lz4"
+            threshold (int, optional): Frames shorter than this are sent as
+                plain text. Defaults to 1024.
+            level (int, optional): Compression level. Defaults to the
+                algorithm's own default.
+            metrics (ServerMetrics, optional): Registry for byte counters
+
+        Raises:
+            ValueError: If the algorithm is unknown or not installed
+        """
+        if algorithm not in available():
+            raise ValueError(f"Compression algorithm not available: {algorithm}")
+        stream = _STREAMS[algorithm]
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.metrics = metrics
+        self._stream = stream(stream.default_level if level is None else level)
+        self._labels = (algorithm,)
+        self.raw_out = 0
+        self.wire_out = 0
+
+    def pack(self, frame):
+        """Compress an outgoing frame if it is long enough
+
+        Frames must be packed in the order they are sent, since every frame
+        extends the same stream.
+
+        Args:
+            frame (bytes): A newline-terminated JSON frame
+
+        Returns:
+            bytes: The frame itself, or a compressed frame
+        """
+        if len(frame) < self.threshold:
+            return frame
+        data = self._stream.compress(frame)
+        packed = HEADER.pack(0, HEADER.size + len(data)) + data
+        self.raw_out += len(frame)
+        self.wire_out += len(packed)
+        if self.metrics:
+            self.metrics.increment("compression_raw_bytes_total", self._labels, len(frame))
+            self.metrics.increment("compression_wire_bytes_total", self._labels, len(packed))
+        return packed
+
+    def unpack(self, frame):
+        """Decompress a complete incoming compressed frame, header included
+
+        Raises:
+            CompressionError: If the frame is corrupt or expands too far
+        """
+        data = self._stream.decompress(frame[HEADER.size:])
+        if len(data) > MAX_DECOMPRESSED_BYTES:
+            raise CompressionError("Compressed frame expands beyond the size limit")
+        return data
+
+    def ratio(self):
+        """Return wire bytes per raw byte sent so far, or None"""
+        if not self.raw_out:
+            return None
+        return round(self.wire_out / self.raw_out, 4)
@@ -0,0 +1,245 @@
+"""
+Connection tracking for WakeMATECompanion
+"""
+
+import collections
+import itertools
+import logging
+import platform
+import select
+import socket
+import threading
+import time
+
+logger = logging.getLogger("WakeMATECompanion")
+
+
+def enable_keepalive(sock, idle=60, interval=10, count=3):
+    """Turn on TCP keepalive so dead peers are noticed without traffic
+
+    Args:
+        sock (socket.socket): Connected client socket
+        idle (int, optional): Seconds of silence before the first probe
+        interval (int, optional): Seconds between probes
+        count (int, optional): Failed probes before the connection is dropped
+    """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        system = platform.system()
+        if system == "Windows" and hasattr(socket, "SIO_KEEPALIVE_VALS"):
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+            return
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+        elif system == "Darwin":
+            # TCP_KEEPALIVE is the macOS name for TCP_KEEPIDLE
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, "TCP_KEEPALIVE", 0x10), idle)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+    except OSError as e:
+        logger.warning(f"Failed to enable TCP keepalive: {str(e)}")
+
+
+class Connection:
+    """A connected client and its statistics"""
+
+    # Whether frames may be compressed (see compression.py)
+    supports_compression = True
+    # Whether screen preview frames can be streamed to it (see screen_preview.py)
+    supports_preview = True
+    # Whether it can be turned into a file transfer data connection (see transfers.py)
+    supports_transfer = True
+
+    def __init__(self, conn_id, sock, addr):
+        """Initialize the connection record
+
+        Args:
+            conn_id (int): Unique connection ID
+            sock (socket.socket): The client socket
+            addr (tuple): The peer address
+        """
+        self.id = conn_id
+        self.sock = sock
+        self.addr = addr
+        self.label = f"{addr[0]}:{addr[1]}"
+        self.connected_at = time.time()
+        self.last_activity = time.monotonic()
+        self.ping_sent_at = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.commands = 0
+        self.errors = 0
+        self.send_lock = threading.Lock()
+        self.session = None
+        self.compression = None
+        # The file transfer this connection carries, once attached
+        self.transfer = None
+        # Mouse buttons pressed with mouse_button and not yet released
+        self.held_buttons = set()
+        self.closed = False
+        # Outbound queue, used once an OutboundWriter is attached (see outbound.py)
+        self.outbound = None
+        self.pending = collections.deque()
+        self.pending_bytes = 0
+        self.stalled_since = None
+        self.watched_fd = None
+        self.drained = threading.Condition(self.send_lock)
+        self._poller = None
+
+    def touch(self, nbytes=0):
+        """Record inbound activity"""
+        self.last_activity = time.monotonic()
+        self.ping_sent_at = None
+        self.bytes_in += nbytes
+
+    def send(self, payload):
+        """Send a complete frame, serialized against other sending threads
+
+        With an OutboundWriter attached this never blocks; otherwise it
+        blocks until the whole frame is written.
+
+        Args:
+            payload (bytes): The encoded frame
+        """
+        outbound = self.outbound
+        if outbound is not None:
+            outbound.send(self, payload)
+            return
+        with self.send_lock:
+            if self.compression is not None:
+                payload = self.compression.pack(payload)
+            self.sock.sendall(payload)
+            self.bytes_out += len(payload)
+
+    def write_blocked(self):
+        """Check whether the outbound queue is above its high watermark"""
+        return self.stalled_since is not None
+
+    def wait_readable(self, timeout):
+        """Wait for input on a non-blocking socket
+
+        Args:
+            timeout (float): Seconds to wait
+
+        Returns:
+            bool: True if a recv() may now return data, EOF or an error
+        """
+        sock = self.sock
+        # TLS may already hold decrypted bytes that the socket no longer shows
+        pending = getattr(sock, "pending", None)
+        if pending is not None and pending():
+            return True
+        if hasattr(select, "poll"):
+            if self._poller is None:
+                self._poller = select.poll()
+                self._poller.register(sock.fileno(), select.POLLIN)
+            return bool(self._poller.poll(timeout * 1000))
+        return bool(select.select([sock], [], [], timeout)[0])
+
+    def idle_seconds(self):
+        """Seconds since the last inbound data"""
+        return time.monotonic() - self.last_activity
+
+    def close(self):
+        """Close the underlying socket, ignoring errors"""
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def to_dict(self):
+        """Return a JSON-friendly snapshot of this connection"""
+        return {
+            "id": self.id,
+            "address": self.label,
+            "connected_at": self.connected_at,
+            "idle_seconds": round(self.idle_seconds(), 3),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "queued_bytes": self.pending_bytes,
+            "commands": self.commands,
+            "errors": self.errors,
+            "authenticated": self.session is not None,
+            "compression": self.compression.algorithm if self.compression else None,
+            "transfer": self.transfer.id if self.transfer else None,
+        }
+
+
+class ConnectionTable:
+    """Thread-safe table of live connections keyed by connection ID"""
+
+    def __init__(self, max_connections=None):
+        """Initialize the table
+
+        Args:
+            max_connections (int, optional): Maximum simultaneous connections.
+                Defaults to None (unlimited).
+        """
+        self.max_connections = max_connections
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._connections)
+
+    def add(self, sock, addr, factory=Connection):
+        """Register a new connection
+
+        Args:
+            sock (socket.socket): The client socket
+            addr (tuple): The peer address
+            factory (type, optional): Connection class to create, called as
+                factory(conn_id, sock, addr). Defaults to Connection.
+
+        Returns:
+            Connection: The new record, or None if the table is full
+        """
+        with self._lock:
+            if self.max_connections is not None and len(self._connections) >= self.max_connections:
+                return None
+            conn = factory(next(self._ids), sock, addr)
+            self._connections[conn.id] = conn
+            return conn
+
+    def remove(self, conn_id):
+        """Remove a connection by ID
+
+        Returns:
+            Connection: The removed record, or None if it was not present
+        """
+        with self._lock:
+            return self._connections.pop(conn_id, None)
+
+    def get(self, conn_id):
+        """Look up a connection by ID"""
+        return self._connections.get(conn_id)
+
+    def all(self):
+        """Return a list of all live connections"""
+        with self._lock:
+            return list(self._connections.values())
+
+    def snapshot(self):
+        """Return JSON-friendly statistics for every live connection"""
+        return [conn.to_dict() for conn in self.all()]
+
+    def close_all(self):
+        """Close and remove every connection
+
+        Returns:
+            list: The connections that were closed
+        """
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+        return connections
@@ -0,0 +1,315 @@
+"""
+Live diagnostics for WakeMATECompanion
+
+The companion runs for weeks at a time, so slowdowns and leaks have to be
+investigated in the running process. This module provides:
+
+- SamplingProfiler: a statistical CPU profiler. A background thread reads
+  every thread's stack at a fixed interval and counts identical stacks. The
+  result is returned as collapsed stacks (the input format of flamegraph.pl
+  and speedscope) or as a nested tree for d3-flame-graph.
+- MemoryTracker: tracemalloc snapshots that can be listed and diffed.
+- process_stats(): thread, file descriptor, memory and GC counts.
+
+None of this costs anything until it is started.
+"""
+
+import gc
+import itertools
+import linecache
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Distinct stacks kept by the profiler; further samples count as truncated
+MAX_STACKS = 20000
+
+# Stack frames kept per sample, counted from the thread's entry point
+MAX_DEPTH = 128
+
+# Memory snapshots kept for diffing
+MAX_SNAPSHOTS = 4
+
+TRUNCATED = "[truncated]"
+
+_DIGITS = re.compile(r"\d+")
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples every thread's stack"""
+
+    def __init__(self, interval=0.005, duration=60.0):
+        """Initialize the profiler
+
+        Args:
+            interval (float, optional): Seconds between samples. Defaults to 0.005.
+            duration (float, optional): Stop sampling on its own after this many
+                seconds. Defaults to 60.
+        """
+        self.interval = interval
+        self.duration = duration
+        self.stacks = {}
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        # Frame labels are cached per code object; labelling is most of the cost
+        self._labels = {}
+
+    @property
+    def running(self):
+        """Check whether the sampler thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start sampling in a background thread"""
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="profiler")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"CPU profiler started ({self.interval * 1000:g} ms interval)")
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.stopped_at is None:
+            self.stopped_at = time.time()
+
+    def _run(self):
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+        while not self._stop.wait(self.interval):
+            if time.monotonic() >= deadline:
+                break
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid != own:
+                    self._record(_DIGITS.sub("N", names.get(tid, "thread")), frame)
+            self.samples += 1
+        self.stopped_at = time.time()
+        logger.info(f"CPU profiler stopped after {self.samples} samples")
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _record(self, thread_name, frame):
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.append(thread_name)
+        labels.reverse()
+        key = ";".join(labels[:MAX_DEPTH])
+        stacks = self.stacks
+        if key not in stacks and len(stacks) >= MAX_STACKS:
+            key = TRUNCATED
+        stacks[key] = stacks.get(key, 0) + 1
+
+    def collapsed(self, limit=None):
+        """Return the most frequent stacks in collapsed format
+
+        Args:
+            limit (int, optional): Keep only this many stacks. Defaults to all.
+
+        Returns:
+            list: "frame;frame;frame count" lines, most frequent first
+        """
+        ordered = sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)
+        return [f"{stack} {count}" for stack, count in itertools.islice(ordered, limit)]
+
+    def flamegraph(self, limit=None):
+        """Return the most frequent stacks as a d3-flame-graph tree
+
+        Args:
+            limit (int, optional): Build the tree from this many stacks.
+                Defaults to all.
+
+        Returns:
+            dict: {"name", "value", "children"} nodes rooted at "all"
+        """
+        root = {"name": "all", "value": 0, "children": {}}
+        ordered = sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)
+        for stack, count in itertools.islice(ordered, limit):
+            root["value"] += count
+            node = root
+            for name in stack.split(";"):
+                child = node["children"].get(name)
+                if child is None:
+                    child = node["children"][name] = {"name": name, "value": 0, "children": {}}
+                child["value"] += count
+                node = child
+
+        def finish(node):
+            node["children"] = [finish(child) for child in node["children"].values()]
+            return node
+        return finish(root)
+
+    def summary(self):
+        """Return the profile's sample counts and timing"""
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "interval_ms": self.interval * 1000,
+            "elapsed_s": round(end - self.started_at, 3) if self.started_at else 0.0,
+        }
+
+
+class MemoryTracker:
+    """tracemalloc snapshots kept for listing and diffing"""
+
+    def __init__(self):
+        self.snapshots = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self):
+        """Check whether tracemalloc is running"""
+        return tracemalloc.is_tracing()
+
+    def snapshot(self, frames=1):
+        """Take a snapshot, starting tracemalloc first if needed
+
+        Allocations made before tracemalloc started are not seen, so the first
+        snapshot is mainly a baseline for later diffs.
+
+        Args:
+            frames (int, optional): Traceback depth to record when starting.
+                Defaults to 1.
+
+        Returns:
+            tuple: (snapshot ID, tracemalloc.Snapshot)
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.info(f"tracemalloc started ({frames} frames)")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        with self._lock:
+            snapshot_id = next(self._ids)
+            self.snapshots[snapshot_id] = snapshot
+            while len(self.snapshots) > MAX_SNAPSHOTS:
+                del self.snapshots[min(self.snapshots)]
+        return snapshot_id, snapshot
+
+    def get(self, snapshot_id):
+        """Return a kept snapshot
+
+        Raises:
+            KeyError: If the snapshot was never taken or has been dropped
+        """
+        with self._lock:
+            return self.snapshots[snapshot_id]
+
+    def stop(self):
+        """Stop tracemalloc and drop all snapshots"""
+        with self._lock:
+            self.snapshots.clear()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info("tracemalloc stopped")
+
+    def usage(self):
+        """Return traced memory in bytes as {"current", "peak"}"""
+        if not tracemalloc.is_tracing():
+            return {"current": 0, "peak": 0}
+        current, peak = tracemalloc.get_traced_memory()
+        return {"current": current, "peak": peak}
+
+
+def top_stats(snapshot, key_type="lineno", limit=20):
+    """Return a snapshot's largest allocation sites
+
+    Args:
+        snapshot (tracemalloc.Snapshot): The snapshot
+        key_type (str, optional): "lineno", "filename" or "traceback"
+        limit (int, optional): Number of sites. Defaults to 20.
+
+    Returns:
+        list: {"site", "size", "count"} dicts, largest first
+    """
+    return [{"site": _site(stat.traceback), "size": stat.size, "count": stat.count}
+            for stat in snapshot.statistics(key_type)[:limit]]
+
+
+def diff_stats(new, old, key_type="lineno", limit=20):
+    """Return the allocation sites that changed most between two snapshots
+
+    Returns:
+        list: {"site", "size", "size_diff", "count", "count_diff"} dicts,
+            largest change first
+    """
+    return [{"site": _site(stat.traceback), "size": stat.size, "size_diff": stat.size_diff,
+             "count": stat.count, "count_diff": stat.count_diff}
+            for stat in new.compare_to(old, key_type)[:limit]]
+
+
+def _site(traceback):
+    return "; ".join(f"{frame.filename}:{frame.lineno}" for frame in traceback)
+
+
+def count_fds():
+    """Return the number of open file descriptors, or None if unknown"""
+    for path in ("/proc/self/fd", "/dev/fd"):
+        try:
+            # listdir's own descriptor is included in the listing
+            return len(os.listdir(path)) - 1
+        except OSError:
+            continue
+    return None
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def process_stats():
+    """Return thread, file descriptor, memory and GC counts for this process"""
+    threads = threading.enumerate()
+    by_name = {}
+    for thread in threads:
+        name = _DIGITS.sub("N", thread.name)
+        by_name[name] = by_name.get(name, 0) + 1
+    return {
+        "pid": os.getpid(),
+        "threads": len(threads),
+        "threads_by_name": dict(sorted(by_name.items(), key=lambda item: item[1], reverse=True)),
+        "fds": count_fds(),
+        "rss_bytes": _rss_bytes(),
+        "max_rss_bytes": _max_rss_bytes(),
+        "gc_counts": list(gc.get_count()),
+        "gc_objects": len(gc.get_objects()),
+        "gc_garbage": len(gc.garbage),
+    }
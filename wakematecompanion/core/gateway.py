@@ -0,0 +1,629 @@
+"""
+WebSocket and HTTP gateway for WakeMATECompanion
+
+One asyncio event loop offers two more ways into the command registry, next
+to the raw TCP protocol:
+
+    GET  /ws                WebSocket; every text message is a command in the
+                            TCP protocol's JSON format, and every reply or
+                            pushed update arrives as its own message
+    POST /command           The body is a command, exactly as sent over TCP
+    POST /commands/<name>   The body, if any, is the params object
+    GET  /commands          Same as list_commands
+
+HTTP connections are kept alive (HTTP/1.1), so a phone or an automation tool
+can reuse one connection for many commands. Commands still go through
+WakeMateServer._process_command on a small thread pool, so validation,
+authentication, rate limiting and metrics behave exactly as they do over TCP.
+
+Browsers send an Origin header. Requests that carry one are refused unless the
+origin is in ``allowed_origins``, so an arbitrary web page cannot drive the
+host through the user's browser.
+"""
+
+import asyncio
+import base64
+import concurrent.futures
+import hashlib
+import logging
+import math
+import socket
+import struct
+import threading
+import time
+from urllib.parse import unquote
+
+from . import capture as capture_format
+from . import outbound
+from .codec import DECODE_ERRORS
+from .connections import Connection
+from . import listeners as listener_utils
+
+logger = logging.getLogger("WakeMATECompanion")
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Largest request head, and largest request body or WebSocket message
+MAX_HEADER_BYTES = 16384
+MAX_MESSAGE_BYTES = 1 << 20
+
+# Threads running commands for gateway clients
+DISPATCH_THREADS = 8
+
+# Commands that push frames outside request/response; WebSocket only
+STREAMING_COMMANDS = ("subscribe", "unsubscribe")
+
+# Error code -> HTTP status. Errors without a code are requests a handler
+# refused (bad input or wrong state) and map to 400; unknown codes to 500.
+ERROR_STATUS = {
+    "invalid_json": 400,
+    "invalid_request": 400,
+    "invalid_params": 400,
+    "auth_required": 401,
+    "auth_failed": 401,
+    "forbidden": 403,
+    "unknown_command": 404,
+    "in_progress": 409,
+    "rate_limited": 429,
+    "internal_error": 500,
+    "unsupported": 501,
+    "busy": 503,
+}
+
+REASONS = {
+    101: "Switching Protocols", 200: "OK", 204: "No Content", 400: "Bad Request",
+    401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    409: "Conflict", 411: "Length Required", 413: "Payload Too Large",
+    429: "Too Many Requests", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error", 501: "Not Implemented", 503: "Service Unavailable",
+}
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_TOO_BIG = 1009
+
+# Seconds between write buffer checks while a WebSocket client is blocked
+STALL_CHECK_INTERVAL = 0.5
+
+
+def accept_key(key):
+    """Compute Sec-WebSocket-Accept for a client's Sec-WebSocket-Key"""
+    return base64.b64encode(hashlib.sha1(key.encode("ascii") + WS_GUID).digest()).decode("ascii")
+
+
+def encode_frame(opcode, payload=b""):
+    """Encode one unmasked, unfragmented server frame"""
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+class FrameError(Exception):
+    """Raised for a WebSocket frame that must close the connection"""
+
+    def __init__(self, close_code, message):
+        super().__init__(message)
+        self.close_code = close_code
+
+
+async def read_frame(reader, limit):
+    """Read and unmask one client frame
+
+    Args:
+        reader (asyncio.StreamReader): The connection
+        limit (int): Largest payload accepted
+
+    Returns:
+        tuple: (fin, opcode, payload)
+
+    Raises:
+        FrameError: If the frame is unmasked, an invalid control frame or
+            larger than limit
+        asyncio.IncompleteReadError: If the connection closes mid-frame
+    """
+    b0, b1 = await reader.readexactly(2)
+    fin = bool(b0 & 0x80)
+    opcode = b0 & 0x0F
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if not b1 & 0x80:
+        raise FrameError(CLOSE_PROTOCOL_ERROR, "Client frames must be masked")
+    if opcode >= 0x8 and (n > 125 or not fin):
+        raise FrameError(CLOSE_PROTOCOL_ERROR, "Control frames must be short and unfragmented")
+    if n > limit:
+        raise FrameError(CLOSE_TOO_BIG, "Message too big")
+    mask = await reader.readexactly(4)
+    return fin, opcode, _unmask(mask, await reader.readexactly(n))
+
+
+def _unmask(mask, data):
+    n = len(data)
+    if not n:
+        return data
+    # XOR the whole payload at once as two big integers
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(data, "little") ^ int.from_bytes(key, "little")).to_bytes(n, "little")
+
+
+class GatewayConnection(Connection):
+    """A gateway client; replies are collected for HTTP or framed for WebSocket"""
+
+    supports_compression = False
+    supports_preview = False
+    supports_transfer = False
+
+    def __init__(self, conn_id, sock, addr):
+        super().__init__(conn_id, sock, addr)
+        self.loop = None
+        self.writer = None
+        # HTTP replies for the current request; None once upgraded to WebSocket
+        self.replies = []
+        # The server's OutboundWriter, whose watermarks, overflow policy and
+        # stall timeout apply to the transport's write buffer
+        self.limits = None
+        self._stall_check = None
+
+    def send(self, payload):
+        """Collect or queue newline-terminated frames; safe from any thread
+
+        Raises:
+            ConnectionError: If the connection is closed or the gateway stopped
+        """
+        self.bytes_out += len(payload)
+        if self.replies is not None:
+            self.replies.append(payload)
+            return
+        if self.closed:
+            raise ConnectionError("Connection is closed")
+        data = b"".join(encode_frame(OP_TEXT, frame) for frame in payload.split(b"\n") if frame)
+        try:
+            self.loop.call_soon_threadsafe(self._write, data)
+        except RuntimeError:
+            raise ConnectionError("Gateway is stopped")
+
+    def _write(self, data):
+        if self.closed or self.writer.transport.is_closing():
+            return
+        self.writer.write(data)
+        self.check_write_buffer()
+
+    def check_write_buffer(self):
+        """Treat the transport's write buffer as this connection's outbound queue
+
+        Above the high watermark the connection is blocked, so push updates
+        are held back and the WebSocket reader pauses. It is disconnected at
+        once under the "disconnect" policy, or once it has been blocked for
+        the stall timeout. Runs on the event loop.
+        """
+        limits = self.limits
+        if limits is None or self.closed:
+            return
+        self.pending_bytes = self.writer.transport.get_write_buffer_size()
+        if self.stalled_since is None:
+            if self.pending_bytes <= limits.high_watermark:
+                return
+            self.stalled_since = time.monotonic()
+            if limits.metrics:
+                limits.metrics.increment("write_backpressure_total")
+            if limits.overflow == outbound.DISCONNECT:
+                limits.disconnect(self, "write buffer overflow")
+                return
+        elif self.pending_bytes <= limits.low_watermark:
+            self.stalled_since = None
+            return
+        elif time.monotonic() - self.stalled_since > limits.stall_timeout:
+            limits.disconnect(self, "stalled")
+            return
+        # Keep looking while blocked; the hub stops sending, so no write would
+        if self._stall_check is None:
+            self._stall_check = self.loop.call_later(STALL_CHECK_INTERVAL, self._recheck_write_buffer)
+
+    def _recheck_write_buffer(self):
+        self._stall_check = None
+        self.check_write_buffer()
+
+    def close(self):
+        """Close the transport from the event loop"""
+        self.closed = True
+        try:
+            self.loop.call_soon_threadsafe(self._close)
+        except (AttributeError, RuntimeError):
+            pass
+
+    def _close(self):
+        if self._stall_check is not None:
+            self._stall_check.cancel()
+            self._stall_check = None
+        if self.stalled_since is not None:
+            # A stalled transport would keep the socket open until it flushed
+            self.writer.transport.abort()
+        else:
+            self.writer.close()
+
+
+class Gateway:
+    """HTTP keep-alive and WebSocket endpoint dispatching into a WakeMateServer"""
+
+    def __init__(self, server, host="0.0.0.0", port=7778, allowed_origins=None,
+                 max_message=MAX_MESSAGE_BYTES):
+        """Initialize the gateway
+
+        Args:
+            server (WakeMateServer): Server whose commands are exposed
+            host (str, optional): Address to bind. Defaults to every interface.
+            port (int, optional): Port to listen on. Defaults to 7778.
+            allowed_origins (list, optional): Browser origins allowed to connect,
+                e.g. ["http://dashboard.local"], or ["*"] for any. Defaults to
+                none.
+            max_message (int, optional): Largest request body or WebSocket
+                message in bytes. Defaults to 1 MiB.
+        """
+        self.server = server
+        self.host = host
+        self.port = port
+        self.allowed_origins = set(allowed_origins or ())
+        self.max_message = max_message
+        # A listening socket to use instead of binding host:port (set by handoff)
+        self.sock = None
+        self.loop = None
+        self.thread = None
+        self._tcp = None
+        self._tasks = set()
+        self._executor = None
+        self._started = threading.Event()
+        self._error = None
+
+    def start(self):
+        """Start the event loop thread and begin listening
+
+        Raises:
+            OSError: If the port cannot be bound
+        """
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            DISPATCH_THREADS, thread_name_prefix="wakemate-gateway-cmd")
+        self._started.clear()
+        self._error = None
+        self.thread = threading.Thread(target=self._run, name="wakemate-gateway")
+        self.thread.daemon = True
+        self.thread.start()
+        self._started.wait(10)
+        if self._error is not None:
+            self._executor.shutdown(wait=False)
+            raise self._error
+
+    def stop(self):
+        """Close every gateway connection and stop the event loop"""
+        loop, self.loop = self.loop, None
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(loop.stop)
+        except RuntimeError:
+            pass
+        self.thread.join(5)
+        self.thread = None
+        self._executor.shutdown(wait=False)
+        logger.info("Gateway stopped")
+
+    def listening_socket(self):
+        """Return the socket the gateway accepts on, or None when stopped"""
+        if self._tcp is None or not self._tcp.sockets:
+            return None
+        return self._tcp.sockets[0]
+
+    def _run(self):
+        """Event loop thread"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            if self.sock is not None:
+                sock, self.sock = self.sock, None
+                server = asyncio.start_server(self._accept, sock=sock, limit=MAX_HEADER_BYTES)
+            else:
+                server = asyncio.start_server(self._accept, self.host, self.port, limit=MAX_HEADER_BYTES)
+            self._tcp = loop.run_until_complete(server)
+        except Exception as e:
+            logger.error(f"Failed to start gateway on {self.host}:{self.port}: {str(e)}")
+            self._error = e
+            loop.close()
+            self._started.set()
+            return
+
+        self.loop = loop
+        self.port = self._tcp.sockets[0].getsockname()[1]
+        logger.info(f"Gateway listening on http://{self.host}:{self.port} (WebSocket at /ws)")
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._tcp.close()
+            loop.run_until_complete(self._tcp.wait_closed())
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    def _accept(self, reader, writer):
+        task = asyncio.get_event_loop().create_task(self._serve(reader, writer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _serve(self, reader, writer):
+        """Serve one client connection until it closes"""
+        server = self.server
+        peer = writer.get_extra_info("peername")
+        family = socket.AF_INET6 if ":" in peer[0] else socket.AF_INET
+        addr = listener_utils.peer_address(family, peer, None)
+
+        conn = server.connections.add(writer.get_extra_info("socket"), addr, GatewayConnection)
+        if conn is None:
+            server.metrics.increment("connections_rejected_total")
+            logger.warning(f"Rejected gateway connection from {addr[0]}: connection limit reached")
+            self._respond(writer, 503, server.codec.frame({"status": "error", "message": "Server busy"}),
+                          keep_alive=False)
+            writer.close()
+            return
+
+        conn.loop = asyncio.get_event_loop()
+        conn.writer = writer
+        server.metrics.increment("connections_total")
+        server.metrics.increment("gateway_connections_total")
+        server._capture(capture_format.OPEN, conn, conn.label.encode("utf-8"))
+        logger.info(f"New gateway connection from {addr[0]}")
+        server._publish_status()
+        try:
+            await self._serve_http(reader, writer, conn)
+        except asyncio.TimeoutError:
+            logger.info(f"Closing idle gateway connection {conn.label}")
+            server.metrics.increment("connections_idle_closed_total")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error handling gateway client {conn.label}: {str(e)}")
+        finally:
+            server.subscriptions.unsubscribe(conn.id)
+            server.connections.remove(conn.id)
+            server._release_buttons(conn)
+            writer.close()
+            server._capture(capture_format.CLOSE, conn)
+            logger.info(f"Gateway connection closed with {conn.label}")
+            server._publish_status()
+
+    def _read(self, coro):
+        return asyncio.wait_for(coro, self.server.idle_timeout)
+
+    async def _serve_http(self, reader, writer, conn):
+        """Read requests off a keep-alive connection"""
+        while True:
+            try:
+                head = await self._read(reader.readuntil(b"\r\n\r\n"))
+            except asyncio.IncompleteReadError as e:
+                if e.partial.strip():
+                    self._respond(writer, 400, keep_alive=False)
+                return
+            except asyncio.LimitOverrunError:
+                self._respond(writer, 431, keep_alive=False)
+                return
+
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ")
+            except ValueError:
+                self._respond(writer, 400, keep_alive=False)
+                return
+            headers = {}
+            for line in lines[1:]:
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+            tokens = set(t.strip().lower() for t in headers.get("connection", "").split(","))
+            if version == "HTTP/1.1":
+                keep_alive = "close" not in tokens
+            else:
+                keep_alive = "keep-alive" in tokens
+
+            cors = ()
+            origin = headers.get("origin")
+            if origin is not None:
+                if origin not in self.allowed_origins and "*" not in self.allowed_origins:
+                    logger.warning(f"Refused gateway request from origin {origin}")
+                    self._respond(writer, 403, keep_alive=False)
+                    return
+                cors = (("Access-Control-Allow-Origin", origin), ("Vary", "Origin"))
+
+            path = target.split("?")[0]
+            if path == "/ws":
+                if method != "GET" or headers.get("upgrade", "").lower() != "websocket":
+                    self._respond(writer, 400, keep_alive=False)
+                    return
+                await self._serve_websocket(reader, writer, conn, headers, tokens)
+                return
+
+            body = b""
+            if "transfer-encoding" in headers:
+                self._respond(writer, 411, keep_alive=False)
+                return
+            try:
+                length = int(headers.get("content-length", 0))
+            except ValueError:
+                length = -1
+            if not 0 <= length <= self.max_message:
+                self._respond(writer, 413 if length > 0 else 400, keep_alive=False)
+                return
+            if length:
+                body = await self._read(reader.readexactly(length))
+            conn.touch(len(head) + length)
+
+            if method == "OPTIONS" and cors:
+                status, payload = 204, b""
+                cors += (("Access-Control-Allow-Methods", "GET, POST"),
+                         ("Access-Control-Allow-Headers", "Content-Type"),
+                         ("Access-Control-Max-Age", "600"))
+                extra = cors
+            else:
+                status, payload, extra = await self._handle_request(method, path, body, conn)
+                extra = cors + extra
+            self._respond(writer, status, payload, keep_alive, extra)
+            await writer.drain()
+            if not keep_alive:
+                return
+
+    async def _handle_request(self, method, path, body, conn):
+        """Run one REST request
+
+        Returns:
+            tuple: (HTTP status, body bytes, extra headers)
+        """
+        codec = self.server.codec
+        if path == "/commands":
+            if method != "GET":
+                return 405, b"", (("Allow", "GET"),)
+            data = b'{"command":"list_commands"}'
+        elif path == "/command" or path.startswith("/commands/"):
+            if method != "POST":
+                return 405, b"", (("Allow", "POST"),)
+            try:
+                decoded = codec.loads(body) if body else None
+            except DECODE_ERRORS:
+                return 400, codec.frame({"status": "error", "code": "invalid_json",
+                                         "message": "Invalid JSON body"}), ()
+            if path == "/command":
+                if not isinstance(decoded, dict):
+                    return 400, codec.frame({"status": "error", "code": "invalid_json",
+                                             "message": "Body must be a command object"}), ()
+                name = decoded.get("command")
+                data = body
+            else:
+                name = unquote(path[len("/commands/"):])
+                data = codec.dumps({"command": name, "params": decoded})
+            if name in STREAMING_COMMANDS:
+                return 400, codec.frame({"status": "error", "code": "invalid_params",
+                                         "message": f"Use the WebSocket endpoint for {name}"}), ()
+        else:
+            return 404, b"", ()
+
+        self.server.metrics.increment("gateway_requests_total")
+        conn.replies = []
+        result = await asyncio.get_event_loop().run_in_executor(
+            self._executor, self.server._process_command, data, conn)
+        replies, conn.replies = conn.replies, []
+        if result is None or not replies:
+            return 204, b"", ()
+        extra = ()
+        status = 200
+        if result.get("status") == "error":
+            code = result.get("code")
+            status = ERROR_STATUS.get(code, 500) if code else 400
+            if "retry_after" in result:
+                extra = (("Retry-After", str(int(math.ceil(result["retry_after"])))),)
+        return status, replies[0], extra
+
+    def _respond(self, writer, status, body=b"", keep_alive=True, headers=()):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Length: {len(body)}"]
+        if body:
+            lines.append("Content-Type: application/json")
+        if not keep_alive:
+            lines.append("Connection: close")
+        lines.extend(f"{name}: {value}" for name, value in headers)
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def _serve_websocket(self, reader, writer, conn, headers, tokens):
+        """Complete the upgrade and run commands from WebSocket messages"""
+        key = headers.get("sec-websocket-key")
+        if not key or "upgrade" not in tokens or headers.get("sec-websocket-version") != "13":
+            self._respond(writer, 400, keep_alive=False, headers=(("Sec-WebSocket-Version", "13"),))
+            return
+
+        conn.replies = None
+        conn.limits = self.server.outbound
+        writer.transport.set_write_buffer_limits(conn.limits.high_watermark, conn.limits.low_watermark)
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n"
+        ).encode("ascii"))
+        self.server.metrics.increment("gateway_websocket_upgrades_total")
+        logger.info(f"WebSocket session opened by {conn.label}")
+        if self.server.on_notification:
+            self.server.on_notification("New Connection", f"Device at {conn.addr[0]} connected")
+
+        loop = asyncio.get_event_loop()
+        parts = []
+        size = 0
+        while True:
+            if conn.stalled_since is not None and not await self._wait_unblocked(writer, conn):
+                return
+            # The whole frame shares one deadline, so a client cannot stall
+            # a reader forever by trickling in a header
+            try:
+                fin, opcode, payload = await self._read(read_frame(reader, self.max_message - size))
+            except FrameError as e:
+                logger.warning(f"Closing WebSocket of {conn.label}: {str(e)}")
+                self._close_websocket(writer, e.close_code)
+                return
+            n = len(payload)
+            conn.touch(n)
+
+            if opcode == OP_CLOSE:
+                writer.write(encode_frame(OP_CLOSE, payload[:2]))
+                return
+            if opcode == OP_PING:
+                writer.write(encode_frame(OP_PONG, payload))
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode in (OP_TEXT, OP_BINARY) and not parts:
+                parts.append(payload)
+            elif opcode == OP_CONTINUATION and parts:
+                parts.append(payload)
+            else:
+                self._close_websocket(writer, CLOSE_PROTOCOL_ERROR)
+                return
+            size += n
+            if not fin:
+                continue
+
+            data = parts[0] if len(parts) == 1 else b"".join(parts)
+            parts = []
+            size = 0
+            await loop.run_in_executor(self._executor, self.server._process_command, data, conn)
+
+    async def _wait_unblocked(self, writer, conn):
+        """Stop reading commands while the client is not reading replies
+
+        Returns:
+            bool: False if the client was disconnected as a slow consumer
+        """
+        limits = conn.limits
+        remaining = limits.stall_timeout - (time.monotonic() - conn.stalled_since)
+        try:
+            # drain() returns once the buffer is below the low watermark
+            await asyncio.wait_for(writer.drain(), max(remaining, 0))
+        except asyncio.TimeoutError:
+            if not conn.closed:
+                limits.disconnect(conn, "stalled")
+            return False
+        conn.check_write_buffer()
+        return not conn.closed
+
+    def _close_websocket(self, writer, code):
+        writer.write(encode_frame(OP_CLOSE, struct.pack("!H", code)))
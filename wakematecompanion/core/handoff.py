@@ -0,0 +1,231 @@
+"""
+Listening-socket handoff between WakeMATECompanion servers (Unix)
+
+A server started with ``handoff_path`` listens for takeovers on that Unix
+socket. A second server started with the same path, in a new process after an
+upgrade or in the same process after a config change, connects to it before
+opening any listeners. The running server then:
+
+1. stops accepting and passes its listening sockets (and the gateway's) across,
+   so the port is never closed and new connections wait in the backlog
+2. lets each client's reader finish the command it is running, then waits for
+   queued executor jobs and input flushes to complete
+3. passes every plain TCP and Unix socket client across with its statistics,
+   subscriptions and pairing session, then stops
+
+The replacement adopts the sockets and carries on. Bytes a phone sent during
+the switch are still in the kernel buffer and are read by the new server, so
+no command is lost. TLS, compressed and gateway (HTTP/WebSocket) connections
+cannot be moved between processes; they are closed and the clients reconnect.
+
+File descriptors travel over the control socket with SCM_RIGHTS, via
+multiprocessing's send_handle/recv_handle. The socket is set to mode 0600
+as soon as it exists, and both sides authenticate with a key derived from the
+pairing key.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import socket
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from multiprocessing.reduction import recv_handle, send_handle
+
+from .auth import default_config_dir, load_or_create_pairing_key
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Seconds a takeover waits for the running server to hand everything over
+TAKEOVER_TIMEOUT = 30.0
+
+# Seconds the old server waits for in-flight commands and queued jobs
+DRAIN_TIMEOUT = 10.0
+
+
+def handoff_supported():
+    """Descriptor passing needs Unix domain sockets"""
+    return os.name == "posix" and hasattr(socket, "AF_UNIX")
+
+
+def default_handoff_path():
+    """Return the control socket path in the config directory"""
+    return os.path.join(default_config_dir(), "handoff.sock")
+
+
+def _authkey():
+    return hmac.new(load_or_create_pairing_key(), b"wakematecompanion-handoff", hashlib.sha256).digest()
+
+
+class Takeover:
+    """Everything received from the server that was replaced"""
+
+    def __init__(self):
+        # (socket, family, bound address)
+        self.listeners = []
+        self.gateway_socket = None
+        # (socket, metadata dict)
+        self.connections = []
+        self.sessions = []
+
+
+class HandoffChannel:
+    """The old server's end of a takeover"""
+
+    def __init__(self, conn, pid):
+        self._conn = conn
+        self.pid = pid
+
+    def send_socket(self, kind, sock, *meta):
+        """Send a message followed by a duplicate of the socket's descriptor"""
+        self._conn.send((kind,) + meta)
+        send_handle(self._conn, sock.fileno(), self.pid)
+
+    def send(self, *message):
+        """Send a message without a descriptor"""
+        self._conn.send(message)
+
+    def close(self):
+        try:
+            self._conn.close()
+        except OSError:
+            pass
+
+
+class HandoffListener:
+    """Waits on the control socket and hands the server to whoever connects"""
+
+    def __init__(self, path, on_takeover):
+        """Create the control socket
+
+        Args:
+            path (str): Unix socket path; replaced if a stale one exists
+            on_takeover (function): Called as on_takeover(channel) on the
+                listener thread when an authenticated takeover arrives
+
+        Raises:
+            OSError: If the socket cannot be created
+        """
+        self.path = path
+        self.on_takeover = on_takeover
+        self._closing = False
+        os.makedirs(os.path.dirname(path) or ".", mode=0o700, exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._listener = Listener(path, family="AF_UNIX", authkey=_authkey())
+        # Listener binds and listens in one step, so the mode is fixed right
+        # after; until then the usual umask already keeps others from
+        # connecting, and every connection must know the key regardless
+        os.chmod(path, 0o600)
+        self.thread = threading.Thread(target=self._run, name="wakemate-handoff")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Accepting server handoffs on {self.path}")
+
+    def _run(self):
+        while not self._closing:
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                if not self._closing:
+                    logger.warning(f"Rejected handoff connection: {str(e)}")
+                continue
+            if self._closing:
+                conn.close()
+                return
+            try:
+                if not conn.poll(5):
+                    raise EOFError("no takeover request")
+                message = conn.recv()
+                if message[0] != "takeover":
+                    raise ValueError(f"unexpected message {message[0]!r}")
+            except (OSError, EOFError, ValueError, IndexError, TypeError) as e:
+                logger.warning(f"Invalid handoff request: {str(e)}")
+                conn.close()
+                continue
+            # One takeover per server: stop listening before handing over
+            self.close()
+            channel = HandoffChannel(conn, message[1])
+            try:
+                self.on_takeover(channel)
+            finally:
+                channel.close()
+            return
+
+    def close(self):
+        """Stop accepting takeovers and remove the control socket"""
+        if self._closing:
+            return
+        self._closing = True
+        # Wake the blocked accept(); the attempt fails authentication harmlessly
+        try:
+            waker = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            waker.settimeout(1.0)
+            waker.connect(self.path)
+            waker.close()
+        except OSError:
+            pass
+        try:
+            self._listener.close()
+        except OSError:
+            pass
+
+
+def take_over(path, timeout=TAKEOVER_TIMEOUT):
+    """Take the listening sockets and clients of the server at a control path
+
+    Args:
+        path (str): The running server's control socket
+        timeout (float, optional): Seconds to wait for each step
+
+    Returns:
+        Takeover: The received sockets, or None if no server is listening
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = Client(path, family="AF_UNIX", authkey=_authkey())
+    except (OSError, EOFError, AuthenticationError) as e:
+        logger.info(f"No server to take over at {path}: {str(e)}")
+        return None
+
+    result = Takeover()
+    try:
+        conn.send(("takeover", os.getpid()))
+        while True:
+            if not conn.poll(timeout):
+                raise TimeoutError("The running server did not finish handing over")
+            message = conn.recv()
+            kind = message[0]
+            if kind == "done":
+                break
+            if kind == "sessions":
+                result.sessions = message[1]
+                continue
+            fd = recv_handle(conn)
+            if kind == "listener":
+                family, bound = message[1], message[2]
+                sock = socket.socket(family, socket.SOCK_STREAM, 0, fd)
+                sock.setblocking(False)
+                result.listeners.append((sock, family, bound))
+            elif kind == "gateway":
+                result.gateway_socket = socket.socket(message[1], socket.SOCK_STREAM, 0, fd)
+            elif kind == "connection":
+                meta = message[1]
+                result.connections.append((socket.socket(meta["family"], socket.SOCK_STREAM, 0, fd), meta))
+            else:
+                os.close(fd)
+                logger.warning(f"Ignoring unknown handoff message {kind!r}")
+    except (OSError, EOFError) as e:
+        # Keep whatever arrived; anything missing is opened fresh
+        logger.error(f"Handoff from {path} failed: {str(e)}")
+    finally:
+        conn.close()
+
+    logger.info(f"Took over {len(result.listeners)} listeners and "
+                f"{len(result.connections)} connections from the previous server")
+    return result
@@ -0,0 +1,139 @@
+"""
+Idempotency keys for WakeMATECompanion
+
+Phones on flaky Wi-Fi retry power and wake commands over a fresh connection
+when a response goes missing. A client can tag such a command with an
+idempotency key; the first request runs it and later requests with the same
+key get the stored response instead of shutting the machine down twice.
+
+Claims that are still running and finished responses are kept apart. Running
+claims sit in a plain dict and never expire: dropping one would let a retry
+run the command a second time. Finished responses live in an insertion-ordered
+dict with a shared TTL, moved to the end when written, so both expiry and the
+size bound pop from the front in O(1). When every slot is taken by a running
+request, new keys are refused.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Longest idempotency key accepted, in characters
+MAX_KEY_LENGTH = 128
+
+
+class IdempotencyBusy(Exception):
+    """Raised when every slot holds a request that is still running"""
+
+
+class _Entry:
+    __slots__ = ("result", "expires", "done")
+
+    def __init__(self):
+        self.result = None
+        self.expires = None
+        self.done = threading.Event()
+
+
+class IdempotencyCache:
+    """Bounded, TTL-evicting store of responses keyed by idempotency key"""
+
+    def __init__(self, max_entries=1024, ttl=600.0, wait_timeout=30.0, metrics=None):
+        """Initialize the cache
+
+        Args:
+            max_entries (int, optional): Entries kept before the oldest is evicted
+            ttl (float, optional): Seconds a response is replayed for
+            wait_timeout (float, optional): Seconds a duplicate waits for the
+                original request to finish
+            metrics (ServerMetrics, optional): Registry for the size gauge
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._running = {}
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+        if metrics:
+            metrics.register_gauge("idempotency_cache_entries", self.__len__)
+
+    def __len__(self):
+        return len(self._running) + len(self._finished)
+
+    def begin(self, key):
+        """Look up a key, claiming it if it is new
+
+        A duplicate of a request that is still running waits for it to finish.
+
+        Args:
+            key (hashable): The scoped idempotency key
+
+        Returns:
+            tuple: (cached response, ticket). A new key returns (None, ticket)
+                and the caller must pass the ticket to complete() or abandon().
+                A duplicate returns (response, None), or (None, None) if the
+                original is still running after wait_timeout.
+
+        Raises:
+            IdempotencyBusy: If the key is new and no finished entry can be
+                evicted to make room for it
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                self._expire(now)
+                entry = self._finished.get(key)
+                if entry is not None:
+                    return entry.result, None
+                entry = self._running.get(key)
+                if entry is None:
+                    if len(self) >= self.max_entries and not self._evict():
+                        raise IdempotencyBusy("Too many requests with idempotency keys are running")
+                    entry = self._running[key] = _Entry()
+                    return None, entry
+
+            if not entry.done.wait(max(deadline - now, 0)):
+                return None, None
+            if entry.result is not None:
+                return entry.result, None
+            # The original was abandoned; try to claim the key again
+
+    def complete(self, key, ticket, result):
+        """Store the response for a claimed key and release any duplicates"""
+        ticket.result = result
+        with self._lock:
+            if self._running.get(key) is ticket:
+                del self._running[key]
+                ticket.expires = time.monotonic() + self.ttl
+                self._finished[key] = ticket
+        ticket.done.set()
+
+    def abandon(self, key, ticket):
+        """Release a claimed key without storing a response, so a retry runs again"""
+        with self._lock:
+            if self._running.get(key) is ticket:
+                del self._running[key]
+        ticket.done.set()
+
+    def _evict(self):
+        """Drop the oldest finished entry
+
+        Returns:
+            bool: False if every entry is still running
+        """
+        # Caller holds self._lock
+        if not self._finished:
+            return False
+        self._finished.popitem(last=False)
+        return True
+
+    def _expire(self, now):
+        # Caller holds self._lock
+        finished = self._finished
+        while finished:
+            key, entry = next(iter(finished.items()))
+            if entry.expires > now:
+                break
+            del finished[key]
@@ -0,0 +1,169 @@
+"""
+Pointer input aggregation for WakeMATECompanion
+
+Trackpad moves and two-finger scrolls arrive from the phone as many tiny
+deltas. Instead of one backend call per event, handlers append to an ordered
+queue of pointer operations: a move or scroll that follows another of the same
+kind is merged into it, while clicks and button presses keep their place in
+the sequence. One flush job on the executor drains the queue, so every event
+that arrived while the backend was busy becomes a single call.
+
+Scrolling accepts fractional amounts for smooth high-resolution wheels; the
+remainder carries over to the next flush instead of being dropped. Backends
+with a ``fractional_scroll`` attribute receive the fractions directly, and
+backends with a ``batch()`` context manager get each flush as one batch.
+"""
+
+import logging
+import math
+import threading
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Largest pointer jump per step while dragging, in pixels
+DRAG_STEP_PX = 25
+
+_MOVE = "move"
+_SCROLL = "scroll"
+_BUTTON = "button"
+_CLICK = "click"
+
+
+class InputAggregator:
+    """Coalesces pointer events and applies them in order on the executor"""
+
+    def __init__(self, backend, submit, metrics=None):
+        """Initialize the aggregator
+
+        Args:
+            backend: Object or module providing move_mouse(dx, dy),
+                scroll_mouse(amount), hscroll_mouse(amount),
+                mouse_button(button, down) and click_mouse(button, clicks, interval)
+            submit (function): Called as submit(fn) to run a flush on the
+                thread that owns the input backend
+            metrics (ServerMetrics, optional): Registry for aggregation counters
+        """
+        self.backend = backend
+        self.submit = submit
+        self.metrics = metrics
+        self._ops = []
+        self._lock = threading.Lock()
+        self._flush_queued = False
+        self._scroll_carry = [0.0, 0.0]
+
+    def move(self, dx, dy):
+        """Queue a relative pointer move"""
+        self._add(_MOVE, dx, dy)
+
+    def scroll(self, vertical=0.0, horizontal=0.0):
+        """Queue a scroll; fractional amounts accumulate across flushes"""
+        self._add(_SCROLL, vertical, horizontal)
+
+    def button(self, button, down):
+        """Queue a button press or release"""
+        self._add(_BUTTON, button, down)
+
+    def click(self, button="left", clicks=1):
+        """Queue a click; clicks=2 is a double-click"""
+        self._add(_CLICK, button, clicks)
+
+    def drag(self, dx, dy, button="left"):
+        """Queue a whole drag gesture: press, move in steps, release"""
+        steps = max(1, int(math.ceil(max(abs(dx), abs(dy)) / DRAG_STEP_PX)))
+        with self._lock:
+            self._ops.append([_BUTTON, button, True])
+            done_x = done_y = 0
+            for i in range(1, steps + 1):
+                x, y = dx * i // steps, dy * i // steps
+                self._ops.append([_MOVE, x - done_x, y - done_y])
+                done_x, done_y = x, y
+            self._ops.append([_BUTTON, button, False])
+            schedule = self._claim_flush()
+        if schedule:
+            self._submit_flush()
+
+    def _add(self, kind, a, b):
+        with self._lock:
+            tail = self._ops[-1] if self._ops else None
+            if tail is not None and tail[0] == kind and kind in (_MOVE, _SCROLL):
+                tail[1] += a
+                tail[2] += b
+                if self.metrics:
+                    self.metrics.increment("input_events_coalesced_total", (kind,))
+            else:
+                self._ops.append([kind, a, b])
+            schedule = self._claim_flush()
+        if schedule:
+            self._submit_flush()
+
+    def _claim_flush(self):
+        # Caller holds self._lock; True if the caller must submit a flush
+        if self._flush_queued:
+            return False
+        self._flush_queued = True
+        return True
+
+    def _submit_flush(self):
+        # Outside the lock: submit() may run the flush inline
+        try:
+            self.submit(self.flush)
+        except Exception:
+            with self._lock:
+                self._flush_queued = False
+            raise
+
+    def flush(self):
+        """Apply every queued operation in order"""
+        with self._lock:
+            ops, self._ops = self._ops, []
+            self._flush_queued = False
+        if not ops:
+            return
+        if self.metrics:
+            self.metrics.increment("input_flushes_total")
+
+        batch = getattr(self.backend, "batch", None)
+        if batch is None:
+            self._apply(ops)
+            return
+        try:
+            with batch():
+                self._apply(ops)
+        except Exception as e:
+            logger.error(f"Failed to write input batch: {str(e)}")
+
+    def _apply(self, ops):
+        backend = self.backend
+        for kind, a, b in ops:
+            try:
+                if kind == _MOVE:
+                    if a or b:
+                        backend.move_mouse(a, b)
+                elif kind == _SCROLL:
+                    self._apply_scroll(a, b)
+                elif kind == _BUTTON:
+                    backend.mouse_button(a, b)
+                else:
+                    backend.click_mouse(a, b, 0.0)
+            except Exception as e:
+                logger.error(f"Failed to apply {kind} input: {str(e)}")
+
+    def _apply_scroll(self, vertical, horizontal):
+        if getattr(self.backend, "fractional_scroll", False):
+            if vertical:
+                self.backend.scroll_mouse(vertical)
+            if horizontal:
+                self.backend.hscroll_mouse(horizontal)
+            return
+        carry = self._scroll_carry
+        carry[0] += vertical
+        carry[1] += horizontal
+        # Emit whole wheel clicks and keep the fraction for next time
+        whole_v = int(carry[0])
+        whole_h = int(carry[1])
+        carry[0] -= whole_v
+        carry[1] -= whole_h
+        if whole_v:
+            self.backend.scroll_mouse(whole_v)
+        if whole_h:
+            self.backend.hscroll_mouse(whole_h)
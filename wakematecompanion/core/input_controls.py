@@ -22,23 +22,27 @@ def move_mouse(dx, dy):
         # Calculate new position
         new_x = current_x + int(dx)
         new_y = current_y + int(dy)
-        # Move to new position
-        pyautogui.moveTo(new_x, new_y)
+        # Move to new position. pyautogui sleeps for pyautogui.PAUSE after
+        # every call unless told not to; input arrives paced by the phone,
+        # so this and the calls below skip that sleep
+        pyautogui.moveTo(new_x, new_y, _pause=False)
         logger.info(f"Mouse moved by ({dx}, {dy})")
     except Exception as e:
         logger.error(f"Failed to move mouse: {str(e)}")
         raise
 
-def click_mouse(button="left"):
+def click_mouse(button="left", clicks=1, interval=0.0):
     """Click the mouse
     
     Args:
         button (str): Which button to click ("left", "right", or "middle")
+        clicks (int): Number of clicks, e.g. 2 for a double-click
+        interval (float): Seconds between clicks
     """
     try:
         import pyautogui
-        pyautogui.click(button=button)
-        logger.info(f"Mouse {button} click")
+        pyautogui.click(button=button, clicks=clicks, interval=interval, _pause=False)
+        logger.info(f"Mouse {button} click x{clicks}")
     except Exception as e:
         logger.error(f"Failed to click mouse: {str(e)}")
         raise
@@ -51,12 +55,44 @@ def scroll_mouse(amount):
     """
     try:
         import pyautogui
-        pyautogui.scroll(int(amount))
+        pyautogui.scroll(int(amount), _pause=False)
         logger.info(f"Mouse scrolled by {amount}")
     except Exception as e:
         logger.error(f"Failed to scroll mouse: {str(e)}")
         raise
 
+def hscroll_mouse(amount):
+    """Scroll the mouse wheel horizontally
+    
+    Args:
+        amount (int): Scroll amount (positive for right, negative for left)
+    """
+    try:
+        import pyautogui
+        pyautogui.hscroll(int(amount), _pause=False)
+        logger.info(f"Mouse scrolled horizontally by {amount}")
+    except Exception as e:
+        logger.error(f"Failed to scroll mouse horizontally: {str(e)}")
+        raise
+
+def mouse_button(button="left", down=True):
+    """Press or release a mouse button, e.g. to start or end a drag
+    
+    Args:
+        button (str): Which button ("left", "right", or "middle")
+        down (bool): True to press, False to release
+    """
+    try:
+        import pyautogui
+        if down:
+            pyautogui.mouseDown(button=button, _pause=False)
+        else:
+            pyautogui.mouseUp(button=button, _pause=False)
+        logger.info(f"Mouse {button} {'down' if down else 'up'}")
+    except Exception as e:
+        logger.error(f"Failed to {'press' if down else 'release'} mouse button: {str(e)}")
+        raise
+
 def type_text(text):
     """Type text
     
@@ -65,7 +101,7 @@ def type_text(text):
     """
     try:
         import pyautogui
-        pyautogui.write(text)
+        pyautogui.write(text, _pause=False)
         logger.info(f"Typed text: {text[:10]}{'...' if len(text) > 10 else ''}")
     except Exception as e:
         logger.error(f"Failed to type text: {str(e)}")
@@ -79,7 +115,7 @@ def press_key(key):
     """
     try:
         import pyautogui
-        pyautogui.press(key)
+        pyautogui.press(key, _pause=False)
         logger.info(f"Special key {key} pressed")
     except Exception as e:
         logger.error(f"Failed to press special key: {str(e)}")
@@ -0,0 +1,183 @@
+"""
+Listening sockets for WakeMATECompanion
+
+The server can listen on several addresses at once: IPv4, IPv6 (dual-stack
+when bound to "::") and, on POSIX, a Unix domain socket for automation on the
+same machine. Listener specs are either (host, port) tuples or strings:
+
+    "0.0.0.0:7777"      IPv4
+    "[::]:7777"         IPv6, also accepting IPv4 where the OS allows it
+    "unix:/path/sock"   Unix domain socket
+"""
+
+import logging
+import os
+import socket
+import stat
+
+from .auth import default_config_dir
+
+logger = logging.getLogger("WakeMATECompanion")
+
+UNIX_AVAILABLE = hasattr(socket, "AF_UNIX")
+
+# Pending connections queued by the kernel per listener
+LISTEN_BACKLOG = 128
+
+
+def default_unix_path():
+    """Return the default Unix socket path"""
+    return os.path.join(default_config_dir(), "wakemate.sock")
+
+
+def default_listeners(host, port=7777, unix_path=None):
+    """Listen on the LAN address, plus a Unix socket where supported
+
+    Other interfaces (VPNs, public addresses) are left alone; pass listener
+    specs such as "[::]:7777" explicitly to serve them.
+
+    Args:
+        host (str): Address phones connect to, usually the LAN IP
+        port (int, optional): TCP port. Defaults to 7777.
+        unix_path (str, optional): Unix socket path. Defaults to
+            ~/.wakematecompanion/wakemate.sock.
+
+    Returns:
+        list: Listener specs
+    """
+    listeners = [(host, port)]
+    if UNIX_AVAILABLE and os.name == "posix":
+        listeners.append("unix:" + (unix_path or default_unix_path()))
+    return listeners
+
+
+def parse_listener(spec):
+    """Turn a listener spec into (family, address)
+
+    Raises:
+        ValueError: If the spec cannot be parsed
+    """
+    if isinstance(spec, str):
+        if spec.startswith("unix:"):
+            if not UNIX_AVAILABLE:
+                raise ValueError("Unix domain sockets are not supported on this platform")
+            return socket.AF_UNIX, spec[5:]
+        host, sep, port = spec.rpartition(":")
+        if not sep:
+            raise ValueError(f"Listener '{spec}' needs a port")
+        spec = (host.strip("[]"), int(port))
+    host, port = spec
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return family, (host, int(port))
+
+
+def format_address(family, address):
+    """Format a bound address for logs and status output"""
+    if family == getattr(socket, "AF_UNIX", None):
+        return f"unix:{address}"
+    if family == socket.AF_INET6:
+        return f"[{address[0]}]:{address[1]}"
+    return f"{address[0]}:{address[1]}"
+
+
+def same_address(family, address, bound_family, bound):
+    """Check whether a bound listener satisfies a listener spec
+
+    Specs asking for an ephemeral port (0) never match, so they get a new one.
+    """
+    if family != bound_family:
+        return False
+    if family == getattr(socket, "AF_UNIX", None):
+        return os.path.abspath(address) == os.path.abspath(bound)
+    return address[0] == bound[0] and address[1] == bound[1]
+
+
+def covers(family, address, bound_family, bound):
+    """Check whether a bound listener serves a spec, ephemeral ports included"""
+    if same_address(family, address, bound_family, bound):
+        return True
+    return (family == bound_family and family != getattr(socket, "AF_UNIX", None)
+            and address[1] == 0 and address[0] == bound[0])
+
+
+def open_listener(family, address, reuse_port=False):
+    """Create, bind and listen on a non-blocking socket
+
+    Args:
+        family (int): Address family
+        address: (host, port) or a Unix socket path
+        reuse_port (bool, optional): Set SO_REUSEPORT so several processes can
+            share a TCP port, with the kernel spreading connections across them
+
+    Returns:
+        tuple: (socket, bound address)
+    """
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if family == getattr(socket, "AF_UNIX", None):
+            _remove_stale_unix_socket(address)
+            os.makedirs(os.path.dirname(address) or ".", mode=0o700, exist_ok=True)
+            sock.bind(address)
+            # Same-user automation only. Nobody can connect before listen(),
+            # so restricting the file here leaves no window open to others.
+            os.chmod(address, 0o600)
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if family == socket.AF_INET6:
+                # "::" serves IPv4 too; specific IPv6 addresses stay IPv6-only
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0 if address[0] == "::" else 1)
+            sock.bind(address)
+        sock.listen(LISTEN_BACKLOG)
+        sock.setblocking(False)
+        return sock, sock.getsockname()
+    except Exception:
+        sock.close()
+        raise
+
+
+def close_listener(sock, family, address):
+    """Close a listener, removing its socket file if it has one"""
+    try:
+        sock.close()
+    except OSError:
+        pass
+    if family == getattr(socket, "AF_UNIX", None):
+        try:
+            os.unlink(address)
+        except OSError:
+            pass
+
+
+def _remove_stale_unix_socket(path):
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"{path} exists and is not a socket")
+    # A socket nobody answers on is left over from a previous run
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"Another server is listening on {path}")
+
+
+def peer_address(family, addr, listen_address):
+    """Normalize an accepted peer address to a (host, port) tuple
+
+    IPv4 clients of a dual-stack listener are reported by their IPv4 address
+    so rate limits and logs treat them the same on every listener.
+    """
+    if family == getattr(socket, "AF_UNIX", None):
+        return ("unix", listen_address)
+    host = addr[0]
+    if host.startswith("::ffff:") and "." in host:
+        host = host[7:]
+    return (host, addr[1])
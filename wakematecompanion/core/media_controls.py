@@ -5,6 +5,7 @@ Media control utilities for WakeMATECompanion
 import platform
 import logging
 import subprocess
+import re
 
 logger = logging.getLogger("WakeMATECompanion")
 
@@ -133,4 +134,73 @@ class MediaControls:
             logger.info("Volume mute command sent")
         except Exception as e:
             logger.error(f"Failed to execute volume mute: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+def get_volume_state():
+    """Read the current output volume
+    
+    Returns:
+        dict: {"level": int or None, "muted": bool or None}
+    """
+    system = platform.system()
+    level = None
+    muted = None
+    
+    try:
+        if system == "Darwin":  # macOS
+            output = subprocess.check_output(
+                ['osascript', '-e', 'get volume settings'], timeout=2
+            ).decode('utf-8')
+            match = re.search(r'output volume:(\d+)', output)
+            if match:
+                level = int(match.group(1))
+            muted = "output muted:true" in output
+        elif system == "Linux":
+            output = subprocess.check_output(
+                ['amixer', '-D', 'pulse', 'sget', 'Master'], timeout=2
+            ).decode('utf-8')
+            match = re.search(r'\[(\d+)%\]\s*(?:\[[^\]]*\]\s*)?\[(on|off)\]', output)
+            if match:
+                level = int(match.group(1))
+                muted = match.group(2) == "off"
+    except Exception as e:
+        logger.warning(f"Failed to read volume: {str(e)}")
+    
+    return {"level": level, "muted": muted}
+
+def get_now_playing():
+    """Read the currently playing track
+    
+    Returns:
+        dict: {"title": str or None, "artist": str or None}
+    """
+    system = platform.system()
+    title = None
+    artist = None
+    
+    try:
+        if system == "Darwin":  # macOS
+            script = """
+            if application "Spotify" is running then
+                tell application "Spotify" to return (name of current track) & "\n" & (artist of current track)
+            else if application "Music" is running then
+                tell application "Music" to return (name of current track) & "\n" & (artist of current track)
+            end if
+            """
+            output = subprocess.check_output(['osascript', '-e', script], timeout=2).decode('utf-8')
+            lines = output.strip().split("\n")
+            if lines and lines[0]:
+                title = lines[0]
+                artist = lines[1] if len(lines) > 1 else None
+        elif system == "Linux":
+            output = subprocess.check_output(
+                ['playerctl', 'metadata', '--format', '{{title}}\n{{artist}}'], timeout=2
+            ).decode('utf-8')
+            lines = output.strip().split("\n")
+            if lines and lines[0]:
+                title = lines[0]
+                artist = lines[1] if len(lines) > 1 else None
+    except Exception as e:
+        logger.warning(f"Failed to read now playing: {str(e)}")
+    
+    return {"title": title, "artist": artist}
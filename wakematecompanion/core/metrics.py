@@ -0,0 +1,416 @@
+"""
+Server metrics for WakeMATECompanion
+
+Counters and latency histograms are striped across a small, fixed number of
+shards keyed by thread id, so the per-command hot path only ever contends with
+threads that happen to hash to the same shard. Snapshots merge the shards.
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Latency bucket upper bounds in milliseconds
+DEFAULT_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Request phases recorded for every command
+PHASES = ("parse", "execute", "send")
+
+_SHARD_COUNT = 8
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (not thread-safe on its own)"""
+
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds=DEFAULT_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value_ms):
+        """Record a single observation in milliseconds"""
+        self.counts[bisect.bisect_left(self.bounds, value_ms)] += 1
+        self.total += value_ms
+        self.count += 1
+
+    def merge(self, other):
+        """Add the observations of another histogram into this one"""
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.total += other.total
+        self.count += other.count
+
+    def quantile(self, q):
+        """Estimate a quantile from the bucket counts
+
+        Args:
+            q (float): Quantile between 0 and 1
+
+        Returns:
+            float: Upper bound of the bucket containing the quantile, or None if empty
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def to_dict(self):
+        """Return a JSON-friendly representation"""
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total, 3),
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "buckets": {
+                (str(b) if i < len(self.bounds) else "+Inf"): c
+                for i, (b, c) in enumerate(zip(list(self.bounds) + [None], self.counts))
+            },
+        }
+
+
+class _Shard:
+    """One stripe of counters and histograms, guarded by its own lock"""
+
+    __slots__ = ("lock", "counters", "histograms")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+
+class ServerMetrics:
+    """Low-contention metrics registry for the command server"""
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        """Initialize the registry
+
+        Args:
+            buckets_ms (tuple, optional): Histogram bucket bounds in milliseconds
+        """
+        self.buckets_ms = tuple(buckets_ms)
+        self.started_at = time.time()
+        self._shards = [_Shard() for _ in range(_SHARD_COUNT)]
+        self._gauges = {}
+        self._gauges_lock = threading.Lock()
+
+    def _shard(self):
+        return self._shards[threading.get_ident() % _SHARD_COUNT]
+
+    def increment(self, name, labels=None, value=1):
+        """Increment a counter
+
+        Args:
+            name (str): Counter name
+            labels (tuple, optional): Label values, e.g. ("mouse_move",)
+            value (int, optional): Amount to add. Defaults to 1.
+        """
+        shard = self._shard()
+        key = (name, labels)
+        with shard.lock:
+            shard.counters[key] = shard.counters.get(key, 0) + value
+
+    def observe(self, name, value_ms, labels=None):
+        """Record a latency observation
+
+        Args:
+            name (str): Histogram name
+            value_ms (float): Observed latency in milliseconds
+            labels (tuple, optional): Label values
+        """
+        shard = self._shard()
+        key = (name, labels)
+        with shard.lock:
+            hist = shard.histograms.get(key)
+            if hist is None:
+                hist = shard.histograms[key] = Histogram(self.buckets_ms)
+            hist.observe(value_ms)
+
+    def register_gauge(self, name, callback):
+        """Register a gauge whose value is read on demand
+
+        Args:
+            name (str): Gauge name
+            callback (function): Returns the current numeric value
+        """
+        with self._gauges_lock:
+            self._gauges[name] = callback
+
+    def unregister_gauge(self, name):
+        """Remove a previously registered gauge"""
+        with self._gauges_lock:
+            self._gauges.pop(name, None)
+
+    def record_command(self, cmd_type, phase_ms, error=False):
+        """Record the outcome of one dispatched command
+
+        Args:
+            cmd_type (str): The command name
+            phase_ms (dict): Mapping of phase name to elapsed milliseconds
+            error (bool, optional): Whether the command failed. Defaults to False.
+        """
+        labels = (cmd_type,)
+        shard = self._shard()
+        with shard.lock:
+            counters = shard.counters
+            key = ("commands_total", labels)
+            counters[key] = counters.get(key, 0) + 1
+            if error:
+                key = ("command_errors_total", labels)
+                counters[key] = counters.get(key, 0) + 1
+            for phase, elapsed in phase_ms.items():
+                hkey = ("command_latency_ms", (cmd_type, phase))
+                hist = shard.histograms.get(hkey)
+                if hist is None:
+                    hist = shard.histograms[hkey] = Histogram(self.buckets_ms)
+                hist.observe(elapsed)
+
+    def _merged(self):
+        counters = {}
+        histograms = {}
+        for shard in self._shards:
+            with shard.lock:
+                for key, value in shard.counters.items():
+                    counters[key] = counters.get(key, 0) + value
+                for key, hist in shard.histograms.items():
+                    merged = histograms.get(key)
+                    if merged is None:
+                        merged = histograms[key] = Histogram(self.buckets_ms)
+                    merged.merge(hist)
+        return counters, histograms
+
+    def _read_gauges(self):
+        with self._gauges_lock:
+            gauges = list(self._gauges.items())
+        values = {}
+        for name, callback in gauges:
+            try:
+                values[name] = callback()
+            except Exception as e:
+                logger.warning(f"Failed to read gauge {name}: {str(e)}")
+        return values
+
+    def snapshot(self):
+        """Return all metrics as a JSON-friendly dictionary"""
+        counters, histograms = self._merged()
+
+        commands = {}
+        for (name, labels), value in counters.items():
+            if name in ("commands_total", "command_errors_total") and labels:
+                entry = commands.setdefault(labels[0], {"count": 0, "errors": 0, "latency_ms": {}})
+                entry["count" if name == "commands_total" else "errors"] = value
+        for (name, labels), hist in histograms.items():
+            if name == "command_latency_ms" and labels:
+                entry = commands.setdefault(labels[0], {"count": 0, "errors": 0, "latency_ms": {}})
+                entry["latency_ms"][labels[1]] = hist.to_dict()
+
+        other_counters = {
+            _flat_name(name, labels): value
+            for (name, labels), value in counters.items()
+            if name not in ("commands_total", "command_errors_total")
+        }
+        other_histograms = {
+            _flat_name(name, labels): hist.to_dict()
+            for (name, labels), hist in histograms.items()
+            if name != "command_latency_ms"
+        }
+
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "commands": commands,
+            "counters": other_counters,
+            "histograms": other_histograms,
+            "gauges": self._read_gauges(),
+        }
+
+    def export(self):
+        """Return raw counters, histograms and gauge values for merging elsewhere
+
+        Returns:
+            dict: Picklable data accepted by MergedMetrics.update()
+        """
+        counters, histograms = self._merged()
+        return {
+            "counters": counters,
+            "histograms": {key: (h.counts, h.total, h.count) for key, h in histograms.items()},
+            "gauges": self._read_gauges(),
+        }
+
+    def render_prometheus(self, prefix="wakemate"):
+        """Render all metrics in the Prometheus text exposition format"""
+        counters, histograms = self._merged()
+        lines = []
+
+        for name in sorted({n for n, _ in counters}):
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for (n, labels), value in sorted(counters.items(), key=lambda kv: str(kv[0])):
+                if n == name:
+                    lines.append(f"{prefix}_{name}{_prom_labels(name, labels)} {value}")
+
+        for name in sorted({n for n, _ in histograms}):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for (n, labels), hist in sorted(histograms.items(), key=lambda kv: str(kv[0])):
+                if n != name:
+                    continue
+                base = _prom_label_pairs(name, labels)
+                cumulative = 0
+                for bound, count in zip(list(hist.bounds) + ["+Inf"], hist.counts):
+                    cumulative += count
+                    le = base + [f'le="{bound}"']
+                    lines.append(f"{prefix}_{name}_bucket{{{','.join(le)}}} {cumulative}")
+                suffix = f"{{{','.join(base)}}}" if base else ""
+                lines.append(f"{prefix}_{name}_sum{suffix} {hist.total}")
+                lines.append(f"{prefix}_{name}_count{suffix} {hist.count}")
+
+        for name, value in sorted(self._read_gauges().items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+class MergedMetrics(ServerMetrics):
+    """Registry that adds the exported metrics of other processes to its own
+
+    Used by the pre-fork supervisor: each worker periodically sends
+    ServerMetrics.export(), and snapshots and Prometheus output cover every
+    worker. Gauges from the workers are summed.
+    """
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        super().__init__(buckets_ms)
+        self._sources = {}
+        self._sources_lock = threading.Lock()
+
+    def update(self, source, exported):
+        """Replace the latest export from one source (e.g. a worker index)"""
+        with self._sources_lock:
+            self._sources[source] = exported
+
+    def _merged(self):
+        counters, histograms = super()._merged()
+        with self._sources_lock:
+            sources = list(self._sources.values())
+        for exported in sources:
+            for key, value in exported["counters"].items():
+                counters[key] = counters.get(key, 0) + value
+            for key, (counts, total, count) in exported["histograms"].items():
+                merged = histograms.get(key)
+                if merged is None:
+                    merged = histograms[key] = Histogram(self.buckets_ms)
+                remote = Histogram(self.buckets_ms)
+                remote.counts, remote.total, remote.count = list(counts), total, count
+                merged.merge(remote)
+        return counters, histograms
+
+    def _read_gauges(self):
+        values = super()._read_gauges()
+        with self._sources_lock:
+            sources = list(self._sources.values())
+        for exported in sources:
+            for name, value in exported["gauges"].items():
+                values[name] = values.get(name, 0) + value
+        return values
+
+
+# Label names for the known labelled metrics
+_LABEL_NAMES = {
+    "commands_total": ("command",),
+    "command_errors_total": ("command",),
+    "command_latency_ms": ("command", "phase"),
+}
+
+
+def _prom_label_pairs(name, labels):
+    if not labels:
+        return []
+    names = _LABEL_NAMES.get(name) or tuple(f"label{i}" for i in range(len(labels)))
+    return [f'{k}="{_prom_escape(v)}"' for k, v in zip(names, labels)]
+
+
+def _prom_labels(name, labels):
+    pairs = _prom_label_pairs(name, labels)
+    return f"{{{','.join(pairs)}}}" if pairs else ""
+
+
+def _prom_escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _flat_name(name, labels):
+    return f"{name}[{','.join(str(l) for l in labels)}]" if labels else name
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsHTTPServer:
+    """Optional local HTTP endpoint serving metrics in Prometheus text format"""
+
+    def __init__(self, metrics, host="127.0.0.1", port=9777):
+        """Initialize the endpoint
+
+        Args:
+            metrics (ServerMetrics): The registry to expose
+            host (str, optional): Address to bind. Defaults to loopback only.
+            port (int, optional): Port to listen on. Defaults to 9777.
+        """
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        """Start serving in a background thread"""
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] == "/metrics":
+                    body = metrics.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path.split("?")[0] == "/metrics.json":
+                    body = json.dumps(metrics.snapshot()).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Metrics endpoint: {format % args}")
+
+        self.httpd = _ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        """Stop serving"""
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+            logger.info("Metrics endpoint stopped")
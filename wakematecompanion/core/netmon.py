@@ -0,0 +1,358 @@
+"""
+Network change and resume monitoring for WakeMATECompanion
+
+After a laptop resumes or moves to another network its address often changes,
+and listeners bound to the old address stop working. The monitor waits on the
+operating system's own notifications instead of polling:
+
+- Linux: an rtnetlink socket subscribed to link and address changes
+- macOS/BSD: a PF_ROUTE routing socket
+
+Events arriving close together are merged, so one DHCP renewal leads to one
+callback. A resume is recognised when the boot clock has moved further than
+the monotonic clock, which stops while the machine sleeps. That check runs on
+the first network event after wake-up, so it needs no timer either.
+
+Sources are pluggable: anything with fileno(), read() and close() works.
+FakeSource lets tests and benchmarks inject events by hand.
+"""
+
+import collections
+import errno
+import logging
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Event kinds
+ADDRESS_ADDED = "address_added"
+ADDRESS_REMOVED = "address_removed"
+LINK_UP = "link_up"
+LINK_DOWN = "link_down"
+RESUME = "resume"
+# Notifications were lost (the kernel's queue overflowed); rescan everything
+OVERFLOW = "overflow"
+
+# Seconds to keep collecting events after the first one of a burst
+DEFAULT_SETTLE = 0.01
+
+# Seconds the boot clock must run ahead of the monotonic clock to count as a sleep
+RESUME_GAP = 2.0
+
+# rtnetlink constants (linux/rtnetlink.h)
+_RTMGRP_LINK = 0x1
+_RTMGRP_IPV4_IFADDR = 0x10
+_RTMGRP_IPV6_IFADDR = 0x100
+_RTM_NEWLINK = 16
+_RTM_DELLINK = 17
+_RTM_NEWADDR = 20
+_RTM_DELADDR = 21
+_IFA_ADDRESS = 1
+_IFA_LOCAL = 2
+_IFF_RUNNING = 0x40
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_IFADDRMSG = struct.Struct("=BBBBI")
+_IFINFOMSG = struct.Struct("=BxHiII")
+_RTATTR = struct.Struct("=HH")
+
+# PF_ROUTE message types (net/route.h)
+_BSD_RTM_NEWADDR = 0xc
+_BSD_RTM_DELADDR = 0xd
+_BSD_RTM_IFINFO = 0xe
+
+
+class NetworkEvent:
+    """One change reported by a source"""
+
+    __slots__ = ("kind", "address", "ifindex")
+
+    def __init__(self, kind, address=None, ifindex=None):
+        self.kind = kind
+        self.address = address
+        self.ifindex = ifindex
+
+    def __repr__(self):
+        return f"NetworkEvent({self.kind!r}, {self.address!r}, {self.ifindex!r})"
+
+
+class NetlinkSource:
+    """Linux rtnetlink link and address notifications"""
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self._sock.bind((0, _RTMGRP_LINK | _RTMGRP_IPV4_IFADDR | _RTMGRP_IPV6_IFADDR))
+        self._sock.setblocking(False)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def read(self):
+        """Return the events waiting on the socket
+
+        Raises:
+            OSError: If the socket fails for another reason than lost messages
+        """
+        events = []
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return events
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                # The receive queue overflowed and messages were dropped
+                events.append(NetworkEvent(OVERFLOW))
+                continue
+            events.extend(parse_netlink(data))
+
+    def close(self):
+        self._sock.close()
+
+
+def parse_netlink(data):
+    """Turn a buffer of rtnetlink messages into NetworkEvents"""
+    events = []
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type = _NLMSGHDR.unpack_from(data, offset)[:2]
+        # A datagram cut short by recv() ends with a partial message
+        if length < _NLMSGHDR.size or offset + length > len(data):
+            break
+        body = offset + _NLMSGHDR.size
+        end = offset + length
+        if msg_type in (_RTM_NEWADDR, _RTM_DELADDR) and end - body >= _IFADDRMSG.size:
+            family, _, _, _, index = _IFADDRMSG.unpack_from(data, body)
+            attrs = _parse_attrs(data, body + _IFADDRMSG.size, end)
+            raw = attrs.get(_IFA_LOCAL, attrs.get(_IFA_ADDRESS))
+            address = None
+            if raw is not None and family in (socket.AF_INET, socket.AF_INET6):
+                address = socket.inet_ntop(family, raw)
+            kind = ADDRESS_ADDED if msg_type == _RTM_NEWADDR else ADDRESS_REMOVED
+            events.append(NetworkEvent(kind, address, index))
+        elif msg_type in (_RTM_NEWLINK, _RTM_DELLINK) and end - body >= _IFINFOMSG.size:
+            _, _, index, flags, _ = _IFINFOMSG.unpack_from(data, body)
+            up = msg_type == _RTM_NEWLINK and flags & _IFF_RUNNING
+            events.append(NetworkEvent(LINK_UP if up else LINK_DOWN, None, index))
+        # Messages are padded to 4 bytes
+        offset += (length + 3) & ~3
+    return events
+
+
+def _parse_attrs(data, offset, end):
+    attrs = {}
+    while offset + _RTATTR.size <= end:
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + _RTATTR.size:offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+class RouteSocketSource:
+    """macOS/BSD routing socket notifications"""
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_ROUTE, socket.SOCK_RAW, 0)
+        self._sock.setblocking(False)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def read(self):
+        """Return the events waiting on the socket"""
+        events = []
+        while True:
+            try:
+                data = self._sock.recv(2048)
+            except (BlockingIOError, InterruptedError):
+                return events
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                events.append(NetworkEvent(OVERFLOW))
+                continue
+            # rt_msghdr starts with msglen:u16 version:u8 type:u8
+            if len(data) < 4:
+                continue
+            msg_type = data[3]
+            if msg_type == _BSD_RTM_NEWADDR:
+                events.append(NetworkEvent(ADDRESS_ADDED))
+            elif msg_type == _BSD_RTM_DELADDR:
+                events.append(NetworkEvent(ADDRESS_REMOVED))
+            elif msg_type == _BSD_RTM_IFINFO:
+                events.append(NetworkEvent(LINK_UP))
+
+    def close(self):
+        self._sock.close()
+
+
+class FakeSource:
+    """Event source driven by push(), for tests and benchmarks"""
+
+    def __init__(self):
+        self._events = collections.deque()
+        self._r, self._w = socket.socketpair()
+        self._r.setblocking(False)
+
+    def push(self, kind, address=None, ifindex=None):
+        """Deliver an event as if the operating system had reported it"""
+        self._events.append(NetworkEvent(kind, address, ifindex))
+        try:
+            self._w.send(b"\0")
+        except OSError:
+            pass
+
+    def fileno(self):
+        return self._r.fileno()
+
+    def read(self):
+        try:
+            while self._r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError, OSError):
+            pass
+        events = []
+        while self._events:
+            events.append(self._events.popleft())
+        return events
+
+    def close(self):
+        self._r.close()
+        self._w.close()
+
+
+def default_source():
+    """Create the platform's event source
+
+    Returns:
+        object: A source, or None if this platform has none
+    """
+    try:
+        if sys.platform.startswith("linux") and hasattr(socket, "AF_NETLINK"):
+            return NetlinkSource()
+        if hasattr(socket, "AF_ROUTE"):
+            return RouteSocketSource()
+    except OSError as e:
+        logger.warning(f"Network change notifications unavailable: {str(e)}")
+    return None
+
+
+def _boot_clock():
+    # CLOCK_BOOTTIME keeps counting during suspend; the monotonic clock does not
+    clock = getattr(time, "CLOCK_BOOTTIME", None)
+    if clock is None:
+        return time.time()
+    return time.clock_gettime(clock)
+
+
+class NetworkMonitor:
+    """Runs a callback when the network changes or the machine resumes"""
+
+    def __init__(self, callback, source, settle=DEFAULT_SETTLE):
+        """Initialize the monitor
+
+        Args:
+            callback (function): Called as callback(events, detected_at) on the
+                monitor thread, where detected_at is the time.monotonic() value
+                when the first event of the burst was read
+            source: Event source with fileno(), read() and close()
+            settle (float, optional): Seconds to merge events after the first.
+                Defaults to 0.01.
+        """
+        self.callback = callback
+        self.source = source
+        self.settle = settle
+        self._stop_r, self._stop_w = socket.socketpair()
+        self._stopping = False
+        self._failed = False
+        self._clocks = (time.monotonic(), _boot_clock())
+        self.thread = None
+
+    def start(self):
+        """Start the monitor thread"""
+        self.thread = threading.Thread(target=self._run, name="wakemate-netmon")
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f"Watching for network changes ({type(self.source).__name__})")
+
+    def stop(self):
+        """Stop the monitor thread and close the source"""
+        self._stopping = True
+        try:
+            self._stop_w.send(b"\0")
+        except OSError:
+            pass
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(2)
+        self.thread = None
+        self.source.close()
+        self._stop_r.close()
+        self._stop_w.close()
+
+    def _resumed(self):
+        """Check whether the machine slept since the last check"""
+        mono, boot = time.monotonic(), _boot_clock()
+        last_mono, last_boot = self._clocks
+        self._clocks = (mono, boot)
+        return (boot - last_boot) - (mono - last_mono) > RESUME_GAP
+
+    def _read(self):
+        """Read the source; a failure asks for a rescan and ends monitoring"""
+        try:
+            return self.source.read()
+        except OSError as e:
+            logger.error(f"Network change notifications failed: {str(e)}")
+            self._failed = True
+            return [NetworkEvent(OVERFLOW)]
+
+    def _run(self):
+        source = self.source
+        while not self._stopping and not self._failed:
+            try:
+                readable = select.select([source, self._stop_r], [], [])[0]
+            except (OSError, ValueError):
+                return
+            if self._stopping:
+                return
+            if source not in readable:
+                continue
+            detected_at = time.monotonic()
+            events = self._read()
+            # Merge the rest of the burst
+            deadline = detected_at + self.settle
+            while not self._failed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([source], [], [], remaining)[0]:
+                    break
+                events.extend(self._read())
+            if self._resumed() and not any(event.kind == RESUME for event in events):
+                events.insert(0, NetworkEvent(RESUME))
+            if not events:
+                continue
+            try:
+                self.callback(events, detected_at)
+            except Exception as e:
+                logger.error(f"Network change handler failed: {str(e)}")
+
+
+def address_assigned(family, host):
+    """Check whether this machine still has an address a listener is bound to
+
+    Wildcard and loopback addresses always count as assigned.
+    """
+    if host in ("", "0.0.0.0", "::", "127.0.0.1", "::1"):
+        return True
+    try:
+        with socket.socket(family, socket.SOCK_DGRAM) as probe:
+            probe.bind((host, 0))
+        return True
+    except OSError:
+        return False
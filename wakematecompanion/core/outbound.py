@@ -0,0 +1,361 @@
+"""
+Buffered, non-blocking writes to client connections for WakeMATECompanion
+
+Client sockets are non-blocking. A frame is written straight to the socket
+when nothing is queued ahead of it and the kernel buffer has room, which is
+almost always. Whatever does not fit goes into the connection's outbound
+queue, and a single writer thread flushes the queues of every connection
+whose socket becomes writable. Several queued frames are written with one
+sendmsg() call (writev); TLS sockets, which cannot scatter, get the frames
+joined instead. No thread ever blocks on a phone with a stalled link.
+
+Each queue has two watermarks:
+
+- above the high watermark the connection is "blocked": its reader stops
+  taking new commands until the queue drains below the low watermark, so the
+  TCP window pushes back on the phone, and push updates are held back
+- a connection that stays above the high watermark for ``stall_timeout``
+  seconds is disconnected as a slow consumer
+
+What happens to push updates for a blocked connection is set by the overflow
+policy:
+
+- "conflate" (default): updates wait in the subscription hub, where newer ones
+  replace older ones, so the oldest status updates are dropped and the client
+  receives a single snapshot per topic once it catches up
+- "disconnect": the connection is closed as soon as it passes the high
+  watermark
+"""
+
+import itertools
+import logging
+import selectors
+import socket
+import threading
+import time
+
+try:
+    import ssl
+    _SSLSocket = ssl.SSLSocket
+    WOULD_BLOCK = (BlockingIOError, InterruptedError, ssl.SSLWantReadError, ssl.SSLWantWriteError)
+except ImportError:
+    _SSLSocket = ()
+    WOULD_BLOCK = (BlockingIOError, InterruptedError)
+
+logger = logging.getLogger("WakeMATECompanion")
+
+CONFLATE = "conflate"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (CONFLATE, DISCONNECT)
+
+DEFAULT_HIGH_WATERMARK = 256 * 1024
+DEFAULT_LOW_WATERMARK = 64 * 1024
+DEFAULT_STALL_TIMEOUT = 10.0
+
+# Frames per sendmsg() call; IOV_MAX is 1024 on Linux and macOS
+MAX_IOVECS = 1024
+
+# Bytes joined per send() on sockets without sendmsg()
+MAX_JOIN_BYTES = 256 * 1024
+
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+
+class OutboundWriter:
+    """Per-connection outbound queues and the thread that flushes them"""
+
+    def __init__(self, high_watermark=DEFAULT_HIGH_WATERMARK, low_watermark=DEFAULT_LOW_WATERMARK,
+                 stall_timeout=DEFAULT_STALL_TIMEOUT, overflow=CONFLATE, metrics=None):
+        """Initialize the writer
+
+        Args:
+            high_watermark (int, optional): Queued bytes above which a
+                connection is blocked. Defaults to 256 KiB.
+            low_watermark (int, optional): Queued bytes below which a blocked
+                connection resumes. Defaults to 64 KiB.
+            stall_timeout (float, optional): Seconds a connection may stay
+                blocked before it is disconnected. Defaults to 10.
+            overflow (str, optional): "conflate" or "disconnect". Defaults to
+                "conflate".
+            metrics (ServerMetrics, optional): Registry for write counters
+
+        Raises:
+            ValueError: If the policy is unknown or the watermarks are inverted
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown write overflow policy: {overflow}")
+        if not 0 <= low_watermark <= high_watermark:
+            raise ValueError("The low write watermark must be between 0 and the high watermark")
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.stall_timeout = stall_timeout
+        self.overflow = overflow
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._added = set()
+        self._watched = set()
+        self._selector = None
+        self._wake_r = self._wake_w = None
+        self._running = False
+        self._thread = None
+
+        if metrics:
+            metrics.register_gauge("write_queued_bytes",
+                                   lambda: sum(conn.pending_bytes for conn in list(self._watched)))
+            metrics.register_gauge("write_blocked_connections",
+                                   lambda: sum(1 for conn in list(self._watched) if conn.stalled_since is not None))
+
+    def start(self):
+        """Start the writer thread"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._run, name="wakemate-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread; anything still queued is discarded"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        self._wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(2)
+        self._thread = None
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        self._added.clear()
+        self._watched.clear()
+
+    def attach(self, conn):
+        """Make a connection's sends go through this writer
+
+        The socket is switched to non-blocking mode, so its reader must wait
+        for input with Connection.wait_readable().
+        """
+        conn.sock.setblocking(False)
+        conn.outbound = self
+
+    def send(self, conn, payload):
+        """Write a frame now, or queue what does not fit; never blocks
+
+        Args:
+            conn (Connection): The connection
+            payload (bytes): The encoded frame
+
+        Raises:
+            ConnectionError: If the connection is closed or was just
+                disconnected by the overflow policy
+            OSError: If the socket fails
+        """
+        watch = False
+        with conn.send_lock:
+            if conn.closed:
+                raise ConnectionError("Connection is closed")
+            # Compressed frames extend one stream, so pack in sending order
+            if conn.compression is not None:
+                payload = conn.compression.pack(payload)
+            if not conn.pending:
+                try:
+                    sent = conn.sock.send(payload)
+                except WOULD_BLOCK:
+                    sent = 0
+                conn.bytes_out += sent
+                if sent == len(payload):
+                    return
+                payload = memoryview(payload)[sent:]
+                watch = True
+            conn.pending.append(payload)
+            conn.pending_bytes += len(payload)
+            blocked = conn.pending_bytes > self.high_watermark
+            if blocked and conn.stalled_since is None:
+                conn.stalled_since = time.monotonic()
+                if self.metrics:
+                    self.metrics.increment("write_backpressure_total")
+        if blocked and self.overflow == DISCONNECT:
+            self.disconnect(conn, "write buffer overflow")
+            raise ConnectionError("Write buffer overflow")
+        if watch:
+            with self._lock:
+                self._added.add(conn)
+            self._wake()
+
+    def wait_drained(self, conn, timeout, level=None):
+        """Wait until a connection's queue is at or below a level
+
+        Args:
+            conn (Connection): The connection
+            timeout (float): Seconds to wait
+            level (int, optional): Queued bytes to wait for. Defaults to the
+                low watermark.
+
+        Returns:
+            bool: True if the queue drained, False on timeout or close
+        """
+        level = self.low_watermark if level is None else level
+        deadline = time.monotonic() + timeout
+        with conn.drained:
+            while conn.pending_bytes > level:
+                remaining = deadline - time.monotonic()
+                if conn.closed or remaining <= 0:
+                    return False
+                # Wake up now and then so a connection closed elsewhere is noticed
+                conn.drained.wait(min(remaining, 1.0))
+            return True
+
+    def wait_unblocked(self, conn):
+        """Hold a reader while its connection is above the high watermark
+
+        Returns:
+            bool: False if the connection was disconnected as a slow consumer
+        """
+        stalled_since = conn.stalled_since
+        if stalled_since is None:
+            return True
+        remaining = self.stall_timeout - (time.monotonic() - stalled_since)
+        if self.wait_drained(conn, max(remaining, 0)):
+            return True
+        if not conn.closed:
+            self.disconnect(conn, "stalled")
+        return False
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (AttributeError, OSError):
+            pass
+
+    def disconnect(self, conn, reason):
+        """Close a connection as a slow consumer and release its waiters"""
+        logger.warning(f"Disconnecting slow consumer {conn.label}: {reason} "
+                       f"({conn.pending_bytes} bytes queued)")
+        if self.metrics:
+            self.metrics.increment("write_slow_consumers_total")
+        conn.close()
+        with conn.drained:
+            conn.drained.notify_all()
+
+    def _run(self):
+        selector = self._selector
+        while self._running:
+            try:
+                events = selector.select(1.0 if self._watched else None)
+            except (OSError, ValueError):
+                if not self._running:
+                    return
+                raise
+            for key, _ in events:
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError, OSError):
+                        pass
+                else:
+                    self._flush(key.data)
+            with self._lock:
+                added, self._added = self._added, set()
+            for conn in added:
+                self._watch(conn)
+            self._sweep()
+
+    def _watch(self, conn):
+        fd = conn.sock.fileno()
+        if fd < 0 or conn.closed:
+            return
+        old = self._selector.get_map().get(fd)
+        if old is not None:
+            if old.data is conn:
+                return
+            # The descriptor was closed and reused while still registered
+            self._unwatch(old.data, fd)
+        self._selector.register(fd, selectors.EVENT_WRITE, conn)
+        self._watched.add(conn)
+        conn.watched_fd = fd
+
+    def _unwatch(self, conn, fd=None):
+        fd = conn.watched_fd if fd is None else fd
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError, OSError):
+            pass
+        self._watched.discard(conn)
+        conn.watched_fd = None
+
+    def _sweep(self):
+        """Forget drained or closed connections and cut off stalled ones"""
+        now = time.monotonic()
+        for conn in list(self._watched):
+            if conn.closed or not conn.pending:
+                self._unwatch(conn)
+            elif conn.stalled_since is not None and now - conn.stalled_since > self.stall_timeout:
+                self._unwatch(conn)
+                self.disconnect(conn, "stalled")
+
+    def _flush(self, conn):
+        with conn.send_lock:
+            try:
+                self._write_pending(conn)
+            except OSError as e:
+                logger.info(f"Write to {conn.label} failed: {str(e)}")
+                conn.pending.clear()
+                conn.pending_bytes = 0
+                conn.close()
+            if conn.pending_bytes <= self.low_watermark:
+                conn.stalled_since = None
+                conn.drained.notify_all()
+        if not conn.pending:
+            self._unwatch(conn)
+
+    def _write_pending(self, conn):
+        """Write queued frames until the queue is empty or the socket is full"""
+        sock = conn.sock
+        pending = conn.pending
+        scatter = _HAS_SENDMSG and not isinstance(sock, _SSLSocket)
+        while pending:
+            if scatter:
+                batch = list(itertools.islice(pending, MAX_IOVECS))
+                size = sum(len(frame) for frame in batch)
+            else:
+                batch = []
+                size = 0
+                for frame in pending:
+                    if batch and size + len(frame) > MAX_JOIN_BYTES:
+                        break
+                    batch.append(frame)
+                    size += len(frame)
+            try:
+                if scatter:
+                    sent = sock.sendmsg(batch)
+                else:
+                    sent = sock.send(batch[0] if len(batch) == 1 else b"".join(batch))
+            except WOULD_BLOCK:
+                return
+            conn.bytes_out += sent
+            conn.pending_bytes -= sent
+            if self.metrics and len(batch) > 1:
+                self.metrics.increment("write_batched_frames_total", value=len(batch))
+            _consume(pending, sent)
+            if sent < size:
+                return
+
+
+def _consume(pending, sent):
+    """Drop sent bytes from the front of a frame queue"""
+    while sent:
+        head = pending[0]
+        if len(head) <= sent:
+            sent -= len(head)
+            pending.popleft()
+        else:
+            pending[0] = memoryview(head)[sent:]
+            sent = 0
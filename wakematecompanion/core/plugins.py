@@ -0,0 +1,219 @@
+"""
+Plugin commands for WakeMATECompanion
+
+Third-party commands (app launchers, custom scripts, ...) live in plugin
+modules, found through the "wakematecompanion.plugins" entry point group or as
+.py files in ~/.wakematecompanion/plugins. A plugin module declares its
+commands in a module-level literal:
+
+    COMMANDS = {
+        "launch_app": {
+            "handler": "launch",            # function name in this module
+            "description": "Start an application",
+            "params": {"name": {"type": "str", "required": True}},
+            "protected": True,              # needs a session in "protected" auth mode
+        },
+    }
+
+Handlers are called as handler(params, conn) and return a response dict.
+COMMANDS is read from the module source without running it, so startup only
+registers names and schemas; a plugin module is imported the first time one
+of its commands is used.
+"""
+
+import ast
+import importlib
+import importlib.util
+import logging
+import os
+import sys
+import threading
+
+from .auth import default_config_dir
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Optional imports - will be handled gracefully if not available
+try:
+    from importlib import metadata as importlib_metadata
+    METADATA_AVAILABLE = True
+except ImportError:
+    try:
+        import importlib_metadata
+        METADATA_AVAILABLE = True
+    except ImportError:
+        METADATA_AVAILABLE = False
+
+ENTRY_POINT_GROUP = "wakematecompanion.plugins"
+
+# Prefix of the module names directory plugins are imported under
+DIRECTORY_PREFIX = "wakematecompanion_plugin_"
+
+
+def default_plugin_dir():
+    """Return the default directory scanned for plugin files"""
+    return os.path.join(default_config_dir(), "plugins")
+
+
+class LazyFunction:
+    """Callable that imports its target function on first call and caches it"""
+
+    __slots__ = ("module", "name", "path", "_fn", "_lock")
+
+    def __init__(self, module, name, path=None):
+        """Initialize the reference
+
+        Args:
+            module (str): Module name
+            name (str): Function name within the module
+            path (str, optional): Source file to load the module from, for
+                modules that are not importable by name
+        """
+        self.module = module
+        self.name = name
+        self.path = path
+        self._fn = None
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        fn = self._fn
+        if fn is None:
+            fn = self.resolve()
+        return fn(*args, **kwargs)
+
+    def resolve(self):
+        """Import the module and look up the function"""
+        with self._lock:
+            if self._fn is None:
+                module = sys.modules.get(self.module)
+                if module is None:
+                    module = _import(self.module, self.path)
+                fn = getattr(module, self.name, None)
+                if not callable(fn):
+                    raise AttributeError(f"{self.module} has no function '{self.name}'")
+                self._fn = fn
+            return self._fn
+
+
+def _import(module_name, path):
+    if path is None:
+        return importlib.import_module(module_name)
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+def read_manifest(path):
+    """Read the COMMANDS literal from a module's source without importing it
+
+    Args:
+        path (str): Path to the module source
+
+    Returns:
+        dict: The COMMANDS mapping
+
+    Raises:
+        ValueError: If the module has no literal COMMANDS mapping
+    """
+    with open(path, "r", encoding="utf-8") as fh:
+        tree = ast.parse(fh.read(), filename=path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+                isinstance(t, ast.Name) and t.id == "COMMANDS" for t in node.targets):
+            commands = ast.literal_eval(node.value)
+            if not isinstance(commands, dict):
+                break
+            return commands
+    raise ValueError(f"{path} does not define a literal COMMANDS mapping")
+
+
+class PluginCommand:
+    """A command declared by a plugin module"""
+
+    __slots__ = ("name", "handler", "params", "description", "protected", "source")
+
+    def __init__(self, name, handler, params, description, protected, source):
+        self.name = name
+        self.handler = handler
+        self.params = params
+        self.description = description
+        self.protected = protected
+        self.source = source
+
+
+def _commands_from(module_name, path, source, load_path=None):
+    commands = []
+    for name, spec in read_manifest(path).items():
+        if not isinstance(spec, dict) or "handler" not in spec:
+            logger.error(f"Plugin command '{name}' in {source} has no handler")
+            continue
+        commands.append(PluginCommand(
+            name,
+            LazyFunction(module_name, spec["handler"], load_path),
+            spec.get("params"),
+            spec.get("description", ""),
+            spec.get("protected", True),
+            source,
+        ))
+    return commands
+
+
+def _entry_point_modules(group):
+    if not METADATA_AVAILABLE:
+        return []
+    eps = importlib_metadata.entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group=group)
+    else:
+        eps = eps.get(group, [])
+    return [(ep.name, ep.value.split(":")[0].strip()) for ep in eps]
+
+
+def discover(plugin_dirs=None, entry_point_group=ENTRY_POINT_GROUP):
+    """Find plugin commands without importing the plugin modules
+
+    Args:
+        plugin_dirs (list, optional): Directories of plugin .py files.
+            Defaults to [default_plugin_dir()].
+        entry_point_group (str, optional): Entry point group naming plugin
+            modules; None skips entry points
+
+    Returns:
+        list: PluginCommand objects
+    """
+    commands = []
+
+    if entry_point_group:
+        for ep_name, module_name in _entry_point_modules(entry_point_group):
+            source = f"entry point '{ep_name}'"
+            try:
+                # Locating a submodule imports its parent package, not the module
+                spec = importlib.util.find_spec(module_name)
+                if spec is None or not spec.origin or not spec.origin.endswith(".py"):
+                    raise ValueError(f"cannot find source for {module_name}")
+                commands.extend(_commands_from(module_name, spec.origin, source))
+            except Exception as e:
+                logger.error(f"Failed to load plugin {source}: {str(e)}")
+
+    if plugin_dirs is None:
+        plugin_dirs = [default_plugin_dir()]
+    for plugin_dir in plugin_dirs:
+        if not os.path.isdir(plugin_dir):
+            continue
+        for filename in sorted(os.listdir(plugin_dir)):
+            if not filename.endswith(".py") or filename.startswith("_"):
+                continue
+            path = os.path.join(plugin_dir, filename)
+            module_name = DIRECTORY_PREFIX + filename[:-3]
+            try:
+                commands.extend(_commands_from(module_name, path, path, load_path=path))
+            except Exception as e:
+                logger.error(f"Failed to load plugin {path}: {str(e)}")
+
+    return commands
@@ -0,0 +1,500 @@
+"""
+Pre-fork worker mode for WakeMATECompanion (Linux)
+
+For hub deployments where one process saturates a core, a supervisor starts N
+worker processes that each run a full WakeMateServer on the same port with
+SO_REUSEPORT; the kernel spreads incoming connections across them.
+
+State that must hold across workers lives in the supervisor and is reached
+over an authenticated local socket:
+
+- idempotency keys, so a retry landing on another worker is still replayed
+- rate limits for power and wake commands, so N workers do not mean N times
+  the budget (high-rate classes stay per worker, which is where a phone's
+  persistent connection lives anyway)
+- metrics, which workers push every second and the supervisor merges
+
+Pairing sessions and TLS session tickets stay per worker: a phone that
+reconnects to a different worker runs auth_hello or a full TLS handshake again.
+"""
+
+import argparse
+import base64
+import itertools
+import logging
+import multiprocessing
+import os
+import platform
+import socket
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from . import listeners as listener_utils
+from .auth import AUTH_OFF, load_or_create_pairing_key
+from .idempotency import IdempotencyBusy, IdempotencyCache
+from .metrics import MergedMetrics, MetricsHTTPServer
+from .rate_limit import RateLimiter, command_class
+from . import tls as tls_support
+from .utils import network_utils
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Command classes whose rate limits are enforced by the supervisor
+SHARED_RATE_CLASSES = ("power", "wake")
+
+# Seconds between metric pushes from each worker
+METRICS_PUSH_INTERVAL = 1.0
+
+# Seconds between polls while a duplicate waits on another worker
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+
+def prefork_supported():
+    """SO_REUSEPORT only balances connections across processes on Linux"""
+    return platform.system() == "Linux" and hasattr(socket, "SO_REUSEPORT")
+
+
+class SharedStateClient:
+    """A worker's connection to the supervisor's shared state"""
+
+    def __init__(self, address, authkey, index=0, idempotency_wait=30.0):
+        """Initialize the client
+
+        Args:
+            address (str): Coordinator socket address
+            authkey (bytes): Coordinator authentication key
+            index (int, optional): Worker index, used to label pushed metrics
+            idempotency_wait (float, optional): Seconds a duplicate waits for
+                the original request to finish
+        """
+        self.index = index
+        self._conn = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+        self._metrics = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.idempotency = _RemoteIdempotencyCache(self, idempotency_wait)
+
+    def call(self, *message):
+        """Send a request and wait for the reply"""
+        with self._lock:
+            self._conn.send(message)
+            return self._conn.recv()
+
+    def notify(self, *message):
+        """Send a message that needs no reply"""
+        with self._lock:
+            self._conn.send(message)
+
+    def wrap_rate_limiter(self, local):
+        """Route power and wake checks to the supervisor, the rest to local"""
+        return _SharedRateLimiter(self, local)
+
+    def start(self, metrics):
+        """Start pushing metrics to the supervisor"""
+        self._metrics = metrics
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._push_loop, name="wakemate-metrics-push")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop pushing, after one final push"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        self._push()
+
+    def _push_loop(self):
+        while not self._stop.wait(METRICS_PUSH_INTERVAL):
+            self._push()
+
+    def _push(self):
+        if self._metrics is None:
+            return
+        try:
+            self.notify("metrics", self.index, self._metrics.export())
+        except (OSError, EOFError) as e:
+            logger.warning(f"Failed to push metrics to supervisor: {str(e)}")
+
+
+class _RemoteIdempotencyCache:
+    """IdempotencyCache interface backed by the supervisor"""
+
+    def __init__(self, client, wait_timeout):
+        self.client = client
+        self.wait_timeout = wait_timeout
+
+    def __len__(self):
+        return 0
+
+    def begin(self, key):
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            reply = self.client.call("idem_begin", key)
+            if reply[0] == "claimed":
+                return None, reply[1]
+            if reply[0] == "done":
+                return reply[1], None
+            if reply[0] == "busy":
+                raise IdempotencyBusy(reply[1])
+            if time.monotonic() >= deadline:
+                return None, None
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    def complete(self, key, ticket, result):
+        self.client.notify("idem_complete", ticket, result)
+
+    def abandon(self, key, ticket):
+        self.client.notify("idem_abandon", ticket)
+
+
+class _SharedRateLimiter:
+    """RateLimiter interface that sends low-rate classes to the supervisor"""
+
+    def __init__(self, client, local):
+        self.client = client
+        self.local = local
+
+    def check(self, client, cmd_type):
+        if command_class(cmd_type) in SHARED_RATE_CLASSES:
+            return self.client.call("rate_check", client, cmd_type)
+        return self.local.check(client, cmd_type)
+
+    def __getattr__(self, name):
+        return getattr(self.local, name)
+
+
+class _Coordinator:
+    """Supervisor side of the shared state"""
+
+    def __init__(self, metrics, rate_limiter, idempotency):
+        self.metrics = metrics
+        self.rate_limiter = rate_limiter
+        self.idempotency = idempotency
+        self.authkey = os.urandom(32)
+        self.listener = Listener(family="AF_UNIX", authkey=self.authkey)
+        self.address = self.listener.address
+        self._tokens = itertools.count(1)
+        self._serving = []
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, name="wakemate-coordinator")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+        # Workers have exited by now; let their last metrics push land
+        for t in self._serving:
+            t.join(1)
+        self._serving = []
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                if self._running:
+                    logger.error(f"Coordinator error: {str(e)}")
+                    continue
+                return
+            t = threading.Thread(target=self._serve, args=(conn,), name="wakemate-coordinator-conn")
+            t.daemon = True
+            t.start()
+            self._serving = [other for other in self._serving if other.is_alive()] + [t]
+
+    def _serve(self, conn):
+        tickets = {}
+        try:
+            while True:
+                message = conn.recv()
+                op = message[0]
+                if op == "rate_check":
+                    wait = self.rate_limiter.check(message[1], message[2]) if self.rate_limiter else 0.0
+                    conn.send(wait)
+                elif op == "idem_begin":
+                    key = message[1]
+                    try:
+                        cached, ticket = self.idempotency.begin(key)
+                    except IdempotencyBusy as e:
+                        conn.send(("busy", str(e)))
+                        continue
+                    if ticket is not None:
+                        token = next(self._tokens)
+                        tickets[token] = (key, ticket)
+                        conn.send(("claimed", token))
+                    elif cached is not None:
+                        conn.send(("done", cached))
+                    else:
+                        conn.send(("pending",))
+                elif op == "idem_complete":
+                    key, ticket = tickets.pop(message[1])
+                    self.idempotency.complete(key, ticket, message[2])
+                elif op == "idem_abandon":
+                    key, ticket = tickets.pop(message[1])
+                    self.idempotency.abandon(key, ticket)
+                elif op == "metrics":
+                    self.metrics.update(message[1], message[2])
+                else:
+                    logger.warning(f"Unknown coordinator request: {op}")
+        except (EOFError, OSError):
+            pass
+        finally:
+            # A worker that went away cannot finish what it claimed
+            for key, ticket in tickets.values():
+                self.idempotency.abandon(key, ticket)
+            conn.close()
+
+
+def _worker_main(index, ip, port, server_kwargs, coordinator, control, worker_init, log_level):
+    """Worker process entry point"""
+    logging.basicConfig(level=log_level, format=f"%(asctime)s - worker {index} - %(levelname)s - %(message)s")
+    if worker_init is not None:
+        worker_init()
+
+    from .server import WakeMateServer
+
+    shared = SharedStateClient(coordinator[0], coordinator[1], index)
+    server = WakeMateServer(ip, port, reuse_port=True, shared_state=shared, **server_kwargs)
+    server.start()
+
+    ready_by = time.monotonic() + 10
+    while not server.addresses and time.monotonic() < ready_by:
+        time.sleep(0.02)
+    control.send(("ready", os.getpid()))
+
+    try:
+        control.recv()  # "stop", or EOF if the supervisor died
+    except (EOFError, OSError):
+        pass
+    server.stop()
+
+
+class PreforkServer:
+    """Runs WakeMateServer in several processes sharing one port"""
+
+    def __init__(self, ip, port=7777, workers=None, worker_init=None,
+                 log_level=logging.INFO, **server_kwargs):
+        """Initialize the supervisor
+
+        Args:
+            ip (str): The IP address to bind to
+            port (int, optional): The port to listen on. Defaults to 7777;
+                0 picks a free port shared by all workers.
+            workers (int, optional): Worker processes. Defaults to the CPU count.
+            worker_init (function, optional): Picklable function run first in
+                each worker, e.g. to install fake backends
+            log_level (int, optional): Log level inside the workers
+            **server_kwargs: Passed to every worker's WakeMateServer
+
+        Raises:
+            RuntimeError: If the platform cannot balance SO_REUSEPORT listeners
+        """
+        if not prefork_supported():
+            raise RuntimeError("Pre-fork mode needs SO_REUSEPORT load balancing, which is Linux-only")
+
+        self.ip = ip
+        self.workers = workers or os.cpu_count() or 1
+        self.worker_init = worker_init
+        self.log_level = log_level
+        self.running = False
+        self.on_notification = None
+
+        # Every worker must bind the same port and share keys and certificates
+        specs = [listener_utils.parse_listener(s) for s in (server_kwargs.pop("listeners", None) or [(ip, port)])]
+        self.tcp_listeners = []
+        self.unix_listeners = []
+        for family, address in specs:
+            if family in (socket.AF_INET, socket.AF_INET6):
+                if address[1] == 0:
+                    address = (address[0], _free_port(family, address[0]))
+                self.tcp_listeners.append(listener_utils.format_address(family, address))
+            else:
+                self.unix_listeners.append("unix:" + address)
+        self.port = listener_utils.parse_listener(self.tcp_listeners[0])[1][1] if self.tcp_listeners else port
+        self.addresses = self.tcp_listeners + self.unix_listeners
+
+        if server_kwargs.get("auth_mode", AUTH_OFF) != AUTH_OFF and not server_kwargs.get("pairing_key"):
+            server_kwargs["pairing_key"] = base64.b64encode(load_or_create_pairing_key()).decode("ascii")
+        if server_kwargs.get("tls"):
+            cert, key = tls_support.ensure_certificate(server_kwargs.get("tls_cert"), server_kwargs.get("tls_key"))
+            server_kwargs["tls_cert"], server_kwargs["tls_key"] = cert, key
+
+        self.metrics_port = server_kwargs.pop("metrics_port", None)
+        self.server_kwargs = server_kwargs
+
+        self.metrics = MergedMetrics()
+        self.metrics.register_gauge("workers_alive", lambda: sum(1 for p in self._processes if p and p.is_alive()))
+        self._rate_limiter = (RateLimiter(server_kwargs.get("rate_limits"), self.metrics)
+                              if server_kwargs.get("rate_limiting", True) else None)
+        self._idempotency = IdempotencyCache(server_kwargs.get("idempotency_max_entries", 1024),
+                                             server_kwargs.get("idempotency_ttl", 600.0),
+                                             wait_timeout=0, metrics=self.metrics)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._processes = []
+        self._controls = []
+        self._coordinator = None
+        self._monitor_thread = None
+        self.metrics_server = None
+
+    def set_notification_callback(self, callback):
+        """Set the notification callback"""
+        self.on_notification = callback
+
+    def start(self):
+        """Start the coordinator and the worker processes"""
+        if self.running:
+            logger.info("Server is already running")
+            return False
+        try:
+            self._coordinator = _Coordinator(self.metrics, self._rate_limiter, self._idempotency)
+            self._processes = [None] * self.workers
+            self._controls = [None] * self.workers
+            for index in range(self.workers):
+                self._spawn(index)
+            for index in range(self.workers):
+                self._wait_ready(index)
+            self.running = True
+
+            self._monitor_thread = threading.Thread(target=self._monitor, name="wakemate-prefork-monitor")
+            self._monitor_thread.daemon = True
+            self._monitor_thread.start()
+
+            if self.metrics_port is not None:
+                try:
+                    self.metrics_server = MetricsHTTPServer(self.metrics, port=self.metrics_port)
+                    self.metrics_server.start()
+                except Exception as e:
+                    logger.error(f"Failed to start metrics endpoint: {str(e)}")
+                    self.metrics_server = None
+
+            logger.info(f"Server started with {self.workers} workers on {', '.join(self.addresses)}")
+            if self.on_notification:
+                self.on_notification("Server Started", f"Listening on {self.ip}:{self.port}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to start server: {str(e)}")
+            self._shutdown_workers()
+            return False
+
+    def stop(self):
+        """Stop the workers and the coordinator"""
+        if not self.running:
+            logger.info("Server is not running")
+            return True
+        self.running = False
+        self._shutdown_workers()
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        logger.info("Server stopped")
+        if self.on_notification:
+            self.on_notification("Server Stopped", "Server has been stopped")
+        return True
+
+    def _spawn(self, index):
+        # Unix sockets cannot be shared, so only the first worker serves them
+        kwargs = dict(self.server_kwargs)
+        kwargs["listeners"] = self.tcp_listeners + (self.unix_listeners if index == 0 else [])
+        parent_end, child_end = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.ip, self.port, kwargs,
+                  (self._coordinator.address, self._coordinator.authkey),
+                  child_end, self.worker_init, self.log_level),
+            name=f"wakemate-worker-{index}",
+        )
+        process.daemon = True
+        process.start()
+        child_end.close()
+        self._processes[index] = process
+        self._controls[index] = parent_end
+
+    def _wait_ready(self, index):
+        control = self._controls[index]
+        if not control.poll(30):
+            raise RuntimeError(f"Worker {index} did not start")
+        control.recv()
+
+    def _monitor(self):
+        while self.running:
+            time.sleep(1.0)
+            for index, process in enumerate(self._processes):
+                if self.running and process is not None and not process.is_alive():
+                    logger.warning(f"Worker {index} exited with code {process.exitcode}; restarting")
+                    self.metrics.increment("worker_restarts_total")
+                    try:
+                        self._spawn(index)
+                        self._wait_ready(index)
+                    except Exception as e:
+                        logger.error(f"Failed to restart worker {index}: {str(e)}")
+
+    def _shutdown_workers(self):
+        for control in self._controls:
+            if control is None:
+                continue
+            try:
+                control.send("stop")
+            except OSError:
+                pass
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+                process.join(1)
+        for control in self._controls:
+            if control is not None:
+                control.close()
+        self._processes = []
+        self._controls = []
+        if self._coordinator:
+            self._coordinator.close()
+            self._coordinator = None
+
+
+def _free_port(family, host):
+    with socket.socket(family, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def main(argv=None):
+    """Run a headless pre-fork server"""
+    parser = argparse.ArgumentParser(prog="python -m wakematecompanion.core.prefork",
+                                     description="Run WakeMATECompanion with several worker processes")
+    parser.add_argument("--listen", action="append",
+                        help='Listener such as "[::]:7777" or "unix:/path"; repeatable')
+    parser.add_argument("--port", type=int, default=7777, help="Port when --listen is not given")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("--auth-mode", default=AUTH_OFF, help='"off", "protected" or "required"')
+    parser.add_argument("--tls", action="store_true", help="Serve over TLS")
+    parser.add_argument("--metrics-port", type=int, help="Serve merged metrics on this loopback port")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    host = network_utils.get_local_ip()
+    server = PreforkServer(host, args.port, workers=args.workers,
+                           listeners=args.listen or listener_utils.default_listeners(host, args.port),
+                           auth_mode=args.auth_mode, tls=args.tls, metrics_port=args.metrics_port)
+    if not server.start():
+        return 1
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
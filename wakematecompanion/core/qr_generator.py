@@ -7,6 +7,9 @@ import json
 import platform
 import subprocess
 import logging
+import atexit
+import tempfile
+import threading
 from pathlib import Path
 
 logger = logging.getLogger("WakeMATECompanion")
@@ -19,17 +22,32 @@ except ImportError:
     QRCODE_AVAILABLE = False
     logger.warning("QR code module not available. Install with: pip install qrcode")
 
+# Seconds the image is kept for the viewer before it is deleted
+QR_LIFETIME = 120
+
 def is_available():
     """Check if QR code generation is available"""
     return QRCODE_AVAILABLE
 
-def generate_qr_code(server_ip, server_port, local_mac=None):
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def generate_qr_code(server_ip, server_port, local_mac=None, pairing_key=None, tls_fingerprint=None):
     """Generate a QR code with the connection information
     
+    The image carries the pairing key, so it is written to a temporary file
+    only this user can read and deleted QR_LIFETIME seconds after it is
+    opened, or when the process exits.
+    
     Args:
         server_ip (str): The server IP address
         server_port (int): The server port
         local_mac (str, optional): The local MAC address
+        pairing_key (str, optional): Base64 pairing key for authenticated sessions
+        tls_fingerprint (str, optional): SHA-256 fingerprint of the server certificate
         
     Returns:
         str: Path to the generated QR code or None if failed
@@ -48,6 +66,11 @@ def generate_qr_code(server_ip, server_port, local_mac=None):
             "serverPort": server_port,
             "localMAC": local_mac
         }
+        if pairing_key:
+            connection_info["pairingKey"] = pairing_key
+        if tls_fingerprint:
+            connection_info["tls"] = True
+            connection_info["tlsFingerprint"] = tls_fingerprint
         
         # Convert to JSON string
         data = json.dumps(connection_info)
@@ -65,10 +88,18 @@ def generate_qr_code(server_ip, server_port, local_mac=None):
         # Create an image from the QR Code
         img = qr.make_image(fill_color="black", back_color="white")
         
-        # Save the image
-        app_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        qr_path = os.path.join(app_path, "wakemateqr.png")
-        img.save(qr_path)
+        # Save the image; mkstemp creates it with mode 0600
+        fd, qr_path = tempfile.mkstemp(prefix="wakemateqr-", suffix=".png")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                img.save(fh)
+        except Exception:
+            _remove(qr_path)
+            raise
+        atexit.register(_remove, qr_path)
+        timer = threading.Timer(QR_LIFETIME, _remove, args=(qr_path,))
+        timer.daemon = True
+        timer.start()
         
         # Open the image with default viewer
         os_type = platform.system()
@@ -79,7 +110,7 @@ def generate_qr_code(server_ip, server_port, local_mac=None):
         elif os_type == "Linux":
             subprocess.call(["xdg-open", qr_path])
         
-        logger.info(f"QR code saved to {qr_path}")
+        logger.info(f"QR code saved to {qr_path}; it is deleted after {QR_LIFETIME}s")
         return qr_path
     
     except Exception as e:
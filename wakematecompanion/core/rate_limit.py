@@ -0,0 +1,161 @@
+"""
+Per-client command rate limiting for WakeMATECompanion
+
+Each client (keyed by peer address, so reconnecting does not reset it) gets a
+token bucket per command class. Buckets refill continuously and are created on
+first use; idle buckets are pruned once the table grows past a bound.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Command name -> command class
+COMMAND_CLASSES = {
+    "mouse_move": "input",
+    "mouse_click": "input",
+    "mouse_scroll": "input",
+    "mouse_button": "input",
+    "mouse_drag": "input",
+    "keyboard_input": "input",
+    "key_press": "input",
+    "keyboard_special": "input",
+    "media_play_pause": "media",
+    "media_next": "media",
+    "media_prev": "media",
+    "volume_up": "media",
+    "volume_down": "media",
+    "volume_mute": "media",
+    "shutdown": "power",
+    "restart": "power",
+    "sleep": "power",
+    "logoff": "power",
+    "wake": "wake",
+    "get_status": "query",
+    "get_metrics": "query",
+    "get_connections": "query",
+    "list_commands": "query",
+    "trace_start": "query",
+    "trace_stop": "query",
+    "trace_dump": "query",
+    "profile_start": "query",
+    "profile_stop": "query",
+    "memory_snapshot": "query",
+    "memory_diff": "query",
+    "memory_stop": "query",
+    "get_diagnostics": "query",
+}
+
+DEFAULT_CLASS = "default"
+
+# Command class -> (tokens per second, burst size)
+DEFAULT_RATE_LIMITS = {
+    "input": (250.0, 500),
+    "media": (20.0, 40),
+    "power": (1 / 30.0, 1),
+    "wake": (2.0, 5),
+    "query": (20.0, 50),
+    DEFAULT_CLASS: (50.0, 100),
+}
+
+# Prune idle buckets once this many exist
+MAX_BUCKETS = 4096
+
+
+def command_class(cmd_type):
+    """Return the rate-limit class of a command"""
+    return COMMAND_CLASSES.get(cmd_type, DEFAULT_CLASS)
+
+
+class TokenBucket:
+    """Continuously refilling token bucket"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, now):
+        """Take one token
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is available
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """Token buckets keyed by (client, command class)"""
+
+    def __init__(self, limits=None, metrics=None):
+        """Initialize the limiter
+
+        Args:
+            limits (dict, optional): Command class -> (rate, burst) overrides;
+                a value of None disables limiting for that class
+            metrics (ServerMetrics, optional): Registry for rejection counters
+        """
+        self.limits = dict(DEFAULT_RATE_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.metrics = metrics
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+        if metrics:
+            metrics.register_gauge("rate_limit_buckets", lambda: len(self._buckets))
+
+    def check(self, client, cmd_type):
+        """Charge one command against a client's budget
+
+        Args:
+            client (str): Client key, usually the peer IP address
+            cmd_type (str): The command name
+
+        Returns:
+            float: 0 if allowed, otherwise seconds the client should wait
+        """
+        cls = command_class(cmd_type)
+        limit = self.limits.get(cls)
+        if limit is None:
+            return 0.0
+
+        key = (client, cls)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._prune(now)
+                bucket = self._buckets[key] = TokenBucket(limit[0], limit[1], now)
+            wait = bucket.take(now)
+
+        if wait and self.metrics:
+            self.metrics.increment("rate_limited_total", (cls,))
+        return wait
+
+    def _prune(self, now):
+        # Caller holds self._lock. Full buckets carry no state worth keeping.
+        for key in [k for k, b in self._buckets.items() if b.is_full(now)]:
+            del self._buckets[key]
+
+    def snapshot(self):
+        """Return the configured limits and live bucket count"""
+        return {
+            "limits": {cls: ({"rate": lim[0], "burst": lim[1]} if lim else None)
+                       for cls, lim in self.limits.items()},
+            "buckets": len(self._buckets),
+        }
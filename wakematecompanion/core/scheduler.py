@@ -0,0 +1,189 @@
+"""
+Priority scheduling of backend commands for WakeMATECompanion
+
+Commands that drive the desktop (input, media, power, wake) run on a small pool
+of executor threads instead of on each client's reader thread. Jobs are taken
+in priority order, so a media key or power command queued behind a flood of
+mouse events from another phone runs next rather than last.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger("WakeMATECompanion")
+
+PRIORITY_CONTROL = 0
+PRIORITY_INPUT = 1
+PRIORITY_NAMES = {PRIORITY_CONTROL: "control", PRIORITY_INPUT: "input"}
+
+
+class SchedulerBusy(Exception):
+    """Raised when the queue for a priority is full"""
+
+
+class _Job:
+    __slots__ = ("fn", "args", "done", "result", "error", "enqueued_at", "queue_ms")
+
+    def __init__(self, fn, args, detached=False):
+        self.fn = fn
+        self.args = args
+        # Nobody waits on a detached job; its errors are logged instead
+        self.done = None if detached else threading.Event()
+        self.result = None
+        self.error = None
+        self.enqueued_at = time.perf_counter()
+        self.queue_ms = 0.0
+
+
+class PriorityScheduler:
+    """Executes jobs in priority order on a fixed pool of threads"""
+
+    def __init__(self, workers=1, max_queued=1024, metrics=None):
+        """Initialize the scheduler
+
+        Args:
+            workers (int, optional): Executor threads. Defaults to 1, which also
+                keeps calls into non-thread-safe backends like pyautogui serial.
+            max_queued (int, optional): Queue bound per priority
+            metrics (ServerMetrics, optional): Registry for queue depth gauges
+        """
+        self.workers = workers
+        self.max_queued = max_queued
+        self._heap = []
+        self._depth = {p: 0 for p in PRIORITY_NAMES}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._active = 0
+
+        if metrics:
+            for priority, name in PRIORITY_NAMES.items():
+                metrics.register_gauge(f"queue_depth_{name}", lambda p=priority: self._depth[p])
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        """Start the executor threads"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"wakemate-executor-{i}")
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        """Stop the executor threads and fail any queued jobs"""
+        with self._cond:
+            self._running = False
+            pending = [entry[2] for entry in self._heap]
+            self._heap = []
+            for p in self._depth:
+                self._depth[p] = 0
+            self._cond.notify_all()
+        for job in pending:
+            if job.done is not None:
+                job.error = RuntimeError("Server is stopping")
+                job.done.set()
+        for t in self._threads:
+            t.join(2)
+        self._threads = []
+
+    def run(self, priority, fn, *args):
+        """Run a job at the given priority and wait for its result
+
+        Falls back to running inline when the scheduler is not started or
+        is stopping.
+
+        Returns:
+            tuple: (result, milliseconds spent queued)
+        """
+        job = _Job(fn, args)
+        with self._cond:
+            # Checked under the lock: a job queued after stop() emptied the
+            # heap would never run, and its caller would wait forever
+            inline = not self._running
+            if not inline:
+                if self._depth[priority] >= self.max_queued:
+                    raise SchedulerBusy(f"Too many queued {PRIORITY_NAMES[priority]} commands")
+                self._depth[priority] += 1
+                heapq.heappush(self._heap, (priority, next(self._seq), job))
+                self._cond.notify()
+        if inline:
+            return fn(*args), 0.0
+
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result, job.queue_ms
+
+    def submit(self, priority, fn, *args):
+        """Queue a job without waiting for it
+
+        Runs inline when the scheduler is not started or is stopping.
+
+        Raises:
+            SchedulerBusy: If the queue for the priority is full
+        """
+        with self._cond:
+            inline = not self._running
+            if not inline:
+                if self._depth[priority] >= self.max_queued:
+                    raise SchedulerBusy(f"Too many queued {PRIORITY_NAMES[priority]} commands")
+                self._depth[priority] += 1
+                heapq.heappush(self._heap, (priority, next(self._seq), _Job(fn, args, detached=True)))
+                self._cond.notify()
+        if inline:
+            fn(*args)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while self._running and not self._heap:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                priority, _, job = heapq.heappop(self._heap)
+                self._depth[priority] -= 1
+                self._active += 1
+
+            job.queue_ms = (time.perf_counter() - job.enqueued_at) * 1000
+            try:
+                job.result = job.fn(*job.args)
+            except BaseException as e:
+                if job.done is None:
+                    logger.error(f"Background job failed: {str(e)}")
+                job.error = e
+            if job.done is not None:
+                job.done.set()
+            with self._cond:
+                self._active -= 1
+                if not self._active and not self._heap:
+                    self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """Wait until every queued and running job has finished
+
+        Returns:
+            bool: True if the scheduler went idle before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._running and (self._active or self._heap):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def snapshot(self):
+        """Return queue depths per priority"""
+        return {PRIORITY_NAMES[p]: depth for p, depth in self._depth.items()}
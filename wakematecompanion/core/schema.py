@@ -0,0 +1,288 @@
+"""
+Declarative command parameter schemas for WakeMATECompanion
+
+Each command declares its parameters as plain dicts. A schema is compiled once,
+when the command is registered, into a validator that checks types, ranges and
+allowed values and fills in defaults, so handlers only ever see clean input.
+
+Field keys:
+    type: "int", "number", "str", "bool" or "list"
+    required: The field must be present (default False)
+    default: Value used when the field is absent
+    min / max: Inclusive bounds for numbers
+    choices: Allowed values
+    max_length: Longest accepted string or list
+    pattern: Regular expression a string must match in full
+    format: Named string format checked by the standard library ("ipv4")
+    items: Field spec for list elements; a single value is wrapped in a list
+"""
+
+import ipaddress
+import math
+import re
+import string
+
+from .subscriptions import TOPICS
+
+MOUSE_BUTTONS = ("left", "right", "middle")
+
+# Keys accepted by key_press: named keys plus single printable characters
+KEY_NAMES = tuple(sorted(set(
+    [
+        "enter", "return", "esc", "escape", "tab", "backspace", "delete", "del",
+        "insert", "space", "up", "down", "left", "right", "home", "end",
+        "pageup", "pagedown", "capslock", "numlock", "scrolllock", "printscreen",
+        "pause", "shift", "ctrl", "alt", "option", "command", "win", "winleft",
+        "winright", "fn", "apps", "volumeup", "volumedown", "volumemute",
+        "playpause", "nexttrack", "prevtrack", "stop",
+    ]
+    + [f"f{i}" for i in range(1, 25)]
+    + list(string.ascii_lowercase + string.digits + string.punctuation)
+)))
+
+MEMORY_KEY_TYPES = ("lineno", "filename", "traceback")
+
+MAC_PATTERN = r"[0-9A-Fa-f]{2}([-:.]?[0-9A-Fa-f]{2}){5}"
+SHA256_PATTERN = r"[0-9a-fA-F]{64}"
+TRANSFER_ID_PATTERN = r"[0-9a-f]{32}"
+
+# Command name -> parameter fields
+COMMAND_PARAMS = {
+    "mouse_move": {
+        "dx": {"type": "int", "default": 0, "min": -10000, "max": 10000},
+        "dy": {"type": "int", "default": 0, "min": -10000, "max": 10000},
+    },
+    "mouse_click": {
+        "button": {"type": "str", "default": "left", "choices": MOUSE_BUTTONS},
+        "clicks": {"type": "int", "default": 1, "min": 1, "max": 3},
+    },
+    "mouse_scroll": {
+        "amount": {"type": "number", "default": 0, "min": -1000, "max": 1000},
+        "horizontal": {"type": "number", "default": 0, "min": -1000, "max": 1000},
+    },
+    "mouse_button": {
+        "button": {"type": "str", "default": "left", "choices": MOUSE_BUTTONS},
+        "action": {"type": "str", "required": True, "choices": ("down", "up")},
+    },
+    "mouse_drag": {
+        "dx": {"type": "int", "default": 0, "min": -10000, "max": 10000},
+        "dy": {"type": "int", "default": 0, "min": -10000, "max": 10000},
+        "button": {"type": "str", "default": "left", "choices": MOUSE_BUTTONS},
+    },
+    "keyboard_input": {
+        "text": {"type": "str", "required": True, "max_length": 4096},
+    },
+    "key_press": {
+        "key": {"type": "str", "required": True, "choices": KEY_NAMES},
+    },
+    "wake": {
+        "mac": {"type": "str", "required": True, "pattern": MAC_PATTERN},
+        "broadcast": {"type": "str", "default": "255.255.255.255", "format": "ipv4"},
+        "port": {"type": "int", "default": 9, "min": 1, "max": 65535},
+    },
+    "subscribe": {
+        "topics": {"type": "list", "required": True, "max_length": len(TOPICS),
+                   "items": {"type": "str", "choices": TOPICS}},
+    },
+    "unsubscribe": {
+        "topics": {"type": "list", "max_length": len(TOPICS),
+                   "items": {"type": "str", "choices": TOPICS}},
+    },
+    "auth_hello": {
+        "client_nonce": {"type": "str", "required": True, "max_length": 128},
+    },
+    "compression": {
+        "algorithms": {"type": "list", "required": True, "max_length": 8,
+                       "items": {"type": "str", "max_length": 16}},
+        "threshold": {"type": "int", "min": 0, "max": 1048576},
+    },
+    "preview_start": {
+        "fps": {"type": "number", "default": 5, "min": 0.2, "max": 30},
+        "max_width": {"type": "int", "default": 960, "min": 64, "max": 3840},
+        "max_height": {"type": "int", "default": 540, "min": 64, "max": 2160},
+        "tile": {"type": "int", "default": 64, "choices": (16, 32, 64, 128, 256)},
+        "format": {"type": "str", "default": "jpeg", "choices": ("jpeg", "png")},
+        "quality": {"type": "int", "default": 70, "min": 10, "max": 95},
+        "min_quality": {"type": "int", "default": 25, "min": 10, "max": 95},
+    },
+    "file_upload": {
+        "name": {"type": "str", "required": True, "max_length": 255},
+        "size": {"type": "int", "required": True, "min": 0, "max": 1 << 50},
+        "sha256": {"type": "str", "pattern": SHA256_PATTERN},
+        "overwrite": {"type": "bool", "default": False},
+        "resume": {"type": "bool", "default": True},
+    },
+    "file_download": {
+        "name": {"type": "str", "required": True, "max_length": 255},
+    },
+    "transfer_attach": {
+        "transfer_id": {"type": "str", "required": True, "pattern": TRANSFER_ID_PATTERN},
+        "offset": {"type": "int", "default": 0, "min": 0, "max": 1 << 50},
+    },
+    "transfer_status": {
+        "transfer_id": {"type": "str", "pattern": TRANSFER_ID_PATTERN},
+    },
+    "transfer_cancel": {
+        "transfer_id": {"type": "str", "required": True, "pattern": TRANSFER_ID_PATTERN},
+    },
+    "trace_start": {
+        "sample_rate": {"type": "number", "default": 1.0, "min": 0.0001, "max": 1},
+        "buffer_size": {"type": "int", "default": 65536, "min": 1024, "max": 1048576},
+    },
+    "trace_dump": {
+        "inline": {"type": "bool", "default": False},
+    },
+    "profile_start": {
+        "interval_ms": {"type": "number", "default": 5, "min": 1, "max": 1000},
+        "duration_s": {"type": "number", "default": 60, "min": 1, "max": 3600},
+    },
+    "profile_stop": {
+        "format": {"type": "str", "default": "collapsed", "choices": ("collapsed", "flamegraph")},
+        "limit": {"type": "int", "default": 500, "min": 1, "max": 20000},
+    },
+    "memory_snapshot": {
+        "frames": {"type": "int", "default": 1, "min": 1, "max": 64},
+        "key_type": {"type": "str", "default": "lineno", "choices": MEMORY_KEY_TYPES},
+        "limit": {"type": "int", "default": 20, "min": 1, "max": 500},
+    },
+    "memory_diff": {
+        "base": {"type": "int", "required": True, "min": 1},
+        "key_type": {"type": "str", "default": "lineno", "choices": MEMORY_KEY_TYPES},
+        "limit": {"type": "int", "default": 20, "min": 1, "max": 500},
+    },
+}
+
+
+class ValidationError(ValueError):
+    """Raised when command parameters do not match the schema"""
+
+
+class InvalidRequest(ValueError):
+    """Raised when a frame is valid JSON but not a command object"""
+
+
+_MISSING = object()
+
+# String format name -> parser that raises ValueError on bad input
+STRING_FORMATS = {
+    "ipv4": ipaddress.IPv4Address,
+}
+
+
+def _compile_field(name, spec):
+    """Build a checker(value) -> value for one field"""
+    kind = spec.get("type", "str")
+    lo = spec.get("min")
+    hi = spec.get("max")
+    choices = frozenset(spec["choices"]) if "choices" in spec else None
+    max_length = spec.get("max_length")
+    pattern = re.compile(spec["pattern"]) if "pattern" in spec else None
+    parse_format = STRING_FORMATS[spec["format"]] if "format" in spec else None
+    item_check = _compile_field(f"{name}[]", spec["items"]) if "items" in spec else None
+
+    def check_range(value):
+        if lo is not None and value < lo:
+            raise ValidationError(f"'{name}' must be at least {lo}")
+        if hi is not None and value > hi:
+            raise ValidationError(f"'{name}' must be at most {hi}")
+        return value
+
+    def check_choice(value):
+        if choices is not None and value not in choices:
+            if len(choices) <= 10:
+                raise ValidationError(f"'{name}' must be one of: {', '.join(sorted(map(str, choices)))}")
+            raise ValidationError(f"'{name}' is not a supported value; see list_commands")
+        return value
+
+    if kind == "int":
+        def check(value):
+            # Accept whole numbers sent as floats; reject bools and strings
+            if type(value) is float and value.is_integer():
+                value = int(value)
+            if type(value) is not int:
+                raise ValidationError(f"'{name}' must be an integer")
+            return check_choice(check_range(value))
+    elif kind == "number":
+        def check(value):
+            if type(value) not in (int, float) or not math.isfinite(value):
+                raise ValidationError(f"'{name}' must be a number")
+            return check_choice(check_range(float(value)))
+    elif kind == "bool":
+        def check(value):
+            if type(value) is not bool:
+                raise ValidationError(f"'{name}' must be true or false")
+            return value
+    elif kind == "str":
+        def check(value):
+            if type(value) is not str:
+                raise ValidationError(f"'{name}' must be a string")
+            if max_length is not None and len(value) > max_length:
+                raise ValidationError(f"'{name}' is longer than {max_length} characters")
+            if pattern is not None and not pattern.fullmatch(value):
+                raise ValidationError(f"'{name}' is not in the expected format")
+            if parse_format is not None:
+                try:
+                    parse_format(value)
+                except ValueError:
+                    raise ValidationError(f"'{name}' is not a valid {spec['format']} value")
+            return check_choice(value)
+    elif kind == "list":
+        def check(value):
+            if not isinstance(value, list):
+                value = [value]
+            if max_length is not None and len(value) > max_length:
+                raise ValidationError(f"'{name}' has more than {max_length} items")
+            return [item_check(v) for v in value] if item_check else value
+    else:
+        raise ValueError(f"Unknown type '{kind}' for parameter '{name}'")
+
+    return check
+
+
+def compile_params(fields):
+    """Compile a parameter schema into a validator
+
+    Args:
+        fields (dict): Field name -> field spec, or None for no parameters
+
+    Returns:
+        function: validator(params) -> dict of checked parameters with defaults
+            filled in. Unknown parameters are dropped. Raises ValidationError.
+    """
+    compiled = tuple(
+        (name, _compile_field(name, spec), spec.get("required", False), spec.get("default"))
+        for name, spec in (fields or {}).items()
+    )
+
+    def validate(params):
+        if params is None:
+            params = {}
+        elif not isinstance(params, dict):
+            raise ValidationError("'params' must be an object")
+        result = {}
+        for name, check, required, default in compiled:
+            value = params.get(name, _MISSING)
+            if value is _MISSING or value is None:
+                if required:
+                    raise ValidationError(f"Missing '{name}' parameter")
+                result[name] = default
+            else:
+                result[name] = check(value)
+        return result
+
+    return validate
+
+
+def describe_params(fields):
+    """Return a JSON-serializable copy of a parameter schema"""
+    described = {}
+    for name, spec in (fields or {}).items():
+        entry = {}
+        for key, value in spec.items():
+            if key == "items":
+                value = describe_params({"item": value})["item"]
+            elif isinstance(value, (tuple, set, frozenset)):
+                value = list(value)
+            entry[key] = value
+        described[name] = entry
+    return described
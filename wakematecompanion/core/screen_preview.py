@@ -0,0 +1,407 @@
+"""
+Remote screen preview for WakeMATECompanion
+
+A preview stream captures the screen at a fixed rate, scales it down, cuts
+each frame into square tiles and sends the phone only the tiles that changed
+since it last saw them. Runs of changed tiles on a row are encoded together
+as one JPEG or PNG, base64 encoded, in a frame like:
+
+    {"type": "screen", "seq": 12, "width": 960, "height": 540,
+     "screen_width": 1920, "screen_height": 1080, "tile": 64,
+     "format": "jpeg", "quality": 70, "keyframe": false,
+     "tiles": [{"x": 128, "y": 64, "w": 192, "h": 64, "data": "..."}]}
+
+The first frame, and any frame after the size changes, is a keyframe
+covering the whole image.
+
+Changed tiles are found by comparing the new frame with what the phone
+shows. With NumPy this is one vectorized comparison of the two frames.
+Without NumPy a hash of every tile is compared instead.
+
+Quality adapts to the connection: while frames wait in its outbound queue,
+frames are skipped and JPEG quality drops; once the queue stays empty,
+quality climbs back and tiles sent at a lower quality are refreshed when
+nothing else changes.
+
+Capture sources are pluggable: anything with a grab() method that returns a
+PIL image works. SyntheticSource draws frames without a display, for tests
+and benchmarks.
+"""
+
+import base64
+import hashlib
+import io
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Optional imports - will be handled gracefully if not available
+try:
+    from PIL import Image, ImageDraw
+    PIL_AVAILABLE = True
+    _BILINEAR = getattr(Image, "Resampling", Image).BILINEAR
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import numpy
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+DEFAULT_FPS = 5.0
+DEFAULT_MAX_WIDTH = 960
+DEFAULT_MAX_HEIGHT = 540
+DEFAULT_TILE = 64
+DEFAULT_QUALITY = 70
+DEFAULT_MIN_QUALITY = 25
+
+# JPEG quality change per frame under pressure, and per frame once drained
+QUALITY_STEP_DOWN = 15
+QUALITY_STEP_UP = 5
+
+# Rows of low-quality tiles refreshed per idle frame
+REFINE_ROWS = 2
+
+
+class ScreenSource:
+    """Captures the real screen with Pillow, or pyautogui where Pillow cannot"""
+
+    def grab(self):
+        """Return the current screen as a PIL image"""
+        try:
+            from PIL import ImageGrab
+            return ImageGrab.grab()
+        except (ImportError, OSError):
+            import pyautogui
+            return pyautogui.screenshot()
+
+
+class SyntheticSource:
+    """Generated frames for tests and benchmarks
+
+    A fixed background with a square moving across it, so successive frames
+    change in a few tiles only. A step of 0 gives a still screen.
+    """
+
+    def __init__(self, width=1920, height=1080, step=24, box=120):
+        """Initialize the source
+
+        Args:
+            width (int, optional): Frame width. Defaults to 1920.
+            height (int, optional): Frame height. Defaults to 1080.
+            step (int, optional): Pixels the square moves per frame.
+            box (int, optional): Size of the square in pixels.
+        """
+        self.width = width
+        self.height = height
+        self.step = step
+        self.box = box
+        self.frames = 0
+        self._background = None
+
+    def grab(self):
+        if self._background is None:
+            self._background = Image.new("RGB", (self.width, self.height))
+            draw = ImageDraw.Draw(self._background)
+            for x in range(0, self.width, 16):
+                draw.line([(x, 0), (x, self.height)], fill=(x % 256, 64, 255 - x % 256))
+        image = self._background.copy()
+        span = max(self.width - self.box, 1)
+        x = (self.frames * self.step) % span
+        y = (self.height - self.box) // 2
+        ImageDraw.Draw(image).rectangle([x, y, x + self.box, y + self.box], fill=(255, 255, 255))
+        self.frames += 1
+        return image
+
+
+def preview_size(width, height, max_width, max_height):
+    """Scale a screen size to fit a bounding box, never enlarging it"""
+    scale = min(max_width / width, max_height / height, 1.0)
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+class TileTracker:
+    """What the phone currently shows, tile by tile"""
+
+    def __init__(self, tile):
+        self.tile = tile
+        self.size = None
+        self.cols = self.rows = 0
+        # NumPy: the frame as shown; otherwise a hash per tile
+        self._shown = None
+        # The same for the image last passed to changed()
+        self._current = None
+        self.quality = []
+
+    def reset(self, size):
+        """Forget everything shown, e.g. for a new frame size"""
+        self.size = size
+        self.cols = -(-size[0] // self.tile)
+        self.rows = -(-size[1] // self.tile)
+        self._shown = None
+        self._current = None
+        self.quality = [0] * (self.cols * self.rows)
+
+    def changed(self, image):
+        """Return the (col, row) tiles of an image that differ from what is shown
+
+        Returns:
+            list: Changed tiles, row by row; all of them after a reset
+        """
+        if image.size != self.size:
+            self.reset(image.size)
+        self._current = numpy.asarray(image) if NUMPY_AVAILABLE else self._hashes(image)
+        if self._shown is None:
+            return [(col, row) for row in range(self.rows) for col in range(self.cols)]
+        if NUMPY_AVAILABLE:
+            return self._changed_numpy(self._current)
+        return [tile for tile, digest in self._current.items() if self._shown.get(tile) != digest]
+
+    def _changed_numpy(self, frame):
+        t = self.tile
+        height, width, channels = frame.shape
+        # Keep channels inside each row: reducing over a 3-wide axis is slow
+        diff = (frame != self._shown).reshape(height, width * channels)
+        pad = ((0, self.rows * t - height), (0, (self.cols * t - width) * channels))
+        if pad[0][1] or pad[1][1]:
+            diff = numpy.pad(diff, pad)
+        per_tile = diff.reshape(self.rows, t, self.cols, t * channels).any(axis=(1, 3))
+        return [(int(col), int(row)) for row, col in zip(*numpy.nonzero(per_tile))]
+
+    def _hashes(self, image):
+        t = self.tile
+        width, height = image.size
+        return {(col, row): hashlib.blake2b(image.crop((col * t, row * t, min((col + 1) * t, width),
+                                                        min((row + 1) * t, height))).tobytes(),
+                                            digest_size=16).digest()
+                for row in range(self.rows) for col in range(self.cols)}
+
+    def mark_sent(self, tiles, quality):
+        """Record that the phone now shows these tiles of the last image checked"""
+        current = self._current
+        if NUMPY_AVAILABLE:
+            if len(tiles) == self.cols * self.rows:
+                self._shown = current.copy()
+            else:
+                if self._shown is None:
+                    # Every pixel differs from this, so unsent tiles stay changed
+                    self._shown = ~current
+                t = self.tile
+                for col, row in tiles:
+                    self._shown[row * t:(row + 1) * t, col * t:(col + 1) * t] = \
+                        current[row * t:(row + 1) * t, col * t:(col + 1) * t]
+        else:
+            if self._shown is None:
+                self._shown = {}
+            for tile in tiles:
+                self._shown[tile] = current[tile]
+        for col, row in tiles:
+            self.quality[row * self.cols + col] = quality
+
+    def below(self, quality, rows):
+        """Return tiles shown at a lower quality, from the first few such rows"""
+        stale = []
+        found_rows = 0
+        for row in range(self.rows):
+            row_tiles = [(col, row) for col in range(self.cols)
+                         if self.quality[row * self.cols + col] < quality]
+            if row_tiles:
+                stale.extend(row_tiles)
+                found_rows += 1
+                if found_rows >= rows:
+                    break
+        return stale
+
+
+def tile_runs(tiles, tile, size, cols, rows):
+    """Merge changed tiles into rectangles, one per run of tiles on a row
+
+    Args:
+        tiles (list): (col, row) tiles
+        tile (int): Tile size in pixels
+        size (tuple): Image (width, height)
+        cols (int): Tiles per row
+        rows (int): Tile rows
+
+    Returns:
+        list: (left, top, right, bottom) boxes; the whole image if every
+            tile changed
+    """
+    width, height = size
+    if len(tiles) == cols * rows:
+        return [(0, 0, width, height)]
+    boxes = []
+    ordered = sorted(tiles, key=lambda t: (t[1], t[0]))
+    for row, group in itertools.groupby(ordered, key=lambda t: t[1]):
+        cols_in_row = [col for col, _ in group]
+        start = prev = cols_in_row[0]
+        for col in cols_in_row[1:] + [None]:
+            if col is not None and col == prev + 1:
+                prev = col
+                continue
+            boxes.append((start * tile, row * tile, min((prev + 1) * tile, width),
+                          min((row + 1) * tile, height)))
+            if col is not None:
+                start = prev = col
+    return boxes
+
+
+def encode_region(image, box, fmt, quality):
+    """Encode part of an image as base64 JPEG or PNG"""
+    buf = io.BytesIO()
+    region = image.crop(box)
+    if fmt == "jpeg":
+        region.save(buf, "JPEG", quality=quality)
+    else:
+        region.save(buf, "PNG", compress_level=1)
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+class PreviewStream:
+    """Captures, diffs and sends frames to one connection on its own thread"""
+
+    def __init__(self, conn, source, codec, fps=DEFAULT_FPS, max_width=DEFAULT_MAX_WIDTH,
+                 max_height=DEFAULT_MAX_HEIGHT, tile=DEFAULT_TILE, fmt="jpeg",
+                 quality=DEFAULT_QUALITY, min_quality=DEFAULT_MIN_QUALITY, backlog_limit=64 * 1024,
+                 metrics=None):
+        """Initialize the stream
+
+        Args:
+            conn (Connection): The connection frames are sent to
+            source: Capture source with grab()
+            codec (JSONCodec): Frame encoder
+            fps (float, optional): Frames captured per second. Defaults to 5.
+            max_width (int, optional): Preview width limit. Defaults to 960.
+            max_height (int, optional): Preview height limit. Defaults to 540.
+            tile (int, optional): Tile size in pixels. Defaults to 64.
+            fmt (str, optional): "jpeg" or "png". Defaults to "jpeg".
+            quality (int, optional): Highest JPEG quality. Defaults to 70.
+            min_quality (int, optional): Lowest JPEG quality under pressure.
+                Defaults to 25.
+            backlog_limit (int, optional): Queued outbound bytes above which
+                frames are skipped. Defaults to 64 KiB.
+            metrics (ServerMetrics, optional): Registry for preview counters
+        """
+        self.conn = conn
+        self.source = source
+        self.codec = codec
+        self.interval = 1.0 / fps
+        self.max_size = (max_width, max_height)
+        self.format = fmt
+        self.max_quality = quality
+        self.min_quality = min(min_quality, quality)
+        self.quality = quality
+        self.backlog_limit = backlog_limit
+        self.metrics = metrics
+        self.tracker = TileTracker(tile)
+        self.seq = 0
+        self.bytes_sent = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start capturing on a background thread"""
+        self._thread = threading.Thread(target=self._run, name=f"wakemate-preview-{self.conn.id}")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop capturing and wait for the thread"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(2)
+
+    def _run(self):
+        next_at = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.step()
+            except OSError as e:
+                logger.info(f"Screen preview for {self.conn.label} stopped: {str(e)}")
+                return
+            except Exception as e:
+                logger.error(f"Screen preview for {self.conn.label} failed: {str(e)}")
+                return
+            # Keep the rate steady; skip the frames a slow capture missed
+            next_at += self.interval
+            now = time.monotonic()
+            if next_at < now:
+                next_at = now
+            self._stop.wait(next_at - now)
+
+    def _under_pressure(self):
+        return self.conn.write_blocked() or self.conn.pending_bytes > self.backlog_limit
+
+    def step(self):
+        """Capture one frame and send what changed
+
+        Returns:
+            dict: The frame sent, or None if nothing was sent
+        """
+        if self._under_pressure():
+            # The phone has not taken the last frames yet: skip this one
+            self.quality = max(self.min_quality, self.quality - QUALITY_STEP_DOWN)
+            if self.metrics:
+                self.metrics.increment("preview_frames_skipped_total")
+            return None
+        if self.conn.pending_bytes == 0 and self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + QUALITY_STEP_UP)
+
+        t0 = time.perf_counter()
+        screen = self.source.grab()
+        size = preview_size(screen.width, screen.height, *self.max_size)
+        image = screen.resize(size, _BILINEAR) if size != screen.size else screen
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        t1 = time.perf_counter()
+
+        keyframe = image.size != self.tracker.size
+        tiles = self.tracker.changed(image)
+        if not tiles and self.format == "jpeg" and self.quality == self.max_quality:
+            # Nothing moved: use the time to sharpen tiles sent while congested
+            tiles = self.tracker.below(self.quality, REFINE_ROWS)
+        t2 = time.perf_counter()
+        if not tiles:
+            return None
+
+        tracker = self.tracker
+        regions = []
+        for box in tile_runs(tiles, tracker.tile, image.size, tracker.cols, tracker.rows):
+            regions.append({"x": box[0], "y": box[1], "w": box[2] - box[0], "h": box[3] - box[1],
+                            "data": encode_region(image, box, self.format, self.quality)})
+        self.seq += 1
+        frame = {
+            "type": "screen",
+            "seq": self.seq,
+            "width": image.width,
+            "height": image.height,
+            "screen_width": screen.width,
+            "screen_height": screen.height,
+            "tile": tracker.tile,
+            "format": self.format,
+            "quality": self.quality,
+            "keyframe": keyframe,
+            "tiles": regions,
+        }
+        payload = self.codec.frame(frame)
+        t3 = time.perf_counter()
+        self.conn.send(payload)
+        tracker.mark_sent(tiles, self.quality if self.format == "jpeg" else 100)
+        self.bytes_sent += len(payload)
+
+        if self.metrics:
+            self.metrics.increment("preview_frames_total")
+            self.metrics.increment("preview_tiles_total", value=len(tiles))
+            self.metrics.increment("preview_bytes_total", value=len(payload))
+            self.metrics.observe("preview_capture_ms", (t1 - t0) * 1000)
+            self.metrics.observe("preview_diff_ms", (t2 - t1) * 1000)
+            self.metrics.observe("preview_encode_ms", (t3 - t2) * 1000)
+        return frame
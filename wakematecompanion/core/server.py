@@ -2,31 +2,513 @@
 Server implementation for WakeMATECompanion
 """
 
+import selectors
+import signal
 import socket
+import ssl
+import sys
 import threading
-import json
 import logging
-import pyautogui
+import time
+import types
+
+from .auth import Authenticator, AuthError, AUTH_OFF
+from . import capture as capture_format
+from . import diagnostics
+from . import handoff
+from . import netmon
+from . import outbound
+from . import compression as compression_utils
+from . import screen_preview
+from .codec import DECODE_ERRORS, JSONCodec, PreencodedResponse, get_codec, preencoded
+from .connections import ConnectionTable, enable_keepalive
+from . import listeners as listener_utils
+from .input_aggregation import InputAggregator
+from .gateway import Gateway
+from .idempotency import IdempotencyBusy, IdempotencyCache, MAX_KEY_LENGTH
+from .metrics import ServerMetrics, MetricsHTTPServer
+from .plugins import LazyFunction, discover as discover_plugins
+from .rate_limit import RateLimiter, command_class
+from .schema import COMMAND_PARAMS, InvalidRequest, ValidationError, compile_params, describe_params
+from .scheduler import PriorityScheduler, SchedulerBusy, PRIORITY_CONTROL, PRIORITY_INPUT
+from .subscriptions import SubscriptionHub
+from .tls import TLSConfig
+from .transfers import UPLOAD, TransferError, TransferManager, default_directory
+from . import tracing
+from .utils import network_utils
+from . import media_controls
 
 logger = logging.getLogger("WakeMATECompanion")
 
+# Seconds allowed for a client to complete the TLS handshake
+TLS_HANDSHAKE_TIMEOUT = 10.0
+
+# Seconds to wait for the rest of a compressed frame that spans several reads
+COMPRESSED_FRAME_TIMEOUT = 10.0
+
+# Command classes that run on the executor, and their priority
+CLASS_PRIORITIES = {
+    "media": PRIORITY_CONTROL,
+    "power": PRIORITY_CONTROL,
+    "wake": PRIORITY_CONTROL,
+    "input": PRIORITY_INPUT,
+}
+
+# Peer hosts that count as this machine for admin commands
+LOCAL_HOSTS = ("unix", "127.0.0.1", "::1")
+
+# With auth off, these are only taken from this machine
+POWER_COMMANDS = ("shutdown", "restart", "sleep", "logoff")
+
+# Commands that type or drive the pointer; they need a session in
+# "protected" mode, since typing on the machine is as good as running code
+INPUT_COMMANDS = ("mouse_move", "mouse_click", "mouse_scroll", "mouse_button", "mouse_drag",
+                  "keyboard_input", "key_press", "keyboard_special")
+
+# Command classes that honour idempotency keys
+IDEMPOTENT_CLASSES = ("power", "wake")
+
+# Pointer commands that only queue work for the input aggregator, so they
+# run inline on the reader thread instead of taking an executor slot each
+AGGREGATED_COMMANDS = ("mouse_move", "mouse_scroll", "mouse_click", "mouse_button", "mouse_drag")
+
+# Backend functions, imported on first use and then called directly, and
+# timed when a traced request calls them
+def _backend(module, name):
+    return tracing.traced(LazyFunction(f"{__package__}.{module}", name), f"{module}.{name}")
+
+_move_mouse = _backend("input_controls", "move_mouse")
+_click_mouse = _backend("input_controls", "click_mouse")
+_scroll_mouse = _backend("input_controls", "scroll_mouse")
+_hscroll_mouse = _backend("input_controls", "hscroll_mouse")
+_mouse_button = _backend("input_controls", "mouse_button")
+_type_text = _backend("input_controls", "type_text")
+_press_key = _backend("input_controls", "press_key")
+_shutdown = _backend("system_controls", "shutdown")
+_restart = _backend("system_controls", "restart")
+_sleep = _backend("system_controls", "sleep")
+_logoff = _backend("system_controls", "logoff")
+_send_magic_packet = _backend("utils.wol", "send_magic_packet")
+
+# Default input backend: pyautogui through input_controls
+_pyautogui_backend = types.SimpleNamespace(
+    name="pyautogui",
+    move_mouse=_move_mouse,
+    click_mouse=_click_mouse,
+    scroll_mouse=_scroll_mouse,
+    hscroll_mouse=_hscroll_mouse,
+    mouse_button=_mouse_button,
+    type_text=_type_text,
+    press_key=_press_key,
+)
+
+INPUT_BACKENDS = ("pyautogui", "uinput", "auto")
+
+
+def open_input_backend(name="pyautogui", uinput_device=None):
+    """Return the input backend for a configured name
+    
+    Args:
+        name (str, optional): "pyautogui", "uinput" (Linux virtual device) or
+            "auto", which picks uinput on Linux when the device is writable.
+            Defaults to "pyautogui".
+        uinput_device (str, optional): uinput device path, or a regular file
+            to record events into. Defaults to /dev/uinput.
+    
+    Returns:
+        The backend object
+    """
+    if name not in INPUT_BACKENDS:
+        raise ValueError(f"Unknown input backend: {name}")
+    if name == "pyautogui":
+        return _pyautogui_backend
+    if sys.platform.startswith("linux"):
+        from . import uinput
+        device = uinput_device or uinput.DEFAULT_DEVICE
+        if name == "uinput" or uinput.available(device):
+            return uinput.UInputBackend(device)
+    elif name == "uinput":
+        raise ValueError("The uinput input backend is only available on Linux")
+    return _pyautogui_backend
+
+# Sent to clients turned away because the connection table is full
+BUSY_RESPONSE = preencoded({"status": "error", "message": "Server busy"}).frame
+
+# Constant responses, encoded once
+COMMAND_EXECUTED = preencoded({"status": "success", "message": "Command executed"})
+MOUSE_MOVED = preencoded({"status": "success", "message": "Mouse moved"})
+MOUSE_CLICKED = preencoded({"status": "success", "message": "Mouse clicked"})
+MOUSE_SCROLLED = preencoded({"status": "success", "message": "Mouse scrolled"})
+MOUSE_BUTTON_SET = preencoded({"status": "success", "message": "Mouse button updated"})
+MOUSE_DRAGGED = preencoded({"status": "success", "message": "Mouse dragged"})
+TEXT_TYPED = preencoded({"status": "success", "message": "Text typed"})
+KEY_PRESSED = preencoded({"status": "success", "message": "Key pressed"})
+SHUTTING_DOWN = preencoded({"status": "success", "message": "Shutting down"})
+RESTARTING = preencoded({"status": "success", "message": "Restarting"})
+GOING_TO_SLEEP = preencoded({"status": "success", "message": "Going to sleep"})
+LOGGING_OFF = preencoded({"status": "success", "message": "Logging off"})
+SUCCESS = preencoded({"status": "success"})
+
 class WakeMateServer:
     """Server for handling phone app connections"""
     
-    def __init__(self, ip, port=7777):
+    def __init__(self, ip, port=7777, metrics_port=None, max_connections=64,
+                 idle_timeout=300.0, ping_interval=None, keepalive=True,
+                 auth_mode=AUTH_OFF, pairing_key=None, tls=False, tls_cert=None,
+                 tls_key=None, rate_limiting=True, rate_limits=None, executor_workers=1,
+                 max_queued=1024, idempotency_ttl=600.0, idempotency_max_entries=1024,
+                 plugins=True, plugin_dirs=None, listeners=None, reuse_port=False,
+                 shared_state=None, codec=None, input_backend="pyautogui", uinput_device=None,
+                 gateway_port=None, gateway_origins=None, capture=None, capture_max_bytes=None,
+                 capture_redact_input=True, trace_sample_rate=None,
+                 trace_buffer_size=tracing.DEFAULT_CAPACITY,
+                 handoff_path=None, network_monitor=False,
+                 write_high_watermark=outbound.DEFAULT_HIGH_WATERMARK,
+                 write_low_watermark=outbound.DEFAULT_LOW_WATERMARK,
+                 write_stall_timeout=outbound.DEFAULT_STALL_TIMEOUT,
+                 write_overflow=outbound.CONFLATE, compression=True,
+                 compression_threshold=compression_utils.DEFAULT_THRESHOLD, compression_level=None,
+                 preview_source=None, file_transfers=True, transfer_dir=None, max_transfers=4):
         """Initialize the server
         
         Args:
             ip (str): The IP address to bind to
             port (int, optional): The port to listen on. Defaults to 7777.
+            metrics_port (int, optional): Serve Prometheus metrics on this
+                loopback port. Defaults to None (disabled).
+            max_connections (int, optional): Connections beyond this are
+                rejected immediately. Defaults to 64; None means unlimited.
+            idle_timeout (float, optional): Close connections that send nothing
+                for this many seconds. Defaults to 300; None disables it.
+            ping_interval (float, optional): Send an application-level ping to
+                connections idle for this many seconds. Defaults to None (off).
+            keepalive (bool, optional): Enable TCP keepalive on client sockets.
+                Defaults to True.
+            auth_mode (str, optional): "off", "protected" (power, wake,
+                keyboard and mouse commands need a paired session) or "required". Defaults to "off",
+                in which shutdown, restart, sleep and logoff are only accepted
+                from this machine.
+            pairing_key (bytes or str, optional): Pairing key shared through the
+                QR code. Loaded from the user config directory if omitted.
+            tls (bool, optional): Serve over TLS with a self-signed certificate
+                whose fingerprint is shared through the QR code. Defaults to False.
+            tls_cert (str, optional): Certificate path; generated if missing
+            tls_key (str, optional): Private key path; generated if missing
+            rate_limiting (bool, optional): Enforce per-client token buckets.
+                Defaults to True.
+            rate_limits (dict, optional): Overrides for DEFAULT_RATE_LIMITS,
+                mapping command class to (rate per second, burst)
+            executor_workers (int, optional): Threads running backend commands.
+                Defaults to 1.
+            max_queued (int, optional): Queued backend commands allowed per
+                priority before new ones are refused. Defaults to 1024.
+            idempotency_ttl (float, optional): Seconds the response to a power
+                or wake command is replayed for a retry carrying the same
+                idempotency key. Defaults to 600.
+            idempotency_max_entries (int, optional): Idempotency keys remembered
+                before the oldest is dropped. Defaults to 1024.
+            plugins (bool, optional): Register plugin commands from entry points
+                and plugin directories. Defaults to True.
+            plugin_dirs (list, optional): Directories of plugin files. Defaults
+                to ~/.wakematecompanion/plugins.
+            listeners (list, optional): Addresses to listen on, as (host, port)
+                tuples or strings like "[::]:7777" or "unix:/path/to.sock"
+                (see listeners.py). Defaults to [(ip, port)].
+            reuse_port (bool, optional): Bind TCP listeners with SO_REUSEPORT.
+                Used by pre-fork workers. Defaults to False.
+            shared_state (SharedStateClient, optional): Coordinator connection
+                that makes idempotency keys, power/wake rate limits and metrics
+                span every pre-fork worker (see prefork.py)
+            codec (str or JSONCodec, optional): JSON codec, "orjson" or "json".
+                Defaults to orjson when it is installed.
+            input_backend (str, optional): "pyautogui", "uinput" or "auto"
+                (see open_input_backend). Defaults to "pyautogui".
+            uinput_device (str, optional): Device for the uinput backend.
+                Defaults to /dev/uinput.
+            gateway_port (int, optional): Also serve WebSocket and HTTP
+                keep-alive clients on this port (see gateway.py). Defaults to
+                None (disabled).
+            gateway_origins (list, optional): Browser origins allowed to use
+                the gateway. Defaults to none.
+            capture (str, optional): Record all traffic to this capture file
+                for later replay (see capture.py). Defaults to None (off).
+            capture_max_bytes (int, optional): Stop capturing once the file
+                reaches this size. Defaults to None (unlimited).
+            capture_redact_input (bool, optional): Mask typed text in the
+                capture. Defaults to True.
+            trace_sample_rate (float, optional): Trace this share of requests
+                from startup (see tracing.py). Defaults to None (off); the
+                trace_start command turns tracing on later.
+            trace_buffer_size (int, optional): Spans kept in the trace ring
+                buffer. Defaults to 65536.
+            handoff_path (str, optional): Unix control socket for zero-downtime
+                restarts (see handoff.py). On start the server takes over the
+                listeners and clients of a server running with the same path,
+                then accepts takeovers itself. Defaults to None (off).
+            network_monitor (bool or object, optional): Watch for network
+                changes and resume, then rebind stale listeners and announce
+                the new address (see netmon.py). True uses the platform's
+                event source; a source object such as netmon.FakeSource can
+                be passed instead. Defaults to False.
+            write_high_watermark (int, optional): Bytes queued for a client
+                before its reader pauses and push updates are held back (see
+                outbound.py). Defaults to 256 KiB.
+            write_low_watermark (int, optional): Queued bytes below which a
+                paused client resumes. Defaults to 64 KiB.
+            write_stall_timeout (float, optional): Seconds a client may stay
+                above the high watermark before it is disconnected.
+                Defaults to 10.
+            write_overflow (str, optional): What to do with push updates for a
+                client above the high watermark: "conflate" merges them into
+                one snapshot per topic, dropping older status updates, and
+                "disconnect" closes the connection. Defaults to "conflate".
+            compression (bool or list, optional): Let clients negotiate
+                compressed frames with the compression command (see
+                compression.py). A list restricts and orders the algorithms.
+                Defaults to True (every installed algorithm).
+            compression_threshold (int, optional): Frames shorter than this
+                are not compressed unless the client asks for another
+                threshold. Defaults to 1024.
+            compression_level (int, optional): Compression level for every
+                algorithm. Defaults to each algorithm's own default.
+            preview_source (optional): Capture source for screen previews,
+                any object with a grab() method returning a PIL image (see
+                screen_preview.py). Defaults to the real screen.
+            file_transfers (bool, optional): Accept file uploads and serve
+                downloads over separate data connections (see transfers.py).
+                Defaults to True.
+            transfer_dir (str, optional): Directory uploads are written to
+                and downloads are served from. Defaults to
+                ~/Downloads/WakeMATE.
+            max_transfers (int, optional): Transfers that may move data at
+                the same time. Defaults to 4.
         """
         self.ip = ip
         self.port = port
+        self.listener_specs = [listener_utils.parse_listener(spec)
+                               for spec in (listeners or [(ip, port)])]
+        self.addresses = []
+        # The TCP port actually listened on; differs from port when it is 0
+        self.bound_port = port
         self.running = False
-        self.socket = None
+        self._listeners = []
         self.server_thread = None
-        self.connected_clients = []
+        self.connections = ConnectionTable(max_connections)
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.keepalive = keepalive
         self.on_notification = None
+        self.on_handoff = None
+        self.on_network_change = None
+        self.codec = codec if isinstance(codec, JSONCodec) else get_codec(codec)
+        self.auth = Authenticator(auth_mode, pairing_key)
+        self.tls = TLSConfig(tls_cert, tls_key) if tls else None
+        
+        # Metrics
+        self.metrics = ServerMetrics()
+        self.metrics.register_gauge("connections_active", lambda: len(self.connections))
+        self.metrics.register_gauge("commands_in_flight", lambda: self._in_flight)
+        if self.tls:
+            self.metrics.register_gauge("tls_session_cache_hits", lambda: self.tls.session_stats()["hits"])
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        
+        # Rate limiting and scheduling
+        self.rate_limiter = RateLimiter(rate_limits, self.metrics) if rate_limiting else None
+        self.scheduler = PriorityScheduler(executor_workers, max_queued, self.metrics)
+        self.idempotency = IdempotencyCache(idempotency_max_entries, idempotency_ttl,
+                                            metrics=self.metrics)
+        self.input_backend = open_input_backend(input_backend, uinput_device)
+        self.input = InputAggregator(
+            self.input_backend,
+            self._submit_input,
+            self.metrics
+        )
+        self.reuse_port = reuse_port
+        self.shared_state = shared_state
+        if shared_state is not None:
+            self.idempotency = shared_state.idempotency
+            if self.rate_limiter:
+                self.rate_limiter = shared_state.wrap_rate_limiter(self.rate_limiter)
+        
+        # Traffic capture
+        self.capture_path = capture
+        self.capture_max_bytes = capture_max_bytes
+        self.capture_redact_input = capture_redact_input
+        self.capture = None
+        
+        # Span tracing; the tracer is kept after trace_stop so it can be dumped
+        self.tracer = None
+        self._active_tracer = None
+        self._trace_signal = None
+        if trace_sample_rate:
+            self.tracer = tracing.Tracer(trace_buffer_size, trace_sample_rate)
+        
+        # On-demand CPU profiling and memory snapshots
+        self.profiler = None
+        self.memory = diagnostics.MemoryTracker()
+        self._admin_commands = set()
+        
+        # Socket handoff to and from other servers
+        self.handoff_path = handoff_path if handoff_path and handoff.handoff_supported() else None
+        if handoff_path and not self.handoff_path:
+            logger.warning("Socket handoff is not supported on this platform")
+        self._handoff_listener = None
+        self._handing_off = False
+        self._released = []
+        self._inherited_listeners = []
+        
+        # Network change monitoring
+        self.network_source = network_monitor
+        self.network_monitor = None
+        self._network_changed_at = None
+        self._wake_w = None
+        
+        # WebSocket / HTTP gateway
+        self.gateway = None
+        if gateway_port is not None:
+            self.gateway = Gateway(self, ip, gateway_port, gateway_origins)
+        
+        # Non-blocking client writes
+        self.outbound = outbound.OutboundWriter(write_high_watermark, write_low_watermark,
+                                                write_stall_timeout, write_overflow, self.metrics)
+        
+        # Frame compression
+        if compression is True:
+            self.compression_algorithms = compression_utils.available()
+        else:
+            self.compression_algorithms = [name for name in (compression or [])
+                                           if name in compression_utils.available()]
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+        
+        # Screen preview streams by connection ID
+        self.preview_source = preview_source
+        self._previews = {}
+        self._previews_lock = threading.Lock()
+        
+        # File transfers
+        self.transfers = None
+        if file_transfers:
+            self.transfers = TransferManager(transfer_dir or default_directory(), max_transfers,
+                                             codec=self.codec, metrics=self.metrics,
+                                             on_complete=self._on_transfer_complete)
+        
+        # Push subscriptions
+        self.subscriptions = SubscriptionHub(self.metrics, max_lag=write_stall_timeout, codec=self.codec)
+        self.subscriptions.register_source("volume", media_controls.get_volume_state)
+        self.subscriptions.register_source("now_playing", media_controls.get_now_playing)
+        
+        # Command dispatch table, with validators compiled from each schema
+        self.commands = {}
+        self._validators = {}
+        self._command_info = {}
+        builtin = {
+            "media_play_pause": self._handle_media_play_pause,
+            "media_next": self._handle_media_next,
+            "media_prev": self._handle_media_previous,
+            "volume_up": self._handle_volume_up,
+            "volume_down": self._handle_volume_down,
+            "volume_mute": self._handle_volume_mute,
+            "mouse_move": self._handle_mouse_move,
+            "mouse_click": self._handle_mouse_click,
+            "mouse_scroll": self._handle_mouse_scroll,
+            "mouse_button": self._handle_mouse_button,
+            "mouse_drag": self._handle_mouse_drag,
+            "keyboard_input": self._handle_keyboard_input,
+            "key_press": self._handle_key_press,
+            "shutdown": self._handle_shutdown,
+            "restart": self._handle_restart,
+            "sleep": self._handle_sleep,
+            "logoff": self._handle_logoff,
+            "wake": self._handle_wake,
+            "get_status": self._handle_get_status,
+            "get_metrics": self._handle_get_metrics,
+            "get_connections": self._handle_get_connections,
+            "ping": self._handle_ping,
+            "pong": self._handle_pong,
+            "subscribe": self._handle_subscribe,
+            "unsubscribe": self._handle_unsubscribe,
+            "auth_hello": self._handle_auth_hello,
+            "compression": self._handle_compression,
+            "preview_start": self._handle_preview_start,
+            "preview_stop": self._handle_preview_stop,
+            "list_commands": self._handle_list_commands,
+        }
+        admin = {
+            "trace_start": self._handle_trace_start,
+            "trace_stop": self._handle_trace_stop,
+            "trace_dump": self._handle_trace_dump,
+            "profile_start": self._handle_profile_start,
+            "profile_stop": self._handle_profile_stop,
+            "memory_snapshot": self._handle_memory_snapshot,
+            "memory_diff": self._handle_memory_diff,
+            "memory_stop": self._handle_memory_stop,
+            "get_diagnostics": self._handle_get_diagnostics,
+        }
+        if self.transfers is not None:
+            builtin.update({
+                "file_upload": self._handle_file_upload,
+                "file_download": self._handle_file_download,
+                "file_list": self._handle_file_list,
+                "transfer_attach": self._handle_transfer_attach,
+                "transfer_status": self._handle_transfer_status,
+                "transfer_cancel": self._handle_transfer_cancel,
+            })
+        for name, handler in builtin.items():
+            self.register_command(name, handler, COMMAND_PARAMS.get(name), protected=name in INPUT_COMMANDS)
+        for name, handler in admin.items():
+            self.register_command(name, handler, COMMAND_PARAMS.get(name), admin=True)
+        # The name older app versions use for key_press
+        self.register_command("keyboard_special", self._handle_key_press, COMMAND_PARAMS["key_press"],
+                              "Alias of key_press", protected=True)
+        if plugins:
+            self._register_plugins(plugin_dirs)
+    
+    def register_command(self, name, handler, params=None, description=None, protected=False,
+                         admin=False):
+        """Add or replace a command
+        
+        Args:
+            name (str): The command name clients send
+            handler (function): Called as handler(params, conn); returns the
+                response dict, or None for no reply
+            params (dict, optional): Parameter schema (see schema.py), compiled
+                here once and enforced before every dispatch
+            description (str, optional): Shown by list_commands. Defaults to
+                the first line of the handler's docstring.
+            protected (bool, optional): Require a session in "protected" auth
+                mode. Defaults to False.
+            admin (bool, optional): Only accept the command from this machine
+                or over an authenticated session, whatever the auth mode.
+                Implies protected. Defaults to False.
+        """
+        if description is None:
+            description = (handler.__doc__ or "").strip().split("\n")[0]
+        self._validators[name] = compile_params(params)
+        self._command_info[name] = {"description": description, "params": describe_params(params)}
+        self.commands[name] = handler
+        if admin:
+            self._admin_commands.add(name)
+        else:
+            self._admin_commands.discard(name)
+        if protected or admin:
+            self.auth.protect(name)
+    
+    def _register_plugins(self, plugin_dirs):
+        """Register plugin commands; their modules load on first use"""
+        for plugin in discover_plugins(plugin_dirs):
+            if plugin.name in self.commands:
+                logger.warning(f"Ignoring plugin command '{plugin.name}' from {plugin.source}: name already in use")
+                continue
+            try:
+                self.register_command(plugin.name, plugin.handler, plugin.params,
+                                      plugin.description, plugin.protected)
+                logger.info(f"Registered plugin command '{plugin.name}' from {plugin.source}")
+            except Exception as e:
+                logger.error(f"Failed to register plugin command '{plugin.name}': {str(e)}")
     
     def set_notification_callback(self, callback):
         """Set the notification callback
@@ -36,6 +518,22 @@ class WakeMateServer:
         """
         self.on_notification = callback
     
+    def set_handoff_callback(self, callback):
+        """Set a callback run after this server has handed over to a replacement
+        
+        Args:
+            callback (function): A function that takes no parameters
+        """
+        self.on_handoff = callback
+    
+    def set_network_callback(self, callback):
+        """Set a callback run after listeners recover from a network change
+        
+        Args:
+            callback (function): A function that takes the server IP
+        """
+        self.on_network_change = callback
+    
     def start(self):
         """Start the server"""
         if self.running:
@@ -43,14 +541,73 @@ class WakeMateServer:
             return False
         
         try:
-            # Start server in a separate thread
+            # Take over the sockets of a server being replaced, if there is one
+            takeover = None
+            if self.handoff_path:
+                takeover = handoff.take_over(self.handoff_path)
+                if takeover is not None:
+                    self._inherited_listeners = takeover.listeners
+                    self.auth.import_sessions(takeover.sessions)
+                    if self.gateway:
+                        self.gateway.sock = takeover.gateway_socket
+            self._handing_off = False
+            
+            # Watch for network changes before listening, so a listener that
+            # cannot open yet is retried once the network is up
+            if self.network_source and self.network_monitor is None:
+                source = netmon.default_source() if self.network_source is True else self.network_source
+                if source is None:
+                    logger.warning("No network change notifications on this platform")
+                else:
+                    self.network_monitor = netmon.NetworkMonitor(self._on_network_change, source)
+                    self.network_monitor.start()
+            
+            # Start server in a separate thread; running is set first because
+            # the thread exits as soon as it sees it unset
+            self.running = True
             self.server_thread = threading.Thread(target=self._run_server)
             self.server_thread.daemon = True
             self.server_thread.start()
             
-            self.running = True
             logger.info(f"Server started on {self.ip}:{self.port}")
             
+            if self.capture_path and self.capture is None:
+                self.capture = capture_format.CaptureWriter(self.capture_path, self.capture_max_bytes,
+                                                            self.capture_redact_input)
+            self.scheduler.start()
+            self.outbound.start()
+            self.subscriptions.start()
+            if self.shared_state is not None:
+                self.shared_state.start(self.metrics)
+            if self.tracer:
+                self._enable_tracing(self.tracer)
+                self._install_trace_signal()
+            if self.gateway:
+                try:
+                    self.gateway.start()
+                except Exception as e:
+                    logger.error(f"Failed to start gateway: {str(e)}")
+            if takeover is not None:
+                for sock, meta in takeover.connections:
+                    self._adopt_client(sock, meta)
+            if self.handoff_path and self._handoff_listener is None:
+                try:
+                    self._handoff_listener = handoff.HandoffListener(self.handoff_path, self._hand_over)
+                    self._handoff_listener.start()
+                except Exception as e:
+                    logger.error(f"Failed to open handoff socket {self.handoff_path}: {str(e)}")
+                    self._handoff_listener = None
+            self._publish_status()
+            
+            # Start optional metrics endpoint
+            if self.metrics_port is not None and self.metrics_server is None:
+                try:
+                    self.metrics_server = MetricsHTTPServer(self.metrics, port=self.metrics_port)
+                    self.metrics_server.start()
+                except Exception as e:
+                    logger.error(f"Failed to start metrics endpoint: {str(e)}")
+                    self.metrics_server = None
+            
             if self.on_notification:
                 self.on_notification("Server Started", f"Listening on {self.ip}:{self.port}")
             
@@ -73,21 +630,55 @@ class WakeMateServer:
         try:
             # Stop server
             self.running = False
-            
-            # Close all client connections
-            for client_sock, addr in self.connected_clients:
+            if self._handoff_listener:
+                self._handoff_listener.close()
+                self._handoff_listener = None
+            if self.network_monitor:
+                self.network_monitor.stop()
+                self.network_monitor = None
+            wake_w = self._wake_w
+            if wake_w is not None:
                 try:
-                    client_sock.close()
-                    logger.info(f"Closed connection to {addr[0]}:{addr[1]}")
-                except:
+                    wake_w.send(b"\0")
+                except OSError:
                     pass
             
-            self.connected_clients = []
+            # Stop the gateway, closing its connections
+            if self.gateway:
+                self.gateway.stop()
+            
+            # Stop pushing updates and running queued commands
+            self.subscriptions.stop()
+            for conn_id in list(self._previews):
+                self._stop_preview(conn_id)
+            self.scheduler.stop()
+            if hasattr(self.input_backend, "close"):
+                self.input_backend.close()
+            if self.shared_state is not None:
+                self.shared_state.stop()
+            
+            # Close all client connections
+            for conn in self.connections.close_all():
+                logger.info(f"Closed connection to {conn.label}")
+            self.outbound.stop()
+            
+            # Stop metrics endpoint
+            if self.metrics_server:
+                self.metrics_server.stop()
+                self.metrics_server = None
+            
+            # Close listening sockets
+            self._close_listeners(self._listeners)
             
-            # Close server socket
-            if self.socket:
-                self.socket.close()
-                self.socket = None
+            if self.capture:
+                self.capture.close()
+                self.capture = None
+            
+            self._disable_tracing()
+            self._restore_trace_signal()
+            if self.profiler:
+                self.profiler.stop()
+            self.memory.stop()
             
             logger.info("Server stopped")
             
@@ -105,69 +696,273 @@ class WakeMateServer:
             return False
     
     def _run_server(self):
-        """Server thread function"""
+        """Server thread function: accept on every listener from one selector"""
+        selector = selectors.DefaultSelector()
+        listeners = []
+        self._listeners = listeners
         try:
-            # Create socket
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socket.bind((self.ip, self.port))
-            self.socket.listen(5)
-            self.socket.settimeout(1.0)  # Add timeout for accepting connections
-            
-            logger.info(f"Server listening on {self.ip}:{self.port}")
-            
-            while self.running:
+            # Create listening sockets, reusing any taken over from a previous server
+            inherited, self._inherited_listeners = self._inherited_listeners, []
+            for family, address in self.listener_specs:
+                match = next((entry for entry in inherited
+                              if listener_utils.same_address(family, address, entry[1], entry[2])), None)
+                if match is not None:
+                    inherited.remove(match)
+                    sock, _, bound = match
+                    listeners.append((sock, family, bound))
+                    selector.register(sock, selectors.EVENT_READ, (family, bound))
+                    logger.info(f"Server listening on {listener_utils.format_address(family, bound)} (inherited)")
+                    continue
                 try:
-                    # Accept connection
-                    client_sock, addr = self.socket.accept()
-                    
-                    # Handle client in a new thread
-                    client_thread = threading.Thread(
-                        target=self._handle_client,
-                        args=(client_sock, addr)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-                    
-                    # Add to clients list
-                    self.connected_clients.append((client_sock, addr))
-                    
-                    # Log connection
-                    logger.info(f"New connection from {addr[0]}")
-                    
-                    if self.on_notification:
-                        self.on_notification("New Connection", f"Device at {addr[0]} connected")
-                
-                except socket.timeout:
-                    continue  # Timeout allows checking server_running flag
+                    sock, bound = listener_utils.open_listener(family, address, self.reuse_port)
                 except Exception as e:
-                    if self.running:  # Only show errors if server should be running
-                        logger.error(f"Server error: {str(e)}")
-                    break
+                    logger.error(f"Failed to listen on {listener_utils.format_address(family, address)}: {str(e)}")
+                    continue
+                listeners.append((sock, family, bound))
+                selector.register(sock, selectors.EVENT_READ, (family, bound))
+                logger.info(f"Server listening on {listener_utils.format_address(family, bound)}")
+            
+            # Inherited listeners the new configuration no longer asks for
+            self._close_listeners(inherited)
+            
+            self._set_addresses(listeners)
+            if not listeners:
+                if not self.network_monitor:
+                    raise OSError("No listener could be opened")
+                logger.warning("No listener could be opened; waiting for the network")
+            
+            # Lets the network monitor interrupt select() right away
+            wake_r, self._wake_w = socket.socketpair()
+            wake_r.setblocking(False)
+            selector.register(wake_r, selectors.EVENT_READ, None)
+            
+            while self.running and not self._handing_off:
+                # Timeout allows checking server_running flag
+                for key, _ in selector.select(timeout=1.0):
+                    if key.data is None:
+                        self._drain_wakeups(wake_r)
+                        if self._network_changed_at is not None:
+                            self._refresh_listeners(selector, listeners)
+                        continue
+                    family, bound = key.data
+                    try:
+                        client_sock, addr = key.fileobj.accept()
+                    except (BlockingIOError, InterruptedError):
+                        continue  # Another wakeup already took it
+                    except Exception as e:
+                        if self.running:  # Only show errors if server should be running
+                            logger.error(f"Server error: {str(e)}")
+                        continue
+                    self._accept_client(client_sock, listener_utils.peer_address(family, addr, bound), family)
         
         except Exception as e:
             logger.error(f"Server error: {str(e)}")
         
         finally:
-            # Clean up if thread exits
-            if self.socket:
-                self.socket.close()
-                self.socket = None
+            # Clean up if thread exits; during a handoff the listeners are
+            # passed on by _hand_over instead
+            for key in list(selector.get_map().values()):
+                if key.data is None:
+                    key.fileobj.close()
+            if self._wake_w is not None:
+                self._wake_w.close()
+                self._wake_w = None
+            selector.close()
+            if not self._handing_off:
+                self._close_listeners(listeners)
             logger.info("Server stopped")
     
-    def _handle_client(self, client_sock, addr):
+    def _drain_wakeups(self, wake_r):
+        """Empty the wake-up socket"""
+        try:
+            while wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+    
+    def _on_network_change(self, events, detected_at):
+        """Network monitor callback: note the new address and wake the server thread
+        
+        Args:
+            events (list): NetworkEvents merged from one burst
+            detected_at (float): time.monotonic() when the burst was first seen
+        """
+        kinds = sorted({event.kind for event in events})
+        logger.info(f"Network change: {', '.join(kinds)}")
+        for kind in kinds:
+            self.metrics.increment("network_events_total", (kind,))
+        
+        # Follow the machine's address; 127.0.0.1 means there is no route yet
+        new_ip = network_utils.get_local_ip()
+        old_ip = self.ip
+        if new_ip != old_ip and new_ip != "127.0.0.1":
+            logger.info(f"Server address changed from {old_ip} to {new_ip}")
+            self.ip = new_ip
+            specs = []
+            for family, address in self.listener_specs:
+                if family in (socket.AF_INET, socket.AF_INET6) and address[0] == old_ip:
+                    address = (new_ip, address[1])
+                specs.append((family, address))
+            self.listener_specs = specs
+        
+        # Connections on a removed address are dead; let their phones reconnect now
+        removed = {event.address for event in events if event.kind == netmon.ADDRESS_REMOVED and event.address}
+        if removed:
+            for conn in self.connections.all():
+                try:
+                    local = conn.sock.getsockname()
+                except OSError:
+                    continue
+                if isinstance(local, tuple) and local[0] in removed:
+                    logger.info(f"Closing {conn.label}: local address {local[0]} was removed")
+                    # Shut down rather than close, so the reader sees EOF and cleans up
+                    try:
+                        conn.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+        
+        if self._network_changed_at is None:
+            self._network_changed_at = detected_at
+        wake_w = self._wake_w
+        if wake_w is not None:
+            try:
+                wake_w.send(b"\0")
+            except OSError:
+                pass
+    
+    def _set_addresses(self, listeners):
+        """Record the addresses and the TCP port actually listened on"""
+        self.addresses = [listener_utils.format_address(family, bound) for _, family, bound in listeners]
+        self.bound_port = next((bound[1] for _, family, bound in listeners
+                                if family in (socket.AF_INET, socket.AF_INET6)), self.port)
+    
+    def _refresh_listeners(self, selector, listeners):
+        """Close listeners on vanished addresses and open any that are missing
+        
+        Runs on the server thread after a network change.
+        """
+        detected_at, self._network_changed_at = self._network_changed_at, None
+        for entry in list(listeners):
+            sock, family, bound = entry
+            if family in (socket.AF_INET, socket.AF_INET6) and not netmon.address_assigned(family, bound[0]):
+                logger.info(f"Closing stale listener {listener_utils.format_address(family, bound)}")
+                selector.unregister(sock)
+                listeners.remove(entry)
+                listener_utils.close_listener(sock, family, bound)
+        
+        for family, address in self.listener_specs:
+            if any(listener_utils.covers(family, address, f, b) for _, f, b in listeners):
+                continue
+            try:
+                sock, bound = listener_utils.open_listener(family, address, self.reuse_port)
+            except Exception as e:
+                logger.warning(f"Still cannot listen on {listener_utils.format_address(family, address)}: {str(e)}")
+                continue
+            listeners.append((sock, family, bound))
+            selector.register(sock, selectors.EVENT_READ, (family, bound))
+            logger.info(f"Server listening on {listener_utils.format_address(family, bound)} (recovered)")
+        
+        self._set_addresses(listeners)
+        ready_ms = (time.monotonic() - detected_at) * 1000
+        self.metrics.observe("network_ready_ms", ready_ms)
+        logger.info(f"Listeners ready {ready_ms:.1f} ms after the network change")
+        
+        # Announce the (possibly new) address to subscribers and the tray
+        self._publish_status()
+        if self.on_network_change:
+            try:
+                self.on_network_change(self.ip)
+            except Exception as e:
+                logger.error(f"Network change callback failed: {str(e)}")
+    
+    def _close_listeners(self, listeners):
+        """Close listening sockets and remove Unix socket files"""
+        while True:
+            try:
+                sock, family, bound = listeners.pop()
+            except IndexError:
+                return
+            listener_utils.close_listener(sock, family, bound)
+    
+    def _accept_client(self, client_sock, addr, family=socket.AF_INET):
+        """Register an accepted socket and start its handler thread"""
+        is_tcp = family in (socket.AF_INET, socket.AF_INET6)
+        # Register before the handler starts so it can always find itself
+        conn = self.connections.add(client_sock, addr)
+        if conn is None:
+            # Table is full - reject without spending a thread on it
+            self.metrics.increment("connections_rejected_total")
+            logger.warning(f"Rejected connection from {addr[0]}: connection limit reached")
+            if not self.tls or not is_tcp:
+                try:
+                    client_sock.setblocking(False)
+                    client_sock.send(BUSY_RESPONSE)
+                except OSError:
+                    pass
+            client_sock.close()
+            return
+        
+        self.metrics.increment("connections_total")
+        self._capture(capture_format.OPEN, conn, conn.label.encode("utf-8"))
+        if is_tcp:
+            try:
+                # Responses are small; don't let Nagle hold them back
+                client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+            if self.keepalive:
+                enable_keepalive(client_sock)
+            # Local Unix socket clients are protected by file permissions instead
+            if self.tls:
+                conn.sock = self.tls.wrap(client_sock)
+        
+        # Handle client in a new thread
+        client_thread = threading.Thread(target=self._handle_client, args=(conn, is_tcp))
+        client_thread.daemon = True
+        client_thread.start()
+        
+        # Log connection
+        logger.info(f"New connection from {addr[0]}")
+        self._publish_status()
+        
+        if self.on_notification:
+            self.on_notification("New Connection", f"Device at {addr[0]} connected")
+    
+    def _handle_client(self, conn, is_tcp=True, handshake=True):
         """Handle communication with a connected client"""
-        client_addr = f"{addr[0]}:{addr[1]}"
+        client_sock = conn.sock
+        client_addr = conn.label
+        released = False
         logger.info(f"Handling client connection from {client_addr}")
         
         try:
-            # Set a timeout to allow checking server_running flag
-            client_sock.settimeout(1.0)
+            if self.tls and is_tcp and handshake and not self._tls_handshake(conn):
+                return
+            
+            # Replies are queued rather than written in place, so a stalled
+            # phone never holds this thread (see outbound.py)
+            self.outbound.attach(conn)
             
             while self.running:
+                if self._handing_off:
+                    # Between commands: pass the socket on unless TLS or
+                    # compression state is bound to it, once queued replies
+                    # have been written
+                    released = (not (self.tls and is_tcp) and conn.compression is None
+                                and self.outbound.wait_drained(conn, handoff.DRAIN_TIMEOUT, 0))
+                    break
+                # Backpressure: stop reading while replies pile up
+                if not self.outbound.wait_unblocked(conn):
+                    break
                 try:
+                    # Wait with a timeout to allow checking server_running flag
+                    if not conn.wait_readable(1.0):
+                        if not self._check_idle(conn):
+                            break
+                        continue
+                    
                     # Receive data
-                    data = client_sock.recv(1024)
+                    data = client_sock.recv(65536)
                     
                     if not data:
                         # Client disconnected
@@ -175,137 +970,970 @@ class WakeMateServer:
                         break
                     
                     # Process command
-                    self._process_command(data.decode('utf-8'), client_sock, client_addr)
+                    conn.touch(len(data))
+                    if data[:1] == compression_utils.MARKER:
+                        for frame in self._read_compressed(conn, data):
+                            self._process_command(frame, conn)
+                    else:
+                        self._process_command(data, conn)
+                    if conn.transfer is not None:
+                        # From now on the connection carries only file data
+                        self._run_transfer(conn)
+                        break
                 
-                except socket.timeout:
+                except outbound.WOULD_BLOCK:
                     continue
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Invalid JSON from {client_addr}: {str(e)}")
-                    response = {"status": "error", "message": "Invalid JSON format"}
-                    client_sock.sendall(json.dumps(response).encode('utf-8'))
                 except Exception as e:
-                    logger.error(f"Error handling client {client_addr}: {str(e)}")
+                    # Sockets closed elsewhere (slow consumers, network changes) end up here
+                    if not conn.closed:
+                        logger.error(f"Error handling client {client_addr}: {str(e)}")
                     break
         
         finally:
-            # Remove client from list and close socket
-            if (client_sock, addr) in self.connected_clients:
-                self.connected_clients.remove((client_sock, addr))
+            # Remove client from the table and close socket
+            if released:
+                conn.topics = self.subscriptions.topics(conn.id)
+                self._released.append(conn)
+            self._stop_preview(conn.id)
+            self.subscriptions.unsubscribe(conn.id)
+            self.connections.remove(conn.id)
+            if not released:
+                # A released connection's buttons are the new server's to release
+                self._release_buttons(conn)
+                conn.close()
+            self._capture(capture_format.CLOSE, conn)
+            logger.info(f"Connection {'released' if released else 'closed'} with {client_addr}")
+            self._publish_status()
+    
+    def _read_compressed(self, conn, data):
+        """Read and decompress the compressed frames a recv() started
+        
+        Args:
+            conn (Connection): The connection
+            data (bytes): Received bytes starting with a compressed frame
+        
+        Returns:
+            list: The plain frames, in order
+        
+        Raises:
+            CompressionError: If compression was not negotiated, or a frame
+                is malformed or does not arrive in time
+        """
+        if conn.compression is None:
+            raise compression_utils.CompressionError("Compressed frame before compression was negotiated")
+        frames = []
+        deadline = time.monotonic() + COMPRESSED_FRAME_TIMEOUT
+        while data:
+            if data[:1] != compression_utils.MARKER:
+                frames.append(data)
+                break
+            length = compression_utils.frame_length(data)
+            if length is None or len(data) < length:
+                # Large frames span several reads
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not conn.wait_readable(remaining):
+                    raise compression_utils.CompressionError("Timed out reading a compressed frame")
+                try:
+                    more = conn.sock.recv(65536)
+                except outbound.WOULD_BLOCK:
+                    continue
+                if not more:
+                    raise ConnectionError("Client disconnected in the middle of a frame")
+                conn.touch(len(more))
+                data += more
+                continue
+            frames.append(conn.compression.unpack(data[:length]))
+            data = data[length:]
+        return frames
+    
+    def _adopt_client(self, sock, meta):
+        """Serve a client connection handed over by a previous server"""
+        family = meta["family"]
+        is_tcp = family in (socket.AF_INET, socket.AF_INET6)
+        if self.tls and is_tcp:
+            logger.warning(f"Closing handed-over plain connection {meta['label']}: TLS is now required")
+            sock.close()
+            return
+        conn = self.connections.add(sock, tuple(meta["addr"]))
+        if conn is None:
+            logger.warning(f"Closing handed-over connection {meta['label']}: connection limit reached")
+            sock.close()
+            return
+        conn.connected_at = meta["connected_at"]
+        conn.bytes_in = meta["bytes_in"]
+        conn.bytes_out = meta["bytes_out"]
+        conn.commands = meta["commands"]
+        conn.errors = meta["errors"]
+        if meta["session"] is not None:
+            conn.session = self.auth.get_session(meta["session"])
+        if meta["topics"]:
+            self.subscriptions.subscribe(conn, meta["topics"])
+        # Older servers do not pass held buttons
+        conn.held_buttons.update(meta.get("held_buttons", ()))
+        self.metrics.increment("connections_adopted_total")
+        self._capture(capture_format.OPEN, conn, conn.label.encode("utf-8"))
+        
+        client_thread = threading.Thread(target=self._handle_client, args=(conn, is_tcp, False))
+        client_thread.daemon = True
+        client_thread.start()
+    
+    def _hand_over(self, channel):
+        """Pass listeners and idle clients to a replacement server, then stop
+        
+        Runs on the handoff listener thread (see handoff.py).
+        
+        Args:
+            channel (HandoffChannel): The connection to the replacement
+        """
+        logger.info(f"Handing over to process {channel.pid}")
+        self._handoff_listener = None
+        try:
+            # Stop accepting; connections arriving now wait in the shared backlog
+            self._handing_off = True
+            if self.server_thread:
+                self.server_thread.join(2)
+            listeners, self._listeners = self._listeners, []
+            for sock, family, bound in listeners:
+                channel.send_socket("listener", sock, family, bound)
+                sock.close()
             
-            client_sock.close()
-            logger.info(f"Connection closed with {client_addr}")
+            gateway_sock = self.gateway.listening_socket() if self.gateway else None
+            if gateway_sock is not None:
+                channel.send_socket("gateway", gateway_sock, gateway_sock.family)
+            if self.gateway:
+                self.gateway.stop()
+            
+            # Let readers finish their current command, then finish queued work
+            deadline = time.monotonic() + handoff.DRAIN_TIMEOUT
+            while len(self.connections) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.input.flush()
+            self.scheduler.drain(max(0.0, deadline - time.monotonic()))
+            
+            channel.send("sessions", self.auth.export_sessions())
+            released, self._released = self._released, []
+            for conn in released:
+                family = conn.sock.family
+                channel.send_socket("connection", conn.sock, {
+                    "family": family,
+                    "addr": conn.addr,
+                    "label": conn.label,
+                    "connected_at": conn.connected_at,
+                    "bytes_in": conn.bytes_in,
+                    "bytes_out": conn.bytes_out,
+                    "commands": conn.commands,
+                    "errors": conn.errors,
+                    "session": conn.session.id if conn.session else None,
+                    "topics": conn.topics,
+                    "held_buttons": sorted(conn.held_buttons),
+                })
+                # Only this process's descriptor closes; the connection stays up
+                conn.sock.close()
+            logger.info(f"Handed over {len(listeners)} listeners and {len(released)} connections")
+        except Exception as e:
+            logger.error(f"Handoff failed: {str(e)}")
+        finally:
+            self.stop()
+            try:
+                channel.send("done")
+            except OSError:
+                pass
+        
+        if self.on_handoff:
+            self.on_handoff()
     
-    def _process_command(self, command_str, client_sock, client_addr):
-        """Process a command from the client"""
+    def _tls_handshake(self, conn):
+        """Complete the TLS handshake on the client thread
+        
+        Returns:
+            bool: True if the handshake succeeded
+        """
+        try:
+            conn.sock.settimeout(TLS_HANDSHAKE_TIMEOUT)
+            t0 = time.perf_counter()
+            conn.sock.do_handshake()
+            self.metrics.observe("tls_handshake_ms", (time.perf_counter() - t0) * 1000)
+            if conn.sock.session_reused:
+                self.metrics.increment("tls_sessions_resumed_total")
+            else:
+                self.metrics.increment("tls_full_handshakes_total")
+            return True
+        except (ssl.SSLEOFError, ConnectionError) as e:
+            logger.info(f"Client {conn.label} disconnected during TLS handshake: {str(e)}")
+            self.metrics.increment("tls_handshake_failures_total")
+            return False
+        except Exception as e:
+            logger.warning(f"TLS handshake with {conn.label} failed: {str(e)}")
+            self.metrics.increment("tls_handshake_failures_total")
+            return False
+    
+    def _check_idle(self, conn):
+        """Ping or expire an idle connection
+        
+        Returns:
+            bool: False if the connection should be closed
+        """
+        idle = conn.idle_seconds()
+        
+        if self.idle_timeout is not None and idle >= self.idle_timeout:
+            logger.info(f"Closing idle connection {conn.label} after {idle:.0f}s")
+            self.metrics.increment("connections_idle_closed_total")
+            return False
+        
+        if self.ping_interval is not None and idle >= self.ping_interval and conn.ping_sent_at is None:
+            conn.ping_sent_at = time.monotonic()
+            conn.send(self.codec.frame({"type": "ping", "ts": time.time()}))
+        
+        return True
+    
+    def _process_command(self, data, conn):
+        """Process a command from the client
+        
+        Args:
+            data (bytes): The received JSON command
+            conn (Connection): The sending connection
+        
+        Returns:
+            dict: The response that was sent, or None
+        """
+        client_addr = conn.label
+        cmd_type = "invalid"
+        error = False
+        phase_ms = {}
+        conn.commands += 1
+        with self._in_flight_lock:
+            self._in_flight += 1
+        self._capture(capture_format.IN, conn, data)
+        tracer = self._active_tracer
+        traced = tracer is not None and tracer.should_sample()
+        if traced:
+            tracing.set_sampled(True)
+        
+        t0 = time.perf_counter()
         try:
             # Parse JSON command
-            command = json.loads(command_str)
+            command = self.codec.loads(data)
+            t1 = time.perf_counter()
+            phase_ms["parse"] = (t1 - t0) * 1000
+            
+            # Unwrap authenticated envelopes
+            authenticated = False
+            if isinstance(command, dict) and "mac" in command and "payload" in command:
+                conn.session, command = self.auth.open_envelope(command, conn.session)
+                authenticated = True
+                t_auth = time.perf_counter()
+                phase_ms["auth"] = (t_auth - t1) * 1000
+                t1 = t_auth
             
             # Extract command type and parameters
+            if not isinstance(command, dict):
+                raise InvalidRequest("A command must be a JSON object")
             cmd_type = command.get("command", "")
-            params = command.get("params", {})
+            if not isinstance(cmd_type, str):
+                cmd_type = "invalid"
+                raise InvalidRequest("'command' must be a string")
+            params = command.get("params")
             
             logger.info(f"Received command '{cmd_type}' from {client_addr}")
             
             # Execute command and build response
-            result = {"status": "success", "message": "Command executed"}
-            
-            # Simple command processing focuses on basic media controls
-            if cmd_type == "media_play_pause":
-                self._media_play_pause()
-            
-            elif cmd_type == "media_next":
-                self._media_next()
-            
-            elif cmd_type == "media_prev":
-                self._media_previous()
-            
-            elif cmd_type == "volume_up":
-                self._volume_up()
-            
-            elif cmd_type == "volume_down":
-                self._volume_down()
-            
-            elif cmd_type == "volume_mute":
-                self._volume_mute()
-            
-            elif cmd_type == "get_status":
-                # Return status information
-                result = {
-                    "status": "success",
-                    "data": {
-                        "server_ip": self.ip,
-                        "server_port": self.port,
-                        "connected": True
-                    }
-                }
-            
-            else:
+            handler = self.commands.get(cmd_type)
+            if handler is not None and not authenticated and self.auth.requires_auth(cmd_type):
+                logger.warning(f"Unauthenticated '{cmd_type}' from {client_addr} rejected")
+                message = "Authentication required"
+                if not self.auth.enabled:
+                    message = f"{cmd_type} needs a paired session, which needs auth_mode 'protected' or 'required'"
+                result = {"status": "error", "code": "auth_required", "message": message}
+                self.metrics.increment("auth_rejected_total")
+            elif handler is not None and not authenticated and cmd_type in self._admin_commands \
+                    and conn.addr[0] not in LOCAL_HOSTS:
+                logger.warning(f"Admin command '{cmd_type}' from {client_addr} rejected")
+                result = {"status": "error", "code": "forbidden",
+                          "message": "Admin commands need a local connection or an authenticated session"}
+                error = True
+                self.metrics.increment("auth_rejected_total")
+            elif handler is not None and not self.auth.enabled and cmd_type in POWER_COMMANDS \
+                    and conn.addr[0] not in LOCAL_HOSTS:
+                logger.warning(f"Power command '{cmd_type}' from {client_addr} rejected: auth is off")
+                result = {"status": "error", "code": "forbidden",
+                          "message": "Power commands from other devices need auth_mode 'protected' or 'required'"}
+                error = True
+                self.metrics.increment("auth_rejected_total")
+            elif handler is None:
                 # Unknown command
                 logger.warning(f"Unknown command '{cmd_type}' from {client_addr}")
-                result = {"status": "error", "message": f"Unknown command: {cmd_type}"}
-            
-            # Send response
-            response = json.dumps(result)
-            client_sock.sendall(response.encode('utf-8'))
-            
-        except json.JSONDecodeError:
+                result = {"status": "error", "code": "unknown_command", "message": f"Unknown command: {cmd_type}"}
+                cmd_type = "unknown"
+                error = True
+            else:
+                t_valid = time.perf_counter()
+                params = self._validators[cmd_type](params)
+                if traced:
+                    tracer.add("validate", "request", t_valid, time.perf_counter())
+                result = self._execute(cmd_type, handler, params, conn, phase_ms,
+                                       command.get("idempotency_key"))
+            phase_ms["execute"] = (time.perf_counter() - t1) * 1000 - phase_ms.get("queue", 0.0)
+            error = error or (result is not None and result.get("status") == "error")
+        
+        except DECODE_ERRORS:
             # Invalid JSON
             logger.warning(f"Invalid JSON from {client_addr}")
-            response = json.dumps({"status": "error", "message": "Invalid JSON command"})
-            client_sock.sendall(response.encode('utf-8'))
+            result = {"status": "error", "code": "invalid_json", "message": "Invalid JSON command"}
+            error = True
+        
+        except InvalidRequest as e:
+            # Valid JSON, but not a command
+            logger.warning(f"Invalid request from {client_addr}: {str(e)}")
+            result = {"status": "error", "code": "invalid_request", "message": str(e)}
+            error = True
+        
+        except ValidationError as e:
+            # Parameters do not match the command's schema
+            logger.warning(f"Invalid parameters for '{cmd_type}' from {client_addr}: {str(e)}")
+            result = {"status": "error", "code": "invalid_params", "message": str(e)}
+            error = True
+        
+        except SchedulerBusy as e:
+            # Executor queue is full
+            logger.warning(f"Dropping '{cmd_type}' from {client_addr}: {str(e)}")
+            result = {"status": "error", "code": "busy", "message": str(e)}
+            error = True
+        
+        except AuthError as e:
+            # Bad MAC, replay or unknown session
+            logger.warning(f"Authentication failed for {client_addr}: {str(e)}")
+            result = {"status": "error", "code": "auth_failed", "message": str(e)}
+            error = True
+            self.metrics.increment("auth_failures_total")
         
         except Exception as e:
             # Other errors
             logger.error(f"Error processing command from {client_addr}: {str(e)}")
-            response = json.dumps({"status": "error", "message": str(e)})
-            client_sock.sendall(response.encode('utf-8'))
+            result = {"status": "error", "code": "internal_error", "message": str(e)}
+            error = True
+            if "parse" in phase_ms:
+                phase_ms["execute"] = (time.perf_counter() - t1) * 1000
+        
+        # Send response (handlers return None for messages that need no reply)
+        t2 = time.perf_counter()
+        t3 = t2
+        try:
+            if type(result) is PreencodedResponse:
+                frame = result.frame
+            elif result is not None:
+                frame = self.codec.frame(result)
+            else:
+                frame = None
+            t3 = time.perf_counter()
+            if frame is not None:
+                conn.send(frame)
+                self._capture(capture_format.OUT, conn, frame)
+        finally:
+            if error:
+                conn.errors += 1
+            t_end = time.perf_counter()
+            phase_ms["send"] = (t_end - t2) * 1000
+            self.metrics.record_command(cmd_type, phase_ms, error)
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            if traced:
+                tracing.set_sampled(False)
+                self._trace_request(tracer, cmd_type, conn, error, phase_ms, t0, t2, t3, t_end)
+        return result
+    
+    def _trace_request(self, tracer, cmd_type, conn, error, phase_ms, t0, t2, t3, t_end):
+        """Record the spans of one traced request on the reader thread"""
+        tracer.instant("recv", "request", t0, {"conn": conn.id})
+        if "parse" in phase_ms:
+            t1 = t0 + phase_ms["parse"] / 1000
+            tracer.add("decode", "request", t0, t1)
+            if "auth" in phase_ms:
+                tracer.add("auth", "request", t1, t1 + phase_ms["auth"] / 1000)
+        tracer.add("encode", "request", t2, t3)
+        tracer.add("send", "request", t3, t_end)
+        tracer.add(cmd_type, "request", t0, t_end, {"conn": conn.id, "error": error})
+    
+    def _capture(self, kind, conn, payload=b""):
+        """Record traffic when capturing is on"""
+        capture = self.capture
+        if capture is not None:
+            capture.record(kind, conn.id, payload)
+    
+    def _execute(self, cmd_type, handler, params, conn, phase_ms, idempotency_key=None):
+        """Replay duplicates, apply rate limits, then run a handler inline or on the executor"""
+        cls = command_class(cmd_type)
+        
+        if idempotency_key is None or cls not in IDEMPOTENT_CLASSES:
+            return self._dispatch(cmd_type, cls, handler, params, conn, phase_ms)
+        
+        if not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+            return {"status": "error", "code": "invalid_params", "message": "Invalid 'idempotency_key'"}
+        
+        # Scope keys per client so one phone cannot replay another's responses
+        key = (conn.addr[0], cmd_type, idempotency_key)
+        try:
+            cached, ticket = self.idempotency.begin(key)
+        except IdempotencyBusy as e:
+            logger.warning(f"Refusing '{cmd_type}' from {conn.label}: {str(e)}")
+            return {"status": "error", "code": "busy", "message": str(e)}
+        if ticket is None:
+            if cached is None:
+                return {"status": "error", "code": "in_progress",
+                        "message": f"'{cmd_type}' with this idempotency key is still running"}
+            logger.info(f"Replaying response to duplicate '{cmd_type}' from {conn.label}")
+            self.metrics.increment("idempotent_replays_total", (cls,))
+            return dict(cached, duplicate=True)
+        
+        try:
+            result = self._dispatch(cmd_type, cls, handler, params, conn, phase_ms)
+        except BaseException:
+            self.idempotency.abandon(key, ticket)
+            raise
+        # Only remember commands that ran; a refused one may be retried
+        if result is not None and result.get("status") == "success":
+            self.idempotency.complete(key, ticket, dict(result))
+        else:
+            self.idempotency.abandon(key, ticket)
+        return result
+    
+    def _dispatch(self, cmd_type, cls, handler, params, conn, phase_ms):
+        """Apply rate limits, then run a handler inline or on the executor"""
+        if self.rate_limiter:
+            wait = self.rate_limiter.check(conn.addr[0], cmd_type)
+            if wait:
+                logger.warning(f"Rate limited '{cmd_type}' from {conn.label}")
+                return {
+                    "status": "error",
+                    "code": "rate_limited",
+                    "message": f"Rate limit exceeded for {cls} commands",
+                    "retry_after": round(wait, 3)
+                }
+        
+        tracer = self._active_tracer
+        if tracer is not None and tracing.sampled():
+            handler = tracer.wrap(handler, f"handle:{cmd_type}")
+        
+        priority = CLASS_PRIORITIES.get(cls)
+        if priority is None or cmd_type in AGGREGATED_COMMANDS:
+            return handler(params, conn)
+        
+        result, phase_ms["queue"] = self.scheduler.run(priority, handler, params, conn)
+        return result
+    
+    def _submit_input(self, flush):
+        """Run an input aggregator flush on the executor, traced when its request is"""
+        tracer = self._active_tracer
+        if tracer is not None and tracing.sampled():
+            flush = tracer.wrap(flush, "input.flush", "input")
+        self.scheduler.submit(PRIORITY_INPUT, flush)
+    
+    # Tracing
+    def _enable_tracing(self, tracer):
+        """Start recording spans into a tracer"""
+        self.tracer = tracer
+        self._active_tracer = tracer
+        tracing.install(tracer)
+        logger.info(f"Tracing {tracer.sample_rate:.0%} of requests")
     
-    # Media control helper functions
-    def _media_play_pause(self):
+    def _disable_tracing(self):
+        """Stop recording spans; the buffer is kept for trace_dump"""
+        self._active_tracer = None
+        tracing.install(None)
+    
+    def _install_trace_signal(self):
+        """Dump the trace buffer on SIGUSR2 where the platform allows it"""
+        if self._trace_signal is not None or not hasattr(signal, "SIGUSR2"):
+            return
+        if threading.current_thread() is not threading.main_thread():
+            return
+        try:
+            self._trace_signal = signal.signal(signal.SIGUSR2, self._on_trace_signal)
+        except (ValueError, OSError) as e:
+            logger.warning(f"Could not install the SIGUSR2 trace handler: {str(e)}")
+    
+    def _restore_trace_signal(self):
+        """Put back the SIGUSR2 handler that was there before start()"""
+        if self._trace_signal is None:
+            return
+        try:
+            signal.signal(signal.SIGUSR2, self._trace_signal)
+        except (ValueError, OSError):
+            pass
+        self._trace_signal = None
+    
+    def _on_trace_signal(self, signum, frame):
+        """SIGUSR2: write the trace buffer to a file in the background"""
+        tracer = self.tracer
+        if tracer is None:
+            return
+        # Signal handlers run between bytecodes of the main thread; keep the
+        # JSON encoding off it
+        threading.Thread(target=self._dump_trace, args=(tracer,), name="trace-dump", daemon=True).start()
+    
+    def _dump_trace(self, tracer):
+        """Write a tracer's buffer to a new file under the config directory"""
+        path = tracing.default_trace_path()
+        try:
+            return path, tracer.dump(path)
+        except OSError as e:
+            logger.error(f"Failed to write trace to {path}: {str(e)}")
+            raise
+    
+    # Tracing handlers
+    def _handle_trace_start(self, params, conn):
+        """Start tracing a share of requests into a fresh buffer"""
+        tracer = tracing.Tracer(params.get("buffer_size", tracing.DEFAULT_CAPACITY),
+                                params.get("sample_rate", 1.0))
+        self._enable_tracing(tracer)
+        self._install_trace_signal()
+        return {"status": "success", "sample_rate": tracer.sample_rate, "buffer_size": tracer.capacity}
+    
+    def _handle_trace_stop(self, params, conn):
+        """Stop tracing; the buffer stays available to trace_dump"""
+        was_tracing = self._active_tracer is not None
+        self._disable_tracing()
+        return {"status": "success", "was_tracing": was_tracing}
+    
+    def _handle_trace_dump(self, params, conn):
+        """Write the trace buffer to a file, or return it inline"""
+        tracer = self.tracer
+        if tracer is None:
+            return {"status": "error", "message": "Tracing has not been started"}
+        if params.get("inline", False):
+            return {"status": "success", "trace": tracer.to_chrome()}
+        try:
+            path, events = self._dump_trace(tracer)
+        except OSError as e:
+            return {"status": "error", "message": f"Failed to write trace: {str(e)}"}
+        return {"status": "success", "path": path, "events": events}
+    
+    # Diagnostics handlers
+    def _handle_profile_start(self, params, conn):
+        """Start sampling every thread's stack"""
+        if self.profiler and self.profiler.running:
+            return {"status": "error", "message": "The profiler is already running"}
+        self.profiler = diagnostics.SamplingProfiler(params.get("interval_ms", 5) / 1000,
+                                                     params.get("duration_s", 60))
+        self.profiler.start()
+        return {"status": "success", "data": self.profiler.summary()}
+    
+    def _handle_profile_stop(self, params, conn):
+        """Stop the profiler and return its stacks"""
+        profiler = self.profiler
+        if profiler is None:
+            return {"status": "error", "message": "The profiler has not been started"}
+        profiler.stop()
+        limit = params.get("limit", 500)
+        data = profiler.summary()
+        if params.get("format", "collapsed") == "flamegraph":
+            data["flamegraph"] = profiler.flamegraph(limit)
+        else:
+            data["collapsed"] = profiler.collapsed(limit)
+        return {"status": "success", "data": data}
+    
+    def _handle_memory_snapshot(self, params, conn):
+        """Take a tracemalloc snapshot and return its largest allocation sites"""
+        snapshot_id, snapshot = self.memory.snapshot(params.get("frames", 1))
+        return {
+            "status": "success",
+            "data": {
+                "snapshot": snapshot_id,
+                "traced": self.memory.usage(),
+                "top": diagnostics.top_stats(snapshot, params.get("key_type", "lineno"),
+                                             params.get("limit", 20)),
+            }
+        }
+    
+    def _handle_memory_diff(self, params, conn):
+        """Take a snapshot and compare it with an earlier one"""
+        try:
+            base = self.memory.get(params["base"])
+        except KeyError:
+            return {"status": "error", "message": f"Unknown snapshot {params['base']}"}
+        snapshot_id, snapshot = self.memory.snapshot()
+        return {
+            "status": "success",
+            "data": {
+                "snapshot": snapshot_id,
+                "base": params["base"],
+                "traced": self.memory.usage(),
+                "diff": diagnostics.diff_stats(snapshot, base, params.get("key_type", "lineno"),
+                                               params.get("limit", 20)),
+            }
+        }
+    
+    def _handle_memory_stop(self, params, conn):
+        """Stop tracemalloc and drop its snapshots"""
+        was_tracing = self.memory.tracing
+        self.memory.stop()
+        return {"status": "success", "was_tracing": was_tracing}
+    
+    def _handle_get_diagnostics(self, params, conn):
+        """Return thread, file descriptor, memory and connection counts"""
+        data = diagnostics.process_stats()
+        data.update({
+            "connections": len(self.connections),
+            "in_flight": self._in_flight,
+            "queue_depth": self.scheduler.snapshot(),
+            "profiler": self.profiler.summary() if self.profiler else None,
+            "tracemalloc": self.memory.usage() if self.memory.tracing else None,
+        })
+        return {"status": "success", "data": data}
+    
+    # Media control handlers
+    def _handle_media_play_pause(self, params, conn):
         """Send media play/pause command"""
         try:
+            import pyautogui
             pyautogui.press('playpause')
             logger.info("Media play/pause command sent")
         except Exception as e:
             logger.error(f"Failed to send media play/pause: {str(e)}")
+        self.subscriptions.request_refresh("now_playing")
+        return COMMAND_EXECUTED
     
-    def _media_next(self):
+    def _handle_media_next(self, params, conn):
         """Send media next track command"""
         try:
+            import pyautogui
             pyautogui.press('nexttrack')
             logger.info("Media next track command sent")
         except Exception as e:
             logger.error(f"Failed to send media next track: {str(e)}")
+        self.subscriptions.request_refresh("now_playing")
+        return COMMAND_EXECUTED
     
-    def _media_previous(self):
+    def _handle_media_previous(self, params, conn):
         """Send media previous track command"""
         try:
+            import pyautogui
             pyautogui.press('prevtrack')
             logger.info("Media previous track command sent")
         except Exception as e:
             logger.error(f"Failed to send media previous track: {str(e)}")
+        self.subscriptions.request_refresh("now_playing")
+        return COMMAND_EXECUTED
     
-    def _volume_up(self):
+    def _handle_volume_up(self, params, conn):
         """Increase volume"""
         try:
+            import pyautogui
             pyautogui.press('volumeup')
             logger.info("Volume up command sent")
         except Exception as e:
             logger.error(f"Failed to send volume up: {str(e)}")
+        self.subscriptions.request_refresh("volume")
+        return COMMAND_EXECUTED
     
-    def _volume_down(self):
+    def _handle_volume_down(self, params, conn):
         """Decrease volume"""
         try:
+            import pyautogui
             pyautogui.press('volumedown')
             logger.info("Volume down command sent")
         except Exception as e:
             logger.error(f"Failed to send volume down: {str(e)}")
+        self.subscriptions.request_refresh("volume")
+        return COMMAND_EXECUTED
     
-    def _volume_mute(self):
+    def _handle_volume_mute(self, params, conn):
         """Mute/unmute volume"""
         try:
+            import pyautogui
             pyautogui.press('volumemute')
             logger.info("Volume mute command sent")
         except Exception as e:
-            logger.error(f"Failed to send volume mute: {str(e)}")
\ No newline at end of file
+            logger.error(f"Failed to send volume mute: {str(e)}")
+        self.subscriptions.request_refresh("volume")
+        return COMMAND_EXECUTED
+    
+    # Input control handlers
+    def _handle_mouse_move(self, params, conn):
+        """Move the mouse cursor by a relative offset"""
+        self.input.move(params["dx"], params["dy"])
+        return MOUSE_MOVED
+    
+    def _handle_mouse_click(self, params, conn):
+        """Click a mouse button, or double/triple-click with clicks > 1"""
+        self.input.click(params["button"], params["clicks"])
+        return MOUSE_CLICKED
+    
+    def _handle_mouse_scroll(self, params, conn):
+        """Scroll the mouse wheel vertically and/or horizontally"""
+        self.input.scroll(params["amount"], params["horizontal"])
+        return MOUSE_SCROLLED
+    
+    def _handle_mouse_button(self, params, conn):
+        """Press or release a mouse button, for drags held across moves"""
+        down = params["action"] == "down"
+        self.input.button(params["button"], down)
+        # Remembered so the button is let go if the phone disconnects mid-drag
+        if down:
+            conn.held_buttons.add(params["button"])
+        else:
+            conn.held_buttons.discard(params["button"])
+        return MOUSE_BUTTON_SET
+    
+    def _release_buttons(self, conn):
+        """Release the mouse buttons a departing client left pressed"""
+        for button in list(conn.held_buttons):
+            logger.info(f"Releasing the {button} mouse button held by {conn.label}")
+            try:
+                self.input.button(button, False)
+            except Exception as e:
+                logger.error(f"Failed to release the {button} mouse button: {str(e)}")
+        conn.held_buttons.clear()
+    
+    def _handle_mouse_drag(self, params, conn):
+        """Drag by a relative offset with a button held down"""
+        self.input.drag(params["dx"], params["dy"], params["button"])
+        return MOUSE_DRAGGED
+    
+    def _handle_keyboard_input(self, params, conn):
+        """Type a string of text"""
+        self.input_backend.type_text(params["text"])
+        return TEXT_TYPED
+    
+    def _handle_key_press(self, params, conn):
+        """Press a special key"""
+        self.input_backend.press_key(params["key"])
+        return KEY_PRESSED
+    
+    # System control handlers
+    def _handle_shutdown(self, params, conn):
+        """Shut down the system"""
+        _shutdown()
+        return SHUTTING_DOWN
+    
+    def _handle_restart(self, params, conn):
+        """Restart the system"""
+        _restart()
+        return RESTARTING
+    
+    def _handle_sleep(self, params, conn):
+        """Put the system to sleep"""
+        _sleep()
+        return GOING_TO_SLEEP
+    
+    def _handle_logoff(self, params, conn):
+        """Log off the current user"""
+        _logoff()
+        return LOGGING_OFF
+    
+    def _handle_wake(self, params, conn):
+        """Send a Wake-on-LAN magic packet to another device"""
+        mac = params["mac"]
+        try:
+            _send_magic_packet(mac, params["broadcast"], params["port"])
+        except Exception as e:
+            self.subscriptions.publish("wake", {"mac": mac, "sent": False, "error": str(e), "ts": time.time()})
+            raise
+        self.subscriptions.publish("wake", {"mac": mac, "sent": True, "ts": time.time()})
+        return {"status": "success", "message": f"Wake packet sent to {mac}"}
+    
+    # Status handlers
+    def _handle_get_status(self, params, conn):
+        """Return status information"""
+        return {
+            "status": "success",
+            "data": {
+                "server_ip": self.ip,
+                "server_port": self.bound_port,
+                "listeners": self.addresses,
+                "gateway_port": self.gateway.port if self.gateway else None,
+                "connected": True,
+                "auth_mode": self.auth.mode,
+                "tls": self.tls is not None,
+                "input_backend": self.input_backend.name,
+                "tls_fingerprint": self.tls.fingerprint if self.tls else None
+            }
+        }
+    
+    def _handle_get_metrics(self, params, conn):
+        """Return server metrics"""
+        return {"status": "success", "data": self.metrics.snapshot()}
+    
+    def _handle_get_connections(self, params, conn):
+        """Return statistics for every live connection"""
+        return {"status": "success", "data": self.connections.snapshot()}
+    
+    def _handle_list_commands(self, params, conn):
+        """List supported commands and their parameters"""
+        commands = {}
+        for name, info in self._command_info.items():
+            commands[name] = dict(info, protected=self.auth.requires_auth(name))
+        return {"status": "success", "data": {"commands": commands}}
+    
+    # Keepalive handlers
+    def _handle_ping(self, params, conn):
+        """Answer a client-initiated ping"""
+        return {"status": "success", "message": "pong", "ts": time.time()}
+    
+    def _handle_pong(self, params, conn):
+        """Accept the reply to a server ping; activity was already recorded"""
+        return None
+    
+    # Authentication handlers
+    def _handle_auth_hello(self, params, conn):
+        """Run the pairing handshake and bind a session to the connection"""
+        conn.session, data = self.auth.handshake(params["client_nonce"], conn.addr[0])
+        logger.info(f"Authenticated session established with {conn.label}")
+        return {"status": "success", "data": data}
+    
+    def _handle_compression(self, params, conn):
+        """Negotiate compressed frames for the rest of the connection"""
+        if not conn.supports_compression:
+            return {"status": "error", "code": "unsupported",
+                    "message": "Compression is not available on this connection"}
+        if conn.compression is not None:
+            return {"status": "error", "message": "Compression is already enabled"}
+        algorithm = compression_utils.negotiate(params["algorithms"], self.compression_algorithms)
+        if algorithm is None:
+            return {"status": "error", "code": "unsupported", "message": "No common compression algorithm",
+                    "algorithms": self.compression_algorithms}
+        threshold = params["threshold"]
+        if threshold is None:
+            threshold = self.compression_threshold
+        state = compression_utils.Compression(algorithm, threshold, self.compression_level, self.metrics)
+        with conn.send_lock:
+            conn.compression = state
+        logger.info(f"Compressing frames of {threshold}+ bytes with {algorithm} for {conn.label}")
+        return {"status": "success", "algorithm": algorithm, "threshold": threshold}
+    
+    # Screen preview handlers
+    def _handle_preview_start(self, params, conn):
+        """Start streaming changed screen tiles to the connection"""
+        # Never show the screen to an unpaired device, whatever the auth mode
+        if conn.session is None:
+            return {"status": "error", "code": "auth_required", "message": "Screen preview needs a paired session"}
+        if not screen_preview.PIL_AVAILABLE:
+            return {"status": "error", "code": "unsupported", "message": "Screen preview needs Pillow"}
+        if not conn.supports_preview:
+            return {"status": "error", "code": "unsupported",
+                    "message": "Screen preview is not available on this connection"}
+        source = self.preview_source or screen_preview.ScreenSource()
+        stream = screen_preview.PreviewStream(conn, source, self.codec, params["fps"], params["max_width"],
+                                              params["max_height"], params["tile"], params["format"],
+                                              params["quality"], params["min_quality"],
+                                              self.outbound.low_watermark, self.metrics)
+        with self._previews_lock:
+            old = self._previews.pop(conn.id, None)
+            self._previews[conn.id] = stream
+        # A second preview_start restarts the stream with the new settings
+        if old is not None:
+            old.stop()
+        stream.start()
+        logger.info(f"Streaming screen preview to {conn.label} at {params['fps']} fps")
+        return {"status": "success", "fps": params["fps"], "tile": params["tile"],
+                "format": params["format"]}
+    
+    def _handle_preview_stop(self, params, conn):
+        """Stop the connection's screen preview"""
+        if not self._stop_preview(conn.id):
+            return {"status": "error", "message": "No screen preview is running"}
+        return SUCCESS
+    
+    def _stop_preview(self, conn_id):
+        """Stop a connection's screen preview, if any
+        
+        Returns:
+            bool: True if a preview was running
+        """
+        with self._previews_lock:
+            stream = self._previews.pop(conn_id, None)
+        if stream is None:
+            return False
+        stream.stop()
+        return True
+    
+    # File transfer handlers
+    def _handle_file_upload(self, params, conn):
+        """Create an upload, or find the one to resume, for a data connection to attach to"""
+        try:
+            transfer = self.transfers.start_upload(params["name"], params["size"], params["sha256"],
+                                                   params["overwrite"], params["resume"])
+        except TransferError as e:
+            return {"status": "error", "code": e.code, "message": str(e)}
+        logger.info(f"Upload of {transfer.name} ({transfer.size} bytes) requested by {conn.label}")
+        return {"status": "success", "transfer_id": transfer.id, "offset": transfer.offset,
+                "size": transfer.size}
+    
+    def _handle_file_download(self, params, conn):
+        """Create a download for a data connection to attach to"""
+        try:
+            transfer = self.transfers.start_download(params["name"])
+        except TransferError as e:
+            return {"status": "error", "code": e.code, "message": str(e)}
+        logger.info(f"Download of {transfer.name} ({transfer.size} bytes) requested by {conn.label}")
+        return {"status": "success", "transfer_id": transfer.id, "size": transfer.size}
+    
+    def _handle_file_list(self, params, conn):
+        """List the files that can be downloaded"""
+        return {"status": "success", "files": self.transfers.list_files()}
+    
+    def _handle_transfer_attach(self, params, conn):
+        """Turn this connection into the data connection of a transfer"""
+        if not conn.supports_transfer or conn.compression is not None:
+            return {"status": "error", "code": "unsupported",
+                    "message": "File data needs a plain, uncompressed connection"}
+        try:
+            transfer = self.transfers.attach(params["transfer_id"], conn, params["offset"])
+        except TransferError as e:
+            return {"status": "error", "code": e.code, "message": str(e)}
+        conn.transfer = transfer
+        return {"status": "success", "transfer_id": transfer.id, "direction": transfer.direction,
+                "offset": transfer.offset, "size": transfer.size}
+    
+    def _handle_transfer_status(self, params, conn):
+        """Report one transfer, or every known transfer"""
+        if params["transfer_id"] is None:
+            return {"status": "success", "transfers": self.transfers.list()}
+        try:
+            transfer = self.transfers.get(params["transfer_id"])
+        except TransferError as e:
+            return {"status": "error", "code": e.code, "message": str(e)}
+        return {"status": "success", "transfer": transfer.to_dict()}
+    
+    def _handle_transfer_cancel(self, params, conn):
+        """Cancel a transfer and discard a partial upload"""
+        try:
+            transfer = self.transfers.cancel(params["transfer_id"])
+        except TransferError as e:
+            return {"status": "error", "code": e.code, "message": str(e)}
+        return {"status": "success", "transfer": transfer.to_dict()}
+    
+    def _run_transfer(self, conn):
+        """Move a transfer's data on this connection's thread until it ends"""
+        # The attach reply goes out first, then the socket is used directly
+        if not self.outbound.wait_drained(conn, self.transfers.timeout, 0):
+            return
+        conn.outbound = None
+        conn.sock.settimeout(self.transfers.timeout)
+        self.transfers.run(conn.transfer, conn, lambda: self.running and not self._handing_off)
+    
+    def _on_transfer_complete(self, transfer):
+        """Tell the user about a received file"""
+        if transfer.direction == UPLOAD and self.on_notification:
+            self.on_notification("File Received", f"{transfer.name} was saved to {self.transfers.directory}")
+    
+    # Subscription handlers
+    def _handle_subscribe(self, params, conn):
+        """Subscribe the connection to pushed state updates"""
+        subscribed = self.subscriptions.subscribe(conn, params["topics"])
+        if not subscribed:
+            return {"status": "error", "message": "No valid topics to subscribe to"}
+        return {"status": "success", "topics": subscribed}
+    
+    def _handle_unsubscribe(self, params, conn):
+        """Remove some or all of the connection's subscriptions"""
+        self.subscriptions.unsubscribe(conn.id, params["topics"])
+        return SUCCESS
+    
+    def _publish_status(self):
+        """Push the server status to subscribers if it changed"""
+        self.subscriptions.publish("status", {
+            "running": self.running,
+            "server_ip": self.ip,
+            "server_port": self.bound_port,
+            "connections": len(self.connections)
+        })
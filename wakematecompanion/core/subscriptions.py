@@ -0,0 +1,341 @@
+"""
+Push subscriptions for WakeMATECompanion
+
+Clients subscribe to topics and the server pushes a delta over their existing
+connection whenever a topic's state changes. Each update is encoded once and
+shared by every subscriber. Delivery happens on a single pusher thread that
+holds updates back while a connection's outbound queue is above its high
+watermark (see outbound.py); a subscriber that falls behind has its pending
+updates for a topic conflated into one snapshot, and is dropped once it has
+been stalled for longer than ``max_lag`` seconds.
+
+Sourced topics (volume, now playing) are read on a separate source thread,
+because reading them can mean running amixer, playerctl or osascript. A slow
+or hung reader never delays pushes for other topics. They are re-read right
+after the server's own media commands, and polled every ``poll_interval``
+seconds while someone is subscribed, so changes made on the machine itself
+are pushed too.
+"""
+
+import logging
+import threading
+import time
+
+from .codec import get_codec
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Topics clients may subscribe to
+TOPICS = ("status", "volume", "now_playing", "wake")
+
+# How often stalled subscribers are retried, in seconds
+RETRY_INTERVAL = 0.02
+
+# How often subscribed sourced topics are re-read, in seconds
+DEFAULT_POLL_INTERVAL = 2.0
+
+_MISSING = object()
+
+
+class _Mailbox:
+    """Updates waiting to be written to one subscriber"""
+
+    __slots__ = ("conn", "topics", "pending", "stalled_since")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.topics = set()
+        self.pending = {}
+        self.stalled_since = None
+
+
+class SubscriptionHub:
+    """Topic state, subscriber registry and push delivery"""
+
+    def __init__(self, metrics=None, max_lag=10.0, codec=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        """Initialize the hub
+
+        Args:
+            metrics (ServerMetrics, optional): Registry for push counters
+            max_lag (float, optional): Seconds a subscriber may stay blocked
+                before it is dropped. Defaults to 10.
+            codec (JSONCodec, optional): Frame encoder. Defaults to the fastest
+                available codec.
+            poll_interval (float, optional): Seconds between reads of subscribed
+                sourced topics. Defaults to 2; None only reads on request.
+        """
+        self.metrics = metrics
+        self.codec = codec or get_codec()
+        self.max_lag = max_lag
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._refresh_ready = threading.Condition(self._lock)
+        self._state = {}
+        self._seq = {}
+        self._subscribers = {topic: set() for topic in TOPICS}
+        self._mailboxes = {}
+        self._dirty = set()
+        self._refresh = set()
+        self._sources = {}
+        self._running = False
+        self._thread = None
+        self._source_thread = None
+
+        if metrics:
+            metrics.register_gauge("subscribers", lambda: len(self._mailboxes))
+            metrics.register_gauge("push_backlog", lambda: len(self._dirty))
+
+    def start(self):
+        """Start the pusher and source threads"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="wakemate-pusher")
+        self._thread.daemon = True
+        self._thread.start()
+        self._source_thread = threading.Thread(target=self._poll_sources, name="wakemate-sources")
+        self._source_thread.daemon = True
+        self._source_thread.start()
+
+    def stop(self):
+        """Stop the pusher and source threads and forget all subscribers"""
+        with self._wakeup:
+            self._running = False
+            self._mailboxes.clear()
+            self._dirty.clear()
+            self._refresh.clear()
+            for subscribers in self._subscribers.values():
+                subscribers.clear()
+            self._wakeup.notify()
+            self._refresh_ready.notify()
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        if self._source_thread:
+            # A source stuck in a subprocess is left behind; it is a daemon
+            self._source_thread.join(2)
+            self._source_thread = None
+
+    def register_source(self, topic, callback):
+        """Register a function that reads the current state of a topic
+
+        Args:
+            topic (str): The topic name
+            callback (function): Returns the topic state as a dict
+        """
+        self._sources[topic] = callback
+
+    def has_subscribers(self, topic):
+        """Check whether anyone is subscribed to a topic"""
+        return bool(self._subscribers.get(topic))
+
+    def request_refresh(self, topic):
+        """Ask the source thread to re-read a sourced topic
+
+        Repeated requests before the source thread runs collapse into a
+        single read, and nothing happens when the topic has no subscribers.
+        """
+        if not self._subscribers.get(topic) or topic not in self._sources:
+            return
+        with self._refresh_ready:
+            self._refresh.add(topic)
+            self._refresh_ready.notify()
+
+    def subscribe(self, conn, topics):
+        """Subscribe a connection to topics and queue their current state
+
+        Args:
+            conn (Connection): The subscribing connection
+            topics (list): Topic names
+
+        Returns:
+            list: The topics that were subscribed
+        """
+        topics = [t for t in topics if t in TOPICS]
+        with self._wakeup:
+            box = self._mailboxes.get(conn.id)
+            if box is None:
+                box = self._mailboxes[conn.id] = _Mailbox(conn)
+            for topic in topics:
+                box.topics.add(topic)
+                self._subscribers[topic].add(conn.id)
+                if topic in self._state:
+                    box.pending[topic] = self._snapshot_frame(topic)
+                    self._dirty.add(conn.id)
+                if topic in self._sources:
+                    self._refresh.add(topic)
+            self._wakeup.notify()
+            if self._refresh:
+                self._refresh_ready.notify()
+        return topics
+
+    def topics(self, conn_id):
+        """Return the topics a connection is subscribed to"""
+        with self._lock:
+            box = self._mailboxes.get(conn_id)
+            return sorted(box.topics) if box else []
+
+    def unsubscribe(self, conn_id, topics=None):
+        """Remove some or all of a connection's subscriptions
+
+        Args:
+            conn_id (int): The connection ID
+            topics (list, optional): Topics to drop. Defaults to all.
+        """
+        with self._lock:
+            box = self._mailboxes.get(conn_id)
+            if box is None:
+                return
+            for topic in list(topics if topics else box.topics):
+                box.topics.discard(topic)
+                box.pending.pop(topic, None)
+                if topic in self._subscribers:
+                    self._subscribers[topic].discard(conn_id)
+            if not box.topics:
+                del self._mailboxes[conn_id]
+                self._dirty.discard(conn_id)
+
+    def publish(self, topic, state):
+        """Update a topic and push the delta to its subscribers
+
+        Args:
+            topic (str): The topic name
+            state (dict): The complete new state
+
+        Returns:
+            bool: True if the state changed
+        """
+        with self._wakeup:
+            old = self._state.get(topic, {})
+            delta = {k: v for k, v in state.items() if old.get(k, _MISSING) != v}
+            for key in old:
+                if key not in state:
+                    delta[key] = None
+            if not delta:
+                return False
+
+            self._state[topic] = dict(state)
+            self._seq[topic] = self._seq.get(topic, 0) + 1
+
+            subscribers = self._subscribers.get(topic)
+            if not subscribers:
+                return True
+
+            frame = self.codec.frame({"type": "event", "topic": topic,
+                                      "seq": self._seq[topic], "delta": delta})
+            snapshot = None
+            conflated = 0
+            for conn_id in subscribers:
+                box = self._mailboxes[conn_id]
+                if topic in box.pending:
+                    # An earlier update is still unsent: replace both with a snapshot
+                    if snapshot is None:
+                        snapshot = self._snapshot_frame(topic)
+                    box.pending[topic] = snapshot
+                    conflated += 1
+                else:
+                    box.pending[topic] = frame
+                self._dirty.add(conn_id)
+            self._wakeup.notify()
+
+        if self.metrics:
+            self.metrics.increment("push_published_total", (topic,))
+            if conflated:
+                self.metrics.increment("push_conflated_total", (topic,), conflated)
+        return True
+
+    def _snapshot_frame(self, topic):
+        return self.codec.frame({"type": "event", "topic": topic, "seq": self._seq.get(topic, 0),
+                                 "snapshot": self._state.get(topic, {})})
+
+    def _read_sources(self, topics):
+        for topic in topics:
+            try:
+                state = self._sources[topic]()
+            except Exception as e:
+                logger.warning(f"Failed to read state for topic {topic}: {str(e)}")
+                continue
+            if state is not None:
+                self.publish(topic, state)
+
+    def _poll_sources(self):
+        """Source thread: read topics that asked for a refresh or are due a poll"""
+        interval = self.poll_interval
+        next_poll = None if interval is None else time.monotonic() + interval
+        while True:
+            with self._refresh_ready:
+                while self._running and not self._refresh:
+                    if next_poll is None:
+                        self._refresh_ready.wait()
+                        continue
+                    remaining = next_poll - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._refresh_ready.wait(remaining)
+                if not self._running:
+                    return
+                refresh, self._refresh = self._refresh, set()
+                if next_poll is not None and time.monotonic() >= next_poll:
+                    refresh.update(topic for topic in self._sources if self._subscribers.get(topic))
+                    next_poll = time.monotonic() + interval
+            if refresh:
+                self._read_sources(refresh)
+
+    def _run(self):
+        """Pusher thread: flush mailboxes"""
+        stalled = False
+        while True:
+            with self._wakeup:
+                if not self._running:
+                    return
+                if not self._dirty:
+                    self._wakeup.wait()
+                elif stalled:
+                    self._wakeup.wait(RETRY_INTERVAL)
+                if not self._running:
+                    return
+                boxes = [self._mailboxes[i] for i in self._dirty if i in self._mailboxes]
+
+            stalled = self._flush(boxes)
+
+    def _flush(self, boxes):
+        """Write pending updates to every subscriber that can take them
+
+        Returns:
+            bool: True if some subscribers were left with pending updates
+        """
+        if not boxes:
+            return False
+
+        now = time.monotonic()
+        stalled = False
+        for box in boxes:
+            if box.conn.write_blocked():
+                if box.stalled_since is None:
+                    box.stalled_since = now
+                elif now - box.stalled_since > self.max_lag:
+                    logger.warning(f"Dropping slow subscriber {box.conn.label}")
+                    self.unsubscribe(box.conn.id)
+                    if self.metrics:
+                        self.metrics.increment("push_dropped_subscribers_total")
+                    continue
+                stalled = True
+                continue
+
+            with self._lock:
+                frames = list(box.pending.values())
+                box.pending.clear()
+                box.stalled_since = None
+                self._dirty.discard(box.conn.id)
+            if not frames:
+                continue
+            try:
+                box.conn.send(b"".join(frames))
+                if self.metrics:
+                    self.metrics.increment("push_frames_sent_total", value=len(frames))
+            except OSError as e:
+                logger.info(f"Push to {box.conn.label} failed: {str(e)}")
+                self.unsubscribe(box.conn.id)
+        return stalled
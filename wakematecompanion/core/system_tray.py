@@ -39,6 +39,12 @@ class WakeMateTray:
         
         # Set up server notification callback
         self.server.set_notification_callback(self.show_notification)
+        
+        # Exit once a newly started instance has taken over the server
+        self.server.set_handoff_callback(self.exit_app)
+        
+        # Show the new address after the network changes
+        self.server.set_network_callback(lambda ip: self.update_tray_title())
     
     def create_default_icon(self):
         """Create a default icon if one doesn't exist"""
@@ -106,8 +112,10 @@ class WakeMateTray:
         # Generate QR code
         qr_path = qr_generator.generate_qr_code(
             self.server.ip, 
-            self.server.port,
-            local_mac
+            self.server.bound_port,
+            local_mac,
+            self.server.auth.pairing_key_b64(),
+            self.server.tls.fingerprint if self.server.tls else None
         )
         
         if qr_path:
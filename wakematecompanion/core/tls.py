@@ -0,0 +1,183 @@
+"""
+Optional TLS transport for WakeMATECompanion
+
+A self-signed certificate is generated on first use. Phones do not check it
+against a CA; instead they pin the SHA-256 fingerprint carried in the QR code.
+Server contexts keep OpenSSL's session cache and issue TLS 1.3 session tickets,
+so a phone reconnecting after sleep resumes instead of running a full handshake.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import ssl
+import subprocess
+
+from .auth import default_config_dir
+
+logger = logging.getLogger("WakeMATECompanion")
+
+# Optional imports - will be handled gracefully if not available
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
+
+CERT_SUBJECT = "WakeMATECompanion"
+CERT_DAYS = 3650
+
+# Session tickets issued per TLS 1.3 handshake
+SESSION_TICKETS = 2
+
+
+def default_paths():
+    """Return the default (cert_path, key_path)"""
+    tls_dir = os.path.join(default_config_dir(), "tls")
+    return os.path.join(tls_dir, "cert.pem"), os.path.join(tls_dir, "key.pem")
+
+
+def _generate_with_cryptography(cert_path, key_path):
+    import datetime
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, CERT_SUBJECT)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=CERT_DAYS))
+        .sign(key, hashes.SHA256())
+    )
+    fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(key.private_bytes(serialization.Encoding.PEM,
+                                   serialization.PrivateFormat.PKCS8,
+                                   serialization.NoEncryption()))
+    with open(cert_path, "wb") as fh:
+        fh.write(cert.public_bytes(serialization.Encoding.PEM))
+
+
+def _generate_with_openssl(cert_path, key_path):
+    openssl = shutil.which("openssl")
+    if not openssl:
+        raise RuntimeError("Generating a TLS certificate needs the cryptography package or the openssl tool")
+    subprocess.run([
+        openssl, "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+        "-nodes", "-keyout", key_path, "-out", cert_path, "-days", str(CERT_DAYS),
+        "-subj", f"/CN={CERT_SUBJECT}",
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.chmod(key_path, 0o600)
+
+
+def ensure_certificate(cert_path=None, key_path=None):
+    """Create a self-signed certificate if one does not exist yet
+
+    Args:
+        cert_path (str, optional): Certificate location
+        key_path (str, optional): Private key location
+
+    Returns:
+        tuple: (cert_path, key_path)
+    """
+    default_cert, default_key = default_paths()
+    cert_path = cert_path or default_cert
+    key_path = key_path or default_key
+    if os.path.exists(cert_path) and os.path.exists(key_path):
+        return cert_path, key_path
+
+    os.makedirs(os.path.dirname(cert_path), exist_ok=True)
+    os.makedirs(os.path.dirname(key_path), exist_ok=True)
+    if CRYPTOGRAPHY_AVAILABLE:
+        _generate_with_cryptography(cert_path, key_path)
+    else:
+        _generate_with_openssl(cert_path, key_path)
+    logger.info(f"Generated self-signed TLS certificate at {cert_path}")
+    return cert_path, key_path
+
+
+def format_fingerprint(der_bytes):
+    """Format the SHA-256 fingerprint of a DER certificate as AA:BB:..."""
+    digest = hashlib.sha256(der_bytes).hexdigest().upper()
+    return ":".join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+
+def certificate_fingerprint(cert_path):
+    """Return the SHA-256 fingerprint of a PEM certificate file"""
+    with open(cert_path, "r", encoding="ascii") as fh:
+        der = ssl.PEM_cert_to_DER_cert(fh.read())
+    return format_fingerprint(der)
+
+
+def server_context(cert_path, key_path):
+    """Build a server context with session resumption enabled
+
+    Args:
+        cert_path (str): Certificate location
+        key_path (str): Private key location
+
+    Returns:
+        ssl.SSLContext: The server context
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+    context.load_cert_chain(cert_path, key_path)
+    # Keep tickets and the server-side session cache for resumption
+    context.options &= ~getattr(ssl, "OP_NO_TICKET", 0)
+    if hasattr(context, "num_tickets"):
+        context.num_tickets = SESSION_TICKETS
+    return context
+
+
+def client_context():
+    """Build a client context that relies on fingerprint pinning
+
+    The certificate is self-signed, so chain verification is off; callers must
+    check the peer with verify_fingerprint() after the handshake.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def verify_fingerprint(ssl_sock, expected):
+    """Check the peer certificate of a connected socket against a pinned fingerprint
+
+    Raises:
+        ssl.SSLError: If the fingerprint does not match
+    """
+    actual = format_fingerprint(ssl_sock.getpeercert(binary_form=True))
+    if actual != expected.upper():
+        raise ssl.SSLError(f"Certificate fingerprint mismatch: {actual}")
+
+
+class TLSConfig:
+    """Certificate, fingerprint and context for a TLS-enabled server"""
+
+    def __init__(self, cert_path=None, key_path=None):
+        """Load or create the certificate and build the server context
+
+        Args:
+            cert_path (str, optional): Certificate location
+            key_path (str, optional): Private key location
+        """
+        self.cert_path, self.key_path = ensure_certificate(cert_path, key_path)
+        self.fingerprint = certificate_fingerprint(self.cert_path)
+        self.context = server_context(self.cert_path, self.key_path)
+
+    def wrap(self, sock):
+        """Wrap an accepted socket; the handshake runs later on the client thread"""
+        return self.context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+
+    def session_stats(self):
+        """Return OpenSSL's server session cache statistics"""
+        return self.context.session_stats()
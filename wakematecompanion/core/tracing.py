@@ -0,0 +1,198 @@
+"""
+Sampled span tracing for WakeMATECompanion
+
+When tracing is on, a sampled share of requests record spans for each stage
+of their life: decode, auth, validate, queue wait, handler, backend calls,
+encode and send. Spans go into a fixed-size ring buffer that overwrites the
+oldest entries, and can be dumped at any time as Chrome trace JSON. Open the
+dump in chrome://tracing or https://ui.perfetto.dev.
+
+Tracing is off unless a Tracer is installed. On the hot path that costs a
+None check per request and a thread-local lookup per backend call.
+"""
+
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from .auth import default_config_dir
+
+logger = logging.getLogger("WakeMATECompanion")
+
+DEFAULT_CAPACITY = 65536
+
+# The tracer spans are recorded into, or None when tracing is off
+_active = None
+
+# Per-thread flag: the request running on this thread is being traced
+_local = threading.local()
+
+
+class Tracer:
+    """Ring buffer of completed spans"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, sample_rate=1.0):
+        """Initialize the tracer
+
+        Args:
+            capacity (int, optional): Spans kept before the oldest are
+                overwritten. Defaults to 65536.
+            sample_rate (float, optional): Share of requests traced, 0 to 1.
+                Defaults to 1.0.
+        """
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self._buffer = [None] * capacity
+        # next() on a count is atomic, so recording takes no lock
+        self._seq = itertools.count()
+        self._epoch = time.perf_counter()
+        self.started_at = time.time()
+
+    def should_sample(self):
+        """Decide whether to trace the next request"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def add(self, name, cat, start, end, args=None, tid=None):
+        """Record a completed span
+
+        Args:
+            name (str): Span name
+            cat (str): Category, e.g. "request" or "backend"
+            start (float): time.perf_counter() at the start
+            end (float): time.perf_counter() at the end
+            args (dict, optional): Extra fields shown with the span
+            tid (int, optional): Thread to draw it on. Defaults to the caller.
+        """
+        i = next(self._seq)
+        self._buffer[i % self.capacity] = (i, name, cat, start, end, tid or threading.get_ident(), args)
+
+    def instant(self, name, cat, at, args=None):
+        """Record a point-in-time event"""
+        self.add(name, cat, at, None, args)
+
+    def wrap(self, fn, name, cat="handler", args=None):
+        """Wrap a function so its run, and its wait to start, are traced
+
+        The wait is drawn on the calling thread as a "queue" span. While the
+        function runs its thread is marked as traced, so backend calls made
+        through traced() record spans too.
+        """
+        queued_at = time.perf_counter()
+        caller = threading.get_ident()
+
+        def traced_call(*call_args):
+            start = time.perf_counter()
+            if start - queued_at > 1e-5:
+                self.add("queue", "scheduler", queued_at, start, tid=caller)
+            was_sampled = getattr(_local, "sampled", False)
+            _local.sampled = True
+            try:
+                return fn(*call_args)
+            finally:
+                _local.sampled = was_sampled
+                self.add(name, cat, start, time.perf_counter(), args)
+        return traced_call
+
+    def events(self):
+        """Return the buffered spans as Chrome trace events, oldest first"""
+        spans = sorted(span for span in list(self._buffer) if span is not None)
+        pid = os.getpid()
+        epoch = self._epoch
+        events = []
+        tids = set()
+        for _, name, cat, start, end, tid, args in spans:
+            event = {"name": name, "cat": cat, "pid": pid, "tid": tid,
+                     "ts": round((start - epoch) * 1e6, 3)}
+            if end is None:
+                event["ph"] = "i"
+                event["s"] = "t"
+            else:
+                event["ph"] = "X"
+                event["dur"] = round((end - start) * 1e6, 3)
+            if args:
+                event["args"] = args
+            events.append(event)
+            tids.add(tid)
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for tid in sorted(tids):
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": names.get(tid, f"thread-{tid}")}})
+        return events
+
+    def to_chrome(self):
+        """Return the buffer as a Chrome trace document"""
+        return {
+            "traceEvents": self.events(),
+            "displayTimeUnit": "ms",
+            "otherData": {"started_at": self.started_at, "sample_rate": self.sample_rate},
+        }
+
+    def dump(self, path):
+        """Write the buffer to a Chrome trace JSON file
+
+        Returns:
+            int: Number of events written
+        """
+        doc = self.to_chrome()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(doc, fh, separators=(",", ":"))
+        logger.info(f"Wrote {len(doc['traceEvents'])} trace events to {path}")
+        return len(doc["traceEvents"])
+
+
+def install(tracer):
+    """Make a tracer receive backend spans; None turns tracing off"""
+    global _active
+    _active = tracer
+
+
+def active():
+    """Return the installed tracer, or None"""
+    return _active
+
+
+def sampled():
+    """Check whether the current thread is running a traced request"""
+    return getattr(_local, "sampled", False)
+
+
+def set_sampled(value):
+    """Mark the current thread as running a traced request, or not"""
+    _local.sampled = value
+
+
+def traced(fn, name, cat="backend"):
+    """Wrap a backend function so calls from traced requests record a span
+
+    Args:
+        fn (function): The function
+        name (str): Span name, e.g. "pyautogui.moveTo"
+        cat (str, optional): Span category. Defaults to "backend".
+
+    Returns:
+        function: The wrapper
+    """
+    def wrapper(*args, **kwargs):
+        tracer = _active
+        if tracer is None or not getattr(_local, "sampled", False):
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            tracer.add(name, cat, start, time.perf_counter())
+    wrapper.__name__ = getattr(fn, "__name__", name)
+    wrapper.__doc__ = getattr(fn, "__doc__", None)
+    return wrapper
+
+
+def default_trace_path():
+    """Return a timestamped path under ~/.wakematecompanion/traces"""
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+    return os.path.join(default_config_dir(), "traces", f"trace-{stamp}-{os.getpid()}.json")
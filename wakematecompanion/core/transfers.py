@@ -0,0 +1,588 @@
+"""
+Streaming, resumable file transfers for WakeMATECompanion
+
+File data never travels over the command connection. The phone asks for a
+transfer there, from a paired session, and gets a transfer ID back:
+
+    {"command": "file_upload", "params": {"name": "IMG_0001.jpg", "size": 3145728}}
+    {"command": "file_download", "params": {"name": "report.pdf"}}
+
+It then opens a second connection to the same port and attaches it:
+
+    {"command": "transfer_attach", "params": {"transfer_id": "...", "offset": 0}}
+
+After the success reply, that connection carries nothing but the file's
+bytes, from the reply's offset to the end, on its own server thread. The
+command connection stays free, and several transfers can run at once, each
+on its own data connection. When the last byte has been written or read,
+the server sends one line and closes the data connection:
+
+    {"type": "transfer_complete", "transfer_id": "...", "name": "...", "size": N, "sha256": "..."}
+
+Uploads are received straight into a reusable buffer and written to
+``<name>.part`` in the transfer directory. The file is renamed once all
+bytes are in and, if given, the client's sha256 matches. Downloads are sent
+with socket.sendfile(), which is os.sendfile() (zero-copy) on plain sockets
+and a read/send loop on TLS. The SHA-256 of every file is computed while
+it streams. A download reads each sent chunk back from the page cache to
+hash it.
+
+A transfer cut off by a disconnect pauses. Attaching again resumes it:
+
+- uploads continue from the offset in the reply, which is the number of bytes
+  already on disk
+- downloads continue from the offset the client asks for
+- asking for the same upload again by name and size, even after a server
+  restart, picks up an existing ``.part`` file
+
+Only plain file names are accepted, and only files directly inside the
+transfer directory can be downloaded.
+"""
+
+import hashlib
+import logging
+import os
+import secrets
+import shutil
+import socket
+import threading
+import time
+from pathlib import Path
+
+from .codec import JSONCodec
+
+logger = logging.getLogger("WakeMATECompanion")
+
+UPLOAD = "upload"
+DOWNLOAD = "download"
+
+# Transfer states
+PENDING = "pending"
+ACTIVE = "active"
+PAUSED = "paused"
+COMPLETE = "complete"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+PART_SUFFIX = ".part"
+
+DEFAULT_MAX_ACTIVE = 4
+DEFAULT_CHUNK_SIZE = 256 * 1024
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_TTL = 3600.0
+
+# Bytes per socket.sendfile() call; the hash catches up after each one
+SENDFILE_CHUNK = 1024 * 1024
+
+# Most transfers kept for transfer_status; finished ones are dropped first
+MAX_TRANSFERS = 256
+
+
+def default_directory():
+    """Return the default transfer directory, ~/Downloads/WakeMATE"""
+    return os.path.join(str(Path.home()), "Downloads", "WakeMATE")
+
+
+class TransferError(Exception):
+    """A transfer request that cannot be served
+
+    Attributes:
+        code (str): Error code for the response, e.g. "not_found"
+    """
+
+    def __init__(self, message, code="invalid_params"):
+        super().__init__(message)
+        self.code = code
+
+
+def check_name(name):
+    """Reject anything but a plain file name
+
+    Raises:
+        TransferError: For paths, hidden names and reserved names
+    """
+    if (not name or name != os.path.basename(name) or "/" in name or "\\" in name
+            or "\0" in name or name.startswith(".") or name.endswith(PART_SUFFIX)):
+        raise TransferError(f"Invalid file name: {name!r}")
+
+
+class Transfer:
+    """One upload or download and its progress"""
+
+    def __init__(self, direction, name, path, size, expected=None):
+        self.id = secrets.token_hex(16)
+        self.direction = direction
+        self.name = name
+        self.path = path
+        self.size = size
+        self.expected = expected
+        self.offset = 0
+        self.status = PENDING
+        self.error = None
+        self.sha256 = None
+        # Hash of the file's first `hashed` bytes
+        self.hasher = hashlib.sha256()
+        self.hashed = 0
+        # Downloads: the file as it was when the transfer was created
+        self.mtime_ns = None
+        # The connection currently carrying the data, if any
+        self.owner = None
+        # Guards the fields above; never held across disk or socket I/O
+        self.lock = threading.Lock()
+        # Orders upload writes between an old owner and a new one; taken
+        # before lock when both are needed
+        self.io_lock = threading.Lock()
+        self.created = time.time()
+        self.updated = time.monotonic()
+
+    @property
+    def part_path(self):
+        return self.path + PART_SUFFIX
+
+    def to_dict(self):
+        """Return a JSON-friendly snapshot of this transfer"""
+        return {
+            "transfer_id": self.id,
+            "direction": self.direction,
+            "name": self.name,
+            "size": self.size,
+            "offset": self.offset,
+            "status": self.status,
+            "error": self.error,
+            "sha256": self.sha256,
+            "created": self.created,
+        }
+
+
+class TransferManager:
+    """Creates transfers and moves their bytes over data connections"""
+
+    def __init__(self, directory, max_active=DEFAULT_MAX_ACTIVE, chunk_size=DEFAULT_CHUNK_SIZE,
+                 timeout=DEFAULT_TIMEOUT, ttl=DEFAULT_TTL, codec=None, metrics=None, on_complete=None):
+        """Initialize the manager
+
+        Args:
+            directory (str): Where uploads are written and downloads are read
+            max_active (int, optional): Transfers that may move data at once.
+                Defaults to 4.
+            chunk_size (int, optional): Upload receive buffer size. Defaults
+                to 256 KiB.
+            timeout (float, optional): Seconds without progress before a data
+                connection is dropped and its transfer paused. Defaults to 30.
+            ttl (float, optional): Seconds an unattached transfer is kept.
+                Defaults to an hour.
+            codec (JSONCodec, optional): Encoder for the completion line
+            metrics (ServerMetrics, optional): Registry for transfer counters
+            on_complete (callable, optional): Called with each finished Transfer
+        """
+        self.directory = directory
+        self.max_active = max_active
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.ttl = ttl
+        self.codec = codec or JSONCodec()
+        self.metrics = metrics
+        self.on_complete = on_complete
+        self._transfers = {}
+        self._lock = threading.Lock()
+
+        if metrics:
+            metrics.register_gauge("transfers_active", lambda: self.active_count())
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for t in self._transfers.values() if t.owner is not None)
+
+    def _path(self, name):
+        check_name(name)
+        return os.path.join(self.directory, name)
+
+    def _add(self, transfer):
+        now = time.monotonic()
+        with self._lock:
+            # Forget abandoned transfers, then finished ones if still full
+            for key, t in list(self._transfers.items()):
+                if t.owner is None and now - t.updated > self.ttl:
+                    del self._transfers[key]
+            finished = [key for key, t in self._transfers.items()
+                        if t.owner is None and t.status in (COMPLETE, FAILED, CANCELLED)]
+            for key in finished[:max(0, len(self._transfers) - MAX_TRANSFERS + 1)]:
+                del self._transfers[key]
+            if len(self._transfers) >= MAX_TRANSFERS:
+                raise TransferError("Too many transfers in progress", "busy")
+            self._transfers[transfer.id] = transfer
+
+    def start_upload(self, name, size, sha256=None, overwrite=False, resume=True):
+        """Create an upload, or find the one to resume
+
+        Args:
+            name (str): File name in the transfer directory
+            size (int): Total size in bytes
+            sha256 (str, optional): Expected hex digest, checked at the end
+            overwrite (bool, optional): Replace an existing file of that name
+            resume (bool, optional): Continue an earlier upload of the same
+                name and size instead of starting again
+
+        Returns:
+            Transfer: The upload; its offset is where the data should resume
+
+        Raises:
+            TransferError: If the name is invalid or taken, or the disk is full
+        """
+        path = self._path(name)
+        expected = sha256.lower() if sha256 else None
+        with self._lock:
+            for t in self._transfers.values():
+                if t.direction == UPLOAD and t.path == path and t.status in (PENDING, ACTIVE, PAUSED):
+                    if resume and t.size == size and t.expected in (None, expected):
+                        return t
+                    raise TransferError(f"{name} is already being uploaded", "busy")
+        if os.path.exists(path) and not overwrite:
+            raise TransferError(f"{name} already exists", "exists")
+        os.makedirs(self.directory, exist_ok=True)
+
+        transfer = Transfer(UPLOAD, name, path, size, expected)
+        try:
+            have = os.path.getsize(transfer.part_path) if resume else 0
+        except OSError:
+            have = 0
+        if have > size:
+            have = 0
+        if not have:
+            # Start a fresh .part file
+            with open(transfer.part_path, "wb"):
+                pass
+        transfer.offset = have
+        if shutil.disk_usage(self.directory).free < size - have:
+            raise TransferError("Not enough free disk space", "no_space")
+        self._add(transfer)
+        if self.metrics:
+            self.metrics.increment("transfers_total", (UPLOAD,))
+        return transfer
+
+    def start_download(self, name):
+        """Create a download of a file in the transfer directory
+
+        Raises:
+            TransferError: If the name is invalid or the file does not exist
+        """
+        path = self._path(name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise TransferError(f"No such file: {name}", "not_found")
+        if not os.path.isfile(path):
+            raise TransferError(f"No such file: {name}", "not_found")
+        transfer = Transfer(DOWNLOAD, name, path, stat.st_size)
+        transfer.mtime_ns = stat.st_mtime_ns
+        self._add(transfer)
+        if self.metrics:
+            self.metrics.increment("transfers_total", (DOWNLOAD,))
+        return transfer
+
+    def list_files(self):
+        """Return the downloadable files, newest first"""
+        files = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return files
+        for entry in entries:
+            name = entry.name
+            if name.startswith(".") or name.endswith(PART_SUFFIX):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append({"name": name, "size": stat.st_size, "modified": stat.st_mtime})
+        files.sort(key=lambda f: f["modified"], reverse=True)
+        return files
+
+    def get(self, transfer_id):
+        """Return a transfer by ID
+
+        Raises:
+            TransferError: If there is no such transfer
+        """
+        with self._lock:
+            transfer = self._transfers.get(transfer_id)
+        if transfer is None:
+            raise TransferError(f"Unknown transfer: {transfer_id}", "not_found")
+        return transfer
+
+    def list(self):
+        """Return snapshots of every known transfer"""
+        with self._lock:
+            transfers = list(self._transfers.values())
+        return [t.to_dict() for t in transfers]
+
+    def cancel(self, transfer_id):
+        """Cancel a transfer, stopping its data connection and removing a partial upload"""
+        transfer = self.get(transfer_id)
+        with transfer.lock:
+            if transfer.status in (COMPLETE, FAILED, CANCELLED):
+                return transfer
+            transfer.status = CANCELLED
+            transfer.owner = None
+            transfer.updated = time.monotonic()
+        if transfer.direction == UPLOAD:
+            try:
+                os.remove(transfer.part_path)
+            except OSError:
+                pass
+        return transfer
+
+    def attach(self, transfer_id, conn, offset=None):
+        """Make a connection the carrier of a transfer's data
+
+        A connection still attached to the transfer, e.g. one that has not
+        yet noticed that the phone went away, stops at its next chunk.
+
+        Args:
+            transfer_id (str): The transfer
+            conn (Connection): The data connection
+            offset (int, optional): Downloads: byte to start from. Defaults
+                to 0. Uploads always resume from the bytes on disk.
+
+        Returns:
+            Transfer: The transfer, with the offset the data starts at
+
+        Raises:
+            TransferError: If the transfer is finished, busy or the offset is
+                out of range
+        """
+        transfer = self.get(transfer_id)
+        stat = None
+        if transfer.direction == DOWNLOAD:
+            offset = offset or 0
+            if not 0 <= offset <= transfer.size:
+                raise TransferError(f"Offset must be between 0 and {transfer.size}")
+            try:
+                stat = os.stat(transfer.path)
+            except OSError:
+                pass
+        # The busy check and the owner change happen under one lock, so two
+        # attaches cannot both take the last free slot
+        with self._lock, transfer.lock:
+            if transfer.status in (COMPLETE, FAILED, CANCELLED):
+                raise TransferError(f"Transfer is {transfer.status}", "invalid_state")
+            if transfer.owner is None:
+                active = sum(1 for t in self._transfers.values() if t.owner is not None)
+                if active >= self.max_active:
+                    raise TransferError(f"Only {self.max_active} transfers may run at once", "busy")
+            if transfer.direction == DOWNLOAD:
+                if stat is None or stat.st_size != transfer.size or stat.st_mtime_ns != transfer.mtime_ns:
+                    transfer.status = FAILED
+                    transfer.error = "The file changed or was removed"
+                    raise TransferError(transfer.error, "invalid_state")
+                transfer.offset = offset
+            transfer.owner = conn
+            transfer.status = ACTIVE
+            transfer.updated = time.monotonic()
+        if offset and transfer.direction == DOWNLOAD and self.metrics:
+            self.metrics.increment("transfers_resumed_total", (DOWNLOAD,))
+        elif transfer.offset and transfer.direction == UPLOAD and self.metrics:
+            self.metrics.increment("transfers_resumed_total", (UPLOAD,))
+        return transfer
+
+    def run(self, transfer, conn, keep_going):
+        """Move a transfer's bytes over its data connection; blocks until done
+
+        Runs on the data connection's own thread. The socket must be in
+        blocking mode with a timeout.
+
+        Args:
+            transfer (Transfer): A transfer attached to conn
+            conn (Connection): The data connection
+            keep_going (callable): Returns False when the server is stopping
+        """
+        try:
+            self._catch_up_hash(transfer, conn)
+            if transfer.direction == UPLOAD:
+                finished = self._receive(transfer, conn, keep_going)
+            else:
+                finished = self._send(transfer, conn, keep_going)
+            if finished:
+                self._finish(transfer, conn)
+        except (OSError, ValueError) as e:
+            # Disconnects and timeouts leave the transfer resumable
+            if not conn.closed:
+                logger.info(f"Transfer {transfer.name} via {conn.label} paused: {str(e)}")
+        finally:
+            with transfer.lock:
+                if transfer.owner is conn:
+                    transfer.owner = None
+                    if transfer.status == ACTIVE:
+                        transfer.status = PAUSED
+                transfer.updated = time.monotonic()
+
+    def _owns(self, transfer, conn):
+        return transfer.owner is conn and transfer.status == ACTIVE
+
+    def _catch_up_hash(self, transfer, conn):
+        """Bring the running hash up to the transfer's offset
+
+        Needed after a server restart (an upload resumed from a .part file)
+        and for downloads resumed at another offset than where they stopped.
+        The hashing reads from disk outside the transfer lock.
+        """
+        with transfer.lock:
+            target = transfer.offset
+            if transfer.hashed > target:
+                hasher, hashed = hashlib.sha256(), 0
+            else:
+                hasher, hashed = transfer.hasher.copy(), transfer.hashed
+        if hashed < target:
+            path = transfer.part_path if transfer.direction == UPLOAD else transfer.path
+            buf = bytearray(self.chunk_size)
+            view = memoryview(buf)
+            with open(path, "rb") as fh:
+                fh.seek(hashed)
+                while hashed < target:
+                    n = fh.readinto(view[:min(len(buf), target - hashed)])
+                    if not n:
+                        raise ValueError("Partial file is shorter than expected")
+                    hasher.update(view[:n])
+                    hashed += n
+        with transfer.lock:
+            if self._owns(transfer, conn) and transfer.offset == target:
+                transfer.hasher, transfer.hashed = hasher, hashed
+
+    def _receive(self, transfer, conn, keep_going):
+        """Write an upload to disk as it arrives
+
+        Each chunk is written and hashed outside the transfer lock, then
+        committed only if this connection still owns the transfer. The I/O
+        lock keeps a stale owner's last write from landing after a new
+        owner has truncated the file.
+
+        Returns:
+            bool: True once every byte is on disk
+        """
+        sock = conn.sock
+        buf = bytearray(self.chunk_size)
+        view = memoryview(buf)
+        with open(transfer.part_path, "r+b", buffering=0) as fh:
+            with transfer.io_lock:
+                with transfer.lock:
+                    if not self._owns(transfer, conn):
+                        return False
+                    offset = transfer.offset
+                    hasher = transfer.hasher.copy()
+                # Anything past the offset was never hashed; it is overwritten now
+                fh.truncate(offset)
+            while offset < transfer.size:
+                if not keep_going():
+                    return False
+                n = sock.recv_into(view, min(len(buf), transfer.size - offset))
+                if not n:
+                    raise ConnectionError("Client closed the data connection")
+                conn.touch(n)
+                with transfer.io_lock:
+                    with transfer.lock:
+                        if not self._owns(transfer, conn):
+                            return False
+                    fh.seek(offset)
+                    fh.write(view[:n])
+                    hasher.update(view[:n])
+                    with transfer.lock:
+                        if not self._owns(transfer, conn):
+                            return False
+                        offset += n
+                        transfer.hasher = hasher.copy()
+                        transfer.hashed = offset
+                        transfer.offset = offset
+                        transfer.updated = time.monotonic()
+                if self.metrics:
+                    self.metrics.increment("transfer_bytes_total", (UPLOAD,), n)
+            os.fsync(fh.fileno())
+        return True
+
+    def _send(self, transfer, conn, keep_going):
+        """Stream a download with sendfile, hashing each chunk after it is sent
+
+        Sending and hashing happen outside the transfer lock; progress is
+        committed only if this connection still owns the transfer.
+
+        Returns:
+            bool: True once every byte has been sent
+        """
+        sock = conn.sock
+        buf = bytearray(self.chunk_size)
+        view = memoryview(buf)
+        with transfer.lock:
+            if not self._owns(transfer, conn):
+                return False
+            offset = transfer.offset
+            hasher = transfer.hasher.copy()
+        with open(transfer.path, "rb") as fh, open(transfer.path, "rb") as hash_fh:
+            hash_fh.seek(offset)
+            while offset < transfer.size:
+                if not keep_going():
+                    return False
+                count = min(SENDFILE_CHUNK, transfer.size - offset)
+                sent = sock.sendfile(fh, offset, count)
+                if not sent:
+                    raise ConnectionError("The file was truncated while sending")
+                conn.bytes_out += sent
+                # The sent range is in the page cache; hash it from there
+                left = sent
+                while left:
+                    n = hash_fh.readinto(view[:min(len(buf), left)])
+                    if not n:
+                        raise ValueError("The file was truncated while sending")
+                    hasher.update(view[:n])
+                    left -= n
+                with transfer.lock:
+                    if not self._owns(transfer, conn):
+                        return False
+                    offset += sent
+                    transfer.hasher = hasher.copy()
+                    transfer.hashed = offset
+                    transfer.offset = offset
+                    transfer.updated = time.monotonic()
+                if self.metrics:
+                    self.metrics.increment("transfer_bytes_total", (DOWNLOAD,), sent)
+        return True
+
+    def _finish(self, transfer, conn):
+        """Verify and publish a finished transfer, then tell the client"""
+        with transfer.lock:
+            if not self._owns(transfer, conn):
+                return
+            digest = transfer.hasher.hexdigest()
+            transfer.sha256 = digest
+            if transfer.expected and transfer.expected != digest:
+                transfer.status = FAILED
+                transfer.error = "SHA-256 mismatch"
+            else:
+                transfer.status = COMPLETE
+            transfer.owner = None
+        if transfer.direction == UPLOAD:
+            if transfer.status == COMPLETE:
+                os.replace(transfer.part_path, transfer.path)
+            else:
+                try:
+                    os.remove(transfer.part_path)
+                except OSError:
+                    pass
+        if transfer.status == COMPLETE:
+            logger.info(f"Transfer of {transfer.name} ({transfer.size} bytes) complete")
+            message = {"type": "transfer_complete", "transfer_id": transfer.id, "name": transfer.name,
+                       "size": transfer.size, "sha256": digest}
+        else:
+            logger.warning(f"Upload of {transfer.name} failed: {transfer.error}")
+            message = {"type": "transfer_failed", "transfer_id": transfer.id, "name": transfer.name,
+                       "code": "hash_mismatch", "message": transfer.error, "sha256": digest}
+        if self.metrics:
+            self.metrics.increment("transfers_finished_total", (transfer.direction, transfer.status))
+        try:
+            conn.sock.sendall(self.codec.frame(message))
+            conn.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        if self.on_complete and transfer.status == COMPLETE:
+            self.on_complete(transfer)
@@ -0,0 +1,347 @@
+"""
+Linux uinput input backend for WakeMATECompanion
+
+Creates a virtual mouse and keyboard through /dev/uinput and injects evdev
+events directly, without going through pyautogui and X11. This works under
+Wayland, on the console and in headless sessions, and has none of pyautogui's
+per-call sleeps.
+
+Each operation becomes one evdev frame: its events followed by SYN_REPORT.
+Inside ``batch()`` frames are buffered and written with a single write() when
+the batch ends, so a whole aggregator flush costs one system call.
+
+When the device path is a regular file instead of the uinput character
+device, no virtual device is created and the raw events are simply appended
+to the file. Tests and benchmarks use this to run without root.
+
+Keyboard input is mapped for a US layout; characters outside it cannot be
+typed through this backend.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import stat
+import struct
+import threading
+import time
+
+logger = logging.getLogger("WakeMATECompanion")
+
+DEFAULT_DEVICE = "/dev/uinput"
+DEVICE_NAME = b"WakeMATE virtual input"
+
+# struct input_event: struct timeval, __u16 type, __u16 code, __s32 value.
+# A zero timestamp lets the kernel stamp the event itself.
+EVENT_FORMAT = "llHHi"
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+# linux/input-event-codes.h
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_REL = 0x02
+SYN_REPORT = 0
+REL_X = 0x00
+REL_Y = 0x01
+REL_HWHEEL = 0x06
+REL_WHEEL = 0x08
+REL_WHEEL_HI_RES = 0x0b
+REL_HWHEEL_HI_RES = 0x0c
+BUS_VIRTUAL = 0x06
+
+# High-resolution wheel units per detent
+WHEEL_HI_RES_UNITS = 120
+
+BUTTONS = {"left": 0x110, "right": 0x111, "middle": 0x112}
+
+# linux/uinput.h ioctls
+UI_DEV_CREATE = 0x5501
+UI_DEV_DESTROY = 0x5502
+UI_DEV_SETUP = 0x405c5503
+UI_SET_EVBIT = 0x40045564
+UI_SET_KEYBIT = 0x40045565
+UI_SET_RELBIT = 0x40045566
+# _IOC(_IOC_READ, 'U', 44, 64): sysfs name of the created device
+UI_GET_SYSNAME = 0x8040552c
+
+SYSFS_INPUT = "/sys/devices/virtual/input"
+# How long to wait for the new device's event node, and how long to give
+# udev and the compositor to open it once it exists. Events written before
+# anyone reads the node are dropped.
+SETTLE_TIMEOUT = 2.0
+SETTLE_DELAY = 0.1
+
+KEY_LEFTSHIFT = 42
+
+# Key names accepted by key_press -> key code
+KEYS = {
+    "esc": 1, "escape": 1, "backspace": 14, "tab": 15, "enter": 28, "return": 28,
+    "ctrl": 29, "shift": 42, "alt": 56, "option": 56, "space": 57, "capslock": 58,
+    "numlock": 69, "scrolllock": 70, "printscreen": 99, "home": 102, "up": 103,
+    "pageup": 104, "left": 105, "right": 106, "end": 107, "down": 108,
+    "pagedown": 109, "insert": 110, "delete": 111, "del": 111, "volumemute": 113,
+    "volumedown": 114, "volumeup": 115, "pause": 119, "win": 125, "winleft": 125,
+    "command": 125, "winright": 126, "apps": 127, "nexttrack": 163,
+    "playpause": 164, "prevtrack": 165, "stop": 166, "fn": 0x1d0,
+}
+KEYS.update({f"f{i}": 58 + i for i in range(1, 11)})
+KEYS.update({"f11": 87, "f12": 88})
+KEYS.update({f"f{i}": 170 + i for i in range(13, 25)})
+
+# Printable characters -> (key code, needs shift), US layout
+CHARS = {" ": (57, False), "\n": (28, False), "\t": (15, False)}
+for _row, _first in (("1234567890", 2), ("qwertyuiop", 16), ("asdfghjkl", 30), ("zxcvbnm", 44)):
+    for _i, _c in enumerate(_row):
+        CHARS[_c] = (_first + _i, False)
+for _c in "abcdefghijklmnopqrstuvwxyz":
+    CHARS[_c.upper()] = (CHARS[_c][0], True)
+for _plain, _shifted, _code in (
+    ("-", "_", 12), ("=", "+", 13), ("[", "{", 26), ("]", "}", 27), (";", ":", 39),
+    ("'", '"', 40), ("`", "~", 41), ("\\", "|", 43), (",", "<", 51), (".", ">", 52),
+    ("/", "?", 53),
+):
+    CHARS[_plain] = (_code, False)
+    CHARS[_shifted] = (_code, True)
+for _c, _digit in zip("!@#$%^&*()", "1234567890"):
+    CHARS[_c] = (CHARS[_digit][0], True)
+
+
+def available(path=DEFAULT_DEVICE):
+    """Check whether a uinput device can be opened for writing"""
+    return os.access(path, os.W_OK)
+
+
+def read_events(data):
+    """Decode raw evdev events, e.g. from a fake device file
+
+    Args:
+        data (bytes): Concatenated input_event structs
+
+    Returns:
+        list: (type, code, value) tuples
+    """
+    usable = len(data) - len(data) % EVENT_SIZE
+    return [event[2:] for event in struct.iter_unpack(EVENT_FORMAT, data[:usable])]
+
+
+class UInputBackend:
+    """Virtual mouse and keyboard on a uinput device"""
+
+    name = "uinput"
+
+    # The aggregator passes fractional scroll amounts straight through
+    fractional_scroll = True
+
+    def __init__(self, path=DEFAULT_DEVICE):
+        """Initialize the backend; the device is opened on first use
+
+        Args:
+            path (str, optional): uinput device, or a regular file to record
+                events into. Defaults to /dev/uinput.
+        """
+        self.path = path
+        self._fd = None
+        self._virtual = False
+        self._lock = threading.RLock()
+        self._pending = []
+        self._batch_depth = 0
+        self._wheel_carry = [0.0, 0.0]
+
+    def open(self):
+        """Open the device and create the virtual input device
+
+        Raises:
+            OSError: If the device cannot be opened or set up
+        """
+        with self._lock:
+            if self._fd is not None:
+                return
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK | os.O_APPEND)
+            try:
+                self._virtual = stat.S_ISCHR(os.fstat(fd).st_mode)
+                if self._virtual:
+                    self._create_device(fd)
+            except Exception:
+                os.close(fd)
+                raise
+            self._fd = fd
+            logger.info(f"uinput backend ready on {self.path}"
+                        f"{'' if self._virtual else ' (recording to file)'}")
+
+    def close(self):
+        """Destroy the virtual device and close the file"""
+        with self._lock:
+            if self._fd is None:
+                return
+            try:
+                if self._virtual:
+                    fcntl.ioctl(self._fd, UI_DEV_DESTROY)
+            except OSError as e:
+                logger.warning(f"Failed to destroy uinput device: {str(e)}")
+            finally:
+                os.close(self._fd)
+                self._fd = None
+                self._pending = []
+
+    def _create_device(self, fd):
+        fcntl.ioctl(fd, UI_SET_EVBIT, EV_KEY)
+        fcntl.ioctl(fd, UI_SET_EVBIT, EV_REL)
+        for code in (REL_X, REL_Y, REL_WHEEL, REL_HWHEEL, REL_WHEEL_HI_RES, REL_HWHEEL_HI_RES):
+            fcntl.ioctl(fd, UI_SET_RELBIT, code)
+        for code in sorted(set(BUTTONS.values()) | set(KEYS.values())):
+            fcntl.ioctl(fd, UI_SET_KEYBIT, code)
+        input_id = (BUS_VIRTUAL, 0x1209, 0x7777, 1)
+        try:
+            # struct uinput_setup: struct input_id, char name[80], __u32 ff_effects_max
+            fcntl.ioctl(fd, UI_DEV_SETUP, struct.pack("HHHH80sI", *input_id, DEVICE_NAME, 0))
+        except OSError:
+            # Kernels before 4.5: write struct uinput_user_dev instead
+            # (name, input_id, ff_effects_max, then four zeroed abs arrays)
+            os.write(fd, struct.pack("80sHHHHi", DEVICE_NAME, *input_id, 0) + bytes(4 * 64 * 4))
+        fcntl.ioctl(fd, UI_DEV_CREATE)
+        self._settle(fd)
+
+    def _settle(self, fd):
+        """Wait for the new device's event node to appear before first use"""
+        try:
+            name = fcntl.ioctl(fd, UI_GET_SYSNAME, bytes(64)).split(b"\0", 1)[0]
+        except OSError:
+            # Kernels before 3.15 cannot name the device; just wait
+            time.sleep(SETTLE_DELAY)
+            return
+        path = os.path.join(SYSFS_INPUT, name.decode("ascii", "replace"))
+        deadline = time.monotonic() + SETTLE_TIMEOUT
+        while True:
+            try:
+                nodes = [n for n in os.listdir(path) if n.startswith("event")]
+            except OSError:
+                nodes = []
+            if nodes and os.path.exists(os.path.join("/dev/input", nodes[0])):
+                break
+            if time.monotonic() >= deadline:
+                logger.warning(f"uinput device {path} has no event node after {SETTLE_TIMEOUT}s")
+                break
+            time.sleep(0.01)
+        time.sleep(SETTLE_DELAY)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Buffer every frame written inside the block into one write()"""
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self._write()
+
+    def _frame(self, *events):
+        """Queue events followed by SYN_REPORT, writing now unless batching"""
+        with self._lock:
+            pending = self._pending
+            for type_, code, value in events:
+                pending.append(struct.pack(EVENT_FORMAT, 0, 0, type_, code, value))
+            pending.append(struct.pack(EVENT_FORMAT, 0, 0, EV_SYN, SYN_REPORT, 0))
+            if not self._batch_depth:
+                self._write()
+
+    def _write(self):
+        # Caller holds self._lock
+        if not self._pending:
+            return
+        data = b"".join(self._pending)
+        self._pending = []
+        if self._fd is None:
+            self.open()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+
+    # Pointer
+
+    def move_mouse(self, dx, dy):
+        """Move the pointer by a relative offset"""
+        events = []
+        if dx:
+            events.append((EV_REL, REL_X, int(dx)))
+        if dy:
+            events.append((EV_REL, REL_Y, int(dy)))
+        if events:
+            self._frame(*events)
+
+    def click_mouse(self, button="left", clicks=1, interval=0.0):
+        """Click a button; clicks > 1 sends them back to back
+
+        interval is accepted for parity with the pyautogui backend; clicks in
+        one frame batch already arrive within the double-click time.
+        """
+        code = BUTTONS[button]
+        with self.batch():
+            for _ in range(clicks):
+                self._frame((EV_KEY, code, 1))
+                self._frame((EV_KEY, code, 0))
+
+    def mouse_button(self, button="left", down=True):
+        """Press or release a button"""
+        self._frame((EV_KEY, BUTTONS[button], 1 if down else 0))
+
+    def scroll_mouse(self, amount):
+        """Scroll vertically; fractional amounts use the high-resolution wheel"""
+        self._scroll(0, REL_WHEEL, REL_WHEEL_HI_RES, amount)
+
+    def hscroll_mouse(self, amount):
+        """Scroll horizontally; fractional amounts use the high-resolution wheel"""
+        self._scroll(1, REL_HWHEEL, REL_HWHEEL_HI_RES, amount)
+
+    def _scroll(self, axis, code, hi_res_code, amount):
+        hi_res = int(round(amount * WHEEL_HI_RES_UNITS))
+        if not hi_res:
+            return
+        with self._lock:
+            # Clients without high-resolution support still need whole detents
+            carry = self._wheel_carry[axis] + amount
+            detents = int(carry)
+            self._wheel_carry[axis] = carry - detents
+            events = [(EV_REL, hi_res_code, hi_res)]
+            if detents:
+                events.append((EV_REL, code, detents))
+            self._frame(*events)
+
+    # Keyboard
+
+    def press_key(self, key):
+        """Press and release a named key or a single character
+
+        Raises:
+            ValueError: If the key has no key code
+        """
+        code = KEYS.get(key.lower())
+        if code is None:
+            if key in CHARS:
+                self.type_text(key)
+                return
+            raise ValueError(f"Key '{key}' is not supported by the uinput backend")
+        with self.batch():
+            self._frame((EV_KEY, code, 1))
+            self._frame((EV_KEY, code, 0))
+
+    def type_text(self, text):
+        """Type text, all in one write
+
+        Raises:
+            ValueError: If the text has characters outside the US layout
+        """
+        missing = sorted(set(c for c in text if c not in CHARS))
+        if missing:
+            raise ValueError(f"Cannot type {''.join(missing)!r} with the uinput backend")
+        with self.batch():
+            for c in text:
+                code, shifted = CHARS[c]
+                if shifted:
+                    self._frame((EV_KEY, KEY_LEFTSHIFT, 1), (EV_KEY, code, 1))
+                    self._frame((EV_KEY, code, 0), (EV_KEY, KEY_LEFTSHIFT, 0))
+                else:
+                    self._frame((EV_KEY, code, 1))
+                    self._frame((EV_KEY, code, 0))